@@ -0,0 +1,4491 @@
+"""
+Núcleo de cálculo do layer.py, sem dependências de interface gráfica.
+Pode ser importado por scripts, pelo modo em lote (lote.py) e pela interface Tkinter (layer.py).
+"""
+import os # Para manipulação de arquivos e caminhos
+import csv # Para exportar resultados em CSV
+import json # Para exportar resultados em JSON
+import hashlib # Para identificar arquivos pelo conteúdo no cache em disco
+import pickle # Para guardar resultados no cache em disco
+import shutil # Para limpar o cache em disco
+import threading # Para nomes únicos dos arquivos temporários do cache
+import time # Para medir o tempo de cada etapa (instrumentação)
+import tracemalloc # Para medir o pico de memória de cada etapa
+import re # Para localizar a primeira linha de átomos no .xyz
+import itertools # Para ler trajetórias .xyz um quadro por vez
+import collections # Para guardar só os últimos quadros ao percorrer saídas do SIESTA e do QE
+import mmap # Para indexar trajetórias grandes sem carregá-las na memória
+import numpy as np # Para cálculos numéricos eficientes, como sqrt
+
+# Códigos de erro herdados dos programas Fortran, devolvidos pelas funções *_python
+ERROR_READ = -999.99 # Arquivo ausente ou ilegível
+ERROR_NATOMS = -888.88 # Número insuficiente de átomos (ou nível de Fermi ausente, no .bands)
+ERROR_DATA = -777.77 # Dados de energia inválidos no .bands
+
+# --- Progresso e Cancelamento ---
+
+class CalculationCancelled(Exception):
+    """
+    Levantada pela função de progresso de um cálculo para interrompê-lo.
+    Os cálculos longos aceitam um argumento 'progress': uma função chamada com a fração
+    concluída (de 0 a 1), que pode levantar esta exceção para cancelar o trabalho.
+    """
+
+# --- Instrumentação (tempo e memória por etapa) ---
+
+# Converte time.perf_counter() em segundos desde a época, para alinhar etapas de vários processos
+_PERF_TO_EPOCH = time.time() - time.perf_counter()
+
+class StageRecord:
+    """
+    Medição de uma etapa de um cálculo:
+    - name: 'categoria/etapa' (ex.: 'xyz/leitura', 'pares/calculo', 'interface/exibicao');
+    - start, duration: início (s desde a época) e duração (s);
+    - peak_bytes: pico de memória alocada durante a etapa, acima do que já havia (None sem tracemalloc);
+    - bytes_read: bytes lidos do disco pela etapa;
+    - process, thread, depth: processo, thread e nível de aninhamento;
+    - info: dicionário com detalhes (arquivo, quadro, exceção que interrompeu a etapa, ...).
+    """
+    __slots__ = ("name", "start", "duration", "peak_bytes", "bytes_read", "process", "thread", "depth", "info")
+
+    def __init__(self, name, info):
+        self.name = name
+        self.info = info
+        self.start = self.duration = 0.0
+        self.peak_bytes = None
+        self.bytes_read = 0
+        self.process = os.getpid()
+        self.thread = threading.get_ident()
+        self.depth = 0
+
+    @property
+    def stage(self):
+        """Última parte do nome ('leitura', 'conversao', 'calculo', ...)."""
+        return self.name.rpartition("/")[2]
+
+class _Stage:
+    """Contexto que mede uma etapa (veja StageProfiler.stage)."""
+    __slots__ = ("profiler", "record", "_t0", "_memory_start", "_peak_seen")
+
+    def __init__(self, profiler, record):
+        self.profiler = profiler
+        self.record = record
+        self._memory_start = None
+
+    def add_bytes(self, n):
+        self.record.bytes_read += n
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        if self.profiler.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # reset_peak apaga o pico das etapas externas: guarda-o nelas antes
+            for parent in stack:
+                parent._peak_seen = max(parent._peak_seen, peak)
+            tracemalloc.reset_peak()
+            self._memory_start = self._peak_seen = current
+        self.record.depth = len(stack)
+        stack.append(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = self.record
+        record.duration = time.perf_counter() - self._t0
+        record.start = self._t0 + _PERF_TO_EPOCH
+        stack = self.profiler._stack()
+        stack.pop()
+        if self._memory_start is not None and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], self._peak_seen)
+            record.peak_bytes = peak - self._memory_start
+            for parent in stack:
+                parent._peak_seen = max(parent._peak_seen, peak)
+        if exc_type is not None:
+            record.info["interrompida"] = exc_type.__name__
+        self.profiler.add_records((record,))
+        return False
+
+class _NullStage:
+    """Contexto vazio usado com a instrumentação desligada: o custo é uma chamada de função."""
+    __slots__ = ()
+
+    def add_bytes(self, n):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class StageProfiler:
+    """
+    Coleta as medições (StageRecord) das etapas dos cálculos: tempo, pico de memória (tracemalloc,
+    se trace_memory=True) e bytes lidos. As etapas podem ser aninhadas e vir de várias threads;
+    como o tracemalloc é global, os picos de memória de etapas simultâneas em threads diferentes
+    se misturam. Veja enable_profiling e profile_stage.
+    """
+    __slots__ = ("records", "trace_memory", "_lock", "_local")
+
+    def __init__(self, trace_memory=True):
+        self.records = []
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def stage(self, name, **info):
+        """Contexto que mede a etapa 'name'; 'info' vai para StageRecord.info."""
+        return _Stage(self, StageRecord(name, info))
+
+    def add_records(self, records):
+        """Acrescenta medições (também as vindas de outros processos, no modo em lote)."""
+        with self._lock:
+            self.records.extend(records)
+
+    def clear(self):
+        with self._lock:
+            self.records = []
+
+    def summary(self, records=None):
+        """
+        Agrega as medições por nome de etapa, na ordem em que apareceram:
+        {nome: {"n", "tempo_s", "pico_bytes", "bytes_lidos"}}. O tempo é somado; o pico é o maior.
+        """
+        totals = {}
+        for record in self.records if records is None else records:
+            entry = totals.setdefault(record.name, {"n": 0, "tempo_s": 0.0, "pico_bytes": None, "bytes_lidos": 0})
+            entry["n"] += 1
+            entry["tempo_s"] += record.duration
+            entry["bytes_lidos"] += record.bytes_read
+            if record.peak_bytes is not None:
+                entry["pico_bytes"] = max(entry["pico_bytes"] or 0, record.peak_bytes)
+        return totals
+
+    def format_summary(self, records=None):
+        """Tabela de texto com o resumo por etapa (veja summary)."""
+        lines = [f"{'etapa':28s} {'n':>6s} {'tempo (ms)':>12s} {'pico (MiB)':>11s} {'lido (MiB)':>11s}"]
+        for name, entry in self.summary(records).items():
+            peak = "-" if entry["pico_bytes"] is None else f"{entry['pico_bytes'] / 2**20:.2f}"
+            read = f"{entry['bytes_lidos'] / 2**20:.2f}" if entry["bytes_lidos"] else "-"
+            lines.append(f"{name:28s} {entry['n']:6d} {entry['tempo_s'] * 1000:12.2f} {peak:>11s} {read:>11s}")
+        return "\n".join(lines)
+
+    def write_trace(self, path, records=None):
+        """
+        Grava as medições no formato Trace Event (JSON), aberto pelo Perfetto (ui.perfetto.dev),
+        pelo chrome://tracing e pelo speedscope: uma barra por etapa, por processo e thread.
+        """
+        records = self.records if records is None else records
+        origin = min((r.start for r in records), default=0.0)
+        events = []
+        for r in records:
+            args = {"bytes_lidos": r.bytes_read}
+            if r.peak_bytes is not None:
+                args["pico_bytes"] = r.peak_bytes
+            args.update({k: str(v) for k, v in r.info.items()})
+            events.append({"name": r.name, "cat": r.name.partition("/")[0], "ph": "X",
+                           "ts": (r.start - origin) * 1e6, "dur": r.duration * 1e6,
+                           "pid": r.process, "tid": r.thread, "args": args})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+# Instrumentação ativa (None = desligada); veja enable_profiling
+_profiler = None
+_started_tracemalloc = False
+
+def enable_profiling(trace_memory=True):
+    """
+    Liga a instrumentação das etapas neste processo e retorna o StageProfiler que coleta as medições.
+    Com trace_memory=True, inicia o tracemalloc, que mede o pico de memória mas deixa as alocações
+    mais lentas. Deve ser chamada em cada processo (no modo em lote, pelo inicializador do pool).
+    """
+    global _profiler, _started_tracemalloc
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    _profiler = StageProfiler(trace_memory)
+    return _profiler
+
+def disable_profiling():
+    """Desliga a instrumentação (e o tracemalloc, se foi iniciado por enable_profiling)."""
+    global _profiler, _started_tracemalloc
+    _profiler = None
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+def get_profiler():
+    """Retorna o StageProfiler em uso, ou None se a instrumentação estiver desligada."""
+    return _profiler
+
+def profile_stage(name, **info):
+    """
+    Contexto que mede uma etapa quando a instrumentação está ligada:
+        with profile_stage("xyz/leitura", arquivo=path) as stage:
+            text = f.read()
+            stage.add_bytes(len(text))
+    Desligada, retorna um contexto vazio compartilhado.
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_STAGE
+    return profiler.stage(name, **info)
+
+# --- Leitura de Arquivos .xyz ---
+
+class XYZFormatError(ValueError):
+    """
+    Erro de formato em um arquivo .xyz (ou em outro arquivo de estrutura, como a saída do SIESTA ou do pw.x).
+    Guarda o número de átomos declarado e o número de átomos lidos (quando conhecidos),
+    para que cada cálculo decida qual código de erro devolver.
+    """
+    def __init__(self, message, natoms=None, n_read=None):
+        super().__init__(message)
+        self.natoms = natoms
+        self.n_read = n_read
+
+class XYZStructure:
+    """
+    Representação compacta de uma estrutura lida de um arquivo .xyz.
+    - coords: array float64 (N, 3) com as coordenadas em Å;
+    - species: array de inteiros (N,) com o código da espécie de cada átomo;
+    - elements: tupla com os símbolos químicos, indexada pelos códigos de 'species';
+    - comment: a segunda linha do arquivo;
+    - lattice: matriz (3, 3) com os vetores de rede nas linhas (Å), ou None se não houver célula;
+    - pbc: tupla de 3 booleanos indicando as direções periódicas.
+    """
+    __slots__ = ("coords", "species", "elements", "comment", "lattice", "pbc")
+
+    def __init__(self, coords, species, elements, comment="", lattice=None, pbc=None):
+        self.coords = coords
+        self.species = species
+        self.elements = elements
+        self.comment = comment
+        self.lattice = lattice
+        self.pbc = pbc if pbc is not None else (lattice is not None,) * 3
+
+    @property
+    def natoms(self):
+        return self.coords.shape[0]
+
+    @property
+    def symbols(self):
+        """Array com o símbolo químico de cada átomo (construído sob demanda)."""
+        return np.asarray(self.elements, dtype=object)[self.species]
+
+def _encode_species(symbols):
+    """
+    Converte uma sequência de símbolos químicos em (elements, species),
+    onde species são códigos inteiros compactos.
+    """
+    elements, species = np.unique(np.asarray(symbols).astype(str), return_inverse=True)
+    return tuple(str(el) for el in elements), species.astype(np.int32).ravel()
+
+def _parse_xyz_body_lines(lines):
+    """
+    Leitura linha a linha (caminho lento), usada apenas quando o corpo do arquivo
+    não tem um número regular de colunas. Mantém o comportamento original:
+    linhas com menos de 4 campos ou com coordenadas inválidas são ignoradas.
+    """
+    symbols = []
+    coords = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) >= 4: # Espera pelo menos tipo, x, y, z
+            try:
+                xyz = (float(parts[1]), float(parts[2]), float(parts[3]))
+            except ValueError:
+                continue
+            symbols.append(parts[0])
+            coords.append(xyz)
+    return symbols, np.array(coords, dtype=np.float64).reshape(-1, 3)
+
+_EXTXYZ_LATTICE_RE = re.compile(r'Lattice\s*=\s*"([^"]*)"', re.IGNORECASE)
+_EXTXYZ_PBC_RE = re.compile(r'pbc\s*=\s*"([^"]*)"', re.IGNORECASE)
+
+def parse_extxyz_lattice(comment):
+    """
+    Lê os vetores de rede e as direções periódicas da linha de comentário de um
+    arquivo extended-XYZ (Lattice="ax ay az bx by bz cx cy cz" pbc="T T F").
+    Retorna (lattice, pbc); lattice é None se a chave Lattice não existir.
+    Sem a chave pbc, a célula é considerada periódica nas três direções.
+    """
+    match = _EXTXYZ_LATTICE_RE.search(comment)
+    if match is None:
+        return None, None
+    try:
+        values = [float(v) for v in match.group(1).split()]
+    except ValueError:
+        raise XYZFormatError("Vetores de rede inválidos na chave Lattice.")
+    if len(values) != 9:
+        raise XYZFormatError("A chave Lattice deve conter 9 números.")
+    lattice = np.array(values, dtype=np.float64).reshape(3, 3)
+
+    pbc = (True, True, True)
+    match = _EXTXYZ_PBC_RE.search(comment)
+    if match is not None:
+        flags = match.group(1).split()
+        if len(flags) != 3:
+            raise XYZFormatError("A chave pbc deve conter 3 valores.")
+        pbc = tuple(flag.upper() in ("T", "TRUE", "1") for flag in flags)
+    return lattice, pbc
+
+def parse_xyz_text(text):
+    """
+    Interpreta o conteúdo de um arquivo .xyz (um único quadro) e retorna um XYZStructure.
+    A tokenização é feita de uma só vez (str.split + conversão vetorizada do NumPy);
+    o caminho linha a linha só é usado para arquivos com colunas irregulares.
+    Levanta XYZFormatError se o número de átomos lidos não corresponder ao declarado.
+    """
+    parts = text.split('\n', 2)
+    try:
+        natoms = int(parts[0].strip())
+    except ValueError:
+        raise XYZFormatError("Não foi possível ler o número de átomos.")
+    comment = parts[1].strip() if len(parts) > 1 else ""
+    body = parts[2] if len(parts) > 2 else ""
+    return _parse_xyz_frame(natoms, comment, body)
+
+def _parse_xyz_frame(natoms, comment, body):
+    """
+    Interpreta um quadro já separado em número de átomos, comentário e corpo
+    (as linhas de átomos). Usado tanto para arquivos de um quadro quanto para trajetórias.
+    """
+    try:
+        lattice, pbc = parse_extxyz_lattice(comment)
+    except XYZFormatError as e:
+        raise XYZFormatError(str(e), natoms=natoms)
+
+    tokens = body.split()
+    # Número de colunas da primeira linha de átomos (tipo, x, y, z, ...)
+    first_row = re.search(r'\S[^\n]*', body)
+    ncols = len(first_row.group().split()) if first_row else 0
+
+    structure = None
+    if natoms > 0 and ncols >= 4 and len(tokens) == natoms * ncols:
+        table = np.array(tokens, dtype=object).reshape(natoms, ncols)
+        try:
+            coords = table[:, 1:4].astype(np.float64)
+        except ValueError:
+            coords = None # Alguma coordenada inválida: usa o caminho lento
+        if coords is not None:
+            elements, species = _encode_species(table[:, 0])
+            structure = XYZStructure(coords, species, elements, comment, lattice, pbc)
+
+    if structure is None:
+        symbols, coords = _parse_xyz_body_lines(body.split('\n'))
+        if len(symbols) != natoms:
+            raise XYZFormatError(
+                f"O número de átomos lidos ({len(symbols)}) não corresponde ao declarado ({natoms}).",
+                natoms=natoms, n_read=len(symbols))
+        elements, species = _encode_species(symbols) if symbols else ((), np.zeros(0, dtype=np.int32))
+        structure = XYZStructure(coords, species, elements, comment, lattice, pbc)
+
+    return structure
+
+def read_xyz(file_path):
+    """
+    Lê um arquivo .xyz do disco e retorna um XYZStructure.
+    Levanta OSError (arquivo ausente/ilegível) ou XYZFormatError (conteúdo inválido).
+    """
+    with profile_stage("xyz/leitura") as stage:
+        with open(file_path, 'r') as f:
+            text = f.read()
+        stage.add_bytes(len(text))
+    with profile_stage("xyz/conversao"):
+        return parse_xyz_text(text)
+
+def iter_xyz_frames(file_path, progress=None):
+    """
+    Gerador que lê um arquivo .xyz de vários quadros (trajetória de relaxação ou de MD)
+    um quadro por vez, retornando um XYZStructure para cada um.
+    Só o quadro atual fica em memória, independentemente do tamanho do arquivo.
+    'progress' recebe a fração do arquivo já lida a cada quadro.
+    Levanta OSError ou XYZFormatError (indicando o número do quadro com problema).
+    """
+    with open(file_path, 'r') as f:
+        size = os.fstat(f.fileno()).st_size
+        frame_number = 0
+        while True:
+            if progress is not None and size:
+                # Posição do buffer binário: aproximada, mas suficiente para uma barra de progresso
+                progress(f.buffer.tell() / size)
+            header = f.readline()
+            if not header:
+                return # Fim do arquivo
+            if not header.strip():
+                continue # Linhas em branco entre quadros ou no final
+            frame_number += 1
+            try:
+                natoms = int(header.strip())
+            except ValueError:
+                raise XYZFormatError(f"Quadro {frame_number}: não foi possível ler o número de átomos.")
+            with profile_stage("xyz/leitura") as stage:
+                comment = f.readline().strip()
+                body = ''.join(itertools.islice(f, natoms))
+                stage.add_bytes(len(header) + len(comment) + len(body))
+            try:
+                with profile_stage("xyz/conversao"):
+                    structure = _parse_xyz_frame(natoms, comment, body)
+            except XYZFormatError as e:
+                raise XYZFormatError(f"Quadro {frame_number}: {e}", natoms=e.natoms, n_read=e.n_read)
+            yield structure
+
+# --- Índice de Quadros (acesso aleatório a trajetórias) ---
+
+# Sufixo do arquivo auxiliar ("sidecar") com o índice de quadros de um .xyz
+FRAME_INDEX_SUFFIX = ".frames.npz"
+_FRAME_INDEX_VERSION = 1
+
+def _find_nth_line_end(mm, start, nlines, size):
+    """
+    Retorna a posição logo após o n-ésimo '\\n' a partir de 'start' em um mmap,
+    contando as quebras de linha em blocos com NumPy (sem laço por linha).
+    Retorna None se o arquivo terminar antes disso.
+    """
+    pos = start
+    remaining = nlines
+    block = 1 << 16
+    while remaining > 0:
+        if pos >= size:
+            return None
+        chunk = mm[pos:pos + block]
+        found = chunk.count(b'\n')
+        if found >= remaining:
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+            return pos + int(newlines[remaining - 1]) + 1
+        remaining -= found
+        pos += len(chunk)
+        if remaining == 1 and pos >= size and not chunk.endswith(b'\n'):
+            return size # Última linha do arquivo sem '\n' final
+        block = min(block * 2, 1 << 24)
+    return pos
+
+def build_xyz_frame_index(file_path):
+    """
+    Percorre um arquivo .xyz uma única vez e registra o deslocamento em bytes
+    e o número de átomos de cada quadro. Usa mmap e só executa Python por quadro,
+    não por linha. Retorna (offsets, natoms) como arrays int64.
+    Levanta OSError ou XYZFormatError.
+    """
+    offsets = []
+    counts = []
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            while pos < size:
+                eol = mm.find(b'\n', pos)
+                if eol < 0:
+                    eol = size
+                header = mm[pos:eol].strip()
+                if not header:
+                    pos = eol + 1 # Linhas em branco entre quadros ou no final
+                    continue
+                try:
+                    natoms = int(header)
+                except ValueError:
+                    raise XYZFormatError(f"Quadro {len(offsets) + 1}: não foi possível ler o número de átomos.")
+                # Pula a linha de comentário e as natoms linhas de átomos
+                end = _find_nth_line_end(mm, eol + 1, natoms + 1, size)
+                if end is None:
+                    raise XYZFormatError(f"Quadro {len(offsets) + 1}: arquivo terminou antes do fim do quadro.",
+                                         natoms=natoms)
+                offsets.append(pos)
+                counts.append(natoms)
+                pos = end
+    return np.array(offsets, dtype=np.int64), np.array(counts, dtype=np.int64)
+
+def _frame_numbers(frames, n_frames):
+    """Converte um índice inteiro (aceita negativos) ou um slice em uma lista de quadros de 0 a n_frames-1."""
+    if isinstance(frames, slice):
+        return range(*frames.indices(n_frames))
+    frame = int(frames)
+    if frame < 0:
+        frame += n_frames
+    if not 0 <= frame < n_frames:
+        raise IndexError(f"O arquivo tem {n_frames} quadro(s); o quadro {int(frames) + 1} não existe.")
+    return [frame]
+
+class XYZFrameIndex:
+    """
+    Índice de quadros de uma trajetória .xyz, para ler qualquer quadro com um seek.
+    - offsets: deslocamento em bytes do início de cada quadro;
+    - natoms: número de átomos de cada quadro;
+    - file_size: tamanho do arquivo indexado (fim do último quadro).
+    """
+    __slots__ = ("file_path", "offsets", "natoms", "file_size")
+
+    def __init__(self, file_path, offsets, natoms, file_size):
+        self.file_path = file_path
+        self.offsets = offsets
+        self.natoms = natoms
+        self.file_size = file_size
+
+    @property
+    def n_frames(self):
+        return self.offsets.shape[0]
+
+    def frame_numbers(self, frames):
+        """Converte um índice inteiro (aceita negativos) ou um slice em uma lista de quadros."""
+        return _frame_numbers(frames, self.n_frames)
+
+    def read_frame(self, frame):
+        """Lê um único quadro (índice a partir de 0; negativos contam do final)."""
+        return next(self.iter_frames(frame))
+
+    def iter_frames(self, frames=slice(None)):
+        """
+        Gerador sobre um quadro, um intervalo ou um passo de quadros (slice),
+        lendo cada um diretamente do seu deslocamento no arquivo.
+        """
+        ends = np.append(self.offsets[1:], self.file_size)
+        with open(self.file_path, 'rb') as f:
+            for k in self.frame_numbers(frames):
+                with profile_stage("xyz/leitura", quadro=k) as stage:
+                    f.seek(int(self.offsets[k]))
+                    text = f.read(int(ends[k] - self.offsets[k])).decode()
+                    stage.add_bytes(len(text))
+                try:
+                    with profile_stage("xyz/conversao", quadro=k):
+                        structure = parse_xyz_text(text)
+                except XYZFormatError as e:
+                    raise XYZFormatError(f"Quadro {k + 1}: {e}", natoms=e.natoms, n_read=e.n_read)
+                yield structure
+
+def load_xyz_frame_index(file_path, write_sidecar=True):
+    """
+    Retorna o XYZFrameIndex de um arquivo .xyz, reaproveitando o arquivo auxiliar
+    '<arquivo>.frames.npz' quando o tamanho e o mtime registrados nele conferem com o
+    arquivo atual. Caso contrário, indexa o arquivo e (se possível) grava um novo auxiliar.
+    """
+    st = os.stat(file_path)
+    stamp = np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+    sidecar = file_path + FRAME_INDEX_SUFFIX
+
+    try:
+        with np.load(sidecar) as data:
+            if int(data["version"]) == _FRAME_INDEX_VERSION and np.array_equal(data["stamp"], stamp):
+                return XYZFrameIndex(file_path, data["offsets"], data["natoms"], st.st_size)
+    except Exception:
+        # Auxiliar ausente, corrompido (truncado: BadZipFile, EOFError...) ou de outra versão: reindexa
+        pass
+
+    with profile_stage("xyz/indice") as stage:
+        offsets, natoms = build_xyz_frame_index(file_path)
+        stage.add_bytes(st.st_size)
+    if write_sidecar:
+        # Gravado à parte e renomeado: outro processo (ex.: o pool do lote.py) que leia o auxiliar
+        # ao mesmo tempo vê o anterior ou o novo inteiro, nunca um arquivo pela metade
+        tmp = f"{sidecar}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, version=_FRAME_INDEX_VERSION, stamp=stamp, offsets=offsets, natoms=natoms)
+            os.replace(tmp, sidecar)
+        except OSError:
+            # Pasta sem permissão de escrita: o índice vale só para esta sessão
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    return XYZFrameIndex(file_path, offsets, natoms, st.st_size)
+
+def parse_frame_selection(text):
+    """
+    Interpreta a seleção de quadros digitada pelo usuário, numerada a partir de 1:
+    - "" -> None (arquivo inteiro / quadro único);
+    - "5" -> quadro 5 (índice 4); "-1" -> último quadro;
+    - "início:fim:passo" (campos opcionais, fim inclusivo) -> slice.
+    Levanta ValueError para texto inválido.
+    """
+    text = text.strip()
+    if not text:
+        return None
+    if ':' not in text:
+        frame = int(text)
+        if frame == 0:
+            raise ValueError("Os quadros são numerados a partir de 1.")
+        return frame - 1 if frame > 0 else frame
+    fields = text.split(':')
+    if len(fields) > 3:
+        raise ValueError("Use o formato início:fim:passo.")
+    start, stop, step = (fields + ["", ""])[:3]
+    start = int(start) - 1 if start.strip() else None
+    stop = int(stop) if stop.strip() else None
+    step = int(step) if step.strip() else None
+    if (start is not None and start < 0) or (stop is not None and stop < 1) or (step is not None and step < 1):
+        raise ValueError("Início, fim e passo devem ser positivos.")
+    return slice(start, stop, step)
+
+# --- Cache de Resultados em Disco ---
+
+# Pasta padrão do cache, compartilhada pela interface e pelo modo em lote
+DEFAULT_CACHE_DIR = os.environ.get("LAYERS_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "layers")
+DEFAULT_CACHE_MAX_BYTES = 1 << 30 # 1 GiB
+_CACHE_VERSION = 1 # Mudar quando o formato dos resultados mudar, para invalidar o cache antigo
+_HASH_CHUNK_BYTES = 1 << 22
+
+def _cache_key_value(value):
+    """Converte parâmetros (slices, arrays, tipos NumPy) em valores aceitos pelo json."""
+    if isinstance(value, slice):
+        return [value.start, value.stop, value.step]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, type):
+        return np.dtype(value).name
+    return str(value)
+
+class ResultCache:
+    """
+    Cache em disco de estruturas lidas e de resultados de cálculos, compartilhado pela interface,
+    pelo modo em lote e pelos processos do pool. Cada entrada é identificada pelo hash do conteúdo
+    do arquivo, pelo tipo de cálculo e pelos parâmetros (corte, PBC, quadro, ...):
+    - o hash de cada arquivo fica registrado com o tamanho e o mtime em 'carimbos/'; enquanto eles
+      não mudam, o arquivo não é relido, e uma consulta custa só um os.stat;
+    - as entradas são arquivos pickle em 'entradas/'; o mtime de cada uma marca o último uso, e as
+      usadas há mais tempo são apagadas quando o total passa de max_bytes (LRU).
+    As gravações são atômicas (arquivo temporário + os.replace) e falhas de escrita são ignoradas:
+    sem permissão de escrita, os cálculos apenas deixam de ser guardados.
+    """
+    __slots__ = ("directory", "max_bytes")
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @property
+    def entries_dir(self):
+        return os.path.join(self.directory, "entradas")
+
+    @property
+    def stamps_dir(self):
+        return os.path.join(self.directory, "carimbos")
+
+    def _write_atomic(self, path, data):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def file_hash(self, file_path):
+        """
+        Hash do conteúdo de um arquivo. Só lê o arquivo se o tamanho ou o mtime mudaram
+        desde a última vez. Levanta OSError se o arquivo não existir.
+        """
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+        stamp_path = os.path.join(self.stamps_dir, hashlib.sha1(path.encode()).hexdigest() + ".json")
+        try:
+            with open(stamp_path, 'r') as f:
+                stamp = json.load(f)
+            if stamp["tamanho"] == st.st_size and stamp["mtime_ns"] == st.st_mtime_ns:
+                return stamp["hash"]
+        except (OSError, ValueError, KeyError):
+            pass # Carimbo ausente, corrompido ou desatualizado: recalcula o hash
+
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(_HASH_CHUNK_BYTES), b""):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+        stamp = {"tamanho": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": content_hash}
+        self._write_atomic(stamp_path, json.dumps(stamp).encode())
+        return content_hash
+
+    def entry_key(self, file_path, kind, params):
+        """Chave de uma entrada: hash de (versão, conteúdo do arquivo, cálculo, parâmetros)."""
+        description = json.dumps([_CACHE_VERSION, self.file_hash(file_path), kind, params],
+                                 sort_keys=True, default=_cache_key_value)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def get(self, key):
+        """Retorna o valor guardado em 'key' (e marca o uso), ou None se não houver."""
+        path = os.path.join(self.entries_dir, key + ".pkl")
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            # Entrada corrompida ou de uma versão antiga das classes: descarta
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path) # Último uso, para a política LRU
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """Guarda 'value' em 'key' e apaga as entradas mais antigas se o limite for ultrapassado."""
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return # Maior que o cache inteiro: não vale a pena guardar
+        if self._write_atomic(os.path.join(self.entries_dir, key + ".pkl"), data):
+            self.evict()
+
+    def evict(self):
+        """Apaga as entradas usadas há mais tempo até o total caber em max_bytes."""
+        entries = []
+        try:
+            with os.scandir(self.entries_dir) as it:
+                for entry in it:
+                    if entry.name.endswith(".pkl"):
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            continue # Apagada por outro processo
+                        entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def size_bytes(self):
+        """Espaço ocupado pelas entradas do cache."""
+        try:
+            with os.scandir(self.entries_dir) as it:
+                return sum(entry.stat().st_size for entry in it if entry.name.endswith(".pkl"))
+        except OSError:
+            return 0
+
+    def clear(self):
+        """Apaga todas as entradas e carimbos."""
+        for folder in (self.entries_dir, self.stamps_dir):
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def cached(self, file_path, kind, params, compute):
+        """
+        Retorna o resultado guardado para (arquivo, kind, params) ou chama compute() e o guarda.
+        Erros de compute() (inclusive CalculationCancelled) não são guardados.
+        """
+        with profile_stage("cache/consulta", calculo=kind):
+            try:
+                key = self.entry_key(file_path, kind, params)
+            except OSError:
+                key = None
+            value = None if key is None else self.get(key)
+        if key is None:
+            return compute() # Arquivo ausente ou ilegível: o próprio cálculo levanta o erro
+        if value is None:
+            value = compute()
+            with profile_stage("cache/gravacao", calculo=kind):
+                self.put(key, value)
+        return value
+
+# Cache usado pelos cálculos do módulo (None = desativado); veja configure_result_cache
+_result_cache = ResultCache()
+
+def configure_result_cache(directory=None, max_bytes=None, enabled=True):
+    """
+    Define a pasta e o tamanho máximo do cache em disco usado pelos cálculos, ou o desativa.
+    Deve ser chamada em cada processo (no modo em lote, pelo inicializador do pool).
+    """
+    global _result_cache
+    if not enabled:
+        _result_cache = None
+        return
+    _result_cache = ResultCache(directory or DEFAULT_CACHE_DIR,
+                                DEFAULT_CACHE_MAX_BYTES if max_bytes is None else max_bytes)
+
+def get_result_cache():
+    """Retorna o ResultCache em uso, ou None se o cache estiver desativado."""
+    return _result_cache
+
+def _cached(file_path, kind, params, compute):
+    if _result_cache is None:
+        return compute()
+    return _result_cache.cached(file_path, kind, params, compute)
+
+# Estruturas já lidas nesta sessão: (caminho, quadro) -> ((tamanho, mtime), XYZStructure),
+# da usada há mais tempo para a mais recente (veja configure_session_cache)
+_xyz_session_cache = {}
+_XYZ_SESSION_CACHE_MAX = 8
+_xyz_session_max = _XYZ_SESSION_CACHE_MAX
+_xyz_session_max_bytes = None
+# Protege o estado de sessão compartilhado pelos cálculos que rodam em threads (as abas da interface):
+# o cache de estruturas e, para o recálculo incremental, os textos e as execuções guardados
+_session_lock = threading.RLock()
+
+def configure_session_cache(max_structures=_XYZ_SESSION_CACHE_MAX, max_bytes=None):
+    """
+    Define quantas estruturas lidas ficam no cache de sessão (veja load_xyz) e, com 'max_bytes',
+    a memória máxima ocupada pelos seus arrays; as usadas há mais tempo são descartadas (a mais
+    recente sempre fica). Processos de longa duração, como o modo de serviço, guardam mais estruturas.
+    """
+    global _xyz_session_max, _xyz_session_max_bytes
+    if max_structures < 1:
+        raise ValueError("O cache de sessão precisa guardar pelo menos uma estrutura.")
+    with _session_lock:
+        _xyz_session_max, _xyz_session_max_bytes = max_structures, max_bytes
+        _trim_session_cache()
+
+def _structure_nbytes(structure):
+    return structure.coords.nbytes + structure.species.nbytes
+
+def _trim_session_cache():
+    # Chamada com _session_lock
+    total = None
+    while len(_xyz_session_cache) > 1:
+        if len(_xyz_session_cache) <= _xyz_session_max:
+            if _xyz_session_max_bytes is None:
+                break
+            if total is None:
+                total = sum(_structure_nbytes(s) for _, s in _xyz_session_cache.values())
+            if total <= _xyz_session_max_bytes:
+                break
+        # Descarta a entrada mais antiga (dicionários preservam a ordem de inserção)
+        _, structure = _xyz_session_cache.pop(next(iter(_xyz_session_cache)))
+        if total is not None:
+            total -= _structure_nbytes(structure)
+
+def load_xyz(file_path, frame=None):
+    """
+    Versão de read_xyz com cache de sessão: cada arquivo é lido uma única vez
+    e reaproveitado por todos os cálculos, enquanto tamanho e mtime não mudarem.
+    Fora da sessão, a estrutura lida fica no cache em disco (veja ResultCache).
+    Com 'frame' (índice a partir de 0), lê apenas esse quadro de uma trajetória,
+    indo direto a ele pelo índice de quadros (levanta IndexError se não existir).
+    Também lê o STRUCT_OUT e as saídas do SIESTA e do pw.x (veja detect_file_format); nelas,
+    sem 'frame', a estrutura é a geometria final.
+    Com o recálculo incremental ligado, um arquivo que muda durante a sessão é relido
+    convertendo só as linhas alteradas (veja configure_incremental).
+    A estrutura retornada é compartilhada e não deve ser modificada.
+    """
+    path = os.path.abspath(file_path)
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    key = (path, frame)
+
+    with _session_lock:
+        cached = _xyz_session_cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            _xyz_session_cache[key] = _xyz_session_cache.pop(key) # Agora é a usada mais recentemente
+            return cached[1]
+
+    file_format = detect_file_format(path)
+    if file_format not in (None, "xyz"):
+        # STRUCT_OUT ou saída do SIESTA/pw.x: sem quadro, vale a geometria final
+        structure = _cached(path, "estrutura", {"quadro": frame},
+                            lambda: OutputFrameIndex(path).read_frame(-1 if frame is None else frame))
+    elif frame is None and _incremental_runs is not None and (cached is not None or path in _xyz_texts):
+        # O arquivo mudou durante a sessão (ex.: novo passo iônico): relê só as linhas alteradas
+        structure = _reread_xyz(path)
+    elif frame is None:
+        structure = _cached(path, "estrutura", {"quadro": None}, lambda: read_xyz(path))
+    else:
+        structure = _cached(path, "estrutura", {"quadro": frame},
+                            lambda: load_xyz_frame_index(path).read_frame(frame))
+    # A leitura fica fora do lock (arquivos diferentes são lidos em paralelo); só o cache é protegido
+    with _session_lock:
+        _xyz_session_cache.pop(key, None)
+        _xyz_session_cache[key] = (stamp, structure)
+        _trim_session_cache()
+    return structure
+
+# --- Leitura Incremental (arquivos editados durante a sessão) ---
+
+# Recálculo incremental: None = desativado (padrão); senão, um dicionário
+# (caminho, cálculo, parâmetros) -> (estrutura, resultado, estado) com a última execução de cada cálculo
+_incremental_runs = None
+_INCREMENTAL_MAX_RUNS = 8
+# Acima desta fração de átomos alterados, refazer o cálculo inteiro é tão rápido quanto atualizar
+_INCREMENTAL_MAX_FRACTION = 0.25
+# Deslocamento mínimo (Å) para que um átomo conte como movido
+_MOVE_TOLERANCE = 1e-6
+# Última versão lida de cada arquivo alterado: caminho -> (bytes, fins de linha, XYZStructure)
+_xyz_texts = {}
+_INCREMENTAL_MAX_TEXT = 64 << 20
+
+def configure_incremental(enabled=True):
+    """
+    Liga ou desliga o recálculo incremental: com ele, cada cálculo guarda a estrutura e o resultado
+    da última execução e, quando o mesmo arquivo muda (poucos átomos movidos, acrescentados ou
+    removidos no fim), refaz só a parte afetada. Desligado por padrão, já que no modo em lote cada
+    arquivo é lido uma única vez; a interface o liga. Também descarta o estado guardado.
+    """
+    global _incremental_runs
+    with _session_lock:
+        _incremental_runs = {} if enabled else None
+        _xyz_texts.clear()
+
+def clear_incremental_state():
+    """Descarta as execuções e os textos guardados para o recálculo incremental."""
+    with _session_lock:
+        if _incremental_runs is not None:
+            _incremental_runs.clear()
+        _xyz_texts.clear()
+
+class StructureChange:
+    """
+    Diferença entre duas versões de uma estrutura (veja diff_structures):
+    - moved: índices (a partir de 0) dos átomos que mudaram de posição ou de elemento;
+    - n_old, n_new: número de átomos antes e depois (átomos acrescentados ou removidos no fim);
+    - cell_changed: se a célula periódica mudou (nesse caso, todas as distâncias mudam).
+    """
+    __slots__ = ("moved", "n_old", "n_new", "cell_changed")
+
+    def __init__(self, moved, n_old, n_new, cell_changed=False):
+        self.moved = moved
+        self.n_old = n_old
+        self.n_new = n_new
+        self.cell_changed = cell_changed
+
+    @property
+    def affected(self):
+        """Átomos da versão nova cujos pares devem ser refeitos: os movidos e os acrescentados."""
+        return np.concatenate((self.moved, np.arange(self.n_old, self.n_new, dtype=np.int64)))
+
+    @property
+    def n_affected(self):
+        """Átomos movidos, acrescentados ou removidos."""
+        return len(self.moved) + abs(self.n_new - self.n_old)
+
+    def old_mask(self):
+        """Máscara (n_old,) dos átomos da versão anterior cujos pares deixam de valer."""
+        mask = np.zeros(self.n_old, dtype=bool)
+        mask[self.moved] = True
+        mask[self.n_new:] = True
+        return mask
+
+def diff_structures(old, new, use_pbc=True, lattice=None, tolerance=_MOVE_TOLERANCE):
+    """
+    Compara duas versões de uma estrutura átomo a átomo (em lote, O(N)). Átomos acrescentados
+    ou removidos são os do fim da lista; uma inserção no meio aparece como muitos átomos movidos.
+    A célula é a de resolve_cell(estrutura, use_pbc, lattice). Retorna um StructureChange.
+    """
+    common = min(old.natoms, new.natoms)
+    moved = np.any(np.abs(new.coords[:common] - old.coords[:common]) > tolerance, axis=1)
+    if old.elements == new.elements:
+        moved |= old.species[:common] != new.species[:common]
+    else:
+        # Códigos diferentes nas duas versões: traduz os antigos para os novos (-1 = elemento ausente)
+        lookup = np.array([new.elements.index(el) if el in new.elements else -1 for el in old.elements])
+        moved |= lookup[old.species[:common]] != new.species[:common]
+
+    old_cell, old_pbc = resolve_cell(old, use_pbc, lattice)
+    new_cell, new_pbc = resolve_cell(new, use_pbc, lattice)
+    if old_cell is None or new_cell is None:
+        cell_changed = (old_cell is None) != (new_cell is None)
+    else:
+        cell_changed = not (np.array_equal(old_cell, new_cell) and np.array_equal(old_pbc, new_pbc))
+    return StructureChange(np.flatnonzero(moved), old.natoms, new.natoms, cell_changed)
+
+def _reread_xyz(path):
+    """
+    Relê um .xyz de um quadro que já foi lido nesta sessão. Se os bytes da versão anterior
+    estiverem guardados, só as linhas de átomos diferentes são convertidas (veja
+    _reparse_changed_lines); senão, ou se o arquivo mudou demais, o texto inteiro é convertido.
+    Guarda os bytes novos para a próxima vez. Levanta OSError ou XYZFormatError, como read_xyz.
+    """
+    with profile_stage("xyz/leitura") as stage:
+        with open(path, 'rb') as f:
+            data = f.read()
+        stage.add_bytes(len(data))
+    buf = np.frombuffer(data, dtype=np.uint8)
+    line_ends = np.append(np.flatnonzero(buf == 10), len(data)) # Fim de cada linha ('\n' ou fim do arquivo)
+    structure = None
+    with _session_lock:
+        previous = _xyz_texts.pop(path, None)
+    if previous is not None:
+        with profile_stage("xyz/releitura"):
+            structure = _reparse_changed_lines(previous, buf, line_ends)
+    if structure is None:
+        with profile_stage("xyz/conversao"):
+            structure = parse_xyz_text(data.decode())
+    if len(data) <= _INCREMENTAL_MAX_TEXT and _atom_lines_only(buf, line_ends, structure.natoms):
+        with _session_lock:
+            _xyz_texts.pop(path, None)
+            if len(_xyz_texts) >= _XYZ_SESSION_CACHE_MAX:
+                del _xyz_texts[next(iter(_xyz_texts))]
+            _xyz_texts[path] = (buf, line_ends, structure)
+    return structure
+
+def _atom_lines_only(buf, line_ends, natoms):
+    """Verdadeiro se, depois das duas linhas de cabeçalho e das 'natoms' linhas de átomos, só houver espaços."""
+    if len(line_ends) < natoms + 2:
+        return False
+    tail = buf[line_ends[natoms + 1]:]
+    return bool(np.isin(tail, (9, 10, 13, 32)).all())
+
+def _reparse_changed_lines(previous, buf, line_ends):
+    """
+    Monta a estrutura do arquivo novo ('buf', com o fim de cada linha em 'line_ends') a partir da
+    versão anterior ('previous' = (bytes, fins de linha, XYZStructure), com uma linha por átomo),
+    convertendo só as linhas de átomos que mudaram e as acrescentadas no fim. As linhas são
+    comparadas em lote, byte a byte, em trechos com o mesmo deslocamento entre as duas versões.
+    Retorna None quando não é possível (formato diferente, linha inválida ou linhas demais
+    alteradas): o chamador converte o texto inteiro.
+    """
+    old_buf, old_line_ends, old = previous
+    if len(line_ends) < 3:
+        return None
+    try:
+        natoms = int(buf[:line_ends[0]].tobytes())
+    except ValueError:
+        return None
+    if natoms < 1 or not _atom_lines_only(buf, line_ends, natoms):
+        return None
+
+    # Linha k de átomos: bytes [starts[k], ends[k]) (as duas primeiras linhas são o cabeçalho)
+    starts, ends = line_ends[1:natoms + 1] + 1, line_ends[2:natoms + 2]
+    old_starts, old_ends = old_line_ends[1:old.natoms + 1] + 1, old_line_ends[2:old.natoms + 2]
+    common = min(old.natoms, natoms)
+    changed = (ends[:common] - starts[:common]) != (old_ends[:common] - old_starts[:common])
+    shift = starts[:common] - old_starts[:common]
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(shift)) + 1, [common]))
+    if len(bounds) > _INCREMENTAL_MAX_FRACTION * natoms + 2:
+        return None
+    for first, last in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        if first == last:
+            continue
+        # Dentro de um trecho, só a última linha pode ter mudado de tamanho (e já está marcada)
+        a, d = starts[first], shift[first]
+        b = starts[last - 1] if changed[last - 1] else ends[last - 1]
+        differ = np.flatnonzero(buf[a:b] != old_buf[a - d:b - d]) + a
+        changed[np.searchsorted(starts[:common], differ, side='right') - 1] = True
+    changed = np.concatenate((np.flatnonzero(changed), np.arange(common, natoms)))
+    if len(changed) > _INCREMENTAL_MAX_FRACTION * natoms:
+        return None
+
+    data = buf.data
+    lines = [bytes(data[starts[k]:ends[k]]).decode() for k in changed.tolist()]
+    symbols, coords = _parse_xyz_body_lines(lines)
+    if len(symbols) != len(changed):
+        return None # Alguma linha alterada não é um átomo válido
+    comment = bytes(data[line_ends[0] + 1:line_ends[1]]).decode().strip()
+    try:
+        lattice, pbc = parse_extxyz_lattice(comment)
+    except XYZFormatError:
+        return None
+
+    new_coords = np.empty((natoms, 3), dtype=np.float64)
+    new_coords[:common] = old.coords[:common]
+    new_coords[changed] = coords
+    # Elementos em ordem alfabética, como em _encode_species, sem os que deixaram de aparecer
+    elements = tuple(sorted(set(old.elements) | set(symbols)))
+    remap = np.array([elements.index(el) for el in old.elements], dtype=np.int32)
+    species = np.empty(natoms, dtype=np.int32)
+    species[:common] = remap[old.species[:common]]
+    species[changed] = [elements.index(el) for el in symbols]
+    used = np.zeros(len(elements), dtype=bool)
+    used[species] = True
+    if not used.all():
+        species = (np.cumsum(used) - 1).astype(np.int32)[species]
+        elements = tuple(el for el, keep in zip(elements, used) if keep)
+    return XYZStructure(new_coords, species, elements, comment, lattice, pbc)
+
+def _run_incremental(file_path, kind, params, structure, use_pbc, lattice, full, update):
+    """
+    Executa um cálculo sobre 'structure' aproveitando, se possível, a execução anterior do mesmo
+    cálculo ('kind' e 'params') para o mesmo arquivo: full() retorna (resultado, estado) do zero;
+    update(resultado anterior, estado anterior, StructureChange) retorna (resultado, estado) ou
+    None quando a atualização não se aplica. Sem o recálculo incremental, apenas chama full().
+    """
+    runs = _incremental_runs
+    if runs is None:
+        return full()[0]
+    key = (os.path.abspath(file_path), kind, json.dumps(params, sort_keys=True, default=_cache_key_value))
+    outcome = None
+    # O cálculo fica fora do lock; execuções simultâneas da mesma chave (ex.: "Atualizar ao Mudar")
+    # não compartilham a anterior: a que não a encontra refaz o cálculo inteiro
+    with _session_lock:
+        previous = runs.pop(key, None)
+    if previous is not None:
+        old_structure, old_result, old_state = previous
+        change = diff_structures(old_structure, structure, use_pbc, lattice)
+        if not change.cell_changed and change.n_affected <= _INCREMENTAL_MAX_FRACTION * structure.natoms:
+            with profile_stage(f"{kind}/incremental", alterados=change.n_affected, atomos=structure.natoms):
+                outcome = update(old_result, old_state, change)
+    if outcome is None:
+        outcome = full()
+    with _session_lock:
+        runs.pop(key, None)
+        if len(runs) >= _INCREMENTAL_MAX_RUNS:
+            del runs[next(iter(runs))]
+        runs[key] = (structure, *outcome)
+    return outcome[0]
+
+# --- Condições Periódicas de Contorno ---
+
+def parse_lattice_text(text):
+    """
+    Converte os vetores de rede digitados pelo usuário (9 números, Å, separados por
+    espaços ou ponto e vírgula; aceita vírgula decimal) em uma matriz (3, 3) com um vetor por linha.
+    Levanta ValueError se o texto não tiver exatamente 9 números.
+    """
+    values = [float(v.replace(',', '.')) for v in re.split(r'[\s;]+', text.strip()) if v]
+    if len(values) != 9:
+        raise ValueError("Informe exatamente 9 números para os vetores de rede (a, b e c).")
+    return np.array(values, dtype=np.float64).reshape(3, 3)
+
+def resolve_cell(structure, use_pbc=True, lattice=None, pbc=None):
+    """
+    Decide qual célula periódica usar em um cálculo.
+    - use_pbc=False: ignora qualquer célula (coordenadas cartesianas puras);
+    - lattice: vetores de rede fornecidos manualmente, que substituem os do arquivo;
+    - pbc: direções periódicas; por padrão, as do arquivo ou (T, T, T).
+    Retorna (lattice, pbc) ou (None, None) quando não há periodicidade.
+    """
+    if not use_pbc:
+        return None, None
+    if lattice is None:
+        lattice = structure.lattice
+    if lattice is None:
+        return None, None
+    if pbc is None:
+        pbc = structure.pbc if structure.lattice is not None else (True, True, True)
+    lattice = np.asarray(lattice, dtype=np.float64).reshape(3, 3)
+    pbc = np.asarray(pbc, dtype=bool).reshape(3)
+    if not pbc.any():
+        return None, None
+    if abs(np.linalg.det(lattice)) < 1e-10:
+        raise ValueError("Os vetores de rede são linearmente dependentes (volume nulo).")
+    return lattice, pbc
+
+def _is_orthogonal(lattice):
+    """Verdadeiro se os três vetores de rede forem mutuamente perpendiculares."""
+    gram = lattice @ lattice.T
+    return np.allclose(gram - np.diag(np.diag(gram)), 0.0, atol=1e-8)
+
+def minimum_image(deltas, lattice, pbc=(True, True, True)):
+    """
+    Aplica a convenção de imagem mínima a um array (M, 3) de vetores diferença,
+    para uma célula triclínica qualquer (vetores de rede nas linhas de 'lattice').
+    Tudo é feito em lote: a diferença é reduzida em coordenadas fracionárias e,
+    em células não ortogonais, as 27 imagens vizinhas são comparadas de uma vez por
+    deslocamento, mantendo a menor.
+    """
+    deltas = np.asarray(deltas, dtype=np.float64)
+    if lattice is None:
+        return deltas
+    pbc = np.asarray(pbc, dtype=bool).reshape(3)
+    frac = deltas @ np.linalg.inv(lattice)
+    frac[:, pbc] -= np.round(frac[:, pbc])
+    reduced = frac @ lattice
+    if _is_orthogonal(lattice):
+        return reduced
+
+    best = reduced
+    best_sq = (reduced ** 2).sum(axis=1)
+    ranges = [(-1, 0, 1) if periodic else (0,) for periodic in pbc]
+    for n1 in ranges[0]:
+        for n2 in ranges[1]:
+            for n3 in ranges[2]:
+                if n1 == n2 == n3 == 0:
+                    continue
+                candidate = reduced + (n1 * lattice[0] + n2 * lattice[1] + n3 * lattice[2])
+                candidate_sq = (candidate ** 2).sum(axis=1)
+                closer = candidate_sq < best_sq
+                if closer.any():
+                    best = np.where(closer[:, None], candidate, best)
+                    best_sq = np.where(closer, candidate_sq, best_sq)
+    return best
+
+def _periodic_images(coords, max_cutoff, lattice, pbc):
+    """
+    Cria as imagens periódicas ("átomos fantasma") que ficam a menos de max_cutoff
+    das faces da célula. Retorna (extended_coords, origin), onde origin[k] é o índice
+    do átomo original correspondente à posição k (as N primeiras são os próprios átomos).
+    """
+    inv = np.linalg.inv(lattice)
+    frac = coords @ inv
+    frac[:, pbc] -= np.floor(frac[:, pbc]) # Leva os átomos para dentro da célula
+    origin = np.arange(coords.shape[0])
+
+    volume = abs(np.linalg.det(lattice))
+    for axis in np.nonzero(pbc)[0]:
+        # Espessura da célula perpendicular à face oposta ao eixo 'axis'
+        other = [k for k in range(3) if k != axis]
+        width = volume / np.linalg.norm(np.cross(lattice[other[0]], lattice[other[1]]))
+        margin = max_cutoff / width
+        n_shifts = int(np.ceil(margin))
+        new_frac, new_origin = [frac], [origin]
+        for shift in range(-n_shifts, n_shifts + 1):
+            if shift == 0:
+                continue
+            shifted = frac[:, axis] + shift
+            keep = (shifted >= -margin) & (shifted < 1.0 + margin)
+            if keep.any():
+                image = frac[keep].copy()
+                image[:, axis] = shifted[keep]
+                new_frac.append(image)
+                new_origin.append(origin[keep])
+        frac = np.concatenate(new_frac)
+        origin = np.concatenate(new_origin)
+
+    return frac @ lattice, origin
+
+# --- Núcleos de Cálculo (NumPy ou Numba) ---
+
+# Backends disponíveis para set_backend ("auto" escolhe o Numba quando estiver instalado)
+BACKENDS = ("numpy", "numba")
+# Backend pedido pela interface e pelo lote.py quando não informado (variável LAYERS_BACKEND)
+DEFAULT_BACKEND = os.environ.get("LAYERS_BACKEND") or "auto"
+
+class NumpyBackend:
+    """
+    Núcleos vetorizados com NumPy, sempre disponíveis e referência da verificação dos demais:
+    - pair_tile: distâncias das posições [p0, p1) da ordem condensada de todos os pares;
+    - pair_distances: distâncias dos pares candidatos (i[k], j[k]) das buscas de vizinhos;
+    - band_extrema: VBM e CBM de cada ponto k e extremos de cada banda em um bloco do .bands;
+    - layer_segments: início, número de átomos e alturas média, mínima e máxima das camadas.
+    Outro backend (veja nucleos_numba.py) implementa os mesmos métodos, com os mesmos resultados.
+    """
+    name = "numpy"
+    description = "NumPy (vetorizado)"
+
+    def pair_tile(self, coords, lattice, pbc, offsets, p0, p1, out):
+        """
+        Calcula as distâncias das posições [p0, p1) da ordem condensada e as grava em out[p0:p1].
+        As diferenças de cada linha vêm de fatias contíguas das coordenadas, e a imagem mínima é
+        aplicada de uma vez ao bloco inteiro.
+        """
+        deltas = np.empty((p1 - p0, 3), dtype=np.float64)
+        first = int(np.searchsorted(offsets, p0, side="right")) - 1
+        last = int(np.searchsorted(offsets, p1 - 1, side="right"))
+        for i, start, stop in zip(range(first, last), offsets[first:last].tolist(), offsets[first+1:last+1].tolist()):
+            a, b = max(start, p0), min(stop, p1)
+            j = a - start + i + 1
+            np.subtract(coords[j:j + b - a], coords[i], out=deltas[a - p0:b - p0])
+        deltas = minimum_image(deltas, lattice, pbc)
+        out[p0:p1] = np.sqrt((deltas ** 2).sum(axis=1))
+
+    def pair_distances(self, coords, i, j, lattice=None, pbc=(True, True, True)):
+        """Distâncias entre coords[i[k]] e coords[j[k]] (imagem mínima se houver 'lattice')."""
+        return np.sqrt((minimum_image(coords[j] - coords[i], lattice, pbc) ** 2).sum(axis=1))
+
+    def band_extrema(self, energies, fermi):
+        """
+        Para um bloco de energias (m, nspin, nbandas), retorna (vbm_k, cbm_k, band_min, band_max):
+        a maior energia <= E_F e a menor energia > E_F em cada ponto k e spin (-inf e inf se não
+        houver) e a menor e a maior energia de cada banda no bloco.
+        """
+        occupied = energies <= fermi
+        return (np.where(occupied, energies, -np.inf).max(axis=2),
+                np.where(occupied, np.inf, energies).min(axis=2),
+                energies.min(axis=0), energies.max(axis=0))
+
+    def layer_segments(self, z_sorted, gap_tolerance):
+        """
+        Separa as alturas ordenadas onde o vazio entre vizinhas passa de gap_tolerance. Retorna
+        (starts, counts, mean_z, min_z, max_z), um valor por camada.
+        """
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(z_sorted) > gap_tolerance) + 1))
+        counts = np.diff(np.append(starts, len(z_sorted)))
+        mean_z = np.add.reduceat(z_sorted, starts) / counts
+        return starts, counts, mean_z, z_sorted[starts], z_sorted[np.append(starts[1:], len(z_sorted)) - 1]
+
+# Elementos processados pelos núcleos (pares, alturas, energias) a partir dos quais um backend
+# adiado carrega o compilado: abaixo disso, importar o Numba e carregar o código do cache em disco
+# (~0,3 s) custa mais do que a diferença para o NumPy
+JIT_MIN_WORK = 2_000_000
+# Veredito de check_backend guardado entre as partidas (só se repete quando o Numba, o NumPy ou
+# nucleos_numba.py mudam)
+BACKEND_CHECK_FILE = os.path.join(DEFAULT_CACHE_DIR, "nucleos.json")
+
+class DeferredBackend:
+    """
+    Backend compilado ainda não carregado: os núcleos rodam em NumPy (mesmos resultados; veja
+    check_backend) até o trabalho somado das chamadas passar de JIT_MIN_WORK, e só então o módulo
+    do backend (e o Numba) é importado e passa a ser o backend ativo. Assim, partidas que só
+    processam entradas pequenas, como uma chamada do lote.py sobre um arquivo ou os processos do
+    pool que só consultam o cache, não pagam a importação.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.description = f"{name.capitalize()} (JIT, carregado sob demanda)"
+        self._numpy = NumpyBackend()
+        self._work = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Carrega o backend (se ainda não foi), o torna ativo e o retorna; o NumPy se falhar."""
+        global _backend, _backend_note
+        with self._lock:
+            if _backend is self:
+                try:
+                    with profile_stage("nucleos/carga", nucleo=self.name):
+                        _backend = _load_backend(self.name)
+                except ImportError as error:
+                    _backend, _backend_note = NumpyBackend(), f"{self.name} indisponível: {error}"
+        return _backend
+
+    def _select(self, work):
+        self._work += work
+        return self.load() if self._work >= JIT_MIN_WORK else self._numpy
+
+    def pair_tile(self, coords, lattice, pbc, offsets, p0, p1, out):
+        self._select(p1 - p0).pair_tile(coords, lattice, pbc, offsets, p0, p1, out)
+
+    def pair_distances(self, coords, i, j, lattice=None, pbc=(True, True, True)):
+        return self._select(len(i)).pair_distances(coords, i, j, lattice, pbc)
+
+    def band_extrema(self, energies, fermi):
+        return self._select(energies.size).band_extrema(energies, fermi)
+
+    def layer_segments(self, z_sorted, gap_tolerance):
+        return self._select(len(z_sorted)).layer_segments(z_sorted, gap_tolerance)
+
+_backend = NumpyBackend() # Backend ativo (veja set_backend)
+_backend_note = None # Por que o backend pedido não ficou ativo (None se ficou)
+
+def available_backends():
+    """Nomes dos backends que podem ser usados neste ambiente (sem importar o Numba)."""
+    import importlib.util
+    return tuple(name for name in BACKENDS if name == "numpy" or importlib.util.find_spec(name) is not None)
+
+def _load_backend(name):
+    if name == "numpy":
+        return NumpyBackend()
+    if name == "numba":
+        # O código compilado fica no cache em disco: só a primeira partida paga a compilação
+        os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(DEFAULT_CACHE_DIR, "numba"))
+        from nucleos_numba import NumbaBackend
+        return NumbaBackend()
+    raise ValueError(f"Backend desconhecido: {name} (use auto, {', '.join(BACKENDS)}).")
+
+def _backend_check_key(name):
+    """
+    Identifica o que a verificação de 'name' testou, sem importá-lo: a instalação do backend
+    (caminho e data do pacote, que mudam a cada atualização), as versões do NumPy e do Python,
+    a arquitetura e o conteúdo do módulo dos núcleos. None se não der para ler.
+    """
+    import importlib.util
+    import platform
+    try:
+        origin = importlib.util.find_spec(name).origin
+        package = os.stat(origin)
+        with open(importlib.util.find_spec(f"nucleos_{name}").origin, "rb") as f:
+            source = hashlib.sha256(f.read()).hexdigest()
+    except (AttributeError, TypeError, OSError, ImportError, ValueError):
+        return None
+    return "|".join((name, origin, str(package.st_mtime_ns), str(package.st_size),
+                     np.__version__, platform.python_version(), platform.machine(), source))
+
+def _read_backend_check(key):
+    """Divergências guardadas por uma verificação anterior com a mesma chave; None se não houver."""
+    try:
+        with open(BACKEND_CHECK_FILE, "r", encoding="utf-8") as f:
+            stored = json.load(f).get(key)
+    except (OSError, ValueError, AttributeError):
+        return None
+    return stored if isinstance(stored, list) else None
+
+def _store_backend_check(key, problems):
+    """Guarda o veredito da verificação em BACKEND_CHECK_FILE (sem erro se não for possível)."""
+    try:
+        with open(BACKEND_CHECK_FILE, "r", encoding="utf-8") as f:
+            verdicts = json.load(f)
+    except (OSError, ValueError):
+        verdicts = {}
+    if not isinstance(verdicts, dict):
+        verdicts = {}
+    verdicts = {k: v for k, v in verdicts.items() if not k.startswith(key.split("|", 1)[0] + "|")}
+    verdicts[key] = problems
+    tmp = f"{BACKEND_CHECK_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(BACKEND_CHECK_FILE), exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(verdicts, f, ensure_ascii=False)
+        os.replace(tmp, BACKEND_CHECK_FILE)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+def check_backend(backend, reference=None, seed=0):
+    """
+    Compara os núcleos de 'backend' com os de 'reference' (None = NumPy) em dados pequenos e
+    aleatórios: todos os pares sem célula e com células ortogonal e triclínica, pares candidatos,
+    extremos de bandas (com um NaN) e camadas. Retorna a lista das divergências (vazia se todos
+    concordarem); um erro em um núcleo também conta como divergência. A tolerância relativa é de
+    1e-9: em células triclínicas, a ordem das somas pode mudar o último dígito das distâncias.
+    """
+    reference = NumpyBackend() if reference is None else reference
+    rng = np.random.default_rng(seed)
+    coords = rng.random((40, 3)) * 12.0
+    natoms = len(coords)
+    offsets = _row_offsets(natoms)
+    total = natoms * (natoms - 1) // 2
+    i, j = (index.astype(np.int64) for index in np.triu_indices(natoms, 1))
+    cells = (("sem célula", None, None),
+             ("célula ortogonal", np.diag([12.0, 13.0, 14.0]), np.array([True, True, False])),
+             ("célula triclínica", np.array([[12.0, 0.0, 0.0], [6.0, 10.4, 0.0], [1.0, 2.0, 13.0]]),
+              np.ones(3, dtype=bool)))
+    energies = rng.normal(size=(30, 2, 12))
+    energies[3, 1, 5] = np.nan
+    z_sorted = np.sort(np.concatenate((rng.normal(0.0, 0.2, 50), rng.normal(3.3, 0.2, 50), [10.0])))
+
+    problems = []
+    def compare(label, run):
+        try:
+            got, expected = run(backend), run(reference)
+            if not all(np.shape(g) == np.shape(e) and np.allclose(g, e, rtol=1e-9, atol=1e-12, equal_nan=True)
+                       for g, e in zip(got, expected)):
+                problems.append(label)
+        except Exception as error:
+            problems.append(f"{label}: {type(error).__name__}: {error}")
+
+    def tile(lattice, pbc, dtype):
+        def run(b):
+            out = np.zeros(total, dtype=dtype)
+            b.pair_tile(coords, lattice, pbc, offsets, 7, total - 5, out)
+            return (out,)
+        return run
+    for label, lattice, pbc in cells:
+        compare(f"todos os pares ({label})", tile(lattice, pbc, np.float64))
+        compare(f"pares candidatos ({label})", lambda b: (b.pair_distances(coords, i[::3], j[::3], lattice, pbc),))
+    compare("todos os pares (float32)", tile(cells[2][1], cells[2][2], np.float32))
+    compare("extremos das bandas", lambda b: b.band_extrema(energies, 0.1))
+    compare("camadas", lambda b: b.layer_segments(z_sorted, LAYER_GAP_TOLERANCE))
+    return problems
+
+def set_backend(name="auto", check=True):
+    """
+    Escolhe os núcleos usados pela tabela de todos os pares, pelas buscas de vizinhos, pelo gap
+    e pela detecção de camadas:
+    - "numpy": vetorizados com NumPy (o backend ao importar o módulo);
+    - "numba": compilados pelo Numba (JIT), se estiver instalado;
+    - "auto": o Numba quando disponível, senão NumPy.
+    Com check=True, o backend escolhido é comparado ao NumPy (check_backend) antes de ser usado;
+    se não puder ser carregado ou divergir, fica o NumPy, e o motivo aparece em backend_status.
+    O veredito fica em BACKEND_CHECK_FILE e vale para as próximas partidas enquanto as versões e
+    os núcleos não mudarem. Os núcleos do Numba são compilados na verificação (ou na primeira
+    chamada) e guardados na pasta NUMBA_CACHE_DIR (por padrão dentro de DEFAULT_CACHE_DIR).
+    Já verificado (ou com check=False, como nos processos dos pools), o backend compilado fica
+    adiado (DeferredBackend): o Numba só é importado quando o trabalho passa de JIT_MIN_WORK.
+    Retorna o nome do backend ativo. Levanta ValueError para nomes desconhecidos.
+    """
+    global _backend, _backend_note
+    wanted = name
+    if name == "auto":
+        wanted = "numba" if "numba" in available_backends() else "numpy"
+    elif name not in BACKENDS:
+        raise ValueError(f"Backend desconhecido: {name} (use auto, {', '.join(BACKENDS)}).")
+    note = "Numba não instalado" if name == "auto" and wanted == "numpy" else None
+    key = _backend_check_key(wanted) if check and wanted != "numpy" else None
+    problems = _read_backend_check(key) if key is not None else None
+    if wanted == "numpy":
+        backend = NumpyBackend()
+    elif not check or problems == []:
+        backend = DeferredBackend(wanted)
+    else:
+        try:
+            if problems is None:
+                with profile_stage("nucleos/carga", nucleo=wanted):
+                    backend = _load_backend(wanted)
+                    problems = check_backend(backend)
+                if key is not None:
+                    _store_backend_check(key, problems)
+        except ImportError as error:
+            backend, note = NumpyBackend(), f"{wanted} indisponível: {error}"
+        else:
+            if problems:
+                backend, note = NumpyBackend(), f"{wanted} divergiu do NumPy em {problems[0]}"
+    _backend, _backend_note = backend, note
+    return backend.name
+
+def get_backend():
+    """Backend de cálculo ativo (veja set_backend; um DeferredBackend enquanto o compilado não carregou)."""
+    return _backend
+
+def backend_status():
+    """Texto curto com o backend ativo e, se for o caso, por que o pedido não ficou ativo."""
+    text = f"Núcleos: {_backend.description}"
+    return text if _backend_note is None else f"{text} ({_backend_note})"
+
+# --- Busca de Vizinhos (Lista de Células) ---
+
+# Raios covalentes (Å), de Cordero et al., Dalton Trans. (2008) 2832.
+COVALENT_RADII = {
+    "H": 0.31, "Li": 1.28, "B": 0.84, "C": 0.76, "N": 0.71, "O": 0.66, "F": 0.57,
+    "Na": 1.66, "Mg": 1.41, "Al": 1.21, "Si": 1.11, "P": 1.07, "S": 1.05, "Cl": 1.02,
+    "K": 2.03, "Ca": 1.76, "Ti": 1.60, "V": 1.53, "Cr": 1.39, "Mn": 1.39, "Fe": 1.32,
+    "Co": 1.26, "Ni": 1.24, "Cu": 1.32, "Zn": 1.22, "Ga": 1.22, "Ge": 1.20, "As": 1.19,
+    "Se": 1.20, "Br": 1.20, "Zr": 1.75, "Nb": 1.64, "Mo": 1.54, "Pd": 1.39, "Ag": 1.45,
+    "In": 1.42, "Sn": 1.39, "Sb": 1.39, "Te": 1.38, "I": 1.39, "Hf": 1.75, "Ta": 1.70,
+    "W": 1.62, "Re": 1.51, "Pt": 1.36, "Au": 1.36, "Pb": 1.46, "Bi": 1.48,
+}
+
+# Tolerância padrão: dois átomos estão ligados se d <= tolerância * (r_i + r_j)
+BOND_TOLERANCE = 1.15
+
+# Abaixo deste número de átomos a busca por força bruta (vetorizada) é mais rápida
+# do que montar a lista de células.
+_BRUTE_FORCE_MAX_ATOMS = 200
+
+# Metade das 26 células vizinhas; a própria célula é tratada à parte (pares i < j).
+_HALF_SHELL_OFFSETS = [(dx, dy, dz)
+                       for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                       if (dx, dy, dz) > (0, 0, 0)]
+
+def _expand_cell_pairs(first_a, count_a, first_b, count_b):
+    """
+    Gera, de forma vetorizada, todos os pares (a, b) entre blocos contíguos de átomos:
+    para cada k, o bloco [first_a[k], first_a[k] + count_a[k]) contra
+    o bloco [first_b[k], first_b[k] + count_b[k]).
+    """
+    # Cada átomo do bloco A é repetido count_b vezes
+    n_a_total = int(count_a.sum())
+    if n_a_total == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    block_of_a = np.repeat(np.arange(len(first_a)), count_a)
+    a_idx = first_a[block_of_a] + (np.arange(n_a_total) - np.repeat(np.cumsum(count_a) - count_a, count_a))
+    reps = count_b[block_of_a]
+    n_pairs = int(reps.sum())
+    i = np.repeat(a_idx, reps)
+    j_start = np.repeat(first_b[block_of_a], reps)
+    j = j_start + (np.arange(n_pairs) - np.repeat(np.cumsum(reps) - reps, reps))
+    return i, j
+
+def find_neighbor_pairs(coords, cutoff, lattice=None, pbc=(True, True, True)):
+    """
+    Encontra todos os pares de átomos (i < j) com distância <= cutoff (Å) usando uma lista de células.
+    O custo é O(N) para densidades atômicas usuais, em vez de O(N²).
+    Com 'lattice', as distâncias seguem a convenção de imagem mínima nas direções 'pbc'.
+    Retorna (i, j, dist) como arrays NumPy, ordenados por (i, j).
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if lattice is None:
+        return _neighbor_pairs(coords, float(cutoff), None)
+    return _periodic_neighbor_pairs(coords, float(cutoff), None, lattice, np.asarray(pbc, dtype=bool))
+
+def _neighbor_pairs(coords, max_cutoff, pair_cutoff):
+    """
+    Núcleo da busca de vizinhos. 'pair_cutoff', se fornecido, recebe os arrays (i, j)
+    dos pares candidatos e retorna o raio de corte de cada par (<= max_cutoff).
+    """
+    natoms = coords.shape[0]
+    empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+    if natoms < 2 or max_cutoff <= 0.0:
+        return empty
+
+    def accept(i, j):
+        d = _backend.pair_distances(coords, i, j)
+        limit = max_cutoff if pair_cutoff is None else pair_cutoff(i, j)
+        keep = d <= limit
+        return i[keep], j[keep], d[keep]
+
+    if natoms <= _BRUTE_FORCE_MAX_ATOMS:
+        i, j = np.triu_indices(natoms, k=1)
+        return accept(i.astype(np.int64), j.astype(np.int64))
+
+    # Índice inteiro da célula de cada átomo (células cúbicas de aresta max_cutoff)
+    cell_xyz = np.floor((coords - coords.min(axis=0)) / max_cutoff).astype(np.int64)
+    dims = cell_xyz.max(axis=0) + 1
+    cell_key = (cell_xyz[:, 0] * dims[1] + cell_xyz[:, 1]) * dims[2] + cell_xyz[:, 2]
+
+    # Ordena os átomos por célula: cada célula ocupa um bloco contíguo em 'order'
+    order = np.argsort(cell_key, kind='stable')
+    keys, first, counts = np.unique(cell_key[order], return_index=True, return_counts=True)
+    keys_xyz = np.stack(np.unravel_index(keys, dims), axis=1)
+
+    parts_i, parts_j, parts_d = [], [], []
+
+    # Pares dentro da mesma célula
+    i, j = _expand_cell_pairs(first, counts, first, counts)
+    same = i < j
+    i, j = order[i[same]], order[j[same]]
+    for part, values in zip((parts_i, parts_j, parts_d), accept(i, j)):
+        part.append(values)
+
+    # Pares entre células vizinhas (meia vizinhança, para não repetir pares)
+    for offset in _HALF_SHELL_OFFSETS:
+        neighbor_xyz = keys_xyz + offset
+        inside = np.all((neighbor_xyz >= 0) & (neighbor_xyz < dims), axis=1)
+        neighbor_keys = (neighbor_xyz[:, 0] * dims[1] + neighbor_xyz[:, 1]) * dims[2] + neighbor_xyz[:, 2]
+        pos = np.searchsorted(keys, neighbor_keys)
+        pos_clipped = np.minimum(pos, len(keys) - 1)
+        exists = inside & (keys[pos_clipped] == neighbor_keys)
+        if not exists.any():
+            continue
+        src = np.nonzero(exists)[0]
+        dst = pos_clipped[exists]
+        i, j = _expand_cell_pairs(first[src], counts[src], first[dst], counts[dst])
+        i, j = order[i], order[j]
+        swap = i > j
+        i, j = np.where(swap, j, i), np.where(swap, i, j)
+        for part, values in zip((parts_i, parts_j, parts_d), accept(i, j)):
+            part.append(values)
+
+    i = np.concatenate(parts_i)
+    j = np.concatenate(parts_j)
+    d = np.concatenate(parts_d)
+    sort = np.lexsort((j, i))
+    return i[sort], j[sort], d[sort]
+
+def _periodic_neighbor_pairs(coords, max_cutoff, pair_cutoff, lattice, pbc):
+    """
+    Busca de vizinhos com condições periódicas: a lista de células roda sobre os átomos
+    mais as suas imagens próximas às faces da célula; os pares encontrados são mapeados
+    de volta aos átomos originais e as distâncias são recalculadas em lote pela imagem mínima.
+    Pares de um átomo com a sua própria imagem não são incluídos.
+    """
+    natoms = coords.shape[0]
+    extended, origin = _periodic_images(coords, max_cutoff, lattice, pbc)
+    i, j, _ = _neighbor_pairs(extended, max_cutoff, None)
+
+    # Os N primeiros pontos são os átomos reais; pares só entre imagens são redundantes
+    real = i < natoms
+    i, j = origin[i[real]], origin[j[real]]
+    a, b = np.minimum(i, j), np.maximum(i, j)
+    distinct = a != b
+    # Um mesmo par pode aparecer por mais de uma imagem: mantém uma única ocorrência
+    keys = np.unique(a[distinct] * natoms + b[distinct])
+    a, b = keys // natoms, keys % natoms
+
+    d = _backend.pair_distances(coords, a, b, lattice, pbc)
+    limit = max_cutoff if pair_cutoff is None else pair_cutoff(a, b)
+    keep = d <= limit
+    return a[keep], b[keep], d[keep]
+
+def _bond_radii(structure, radii=None, tolerance=BOND_TOLERANCE):
+    """
+    Raio covalente de cada átomo (COVALENT_RADII, complementado por 'radii') e o maior raio de
+    corte possível entre dois átomos da estrutura. Levanta ValueError para elementos sem raio.
+    """
+    table = dict(COVALENT_RADII)
+    if radii:
+        table.update(radii)
+    missing = [el for el in structure.elements if el not in table]
+    if missing:
+        raise ValueError(f"Raio covalente desconhecido para: {', '.join(missing)}.")
+
+    # Raio de cada espécie, indexado pelo código inteiro de 'species'
+    species_radii = np.array([table[el] for el in structure.elements], dtype=np.float64)
+    return species_radii[structure.species], tolerance * 2.0 * species_radii.max()
+
+def find_bonded_pairs(structure, cutoff=None, radii=None, tolerance=BOND_TOLERANCE,
+                      use_pbc=True, lattice=None):
+    """
+    Encontra os pares ligados de um XYZStructure.
+    - Com 'cutoff' (Å): ligados são os pares com d <= cutoff;
+    - Sem 'cutoff': usa raios covalentes por elemento, d <= tolerance * (r_i + r_j).
+      'radii' permite sobrescrever ou complementar COVALENT_RADII.
+    A célula periódica vem do arquivo (extended-XYZ) ou de 'lattice'; veja resolve_cell.
+    Retorna (i, j, dist) como arrays NumPy. Levanta ValueError para elementos sem raio conhecido.
+    """
+    cell, pbc = resolve_cell(structure, use_pbc, lattice)
+    if cutoff is not None:
+        return find_neighbor_pairs(structure.coords, cutoff, cell, pbc)
+
+    atom_radii, max_cutoff = _bond_radii(structure, radii, tolerance)
+
+    def pair_cutoff(i, j):
+        return tolerance * (atom_radii[i] + atom_radii[j])
+
+    if cell is not None:
+        return _periodic_neighbor_pairs(structure.coords, max_cutoff, pair_cutoff, cell, pbc)
+    return _neighbor_pairs(structure.coords, max_cutoff, pair_cutoff)
+
+def _neighbor_candidates_of(coords, atoms, max_cutoff, lattice=None, pbc=None):
+    """
+    Pares candidatos (a, j) entre os átomos 'atoms' e todos os átomos, por uma lista de células
+    de aresta >= max_cutoff da qual só as 27 células em torno de cada átomo de 'atoms' são
+    visitadas. Com 'lattice', as células são definidas em coordenadas fracionárias e dão a volta
+    nas direções periódicas 'pbc' (com menos de 3 células em uma direção, cada uma é visitada uma vez).
+    """
+    periodic = np.zeros(3, dtype=bool)
+    if lattice is None:
+        scaled = coords / max_cutoff
+    else:
+        periodic = np.asarray(pbc, dtype=bool)
+        frac = coords @ np.linalg.inv(lattice)
+        frac[:, periodic] -= np.floor(frac[:, periodic])
+        # Espessura da célula perpendicular a cada par de vetores de rede
+        volume = abs(np.linalg.det(lattice))
+        widths = np.array([volume / np.linalg.norm(np.cross(lattice[(k + 1) % 3], lattice[(k + 2) % 3]))
+                           for k in range(3)])
+        n_periodic = np.maximum(1, np.floor(widths / max_cutoff))
+        scaled = frac * np.where(periodic, n_periodic, widths / max_cutoff)
+    cell_xyz = np.floor(scaled).astype(np.int64)
+    cell_xyz[:, ~periodic] -= cell_xyz[:, ~periodic].min(axis=0)
+    dims = cell_xyz.max(axis=0) + 1
+    if lattice is not None:
+        dims[periodic] = n_periodic[periodic]
+        cell_xyz[:, periodic] %= dims[periodic]
+    cell_key = (cell_xyz[:, 0] * dims[1] + cell_xyz[:, 1]) * dims[2] + cell_xyz[:, 2]
+
+    # Células vizinhas de cada átomo de 'atoms', uma linha por deslocamento (-1 = fora da caixa)
+    atoms = np.asarray(atoms, dtype=np.int64)
+    axis_offsets = [range(dims[k]) if periodic[k] and dims[k] < 3 else (-1, 0, 1) for k in range(3)]
+    neighbor_keys = []
+    for offset in itertools.product(*axis_offsets):
+        neighbor_xyz = cell_xyz[atoms] + offset
+        neighbor_xyz[:, periodic] %= dims[periodic]
+        inside = np.all((neighbor_xyz >= 0) & (neighbor_xyz < dims), axis=1)
+        keys = (neighbor_xyz[:, 0] * dims[1] + neighbor_xyz[:, 1]) * dims[2] + neighbor_xyz[:, 2]
+        neighbor_keys.append(np.where(inside, keys, -1))
+    neighbor_keys = np.array(neighbor_keys)
+
+    # Só os átomos dessas células são ordenados (e não todos os átomos)
+    wanted = neighbor_keys[neighbor_keys >= 0]
+    n_cells = int(np.prod(dims))
+    if n_cells <= 8 * len(coords) + (1 << 20):
+        table = np.zeros(n_cells, dtype=bool)
+        table[wanted] = True
+        candidates = np.flatnonzero(table[cell_key])
+    else:
+        candidates = np.flatnonzero(np.isin(cell_key, wanted))
+    order = candidates[np.argsort(cell_key[candidates], kind='stable')]
+    sorted_keys = cell_key[order]
+
+    first = np.searchsorted(sorted_keys, neighbor_keys, side='left')
+    count = np.where(neighbor_keys >= 0, np.searchsorted(sorted_keys, neighbor_keys, side='right') - first, 0)
+    n_offsets = len(neighbor_keys)
+    a, j = _expand_cell_pairs(np.tile(np.arange(len(atoms)), n_offsets), np.ones(first.size, dtype=np.int64),
+                              first.ravel(), count.ravel())
+    return atoms[a], order[j]
+
+def find_bonded_pairs_of(structure, atoms, cutoff=None, radii=None, tolerance=BOND_TOLERANCE,
+                         use_pbc=True, lattice=None):
+    """
+    Versão de find_bonded_pairs restrita aos pares que envolvem pelo menos um dos átomos 'atoms'
+    (índices a partir de 0). Só as células em torno desses átomos são visitadas, então o custo
+    depende de len(atoms), e não do número total de átomos.
+    Retorna (i, j, dist) com i < j, ordenados por (i, j). Levanta ValueError como find_bonded_pairs.
+    """
+    cell, pbc = resolve_cell(structure, use_pbc, lattice)
+    atoms = np.unique(np.asarray(atoms, dtype=np.int64))
+    if cutoff is not None:
+        atom_radii, max_cutoff = None, float(cutoff)
+    else:
+        atom_radii, max_cutoff = _bond_radii(structure, radii, tolerance)
+    if len(atoms) == 0 or structure.natoms < 2 or max_cutoff <= 0.0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+    a, j = _neighbor_candidates_of(structure.coords, atoms, max_cutoff, cell, pbc)
+    # Um par entre dois átomos de 'atoms' aparece a partir de cada um deles: fica o de a < j
+    selected = np.zeros(structure.natoms, dtype=bool)
+    selected[atoms] = True
+    keep = (j != a) & (~selected[j] | (a < j))
+    i, j = np.minimum(a[keep], j[keep]), np.maximum(a[keep], j[keep])
+
+    coords = structure.coords
+    d = _backend.pair_distances(coords, i, j, cell, pbc)
+    limit = max_cutoff if atom_radii is None else tolerance * (atom_radii[i] + atom_radii[j])
+    keep = d <= limit
+    i, j, d = i[keep], j[keep], d[keep]
+    sort = np.lexsort((j, i))
+    return i[sort], j[sort], d[sort]
+
+# --- Funções de Cálculo Traduzidas do Fortran para Python ---
+
+ANG_TO_BOHR = 1.8897259886 # Constante de conversão
+
+def _layer_distance(coords, cell, pbc):
+    """
+    Distância (Å) entre a camada inferior (2 primeiros átomos) e a superior (2 últimos).
+    """
+    natoms = coords.shape[0]
+
+    # A lógica Fortran assume que os 2 primeiros são da camada inferior e os 2 últimos da superior.
+    # Isso implica que os átomos estão ordenados por camada no arquivo .xyz.
+    # Se o arquivo não estiver ordenado, essa lógica pode não ser precisa.
+    if cell is None:
+        z_bot_avg = (coords[0, 2] + coords[1, 2]) / 2.0
+        z_top_avg = (coords[natoms-1, 2] + coords[natoms-2, 2]) / 2.0 # natoms-1 é o último, natoms-2 é o penúltimo
+        layer_delta = np.array([0.0, 0.0, z_top_avg - z_bot_avg])
+    else:
+        # Com PBC, cada média e a diferença entre camadas seguem a imagem mínima,
+        # para que átomos "do outro lado" da célula não distorçam o resultado.
+        pair_deltas = minimum_image(np.array([coords[1] - coords[0],
+                                              coords[natoms-2] - coords[natoms-1]]), cell, pbc)
+        bot_avg = coords[0] + pair_deltas[0] / 2.0
+        top_avg = coords[natoms-1] + pair_deltas[1] / 2.0
+        layer_delta = minimum_image((top_avg - bot_avg)[None, :], cell, pbc)[0]
+
+    return float(layer_delta[2])
+
+class LayerDistanceResult:
+    """
+    Distância entre camadas de uma estrutura:
+    - distance_ang: distância em Å (distance_bohr é calculada a partir dela);
+    - periodic: se as diferenças usaram a imagem mínima;
+    - frame: quadro da trajetória usado (None = arquivo de um quadro).
+    """
+    __slots__ = ("distance_ang", "periodic", "frame")
+
+    def __init__(self, distance_ang, periodic=False, frame=None):
+        self.distance_ang = distance_ang
+        self.periodic = periodic
+        self.frame = frame
+
+    @property
+    def distance_bohr(self):
+        return self.distance_ang * ANG_TO_BOHR
+
+    def columns(self, readable=False):
+        return {"distancia_ang": np.array([self.distance_ang]),
+                "distancia_bohr": np.array([self.distance_bohr])}
+
+    def metadata(self):
+        return {"periodico": self.periodic, "quadro": self.frame}
+
+def calculate_layer_distance(file_path, use_pbc=True, lattice=None, frame=None):
+    """
+    Calcula a distância entre camadas de um arquivo .xyz e retorna um LayerDistanceResult.
+    Com célula periódica (do arquivo ou 'lattice'), as diferenças usam a imagem mínima.
+    Com 'frame', usa apenas esse quadro de uma trajetória (veja load_xyz).
+    O resultado fica no cache em disco (veja ResultCache).
+    Levanta OSError, IndexError, XYZFormatError (também para menos de 4 átomos) ou ValueError.
+    """
+    def compute():
+        structure = load_xyz(file_path, frame)
+        if structure.natoms < 4:
+            raise XYZFormatError("Número insuficiente de átomos para calcular a distância entre camadas (mínimo de 4).",
+                                 natoms=structure.natoms, n_read=structure.natoms)
+        cell, pbc = resolve_cell(structure, use_pbc, lattice)
+        with profile_stage("camadas/calculo", atomos=structure.natoms):
+            return LayerDistanceResult(_layer_distance(structure.coords, cell, pbc), cell is not None, frame)
+
+    return _cached(file_path, "camadas", {"pbc": use_pbc, "rede": lattice, "quadro": frame}, compute)
+
+def calculate_layer_distance_python(file_path, use_pbc=True, lattice=None, frame=None):
+    """
+    Calcula a distância entre camadas a partir de um arquivo .xyz.
+    Traduzido do programa Fortran 'distancia_layers'; veja calculate_layer_distance.
+    Retorna (distancia_ang, distancia_bohr) ou códigos de erro (ERROR_READ, ERROR_NATOMS).
+    """
+    try:
+        result = calculate_layer_distance(file_path, use_pbc, lattice, frame)
+    except (OSError, IndexError):
+        # Erro ao abrir o arquivo, similar ao -999.99 do Fortran
+        return ERROR_READ, ERROR_READ
+    except XYZFormatError as e:
+        if e.natoms is not None and e.natoms < 4:
+            # Número insuficiente de átomos, similar ao -888.88 do Fortran
+            return ERROR_NATOMS, ERROR_NATOMS
+        # Erro ao ler o número de átomos ou número de coordenadas diferente do declarado
+        return ERROR_READ, ERROR_READ
+    except ValueError:
+        # Célula periódica inválida
+        return ERROR_READ, ERROR_READ
+    except Exception:
+        # Outros erros de leitura
+        return ERROR_READ, ERROR_READ
+
+    return result.distance_ang, result.distance_bohr
+
+def calculate_atom_distances_python(file_path, use_pbc=True, lattice=None, frame=None, progress=None):
+    """
+    Calcula distâncias entre pares de átomos a partir de um arquivo .xyz.
+    Traduzido do programa Fortran 'calcula_distancias'.
+    Com célula periódica (do arquivo ou 'lattice'), as distâncias usam a imagem mínima.
+    Com 'frame', usa apenas esse quadro de uma trajetória (veja load_xyz).
+    'progress' recebe a fração dos pares já calculados (veja CalculationCancelled).
+    Retorna uma string formatada com os resultados ou uma mensagem de erro.
+    """
+    try:
+        pairs = calculate_pair_distances(file_path, use_pbc=use_pbc, lattice=lattice, frame=frame,
+                                         progress=progress)
+    except FileNotFoundError:
+        return f"Erro ao abrir o arquivo '{os.path.basename(file_path)}'."
+    except XYZFormatError as e:
+        if e.natoms is None:
+            return f"Erro: Não foi possível ler o número de átomos do arquivo '{os.path.basename(file_path)}'."
+        if e.natoms < 2:
+            return "Erro: Número insuficiente de átomos para calcular distâncias (mínimo de 2)."
+        return f"Erro: {e}"
+    except (IndexError, ValueError) as e:
+        return f"Erro: {e}"
+    except CalculationCancelled:
+        raise
+    except Exception as e:
+        return f"Erro ao ler arquivo {os.path.basename(file_path)}: {e}"
+
+    return "\n".join(itertools.chain([pairs.header()], pairs.format_lines()))
+
+def calculate_bond_distances_python(file_path, cutoff=None, use_pbc=True, lattice=None, frame=None,
+                                    progress=None):
+    """
+    Calcula apenas as distâncias de ligação a partir de um arquivo .xyz, usando a lista de células.
+    Com 'cutoff' (Å), considera ligados os pares com d <= cutoff; sem ele, usa os raios covalentes.
+    Com célula periódica (do arquivo ou 'lattice'), as distâncias usam a imagem mínima.
+    Com 'frame', usa apenas esse quadro de uma trajetória (veja load_xyz).
+    'progress' recebe a fração concluída (veja CalculationCancelled).
+    Retorna uma string formatada com os resultados ou uma mensagem de erro,
+    no mesmo formato de calculate_atom_distances_python.
+    """
+    try:
+        pairs = calculate_pair_distances(file_path, bonds_only=True, cutoff=cutoff, use_pbc=use_pbc,
+                                         lattice=lattice, frame=frame, progress=progress)
+    except FileNotFoundError:
+        return f"Erro ao abrir o arquivo '{os.path.basename(file_path)}'."
+    except XYZFormatError as e:
+        if e.natoms is None:
+            return f"Erro: Não foi possível ler o número de átomos do arquivo '{os.path.basename(file_path)}'."
+        return f"Erro: {e}"
+    except (IndexError, ValueError) as e:
+        return f"Erro: {e}"
+    except CalculationCancelled:
+        raise
+    except Exception as e:
+        return f"Erro ao ler arquivo {os.path.basename(file_path)}: {e}"
+
+    if pairs.n_pairs == 0:
+        return pairs.header() + "\nNenhuma ligação encontrada."
+    return "\n".join(itertools.chain([pairs.header()], pairs.format_lines()))
+
+# --- Detecção de Camadas ---
+
+# Separação mínima em z (Å) entre dois átomos vizinhos em z para que fiquem em camadas diferentes
+LAYER_GAP_TOLERANCE = 1.0
+
+class LayerSegmentation:
+    """
+    Camadas de uma estrutura, detectadas pelos vazios na coordenada z:
+    - layer_of_atom: array int32 (N,) com a camada (a partir de 0, de baixo para cima) de cada átomo;
+    - counts: número de átomos de cada camada;
+    - mean_z, min_z, max_z: z médio, mínimo e máximo de cada camada (Å);
+    - wrap_spacing: com PBC em z, distância da camada superior à imagem da inferior na célula
+      seguinte (Å); None sem periodicidade em z;
+    - gap_tolerance: tolerância usada na detecção.
+    Com PBC em z, 'z' é a altura ao longo da normal ao plano ab, e uma camada que atravessa a face
+    da célula fica inteira (as alturas podem passar da altura da célula).
+    """
+    __slots__ = ("layer_of_atom", "counts", "mean_z", "min_z", "max_z", "wrap_spacing", "gap_tolerance")
+
+    def __init__(self, layer_of_atom, counts, mean_z, min_z, max_z, wrap_spacing=None,
+                 gap_tolerance=LAYER_GAP_TOLERANCE):
+        self.layer_of_atom = layer_of_atom
+        self.counts = counts
+        self.mean_z = mean_z
+        self.min_z = min_z
+        self.max_z = max_z
+        self.wrap_spacing = wrap_spacing
+        self.gap_tolerance = gap_tolerance
+
+    @property
+    def n_layers(self):
+        return self.mean_z.shape[0]
+
+    @property
+    def spacings(self):
+        """Distâncias (Å) entre os z médios de camadas adjacentes, de baixo para cima (n_camadas - 1)."""
+        return np.diff(self.mean_z)
+
+    @property
+    def corrugation(self):
+        """Ondulação de cada camada: diferença entre o maior e o menor z (Å)."""
+        return self.max_z - self.min_z
+
+    def columns(self, readable=False):
+        # Distância até a camada de cima; a última usa a imagem periódica (ou NaN)
+        following = np.append(self.spacings, np.nan if self.wrap_spacing is None else self.wrap_spacing)
+        return {"camada": np.arange(1, self.n_layers + 1), "n_atomos": self.counts,
+                "z_medio_ang": self.mean_z, "z_min_ang": self.min_z, "z_max_ang": self.max_z,
+                "corrugacao_ang": self.corrugation, "distancia_proxima_ang": following}
+
+    def metadata(self):
+        return {"n_camadas": self.n_layers, "tolerancia_ang": self.gap_tolerance,
+                "distancia_periodica_ang": self.wrap_spacing, "camada_de_cada_atomo": self.layer_of_atom}
+
+def detect_layers(coords, gap_tolerance=LAYER_GAP_TOLERANCE, lattice=None, periodic_z=False):
+    """
+    Separa os átomos em camadas: ordena as alturas uma única vez (O(N log N)) e inicia uma
+    nova camada sempre que a diferença entre alturas consecutivas passa de 'gap_tolerance'.
+    Com 'lattice' e periodic_z=True, as alturas são tomadas ao longo da normal ao plano ab e
+    reduzidas à célula; o corte periódico é feito no maior vazio, de modo que uma camada que
+    atravessa a face da célula não é dividida. As estatísticas por camada são vetorizadas.
+    Retorna um LayerSegmentation. Levanta ValueError se não houver átomos.
+    """
+    return _detect_layers_sorted(coords, gap_tolerance, lattice, periodic_z)[0]
+
+def _layer_heights(coords, lattice=None, periodic_z=False):
+    """
+    Alturas usadas na detecção de camadas (veja detect_layers) e a altura da célula ao longo
+    da normal ao plano ab, ou None sem periodicidade em z.
+    """
+    if lattice is None or not periodic_z:
+        return coords[:, 2].copy(), None
+    lattice = np.asarray(lattice, dtype=np.float64).reshape(3, 3)
+    normal = np.cross(lattice[0], lattice[1])
+    height = abs(np.linalg.det(lattice)) / np.linalg.norm(normal) # Altura da célula ao longo da normal
+    frac_c = (coords @ np.linalg.inv(lattice))[:, 2]
+    return (frac_c - np.floor(frac_c)) * height, height
+
+def _detect_layers_sorted(coords, gap_tolerance, lattice, periodic_z):
+    """detect_layers que retorna também as alturas ordenadas e a ordem dos átomos (veja update_layers)."""
+    coords = np.asarray(coords, dtype=np.float64)
+    if coords.shape[0] == 0:
+        raise ValueError("Nenhum átomo para separar em camadas.")
+    z, height = _layer_heights(coords, lattice, periodic_z)
+    order = np.argsort(z, kind='stable')
+    z_sorted = z[order]
+    return _segment_sorted_heights(z_sorted, order, height, gap_tolerance), (z_sorted, order)
+
+def _segment_sorted_heights(z_sorted, order, height, gap_tolerance):
+    """Separa em camadas as alturas já ordenadas ('order' leva a posição ordenada ao átomo)."""
+    natoms = len(z_sorted)
+    gaps = np.diff(z_sorted)
+
+    wrap_spacing = None
+    if height is not None and natoms > 1:
+        # Começa a sequência logo após o maior vazio, contando o vazio através da face da célula
+        wrap_gap = z_sorted[0] + height - z_sorted[-1]
+        k = int(np.argmax(gaps))
+        if gaps[k] > wrap_gap:
+            z_sorted = np.concatenate((z_sorted[k + 1:], z_sorted[:k + 1] + height))
+            order = np.concatenate((order[k + 1:], order[:k + 1]))
+
+    starts, counts, mean_z, min_z, max_z = _backend.layer_segments(z_sorted, gap_tolerance)
+    labels_sorted = np.repeat(np.arange(len(starts), dtype=np.int32), counts)
+    layer_of_atom = np.empty(natoms, dtype=np.int32)
+    layer_of_atom[order] = labels_sorted
+
+    if height is not None:
+        wrap_spacing = float(mean_z[0] + height - mean_z[-1])
+    return LayerSegmentation(layer_of_atom, counts, mean_z, min_z, max_z, wrap_spacing, gap_tolerance)
+
+def update_layers(state, structure, change, gap_tolerance=LAYER_GAP_TOLERANCE, lattice=None, periodic_z=False):
+    """
+    Refaz a detecção de camadas depois de uma mudança pequena na estrutura ('change' vem de
+    diff_structures, com a mesma célula): as alturas dos átomos que não mudaram continuam
+    ordenadas, então só as dos átomos afetados são recalculadas, ordenadas e intercaladas,
+    sem reordenar todos os átomos. 'state' é o par (alturas ordenadas, ordem) da detecção anterior.
+    Retorna (LayerSegmentation, novo estado).
+    """
+    z_sorted, order = state
+    keep = ~change.old_mask()[order]
+    z_kept, order_kept = z_sorted[keep], order[keep]
+    affected = change.affected
+    z_new, height = _layer_heights(structure.coords[affected], lattice, periodic_z)
+    new_order = np.argsort(z_new, kind='stable')
+    z_new, affected = z_new[new_order], affected[new_order]
+    positions = np.searchsorted(z_kept, z_new, side='right')
+    z_sorted = np.insert(z_kept, positions, z_new)
+    order = np.insert(order_kept, positions, affected)
+    return _segment_sorted_heights(z_sorted, order, height, gap_tolerance), (z_sorted, order)
+
+def calculate_layers(file_path, gap_tolerance=LAYER_GAP_TOLERANCE, use_pbc=True, lattice=None, frame=None):
+    """
+    Detecta as camadas de um arquivo .xyz (veja detect_layers), em qualquer ordem de átomos.
+    A periodicidade em z vem da célula do arquivo ou de 'lattice' (veja resolve_cell).
+    Com 'frame', usa apenas esse quadro de uma trajetória. O resultado fica no cache em disco e,
+    com o recálculo incremental ligado, é atualizado só para os átomos afetados (veja update_layers).
+    Levanta OSError, IndexError, XYZFormatError ou ValueError.
+    """
+    def compute():
+        structure = load_xyz(file_path, frame)
+        if structure.natoms == 0:
+            raise XYZFormatError("O arquivo não contém átomos.", natoms=0, n_read=0)
+        cell, pbc = resolve_cell(structure, use_pbc, lattice)
+        periodic_z = cell is not None and bool(pbc[2])
+
+        def full():
+            with profile_stage("segmentacao/calculo", atomos=structure.natoms):
+                return _detect_layers_sorted(structure.coords, gap_tolerance, cell, periodic_z)
+
+        return _run_incremental(file_path, "segmentacao", params, structure, use_pbc, lattice, full,
+                                lambda result, state, change: update_layers(state, structure, change,
+                                                                            gap_tolerance, cell, periodic_z))
+
+    params = {"tolerancia": gap_tolerance, "pbc": use_pbc, "rede": lattice, "quadro": frame}
+    return _cached(file_path, "segmentacao", params, compute)
+
+# --- Tabelas de Pares (distâncias como arrays) ---
+
+class PairDistances:
+    """
+    Distâncias entre pares de átomos guardadas como arrays, sem nenhuma formatação:
+    - pair_i, pair_j: arrays int32 (M,) com os índices (a partir de 0) dos átomos, i < j;
+    - distances: array (M,) com as distâncias em Å (float64, ou float32 para economizar memória);
+    - species, elements: códigos e símbolos das espécies, como em XYZStructure;
+    - periodic: se as distâncias usam a imagem mínima;
+    - bonds_only, cutoff: se só os pares ligados foram guardados, e com qual raio de corte
+      (None = raios covalentes).
+    As linhas de texto são geradas sob demanda (format_lines), só para as linhas exibidas.
+    """
+    __slots__ = ("pair_i", "pair_j", "distances", "species", "elements", "periodic", "bonds_only", "cutoff")
+
+    def __init__(self, pair_i, pair_j, distances, species, elements, periodic=False,
+                 bonds_only=False, cutoff=None):
+        self.pair_i = pair_i
+        self.pair_j = pair_j
+        self.distances = distances
+        self.species = species
+        self.elements = elements
+        self.periodic = periodic
+        self.bonds_only = bonds_only
+        self.cutoff = cutoff
+
+    @property
+    def n_pairs(self):
+        return len(self.distances)
+
+    @property
+    def natoms(self):
+        return len(self.species)
+
+    def header(self):
+        """Linha de título, igual à dos resultados em texto."""
+        units = "Å e bohr, imagem mínima" if self.periodic else "Å e bohr"
+        if not self.bonds_only:
+            return f"Distâncias entre pares de átomos ({units}):"
+        if self.cutoff is not None:
+            return f"Distâncias de ligação (d <= {self.cutoff:.4f} Å) ({units}):"
+        return f"Distâncias de ligação (raios covalentes x {BOND_TOLERANCE:.2f}) ({units}):"
+
+    def select(self, element_pair=None, sort_by="index", descending=False):
+        """
+        Retorna os índices das linhas a exibir, sem copiar as distâncias.
+        - element_pair: par de símbolos (ex.: ("C", "H")), em qualquer ordem; None = todos;
+        - sort_by: "index" (ordem i, j) ou "distance";
+        - descending: inverte a ordem.
+        """
+        rows = None
+        if element_pair is not None:
+            codes = {el: k for k, el in enumerate(self.elements)}
+            a, b = (codes.get(el, -1) for el in element_pair)
+            si, sj = self.species[self.pair_i], self.species[self.pair_j]
+            rows = np.flatnonzero(((si == a) & (sj == b)) | ((si == b) & (sj == a)))
+
+        if sort_by == "distance":
+            values = self.distances if rows is None else self.distances[rows]
+            order = np.argsort(values, kind="stable")
+            rows = order if rows is None else rows[order]
+        elif sort_by != "index":
+            raise ValueError(f"Ordenação desconhecida: {sort_by}")
+        elif rows is None:
+            rows = np.arange(self.n_pairs)
+
+        return rows[::-1] if descending else rows
+
+    def find_atom(self, atom, rows):
+        """
+        Posição, dentro de 'rows', da primeira linha que envolve o átomo 'atom' (índice a partir de 0),
+        ou None se ele não aparecer.
+        """
+        hits = np.flatnonzero((self.pair_i[rows] == atom) | (self.pair_j[rows] == atom))
+        return int(hits[0]) if len(hits) else None
+
+    def element_pair_stats(self):
+        """
+        Estatísticas das distâncias por par de elementos, com uma única ordenação:
+        lista de (elemento_a, elemento_b, n_pares, mínimo, média, máximo), em Å.
+        """
+        if self.n_pairs == 0:
+            return []
+        si, sj = self.species[self.pair_i], self.species[self.pair_j]
+        codes = np.minimum(si, sj).astype(np.int64) * len(self.elements) + np.maximum(si, sj)
+        order = np.argsort(codes, kind="stable")
+        keys, starts, counts = np.unique(codes[order], return_index=True, return_counts=True)
+        d = self.distances[order].astype(np.float64, copy=False)
+        means = np.add.reduceat(d, starts) / counts
+        mins = np.minimum.reduceat(d, starts)
+        maxs = np.maximum.reduceat(d, starts)
+        return [(self.elements[k // len(self.elements)], self.elements[k % len(self.elements)], int(n),
+                 float(lo), float(mean), float(hi))
+                for k, n, lo, mean, hi in zip(keys.tolist(), counts, mins, means, maxs)]
+
+    def columns(self, readable=False):
+        """
+        Colunas para exportação (veja export_result), com os átomos numerados a partir de 1.
+        Com readable=True, inclui também os símbolos químicos de cada par.
+        """
+        cols = {"atomo_i": self.pair_i + 1, "atomo_j": self.pair_j + 1}
+        if readable:
+            symbols = np.asarray(self.elements)
+            cols["elemento_i"] = symbols[self.species[self.pair_i]]
+            cols["elemento_j"] = symbols[self.species[self.pair_j]]
+        cols["distancia_ang"] = self.distances
+        return cols
+
+    def metadata(self):
+        return {"n_atomos": self.natoms, "n_pares": self.n_pairs, "periodico": self.periodic,
+                "apenas_ligacoes": self.bonds_only, "corte_ang": self.cutoff,
+                "elementos": list(self.elements), "especies": self.species}
+
+    def format_lines(self, rows=None):
+        """
+        Gera as linhas de texto ("  1 C  -   2 C :     1.4200 Å        2.6834 bohr") das linhas
+        indicadas em 'rows' (todas, se None), uma por vez.
+        """
+        if rows is None:
+            pair_i, pair_j, dists_ang = self.pair_i, self.pair_j, self.distances
+        else:
+            pair_i, pair_j, dists_ang = self.pair_i[rows], self.pair_j[rows], self.distances[rows]
+        symbols = np.asarray(self.elements, dtype=object)
+        sym_i, sym_j = symbols[self.species[pair_i]], symbols[self.species[pair_j]]
+        dists_bohr = dists_ang * ANG_TO_BOHR
+        for i, si, j, sj, d_ang, d_bohr in zip(pair_i.tolist(), sym_i, pair_j.tolist(), sym_j,
+                                               dists_ang.tolist(), dists_bohr.tolist()):
+            yield f"{i+1:3d} {si:2s} - {j+1:3d} {sj:2s}: {d_ang:10.4f} Å    {d_bohr:10.4f} bohr"
+
+def calculate_pair_distances(file_path, bonds_only=False, cutoff=None, use_pbc=True, lattice=None,
+                             frame=None, progress=None, dtype=np.float64):
+    """
+    Calcula as distâncias entre pares de átomos de um arquivo .xyz e retorna um PairDistances.
+    - bonds_only=False: todos os pares i < j, em blocos (memória proporcional a N²; veja condensed_distances);
+    - bonds_only=True: só os pares ligados, via lista de células ('cutoff' em Å ou raios covalentes).
+    Com célula periódica (do arquivo ou 'lattice'), as distâncias usam a imagem mínima.
+    'progress' recebe a fração concluída (veja CalculationCancelled).
+    'dtype' define o tipo das distâncias guardadas (np.float32 usa metade da memória).
+    O resultado fica no cache em disco (veja ResultCache). Com o recálculo incremental ligado
+    (configure_incremental), quando o arquivo muda só os pares dos átomos afetados são refeitos.
+    Levanta OSError, IndexError, XYZFormatError (também para menos de 2 átomos) ou ValueError.
+    """
+    params = {"apenas_ligacoes": bonds_only, "corte": cutoff, "pbc": use_pbc, "rede": lattice,
+              "quadro": frame, "dtype": np.dtype(dtype).name}
+    return _cached(file_path, "pares", params, lambda: _compute_pair_distances(
+        file_path, bonds_only, cutoff, use_pbc, lattice, frame, progress, dtype, params))
+
+def _compute_pair_distances(file_path, bonds_only, cutoff, use_pbc, lattice, frame, progress, dtype, params):
+    structure = load_xyz(file_path, frame)
+    num_atoms = structure.natoms
+    if num_atoms < 2:
+        raise XYZFormatError("Número insuficiente de átomos para calcular distâncias (mínimo de 2).",
+                             natoms=num_atoms, n_read=num_atoms)
+
+    def full():
+        with profile_stage("ligacoes/calculo" if bonds_only else "pares/calculo", atomos=num_atoms):
+            result = _pair_distances_kernel(structure, bonds_only, cutoff, use_pbc, lattice, progress, dtype)
+        return result, None
+
+    def update(previous, state, change):
+        result = update_pair_distances(previous, structure, change, use_pbc, lattice)
+        return None if result is None else (result, None)
+
+    return _run_incremental(file_path, "pares", params, structure, use_pbc, lattice, full, update)
+
+def _pair_distances_kernel(structure, bonds_only, cutoff, use_pbc, lattice, progress, dtype):
+    num_atoms = structure.natoms
+    cell, pbc = resolve_cell(structure, use_pbc, lattice)
+
+    if bonds_only:
+        if progress is not None:
+            progress(0.0)
+        pair_i, pair_j, dists_ang = find_bonded_pairs(structure, cutoff=cutoff,
+                                                      use_pbc=use_pbc, lattice=lattice)
+        return PairDistances(pair_i.astype(np.int32), pair_j.astype(np.int32), dists_ang.astype(dtype, copy=False),
+                             structure.species, structure.elements, cell is not None, True, cutoff)
+
+    # Todos os pares, em blocos da ordem condensada (veja condensed_distances e configure_pair_engine)
+    total_pairs = num_atoms * (num_atoms - 1) // 2
+    pair_i = np.empty(total_pairs, dtype=np.int32)
+    pair_j = np.empty(total_pairs, dtype=np.int32)
+    dists_ang = condensed_distances(structure.coords, cell, pbc, dtype, progress=progress,
+                                    pair_i=pair_i, pair_j=pair_j)
+    return PairDistances(pair_i, pair_j, dists_ang, structure.species, structure.elements, cell is not None)
+
+def update_pair_distances(previous, structure, change, use_pbc=True, lattice=None):
+    """
+    Atualiza um PairDistances calculado para a versão anterior de uma estrutura ('change' vem de
+    diff_structures): só os pares que envolvem átomos movidos, acrescentados ou removidos são
+    refeitos, e os demais são copiados. Nas ligações, os vizinhos novos vêm de find_bonded_pairs_of;
+    na tabela de todos os pares, as linhas dos átomos movidos são reescritas no lugar.
+    Retorna None quando é preciso recalcular tudo (célula alterada, ou átomos acrescentados ou
+    removidos na tabela de todos os pares).
+    """
+    if change.cell_changed:
+        return None
+    dtype = previous.distances.dtype # Os pares refeitos mantêm a precisão da tabela anterior
+    if previous.bonds_only:
+        stale = change.old_mask()
+        keep = ~(stale[previous.pair_i] | stale[previous.pair_j])
+        i, j, d = find_bonded_pairs_of(structure, change.affected, cutoff=previous.cutoff,
+                                       use_pbc=use_pbc, lattice=lattice)
+        # Os pares mantidos e os novos já estão ordenados por (i, j): basta intercalá-los
+        kept_i, kept_j = previous.pair_i[keep], previous.pair_j[keep]
+        n = max(change.n_old, change.n_new)
+        positions = np.searchsorted(kept_i.astype(np.int64) * n + kept_j, i * n + j)
+        return PairDistances(np.insert(kept_i, positions, i), np.insert(kept_j, positions, j),
+                             np.insert(previous.distances[keep], positions, d.astype(dtype, copy=False)),
+                             structure.species,
+                             structure.elements, previous.periodic, True, previous.cutoff)
+
+    num_atoms = structure.natoms
+    if change.n_old != num_atoms:
+        return None
+    cell, pbc = resolve_cell(structure, use_pbc, lattice)
+    coords = structure.coords
+    others = np.arange(num_atoms, dtype=np.int64)
+    dists_ang = previous.distances.copy() # O resultado anterior pode estar em uso (interface, cache)
+    for a in change.moved.tolist():
+        d = np.sqrt((minimum_image(coords - coords[a], cell, pbc) ** 2).sum(axis=1))
+        # Posição do par (min, max) na ordem i < j da tabela
+        i, j = np.minimum(others, a), np.maximum(others, a)
+        rows = i * (2 * num_atoms - i - 1) // 2 + (j - i - 1)
+        dists_ang[rows[others != a]] = d[others != a]
+    return PairDistances(previous.pair_i, previous.pair_j, dists_ang, structure.species, structure.elements,
+                         previous.periodic)
+
+# --- Tabela Completa de Pares em Blocos (vários processos) ---
+
+# Orçamento padrão (bytes) da memória temporária de todos os blocos calculados ao mesmo tempo
+PAIR_MEMORY_BUDGET = 64 * 1024 * 1024
+# Memória temporária aproximada por par de um bloco (diferenças, imagem mínima e quadrados)
+_BYTES_PER_PAIR = 160
+# Pares por bloco: blocos maiores saem do cache e ficam mais lentos, mesmo com memória de sobra
+_TILE_PAIRS = 1 << 14
+# Pares por tarefa (sequência de blocos enviada a um processo, e intervalo entre avisos de progresso)
+_TASK_PAIRS = 1 << 18
+# Abaixo deste número de pares, abrir os processos custa mais do que o próprio cálculo
+_PARALLEL_MIN_PAIRS = 1 << 24
+
+_pair_workers = 1 # Processos da tabela de todos os pares (veja configure_pair_engine)
+_pair_memory_budget = PAIR_MEMORY_BUDGET
+
+def configure_pair_engine(workers=1, memory_budget=None):
+    """
+    Define como a tabela de todos os pares é calculada quando a chamada não informa esses valores
+    (calculate_pair_distances, calculate_distance_matrix, condensed_distances):
+    - workers: número de processos (None = um por núcleo; 1 = só o processo atual);
+    - memory_budget: memória temporária total dos blocos em cálculo, em bytes (None = padrão).
+    """
+    global _pair_workers, _pair_memory_budget
+    _pair_workers = workers
+    _pair_memory_budget = PAIR_MEMORY_BUDGET if memory_budget is None else int(memory_budget)
+
+def _row_offsets(natoms):
+    """Posição, na ordem condensada, do primeiro par de cada linha i (N+1 valores; o último é o total)."""
+    i = np.arange(natoms + 1, dtype=np.int64)
+    return i * (2 * natoms - i - 1) // 2
+
+def _tile_indices(offsets, p0, p1):
+    """Índices (i, j) dos pares nas posições [p0, p1) da ordem condensada, como arrays int64."""
+    first = int(np.searchsorted(offsets, p0, side="right")) - 1
+    last = int(np.searchsorted(offsets, p1 - 1, side="right"))
+    counts = np.minimum(offsets[first+1:last+1], p1) - np.maximum(offsets[first:last], p0)
+    i = np.repeat(np.arange(first, last, dtype=np.int64), counts)
+    j = np.arange(p0, p1, dtype=np.int64) - offsets[i] + i + 1
+    return i, j
+
+def _fill_pair_range(coords, lattice, pbc, offsets, p0, p1, out, tile_pairs):
+    """Calcula as posições [p0, p1) da ordem condensada, um bloco de até tile_pairs pares por vez."""
+    for start in range(p0, p1, tile_pairs):
+        _backend.pair_tile(coords, lattice, pbc, offsets, start, min(start + tile_pairs, p1), out)
+
+_tile_state = None # (coords, rede, pbc, offsets, saída, pares por bloco, memórias) em cada processo auxiliar
+
+def _init_tile_worker(coords_name, natoms, lattice, pbc, out_name, out_path, dtype, tile_pairs, backend):
+    """
+    Inicializa um processo auxiliar: as coordenadas e a saída são lidas e escritas direto na
+    memória compartilhada (ou no arquivo mapeado) criada pelo processo principal, sem cópias.
+    Usa o mesmo backend do processo principal (já verificado lá).
+    """
+    global _tile_state
+    set_backend(backend, check=False)
+    from multiprocessing import shared_memory
+    total_pairs = natoms * (natoms - 1) // 2
+    coords_block = shared_memory.SharedMemory(name=coords_name)
+    coords = np.ndarray((natoms, 3), dtype=np.float64, buffer=coords_block.buf)
+    if out_path is None:
+        out_block = shared_memory.SharedMemory(name=out_name)
+        out = np.ndarray((total_pairs,), dtype=dtype, buffer=out_block.buf)
+    else:
+        out_block = None
+        out = np.load(out_path, mmap_mode="r+")
+    # Os blocos ficam abertos até o processo terminar (as vistas vêm antes, para serem liberadas primeiro)
+    _tile_state = (coords, lattice, pbc, _row_offsets(natoms), out, tile_pairs, (coords_block, out_block))
+
+def _pair_range_task(p0, p1):
+    coords, lattice, pbc, offsets, out, tile_pairs, _ = _tile_state
+    _fill_pair_range(coords, lattice, pbc, offsets, p0, p1, out, tile_pairs)
+    return p0, p1
+
+def _resolve_pair_workers(workers, total_pairs):
+    if workers is None:
+        workers = _pair_workers
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return max(int(workers), 1) if total_pairs >= _PARALLEL_MIN_PAIRS else 1
+
+def condensed_distances(coords, lattice=None, pbc=(True, True, True), dtype=np.float64, workers=None,
+                        memory_budget=None, out=None, progress=None, pair_i=None, pair_j=None):
+    """
+    Distâncias de todos os pares i < j das coordenadas 'coords' (N, 3), em um array (N(N-1)/2,)
+    na ordem condensada (a de scipy.spatial.distance.pdist e de PairDistances): o par (i, j) fica
+    na posição i*(2N-i-1)//2 + (j-i-1). Com 'lattice', as distâncias usam a imagem mínima
+    (pbc = direções periódicas), com resultados idênticos aos de minimum_image par a par.
+    O triângulo superior é dividido em blocos contíguos, calculados de forma vetorizada:
+    - workers: processos (None = configure_pair_engine); tabelas pequenas ficam no processo atual.
+      Os processos leem as coordenadas de uma memória compartilhada e escrevem cada bloco
+      direto na saída;
+    - memory_budget: limite da memória temporária dos blocos em cálculo ao mesmo tempo (bytes),
+      sem contar a saída; os blocos nunca passam de _TILE_PAIRS pares, para caber no cache;
+    - out: caminho de um arquivo .npy, criado mapeado em disco (para tabelas maiores do que a
+      memória; o resultado é então um np.memmap), ou None para um array comum;
+    - dtype: np.float64 ou np.float32 (metade da memória);
+    - pair_i, pair_j: arrays (N(N-1)/2,) opcionais onde gravar também os índices de cada par.
+    'progress' recebe a fração dos pares já calculados (veja CalculationCancelled).
+    """
+    coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 3)
+    natoms = len(coords)
+    total_pairs = natoms * (natoms - 1) // 2
+    if lattice is not None:
+        lattice = np.asarray(lattice, dtype=np.float64).reshape(3, 3)
+        pbc = np.asarray(pbc, dtype=bool).reshape(3)
+    dtype = np.dtype(dtype)
+    workers = _resolve_pair_workers(workers, total_pairs)
+    budget = _pair_memory_budget if memory_budget is None else int(memory_budget)
+    tile_pairs = min(max(budget // (_BYTES_PER_PAIR * workers), 1024), _TILE_PAIRS)
+    # Pelo menos algumas tarefas por processo, para dividir bem o trabalho
+    task_pairs = max(min(_TASK_PAIRS, -(-total_pairs // (4 * workers))), 1)
+    tasks = [(p0, min(p0 + task_pairs, total_pairs)) for p0 in range(0, total_pairs, task_pairs)]
+
+    if out is None:
+        result = None
+    else:
+        result = np.lib.format.open_memmap(out, mode="w+", dtype=dtype, shape=(total_pairs,))
+    offsets = _row_offsets(natoms)
+
+    def task_done(p0, p1, done):
+        if pair_i is not None:
+            pair_i[p0:p1], pair_j[p0:p1] = _tile_indices(offsets, p0, p1)
+        if progress is not None:
+            progress(done / total_pairs)
+
+    if progress is not None:
+        progress(0.0)
+    if workers == 1 or len(tasks) < 2:
+        if result is None:
+            result = np.empty(total_pairs, dtype=dtype)
+        done = 0
+        for p0, p1 in tasks:
+            _fill_pair_range(coords, lattice, pbc, offsets, p0, p1, result, tile_pairs)
+            done += p1 - p0
+            task_done(p0, p1, done)
+    else:
+        result = _parallel_pair_ranges(coords, lattice, pbc, dtype, workers, tasks, tile_pairs, result, out,
+                                       task_done)
+    if out is not None:
+        result.flush()
+    return result
+
+def _parallel_pair_ranges(coords, lattice, pbc, dtype, workers, tasks, tile_pairs, result, out_path, task_done):
+    import multiprocessing
+    from multiprocessing import shared_memory
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    natoms = len(coords)
+    total_pairs = natoms * (natoms - 1) // 2
+    blocks = []
+    try:
+        coords_block = shared_memory.SharedMemory(create=True, size=coords.nbytes)
+        blocks.append(coords_block)
+        np.ndarray(coords.shape, dtype=np.float64, buffer=coords_block.buf)[:] = coords
+        out_name = None
+        if result is None:
+            out_block = shared_memory.SharedMemory(create=True, size=max(total_pairs * dtype.itemsize, 1))
+            blocks.append(out_block)
+            out_name = out_block.name
+        # "spawn": a interface roda os cálculos em threads, e copiar (fork) um processo com
+        # várias threads pode travar o processo filho
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_tile_worker,
+                                 initargs=(coords_block.name, natoms, lattice, pbc, out_name, out_path,
+                                           dtype, tile_pairs, _backend.name)) as pool:
+            futures = [pool.submit(_pair_range_task, p0, p1) for p0, p1 in tasks]
+            try:
+                done = 0
+                for future in as_completed(futures):
+                    p0, p1 = future.result()
+                    done += p1 - p0
+                    task_done(p0, p1, done)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        if result is None:
+            # Cópia para um array comum: a memória compartilhada é liberada logo abaixo
+            result = np.ndarray((total_pairs,), dtype=dtype, buffer=out_block.buf).copy()
+        return result
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+class DistanceMatrix:
+    """
+    Distâncias de todos os pares de uma estrutura na ordem condensada (veja condensed_distances),
+    sem os índices de cada par, como entrada de impressões digitais (fingerprints) por distâncias:
+    - condensed: array (N(N-1)/2,) em Å (float64 ou float32; np.memmap se gravado em disco);
+    - species, elements: códigos e símbolos das espécies, como em XYZStructure;
+    - periodic: se as distâncias usam a imagem mínima.
+    """
+    __slots__ = ("condensed", "species", "elements", "periodic")
+
+    def __init__(self, condensed, species, elements, periodic=False):
+        self.condensed = condensed
+        self.species = species
+        self.elements = elements
+        self.periodic = periodic
+
+    @property
+    def natoms(self):
+        return len(self.species)
+
+    @property
+    def n_pairs(self):
+        return len(self.condensed)
+
+    def distance(self, i, j):
+        """Distância entre os átomos i e j (índices a partir de 0), em Å."""
+        i, j = min(i, j), max(i, j)
+        if i == j:
+            return 0.0
+        return float(self.condensed[i * (2 * self.natoms - i - 1) // 2 + (j - i - 1)])
+
+    def square(self):
+        """Matriz (N, N) completa e simétrica, com zeros na diagonal (memória N²)."""
+        matrix = np.zeros((self.natoms, self.natoms), dtype=self.condensed.dtype)
+        i, j = np.triu_indices(self.natoms, 1)
+        matrix[i, j] = self.condensed
+        matrix[j, i] = self.condensed
+        return matrix
+
+    def columns(self, readable=False):
+        """Colunas para exportação (veja export_result), com os átomos numerados a partir de 1."""
+        i, j = _tile_indices(_row_offsets(self.natoms), 0, self.n_pairs)
+        cols = {"atomo_i": i + 1, "atomo_j": j + 1}
+        if readable:
+            symbols = np.asarray(self.elements)
+            cols["elemento_i"] = symbols[self.species[i]]
+            cols["elemento_j"] = symbols[self.species[j]]
+        cols["distancia_ang"] = self.condensed
+        return cols
+
+    def metadata(self):
+        return {"n_atomos": self.natoms, "n_pares": self.n_pairs, "periodico": self.periodic,
+                "elementos": list(self.elements), "especies": self.species}
+
+def calculate_distance_matrix(file_path, use_pbc=True, lattice=None, frame=None, dtype=np.float64,
+                              workers=None, memory_budget=None, out=None, progress=None):
+    """
+    Calcula as distâncias de todos os pares de um arquivo de estrutura na ordem condensada e
+    retorna um DistanceMatrix (veja condensed_distances para workers, memory_budget e out).
+    Com célula periódica (do arquivo ou 'lattice'), as distâncias usam a imagem mínima.
+    Sem 'out', o resultado fica no cache em disco (veja ResultCache); com 'out', o arquivo .npy
+    gravado já é o resultado e pode ser reaberto com np.load(out, mmap_mode="r").
+    Levanta OSError, IndexError, XYZFormatError (também para menos de 2 átomos) ou ValueError.
+    """
+    def compute():
+        structure = load_xyz(file_path, frame)
+        if structure.natoms < 2:
+            raise XYZFormatError("Número insuficiente de átomos para calcular distâncias (mínimo de 2).",
+                                 natoms=structure.natoms, n_read=structure.natoms)
+        cell, pbc = resolve_cell(structure, use_pbc, lattice)
+        with profile_stage("matriz/calculo", atomos=structure.natoms):
+            condensed = condensed_distances(structure.coords, cell, pbc, dtype, workers, memory_budget,
+                                            out, progress)
+        return DistanceMatrix(condensed, structure.species, structure.elements, cell is not None)
+
+    if out is not None:
+        return compute()
+    params = {"pbc": use_pbc, "rede": lattice, "quadro": frame, "dtype": np.dtype(dtype).name}
+    return _cached(file_path, "matriz", params, compute)
+
+# --- Consultas de Distâncias (vizinhos, seleções e pares) ---
+
+# Átomos por célula, em média, no índice espacial das consultas
+_INDEX_ATOMS_PER_CELL = 4.0
+# Máximo de (átomo consultado, célula visitada) processados de uma vez
+_QUERY_CHUNK = 1 << 20
+
+class NeighborIndex:
+    """
+    Índice espacial (lista de células) montado uma única vez sobre as coordenadas de uma estrutura,
+    para consultas cujo custo depende dos átomos consultados e dos vizinhos visitados, e não de N²:
+    - within(sources, radius, targets): os átomos a até 'radius' (Å) de cada átomo de 'sources';
+    - nearest(sources, k, targets): os k átomos mais próximos de cada átomo de 'sources'.
+    'targets' (máscara booleana (N,), opcional) restringe os vizinhos aceitos.
+    Com 'lattice', as células são definidas em coordenadas fracionárias, dão a volta nas direções
+    periódicas 'pbc' e as distâncias usam a imagem mínima (como em _neighbor_candidates_of).
+    """
+    __slots__ = ("coords", "lattice", "pbc", "periodic", "dims", "bin_widths", "cell_xyz",
+                 "order", "keys", "first", "counts")
+
+    def __init__(self, coords, lattice=None, pbc=None, atoms_per_cell=_INDEX_ATOMS_PER_CELL):
+        coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 3)
+        natoms = len(coords)
+        self.coords, self.lattice = coords, lattice
+        self.periodic = np.zeros(3, dtype=bool)
+        if lattice is None:
+            frac, widths = coords, np.ones(3)
+        else:
+            self.periodic = np.asarray(pbc, dtype=bool).reshape(3)
+            frac = coords @ np.linalg.inv(lattice)
+            frac[:, self.periodic] -= np.floor(frac[:, self.periodic])
+            # Espessura da célula perpendicular a cada par de vetores de rede
+            volume = abs(np.linalg.det(lattice))
+            widths = np.array([volume / np.linalg.norm(np.cross(lattice[(k + 1) % 3], lattice[(k + 2) % 3]))
+                               for k in range(3)])
+        self.pbc = self.periodic if lattice is not None else None
+        # Posição de cada átomo em Å ao longo de cada eixo do índice; o tamanho das células vem da
+        # região ocupada pelos átomos (o vácuo de uma célula periódica não conta)
+        heights = frac * widths
+        extents = np.ptp(heights, axis=0) if natoms else np.zeros(3)
+        extents = np.maximum(np.where(self.periodic, np.minimum(extents, widths), extents), 1.0)
+        edge = float(np.cbrt(np.prod(extents) * atoms_per_cell / max(natoms, 1)))
+        n_periodic = np.maximum(1, np.floor(widths / edge)).astype(np.int64)
+        self.bin_widths = np.where(self.periodic, widths / n_periodic, edge)
+
+        cell_xyz = np.floor(heights / self.bin_widths).astype(np.int64)
+        if natoms:
+            cell_xyz[:, ~self.periodic] -= cell_xyz[:, ~self.periodic].min(axis=0)
+        dims = cell_xyz.max(axis=0) + 1 if natoms else np.ones(3, dtype=np.int64)
+        dims[self.periodic] = n_periodic[self.periodic]
+        cell_xyz[:, self.periodic] %= dims[self.periodic]
+        self.dims, self.cell_xyz = dims, cell_xyz
+
+        # Átomos ordenados por célula: cada célula ocupa um bloco contíguo de 'order'
+        cell_key = self._keys(cell_xyz)
+        self.order = np.argsort(cell_key, kind="stable")
+        self.keys, self.first, self.counts = np.unique(cell_key[self.order], return_index=True,
+                                                       return_counts=True)
+
+    @property
+    def natoms(self):
+        return len(self.coords)
+
+    def _keys(self, cells):
+        return (cells[..., 0] * self.dims[1] + cells[..., 1]) * self.dims[2] + cells[..., 2]
+
+    def _offsets(self, radius):
+        """
+        Deslocamentos de célula que alcançam todos os átomos a até 'radius' (Å), e se eles cobrem a
+        estrutura inteira. Nas direções periódicas com poucas células, cada uma é visitada uma vez.
+        """
+        shells = np.floor(radius / self.bin_widths).astype(np.int64) + 1
+        axes, covers_all = [], True
+        for k in range(3):
+            if self.periodic[k] and 2 * shells[k] + 1 >= self.dims[k]:
+                axes.append(np.arange(self.dims[k]))
+            else:
+                axes.append(np.arange(-shells[k], shells[k] + 1))
+                covers_all &= not self.periodic[k] and shells[k] >= self.dims[k] - 1
+        return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3), covers_all
+
+    def _candidates(self, sources, offsets):
+        """Pares (a, j) entre cada átomo de 'sources' e os átomos das células deslocadas por 'offsets'."""
+        parts_a, parts_j = [], []
+        chunk = max(1, _QUERY_CHUNK // len(offsets))
+        for start in range(0, len(sources), chunk):
+            src = sources[start:start + chunk]
+            cells = self.cell_xyz[src][:, None, :] + offsets[None, :, :]
+            cells[..., self.periodic] %= self.dims[self.periodic]
+            inside = np.all((cells >= 0) & (cells < self.dims), axis=2)
+            keys = self._keys(cells)
+            pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            found = inside & (self.keys[pos] == keys)
+            owner = np.broadcast_to(np.arange(len(src))[:, None], keys.shape)[found]
+            cells_found = pos[found]
+            a, j = _expand_cell_pairs(owner, np.ones(len(owner), dtype=np.int64),
+                                      self.first[cells_found], self.counts[cells_found])
+            parts_a.append(src[a])
+            parts_j.append(self.order[j])
+        if not parts_a:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(parts_a), np.concatenate(parts_j)
+
+    def _neighbors(self, sources, radius, targets):
+        """Vizinhos candidatos (a, j, dist), agrupados por átomo consultado (em ordem crescente)."""
+        offsets, covers_all = self._offsets(radius)
+        a, j = self._candidates(sources, offsets)
+        keep = a != j
+        if targets is not None:
+            keep &= targets[j]
+        a, j = a[keep], j[keep]
+        return a, j, self.distances(a, j), covers_all
+
+    def distances(self, i, j):
+        """Distâncias (Å) dos pares (i[k], j[k]), pela imagem mínima quando há célula."""
+        i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+        return _backend.pair_distances(self.coords, i, j, self.lattice, self.pbc)
+
+    def within(self, sources, radius, targets=None):
+        """
+        Retorna (i, j, dist) com os átomos j a até 'radius' de cada i de 'sources',
+        ordenados por átomo consultado e por distância.
+        """
+        sources = np.unique(np.asarray(sources, dtype=np.int64))
+        a, j, d, _ = self._neighbors(sources, float(radius), targets)
+        keep = d <= radius
+        a, j, d = a[keep], j[keep], d[keep]
+        order = np.lexsort((j, d, a))
+        return a[order], j[order], d[order]
+
+    def nearest(self, sources, k, targets=None):
+        """
+        Retorna (i, j, dist) com os k vizinhos mais próximos de cada i de 'sources' (menos, se não
+        houver k átomos aceitos), ordenados por átomo consultado e por distância. O raio de busca
+        começa em uma camada de células e dobra só para os átomos que ainda não têm k vizinhos nele.
+        """
+        sources = np.unique(np.asarray(sources, dtype=np.int64))
+        first_radius = 0.999 * float(self.bin_widths.min()) * max(1.0, (k / (2 * _INDEX_ATOMS_PER_CELL)) ** (1 / 3))
+        parts = []
+        chunk = max(1, _QUERY_CHUNK // 256)
+        for start in range(0, len(sources), chunk):
+            pending, radius = sources[start:start + chunk], first_radius
+            while len(pending):
+                a, j, d, covers_all = self._neighbors(pending, radius, targets)
+                # Distâncias de cada átomo consultado em uma linha (completada com infinito)
+                first = np.searchsorted(a, pending, side="left")
+                found = np.searchsorted(a, pending, side="right") - first
+                column = np.arange(len(a)) - np.repeat(first, found)
+                table = np.full((len(pending), max(int(found.max()), k)), np.inf)
+                table[np.repeat(np.arange(len(pending)), found), column] = d
+                best = np.argsort(table, axis=1, kind="stable")[:, :k]
+                best_d = np.take_along_axis(table, best, axis=1)
+                # Com k vizinhos a até 'radius', nenhum átomo fora do raio de busca pode estar mais perto
+                done = (best_d[:, -1] <= radius) | covers_all
+                rows, cols = np.nonzero(np.isfinite(best_d) & done[:, None])
+                hits = first[rows] + best[rows, cols]
+                parts.append((a[hits], j[hits], d[hits]))
+                pending = pending[~done]
+                radius *= 2.0
+        if not parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=np.float64)
+        i, j, d = (np.concatenate(p) for p in zip(*parts))
+        order = np.lexsort((d, i))
+        return i[order], j[order], d[order]
+
+class DistanceQueryResult(PairDistances):
+    """
+    Resultado de uma consulta de distâncias (veja DistanceQuery), exibido e exportado como um
+    PairDistances; aqui pair_i é o átomo consultado e pair_j o vizinho (sem exigir i < j), na ordem
+    da consulta: por átomo consultado e, em cada um, por distância.
+    - query: texto da consulta (ou a descrição da chamada);
+    - kind: "vizinhos", "raio", "pares" ou "par".
+    """
+    __slots__ = ("query", "kind")
+
+    def __init__(self, pair_i, pair_j, distances, species, elements, periodic, query, kind, cutoff=None):
+        super().__init__(pair_i, pair_j, distances, species, elements, periodic, False, cutoff)
+        self.query = query
+        self.kind = kind
+
+    def header(self):
+        units = "Å e bohr, imagem mínima" if self.periodic else "Å e bohr"
+        return f"Consulta \"{self.query}\" ({units}):"
+
+    def columns(self, readable=False):
+        cols = super().columns(readable)
+        if self.kind == "vizinhos":
+            # Posição de cada vizinho (1 = o mais próximo) entre os do seu átomo consultado
+            first = np.searchsorted(self.pair_i, self.pair_i, side="left") if self.n_pairs else self.pair_i
+            cols["ordem"] = np.arange(self.n_pairs) - first + 1
+        return cols
+
+    def metadata(self):
+        meta = super().metadata()
+        meta.update({"consulta": self.query, "tipo_consulta": self.kind})
+        return meta
+
+_SELECTION_RANGE_RE = re.compile(r"^(\d+)(?:[-:](\d+))?$")
+
+def parse_atom_selection(text, structure, layers=None):
+    """
+    Converte o texto de uma seleção de átomos nos índices (a partir de 0, ordenados) selecionados.
+    A seleção é uma união de termos separados por vírgula ou ';'; cada termo combina, separados por
+    espaços:
+    - índices ou intervalos de átomos a partir de 1 ("17", "1-100" ou "1:100");
+    - símbolos químicos ("Mo", "S");
+    - camadas, a partir de 1 de baixo para cima ("camada 2", "camadas 1-3");
+    - "todos" (ou "*").
+    Em um termo, valores do mesmo tipo se somam e tipos diferentes se restringem:
+    "Mo S camada 1" são os Mo e os S da primeira camada.
+    'layers' é um LayerSegmentation, ou uma função sem argumentos que o retorna (só chamada se a
+    seleção usar camadas). Levanta ValueError para seleções inválidas ou vazias.
+    """
+    natoms = structure.natoms
+    symbols = {el.lower(): code for code, el in enumerate(structure.elements)}
+    selected = np.zeros(natoms, dtype=bool)
+    terms = [t.split() for t in re.split(r"[,;]", text) if t.strip()]
+    if not terms:
+        raise ValueError("Seleção de átomos vazia.")
+
+    def span(token, limit, what):
+        match = _SELECTION_RANGE_RE.match(token)
+        if match is None:
+            raise ValueError(f"Intervalo de {what} inválido: '{token}'.")
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if not 1 <= first <= last <= limit:
+            raise ValueError(f"{what.capitalize()} {token} fora do intervalo 1-{limit}.")
+        return first - 1, last
+
+    for tokens in terms:
+        filters = {}
+        k = 0
+        while k < len(tokens):
+            token = tokens[k]
+            word = token.lower()
+            if word in ("todos", "*"):
+                filters.setdefault("todos", np.ones(natoms, dtype=bool))
+            elif word in ("camada", "camadas"):
+                if k + 1 == len(tokens):
+                    raise ValueError("Informe o número da camada (ex.: camada 1).")
+                if callable(layers):
+                    layers = layers()
+                if layers is None:
+                    raise ValueError("As camadas da estrutura não estão disponíveis.")
+                first, last = span(tokens[k + 1], layers.n_layers, "camadas")
+                mask = (layers.layer_of_atom >= first) & (layers.layer_of_atom < last)
+                filters["camada"] = filters.get("camada", False) | mask
+                k += 1
+            elif word in symbols:
+                filters["elemento"] = filters.get("elemento", False) | (structure.species == symbols[word])
+            elif _SELECTION_RANGE_RE.match(token):
+                first, last = span(token, natoms, "átomos")
+                mask = np.zeros(natoms, dtype=bool)
+                mask[first:last] = True
+                filters["indice"] = filters.get("indice", False) | mask
+            else:
+                raise ValueError(f"Elemento ou termo desconhecido na seleção: '{token}' "
+                                 f"(elementos da estrutura: {', '.join(structure.elements)}).")
+            k += 1
+        term = np.ones(natoms, dtype=bool)
+        for mask in filters.values():
+            term &= mask
+        selected |= term
+
+    atoms = np.flatnonzero(selected)
+    if len(atoms) == 0:
+        raise ValueError(f"A seleção '{text.strip()}' não contém nenhum átomo.")
+    return atoms
+
+_QUERY_NEIGHBORS_RE = re.compile(
+    r"^(?P<kind>vizinhos|raio)\s+(?P<value>\S+)(?:\s+de\s+(?P<sources>.+?))?(?:\s+entre\s+(?P<targets>.+))?$",
+    re.IGNORECASE)
+_QUERY_BETWEEN_RE = re.compile(r"^pares\s+(?P<sources>.+?)\s+com\s+(?P<targets>.+)$", re.IGNORECASE)
+_QUERY_PAIR_RE = re.compile(r"^par\s+(?P<pairs>.+)$", re.IGNORECASE)
+
+class DistanceQuery:
+    """
+    Consultas de distâncias sobre uma estrutura já lida, respondidas por um NeighborIndex montado
+    uma única vez, sem calcular todos os N(N-1)/2 pares:
+    - nearest(k, de, entre): os k vizinhos mais próximos de cada átomo de 'de';
+    - within(raio, de, entre): os vizinhos a até 'raio' Å de cada átomo de 'de';
+    - between(de, com): todos os pares entre duas seleções (custo proporcional a |de| x |com|);
+    - pairs([(i, j), ...]): distâncias de pares explícitos (índices a partir de 0);
+    - run(texto): as mesmas consultas a partir de um texto (veja run).
+    As seleções são textos (veja parse_atom_selection), arrays de índices a partir de 0 ou None
+    (todos os átomos). As camadas só são detectadas se alguma seleção as usar.
+    """
+    def __init__(self, structure, use_pbc=True, lattice=None, gap_tolerance=LAYER_GAP_TOLERANCE):
+        if structure.natoms < 2:
+            raise XYZFormatError("Número insuficiente de átomos para calcular distâncias (mínimo de 2).",
+                                 natoms=structure.natoms, n_read=structure.natoms)
+        self.structure = structure
+        self.cell, self.pbc = resolve_cell(structure, use_pbc, lattice)
+        self.gap_tolerance = gap_tolerance
+        self._layers = None
+        with profile_stage("consulta/indice", atomos=structure.natoms):
+            self.index = NeighborIndex(structure.coords, self.cell, self.pbc)
+
+    @property
+    def layers(self):
+        """Camadas da estrutura (veja detect_layers), detectadas na primeira vez que são usadas."""
+        if self._layers is None:
+            periodic_z = self.cell is not None and bool(self.pbc[2])
+            self._layers = detect_layers(self.structure.coords, self.gap_tolerance, self.cell, periodic_z)
+        return self._layers
+
+    def select(self, selection=None):
+        """Índices (a partir de 0, ordenados) dos átomos de uma seleção."""
+        if selection is None:
+            return np.arange(self.structure.natoms, dtype=np.int64)
+        if isinstance(selection, str):
+            return parse_atom_selection(selection, self.structure, lambda: self.layers)
+        atoms = np.unique(np.asarray(selection, dtype=np.int64))
+        if len(atoms) and (atoms[0] < 0 or atoms[-1] >= self.structure.natoms):
+            raise ValueError(f"Índices de átomos fora do intervalo 0-{self.structure.natoms - 1}.")
+        return atoms
+
+    def _mask(self, selection):
+        if selection is None:
+            return None
+        mask = np.zeros(self.structure.natoms, dtype=bool)
+        mask[self.select(selection)] = True
+        return mask
+
+    def _result(self, i, j, d, query, kind, cutoff=None):
+        return DistanceQueryResult(i.astype(np.int32), j.astype(np.int32), d, self.structure.species,
+                                   self.structure.elements, self.cell is not None, query, kind, cutoff)
+
+    def nearest(self, k, sources=None, targets=None, query=None):
+        k = int(k)
+        if k < 1:
+            raise ValueError("O número de vizinhos deve ser pelo menos 1.")
+        with profile_stage("consulta/calculo", tipo="vizinhos"):
+            i, j, d = self.index.nearest(self.select(sources), k, self._mask(targets))
+        return self._result(i, j, d, query or f"vizinhos {k}", "vizinhos")
+
+    def within(self, radius, sources=None, targets=None, query=None):
+        radius = float(radius)
+        if radius <= 0.0:
+            raise ValueError("O raio deve ser positivo (em Å).")
+        with profile_stage("consulta/calculo", tipo="raio"):
+            i, j, d = self.index.within(self.select(sources), radius, self._mask(targets))
+        return self._result(i, j, d, query or f"raio {radius:g}", "raio", radius)
+
+    def between(self, sources, targets, query=None):
+        """Todos os pares entre duas seleções; um par com os dois átomos nas duas aparece uma vez."""
+        a, b = self.select(sources), self.select(targets)
+        with profile_stage("consulta/calculo", tipo="pares"):
+            i, j = np.repeat(a, len(b)), np.tile(b, len(a))
+            in_a, in_b = self._mask(a), self._mask(b)
+            keep = (i != j) & ~((i > j) & in_a[j] & in_b[i])
+            i, j = i[keep], j[keep]
+            d = self.index.distances(i, j)
+        return self._result(i, j, d, query or "pares", "pares")
+
+    def pairs(self, pairs, query=None):
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        natoms = self.structure.natoms
+        if len(pairs) and (pairs.min() < 0 or pairs.max() >= natoms):
+            raise ValueError(f"Os átomos dos pares devem estar entre 1 e {natoms}.")
+        return self._result(pairs[:, 0], pairs[:, 1], self.index.distances(pairs[:, 0], pairs[:, 1]),
+                            query or "par", "par")
+
+    def run(self, text):
+        """
+        Executa uma consulta escrita como texto (seleções como em parse_atom_selection, átomos a
+        partir de 1):
+        - "vizinhos 3 de Mo": os 3 vizinhos mais próximos de cada Mo (sem "de", de todos os átomos);
+        - "vizinhos 6 de Mo entre S", "raio 3.2 de Mo entre S": só os vizinhos da seleção após "entre";
+        - "pares S camada 1 com S camada 2": todas as distâncias entre as duas seleções;
+        - "par 17 902" ou "par 17 902, 3 8": distâncias entre átomos específicos.
+        Retorna um DistanceQueryResult. Levanta ValueError para consultas inválidas.
+        """
+        query = " ".join(text.split())
+        match = _QUERY_NEIGHBORS_RE.match(query)
+        if match:
+            value = match.group("value").replace(",", ".")
+            try:
+                value = int(value) if match.group("kind").lower() == "vizinhos" else float(value)
+            except ValueError:
+                raise ValueError(f"Valor inválido na consulta: '{match.group('value')}'.") from None
+            run = self.nearest if match.group("kind").lower() == "vizinhos" else self.within
+            return run(value, match.group("sources"), match.group("targets"), query=query)
+        match = _QUERY_BETWEEN_RE.match(query)
+        if match:
+            return self.between(match.group("sources"), match.group("targets"), query=query)
+        match = _QUERY_PAIR_RE.match(query)
+        if match:
+            numbers = [v for v in re.split(r"[\s,;]+", match.group("pairs")) if v]
+            if len(numbers) % 2 or not all(v.isdigit() for v in numbers):
+                raise ValueError("Informe os pares como números de átomos, ex.: par 17 902, 3 8.")
+            return self.pairs(np.array(numbers, dtype=np.int64).reshape(-1, 2) - 1, query=query)
+        raise ValueError("Consulta desconhecida. Use, por exemplo: \"vizinhos 3 de Mo\", "
+                         "\"raio 3.2 de Mo entre S\", \"pares S camada 1 com S camada 2\" ou \"par 17 902\".")
+
+# Consultas abertas nesta sessão, da usada há mais tempo para a mais recente (protegidas por _session_lock)
+_query_session = collections.OrderedDict() # (caminho, quadro, pbc, rede, tolerância) -> DistanceQuery
+_QUERY_SESSION_MAX = 4
+
+def open_distance_query(file_path, use_pbc=True, lattice=None, frame=None, gap_tolerance=LAYER_GAP_TOLERANCE):
+    """
+    DistanceQuery de um arquivo de estrutura (veja load_xyz). O índice espacial é montado na primeira
+    consulta e reaproveitado pelas seguintes enquanto o arquivo não mudar.
+    Levanta OSError, IndexError, XYZFormatError (também para menos de 2 átomos) ou ValueError.
+    """
+    structure = load_xyz(file_path, frame)
+    lattice_key = None if lattice is None else tuple(np.ravel(lattice).tolist())
+    key = (os.path.abspath(file_path), frame, bool(use_pbc), lattice_key, gap_tolerance)
+    with _session_lock:
+        query = _query_session.get(key)
+        if query is not None and query.structure is structure:
+            _query_session.move_to_end(key)
+            return query
+    query = DistanceQuery(structure, use_pbc, lattice, gap_tolerance)
+    with _session_lock:
+        _query_session[key] = query
+        _query_session.move_to_end(key)
+        while len(_query_session) > _QUERY_SESSION_MAX:
+            _query_session.popitem(last=False)
+    return query
+
+def query_distances(file_path, text, use_pbc=True, lattice=None, frame=None, gap_tolerance=LAYER_GAP_TOLERANCE):
+    """Executa uma consulta de distâncias em texto (veja DistanceQuery.run) sobre um arquivo de estrutura."""
+    return open_distance_query(file_path, use_pbc, lattice, frame, gap_tolerance).run(text)
+
+# --- Trajetórias (vários quadros) ---
+
+class LayerDistanceSeries:
+    """
+    Série temporal da distância entre camadas ao longo de uma trajetória .xyz.
+    - distances_ang: array (n_quadros,) com a distância entre camadas de cada quadro (Å);
+    - frame_numbers: array com o índice (a partir de 0) de cada quadro no arquivo;
+    - bond_count, bond_mean, bond_std: estatísticas das ligações em cada quadro
+      (número de ligações, média e desvio padrão em Å), ou None se não foram pedidas.
+    """
+    __slots__ = ("distances_ang", "frame_numbers", "bond_count", "bond_mean", "bond_std")
+
+    def __init__(self, distances_ang, frame_numbers, bond_count=None, bond_mean=None, bond_std=None):
+        self.distances_ang = distances_ang
+        self.frame_numbers = frame_numbers
+        self.bond_count = bond_count
+        self.bond_mean = bond_mean
+        self.bond_std = bond_std
+
+    @property
+    def n_frames(self):
+        return self.distances_ang.shape[0]
+
+    @property
+    def final_ang(self):
+        """Distância entre camadas no último quadro (Å)."""
+        return float(self.distances_ang[-1])
+
+    @property
+    def mean_ang(self):
+        return float(self.distances_ang.mean())
+
+    @property
+    def std_ang(self):
+        return float(self.distances_ang.std())
+
+    def columns(self, readable=False):
+        cols = {"quadro": self.frame_numbers + 1, "distancia_ang": self.distances_ang}
+        if self.bond_count is not None:
+            cols.update(n_ligacoes=self.bond_count, ligacao_media_ang=self.bond_mean,
+                        ligacao_desvio_ang=self.bond_std)
+        return cols
+
+    def metadata(self):
+        return {"n_quadros": self.n_frames, "final_ang": self.final_ang,
+                "media_ang": self.mean_ang, "desvio_ang": self.std_ang}
+
+def calculate_layer_distance_trajectory_python(file_path, use_pbc=True, lattice=None,
+                                               bond_stats=False, bond_cutoff=None, frames=None,
+                                               progress=None):
+    """
+    Calcula a distância entre camadas em cada quadro de uma trajetória .xyz (relaxação ou MD).
+    Os quadros são lidos um por vez (iter_structure_frames), então o consumo de memória não
+    depende do tamanho do arquivo. Com bond_stats=True, também calcula por quadro o número,
+    a média e o desvio padrão dos comprimentos de ligação (raio de corte 'bond_cutoff'
+    ou raios covalentes). 'frames' (um slice) restringe o cálculo a um intervalo ou passo de
+    quadros, lidos diretamente pelo índice de quadros. 'progress' recebe a fração concluída
+    (veja CalculationCancelled). Retorna um LayerDistanceSeries.
+    O resultado fica no cache em disco (veja ResultCache).
+    Levanta OSError, XYZFormatError ou ValueError (célula ou elemento inválido).
+    """
+    params = {"pbc": use_pbc, "rede": lattice, "ligacoes": bond_stats, "corte": bond_cutoff, "quadros": frames}
+    return _cached(file_path, "trajetoria", params, lambda: _compute_layer_distance_trajectory(
+        file_path, use_pbc, lattice, bond_stats, bond_cutoff, frames, progress))
+
+def _compute_layer_distance_trajectory(file_path, use_pbc, lattice, bond_stats, bond_cutoff, frames, progress):
+    distances, frame_numbers = [], []
+    bond_count, bond_mean, bond_std = [], [], []
+
+    if frames is None:
+        frame_iter = enumerate(iter_structure_frames(file_path, progress))
+    else:
+        index = load_frame_index(file_path)
+        selected = index.frame_numbers(frames)
+        frame_iter = zip(selected, index.iter_frames(frames))
+
+    for frame_number, structure in frame_iter:
+        if progress is not None and frames is not None:
+            progress(len(distances) / len(selected))
+        if structure.natoms < 4:
+            raise XYZFormatError(
+                f"Quadro {frame_number + 1}: número insuficiente de átomos (mínimo de 4).",
+                natoms=structure.natoms)
+        frame_numbers.append(frame_number)
+        with profile_stage("trajetoria/calculo", quadro=frame_number):
+            cell, pbc = resolve_cell(structure, use_pbc, lattice)
+            distances.append(_layer_distance(structure.coords, cell, pbc))
+
+            if bond_stats:
+                _, _, bonds = find_bonded_pairs(structure, cutoff=bond_cutoff, use_pbc=use_pbc, lattice=lattice)
+                bond_count.append(len(bonds))
+                bond_mean.append(bonds.mean() if len(bonds) else np.nan)
+                bond_std.append(bonds.std() if len(bonds) else np.nan)
+
+    if not distances:
+        raise XYZFormatError("Nenhum quadro encontrado no arquivo.")
+
+    if not bond_stats:
+        return LayerDistanceSeries(np.array(distances), np.array(frame_numbers))
+    return LayerDistanceSeries(np.array(distances), np.array(frame_numbers), np.array(bond_count),
+                               np.array(bond_mean), np.array(bond_std))
+
+# --- Distribuição Radial e Histograma de Ligações ---
+
+RDF_DEFAULT_RMAX = 8.0 # Alcance padrão de g(r) (Å)
+RDF_DEFAULT_BINS = 200
+# Pares candidatos processados de cada vez: limita a memória (cerca de 100 MiB por bloco),
+# qualquer que seja o número de átomos
+_RDF_BLOCK_PAIRS = 1 << 20
+
+class DistanceHistogram:
+    """
+    Histograma de distâncias entre pares, acumulado sobre um ou mais quadros de um .xyz:
+    - kind: "rdf" (todos os pares até r_max) ou "ligacoes" (só os pares ligados);
+    - edges: limites dos intervalos (Å); counts: pares em cada intervalo, somados sobre os quadros
+      (na RDF, pares ordenados: o par i-j conta uma vez a partir de i e outra a partir de j);
+    - g_r: função de distribuição radial normalizada pelo gás ideal (só na RDF com célula periódica);
+    - coordination: número de coordenação acumulado n(r) por átomo de referência (só na RDF);
+    - element_pair: par (A, B) selecionado (A = referência), ou None para todos os pares;
+    - n_frames, n_reference: quadros usados e átomos de referência por quadro;
+    - mean, std: média e desvio padrão das distâncias contadas (no histograma de ligações).
+    """
+    __slots__ = ("kind", "edges", "counts", "g_r", "coordination", "element_pair", "n_frames",
+                 "n_reference", "periodic", "mean", "std")
+
+    def __init__(self, kind, edges, counts, g_r=None, coordination=None, element_pair=None, n_frames=1,
+                 n_reference=0, periodic=False, mean=None, std=None):
+        self.kind = kind
+        self.edges = edges
+        self.counts = counts
+        self.g_r = g_r
+        self.coordination = coordination
+        self.element_pair = element_pair
+        self.n_frames = n_frames
+        self.n_reference = n_reference
+        self.periodic = periodic
+        self.mean = mean
+        self.std = std
+
+    @property
+    def centers(self):
+        return 0.5 * (self.edges[1:] + self.edges[:-1])
+
+    @property
+    def r_max(self):
+        return float(self.edges[-1])
+
+    @property
+    def pair_label(self):
+        return "todos os pares" if self.element_pair is None else "-".join(self.element_pair)
+
+    def columns(self, readable=False):
+        cols = {"r_ang": self.centers, "contagem": self.counts}
+        if self.g_r is not None:
+            cols["g_r"] = self.g_r
+        if self.coordination is not None:
+            cols["coordenacao"] = self.coordination
+        return cols
+
+    def metadata(self):
+        return {"tipo": self.kind, "par": self.pair_label, "n_quadros": self.n_frames,
+                "n_referencia": self.n_reference, "periodico": self.periodic, "r_max": self.r_max,
+                "media": self.mean, "desvio": self.std}
+
+def _cell_pair_blocks(coords, r_max, block_pairs=_RDF_BLOCK_PAIRS):
+    """
+    Gera os pares candidatos de uma lista de células de aresta r_max em blocos de cerca de
+    'block_pairs' pares, como (fração já percorrida, i, j): cada par não ordenado aparece uma
+    única vez, e a memória fica limitada pelo bloco, e não pelo número total de pares.
+    """
+    cell_xyz = np.floor((coords - coords.min(axis=0)) / r_max).astype(np.int64)
+    dims = cell_xyz.max(axis=0) + 1
+    cell_key = (cell_xyz[:, 0] * dims[1] + cell_xyz[:, 1]) * dims[2] + cell_xyz[:, 2]
+    order = np.argsort(cell_key, kind='stable')
+    keys, first, counts = np.unique(cell_key[order], return_index=True, return_counts=True)
+    keys_xyz = np.stack(np.unravel_index(keys, dims), axis=1)
+
+    # Tarefas (célula de origem, célula de destino): a própria célula e a meia vizinhança
+    src, dst = [np.arange(len(keys))], [np.arange(len(keys))]
+    for offset in _HALF_SHELL_OFFSETS:
+        neighbor_xyz = keys_xyz + offset
+        inside = np.all((neighbor_xyz >= 0) & (neighbor_xyz < dims), axis=1)
+        neighbor_keys = (neighbor_xyz[:, 0] * dims[1] + neighbor_xyz[:, 1]) * dims[2] + neighbor_xyz[:, 2]
+        pos = np.minimum(np.searchsorted(keys, neighbor_keys), len(keys) - 1)
+        exists = inside & (keys[pos] == neighbor_keys)
+        src.append(np.nonzero(exists)[0])
+        dst.append(pos[exists])
+    same = np.zeros(sum(len(part) for part in src), dtype=bool)
+    same[:len(keys)] = True
+    src, dst = np.concatenate(src), np.concatenate(dst)
+
+    # Agrupa tarefas consecutivas até somar block_pairs pares (uma tarefa maior fica sozinha)
+    sizes = counts[src] * counts[dst]
+    cumulative = np.cumsum(sizes)
+    total = max(int(cumulative[-1]), 1)
+    bounds = np.searchsorted(cumulative, np.arange(block_pairs, total, block_pairs), side='right')
+    bounds = np.unique(np.concatenate(([0], bounds, [len(src)])))
+    for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        s, t = src[start:stop], dst[start:stop]
+        i, j = _expand_cell_pairs(first[s], counts[s], first[t], counts[t])
+        keep = ~np.repeat(same[start:stop], sizes[start:stop]) | (i < j)
+        yield int(cumulative[stop - 1]) / total, order[i[keep]], order[j[keep]]
+
+def _element_codes(structure, element_pair):
+    """Códigos de espécie de um par de elementos (A, B); levanta ValueError se algum não existir."""
+    if element_pair is None:
+        return None
+    codes = []
+    for el in element_pair:
+        if el not in structure.elements:
+            raise ValueError(f"O elemento {el} não aparece no arquivo (elementos: {', '.join(structure.elements)}).")
+        codes.append(structure.elements.index(el))
+    return tuple(codes)
+
+def _iter_selected_frames(file_path, frames):
+    """
+    Gera (k, n, estrutura) para os quadros selecionados de um .xyz ou de uma saída do SIESTA ou
+    do pw.x ('frames': None = todos, um índice ou um slice), lidos um de cada vez pelo índice de quadros.
+    """
+    index = load_frame_index(file_path, write_sidecar=frames is not None)
+    selection = slice(None) if frames is None else frames
+    n = len(index.frame_numbers(selection))
+    for k, structure in enumerate(index.iter_frames(selection)):
+        yield k, n, structure
+
+def _rdf_frame_counts(structure, r_max, n_bins, codes, cell, pbc, progress):
+    """
+    Histograma (n_bins,) dos pares ordenados até r_max de um quadro, em blocos. Com célula, os
+    pares são procurados entre os átomos e as suas imagens periódicas: um par entre dois pontos
+    conta uma vez para cada ponto que é um átomo real (e só se esse ponto for de A e o outro de B).
+    """
+    natoms = structure.natoms
+    if cell is not None:
+        points, origin = _periodic_images(structure.coords, r_max, cell, pbc)
+    else:
+        points, origin = structure.coords, np.arange(natoms)
+    species = structure.species[origin]
+    counts = np.zeros(n_bins)
+    if len(points) < 2:
+        return counts
+    scale = n_bins / r_max
+    for fraction, p, q in _cell_pair_blocks(points, r_max):
+        real_p, real_q = p < natoms, q < natoms
+        if codes is None:
+            weight = real_p.astype(np.float64) + real_q
+        else:
+            sp, sq = species[p], species[q]
+            weight = ((real_p & (sp == codes[0]) & (sq == codes[1])).astype(np.float64)
+                      + (real_q & (sq == codes[0]) & (sp == codes[1])))
+        bins = (np.sqrt(((points[q] - points[p]) ** 2).sum(axis=1)) * scale).astype(np.int64)
+        valid = (bins < n_bins) & (weight > 0)
+        counts += np.bincount(bins[valid], weights=weight[valid], minlength=n_bins)
+        if progress is not None:
+            progress(fraction)
+    return counts
+
+def calculate_rdf(file_path, r_max=RDF_DEFAULT_RMAX, n_bins=RDF_DEFAULT_BINS, element_pair=None,
+                  use_pbc=True, lattice=None, frames=None, progress=None):
+    """
+    Calcula a função de distribuição radial g(r) de um arquivo .xyz, para todos os pares ou para um
+    par de elementos ('element_pair' = ("Mo", "S"): vizinhos S em torno de cada Mo), até 'r_max' (Å)
+    em 'n_bins' intervalos. Os pares são contados em blocos de tamanho fixo sobre uma lista de
+    células, com binning vetorizado: nem as N² distâncias nem a lista de pares são guardadas.
+    Com vários quadros ('frames': None = todos, índice ou slice), o histograma é a média sobre eles.
+    g(r) só é normalizada com célula periódica (densidade = N/V); sem ela, o resultado traz as
+    contagens e o número de coordenação acumulado. O resultado fica no cache em disco.
+    Retorna um DistanceHistogram. Levanta OSError, IndexError, XYZFormatError ou ValueError.
+    """
+    if r_max <= 0.0 or n_bins < 1:
+        raise ValueError("O alcance e o número de intervalos devem ser positivos.")
+    params = {"r_max": r_max, "intervalos": n_bins, "par": element_pair, "pbc": use_pbc, "rede": lattice,
+              "quadros": frames}
+    return _cached(file_path, "rdf", params, lambda: _compute_rdf(
+        file_path, float(r_max), int(n_bins), element_pair, use_pbc, lattice, frames, progress))
+
+def _compute_rdf(file_path, r_max, n_bins, element_pair, use_pbc, lattice, frames, progress):
+    counts = np.zeros(n_bins)
+    n_frames = n_reference = n_target = 0
+    volume = 0.0
+    periodic = False
+    for k, n, structure in _iter_selected_frames(file_path, frames):
+        codes = _element_codes(structure, element_pair)
+        cell, pbc = resolve_cell(structure, use_pbc, lattice)
+        frame_progress = None if progress is None else (lambda f: progress((k + f) / n))
+        with profile_stage("rdf/calculo", quadro=k, atomos=structure.natoms):
+            counts += _rdf_frame_counts(structure, r_max, n_bins, codes, cell, pbc, frame_progress)
+        n_frames += 1
+        if codes is None:
+            n_reference += structure.natoms
+            n_target += structure.natoms
+        else:
+            n_reference += int(np.count_nonzero(structure.species == codes[0]))
+            n_target += int(np.count_nonzero(structure.species == codes[1]))
+        if cell is not None:
+            periodic = True
+            volume += abs(np.linalg.det(cell))
+    if n_frames == 0:
+        raise XYZFormatError("Nenhum quadro encontrado no arquivo.")
+
+    edges = np.linspace(0.0, r_max, n_bins + 1)
+    coordination = np.cumsum(counts) / max(n_reference, 1)
+    g_r = None
+    if periodic and n_reference and n_target:
+        # Pares esperados em cada casca para um gás ideal com a densidade média dos alvos (B)
+        shells = 4.0 / 3.0 * np.pi * (edges[1:] ** 3 - edges[:-1] ** 3)
+        density = n_target / volume
+        g_r = counts / (n_reference * density * shells)
+    return DistanceHistogram("rdf", edges, counts, g_r, coordination, element_pair, n_frames,
+                             n_reference // n_frames, periodic)
+
+def calculate_bond_histogram(file_path, n_bins=RDF_DEFAULT_BINS, cutoff=None, element_pair=None,
+                             use_pbc=True, lattice=None, frames=None, progress=None):
+    """
+    Histograma dos comprimentos de ligação de um arquivo .xyz (pares ligados pela lista de células,
+    com 'cutoff' em Å ou pelos raios covalentes), para todas as ligações ou para um par de elementos,
+    de 0 até o maior raio de corte possível, em 'n_bins' intervalos. Com vários quadros ('frames':
+    None = todos, índice ou slice), as contagens são somadas; se um quadro tiver elementos com raio
+    de corte maior que o do primeiro, o histograma ganha intervalos da mesma largura até ele.
+    O resultado fica no cache em disco.
+    Retorna um DistanceHistogram. Levanta OSError, IndexError, XYZFormatError ou ValueError.
+    """
+    if n_bins < 1:
+        raise ValueError("O número de intervalos deve ser positivo.")
+    params = {"intervalos": n_bins, "corte": cutoff, "par": element_pair, "pbc": use_pbc, "rede": lattice,
+              "quadros": frames}
+    return _cached(file_path, "histograma_ligacoes", params, lambda: _compute_bond_histogram(
+        file_path, int(n_bins), cutoff, element_pair, use_pbc, lattice, frames, progress))
+
+def _compute_bond_histogram(file_path, n_bins, cutoff, element_pair, use_pbc, lattice, frames, progress):
+    counts = np.zeros(n_bins)
+    width = None
+    n_frames = n_bonds = 0
+    total = total_sq = 0.0
+    periodic = False
+    for k, n, structure in _iter_selected_frames(file_path, frames):
+        if progress is not None:
+            progress(k / n)
+        codes = _element_codes(structure, element_pair)
+        with profile_stage("ligacoes/histograma", quadro=k, atomos=structure.natoms):
+            i, j, d = find_bonded_pairs(structure, cutoff=cutoff, use_pbc=use_pbc, lattice=lattice)
+            if codes is not None:
+                si, sj = structure.species[i], structure.species[j]
+                d = d[((si == codes[0]) & (sj == codes[1])) | ((si == codes[1]) & (sj == codes[0]))]
+            # Intervalos da mesma largura em todos os quadros, a do primeiro (n_bins até o maior raio de
+            # corte da busca); um quadro com elementos de raio maior acrescenta intervalos no fim
+            r_max = float(cutoff) if cutoff is not None else _bond_radii(structure)[1]
+            if width is None:
+                width = r_max / n_bins
+            needed = int(np.ceil(r_max / width - 1e-9))
+            if needed > len(counts):
+                counts = np.concatenate((counts, np.zeros(needed - len(counts))))
+            # Só d == raio de corte cai fora do último intervalo (que inclui o limite superior)
+            bins = np.minimum((d / width).astype(np.int64), len(counts) - 1)
+            counts += np.bincount(bins, minlength=len(counts))
+        n_frames += 1
+        n_bonds += len(d)
+        total += float(d.sum())
+        total_sq += float((d ** 2).sum())
+        periodic = periodic or resolve_cell(structure, use_pbc, lattice)[0] is not None
+    if n_frames == 0:
+        raise XYZFormatError("Nenhum quadro encontrado no arquivo.")
+
+    mean = total / n_bonds if n_bonds else None
+    std = float(np.sqrt(max(total_sq / n_bonds - mean ** 2, 0.0))) if n_bonds else None
+    edges = np.linspace(0.0, width * len(counts), len(counts) + 1)
+    return DistanceHistogram("ligacoes", edges, counts, element_pair=element_pair, n_frames=n_frames,
+                             n_reference=n_bonds // n_frames, periodic=periodic, mean=mean, std=std)
+
+# --- Leitura de Arquivos .bands ---
+
+class BandsFormatError(ValueError):
+    """
+    Erro de formato em um arquivo .bands.
+    'error_code' guarda o código de erro herdado do Fortran (-888.88 para nível de Fermi
+    ausente/ilegível, -777.77 para dados de energia inválidos).
+    """
+    def __init__(self, message, error_code=ERROR_DATA):
+        super().__init__(message)
+        self.error_code = error_code
+
+class BandsHeader:
+    """
+    Cabeçalho de um arquivo .bands do SIESTA:
+    - fermi: nível de Fermi (eV);
+    - nbands, nspin, nk: número de bandas, de canais de spin e de pontos k;
+    - siesta: False para o formato simplificado (Fermi seguido apenas de energias).
+    """
+    __slots__ = ("fermi", "nbands", "nspin", "nk", "siesta")
+
+    def __init__(self, fermi, nbands, nspin, nk, siesta=True):
+        self.fermi = fermi
+        self.nbands = nbands
+        self.nspin = nspin
+        self.nk = nk
+        self.siesta = siesta
+
+# Tamanho (em bytes de texto) lido por vez ao percorrer as energias de um .bands
+_BANDS_CHUNK_BYTES = 1 << 20
+
+def _read_bands_header(f):
+    """
+    Lê o cabeçalho de um .bands. No formato do SIESTA são 4 linhas:
+    nível de Fermi; intervalo do caminho k; intervalo de energias; nbands nspin nk.
+    Se as linhas 2 a 4 não seguirem esse formato, o arquivo é tratado como simplificado
+    e o arquivo é reposicionado logo após a linha do nível de Fermi.
+    """
+    first_line = f.readline()
+    if not first_line.strip():
+        raise BandsFormatError("O arquivo está vazio.", error_code=ERROR_NATOMS)
+    try:
+        fermi = float(first_line.split()[0])
+    except ValueError:
+        raise BandsFormatError("Não foi possível ler o nível de Fermi da primeira linha.", error_code=ERROR_NATOMS)
+
+    after_fermi = f.tell()
+    try:
+        k_range = [float(v) for v in f.readline().split()]
+        e_range = [float(v) for v in f.readline().split()]
+        dims = [int(v) for v in f.readline().split()]
+        if len(k_range) == 2 and len(e_range) == 2 and len(dims) == 3 and min(dims) > 0:
+            nbands, nspin, nk = dims
+            return BandsHeader(fermi, nbands, nspin, nk)
+    except ValueError:
+        pass
+    f.seek(after_fermi)
+    return BandsHeader(fermi, 0, 1, 0, siesta=False)
+
+# Bytes de espaço em branco (espaço, \t, \n, \v, \f, \r) que separam os números dos blocos de bandas
+_BLANK_BYTES = np.zeros(256, dtype=bool)
+_BLANK_BYTES[[32, 9, 10, 11, 12, 13]] = True
+
+def _fromstring_floats(text):
+    """
+    Converte um texto só de números separados por espaço em branco em um array float64, direto em C
+    (np.fromstring). Levanta ValueError se algum token não for um número inteiro: só as versões
+    recentes do NumPy levantam o erro; as anteriores devolvem apenas os números antes do problema
+    (com um DeprecationWarning), então o total também é comparado ao número de tokens do texto.
+    """
+    values = np.fromstring(text, dtype=np.float64, sep=' ')
+    blank = _BLANK_BYTES[np.frombuffer(text.encode(), dtype=np.uint8)]
+    n_tokens = np.count_nonzero(blank[:-1] & ~blank[1:]) + (len(blank) > 0 and not blank[0])
+    if len(values) != n_tokens:
+        raise ValueError("Texto ou números colados no meio dos números.")
+    return values
+
+def _lines_to_floats(lines):
+    """
+    Converte um bloco de linhas de números em um array float64, direto em C (_fromstring_floats),
+    sem criar um objeto Python por número. Se houver texto no meio, cai para a leitura
+    linha a linha, separando os números colados e ignorando as linhas não numéricas (como
+    fazia o código original).
+    """
+    try:
+        return _fromstring_floats(''.join(lines))
+    except ValueError:
+        values = []
+        for line in lines:
+            try:
+                values.extend([float(val) for val in line.split()])
+            except ValueError:
+                parts = [_split_glued(token) for token in line.split()]
+                if None not in parts:
+                    values.extend(float(value) for part in parts for value in part)
+        return np.array(values, dtype=np.float64)
+
+def _read_bands_lines(f, chunk_bytes):
+    """Lê até cerca de 'chunk_bytes' de linhas inteiras de um .bands aberto (etapa 'bands/leitura')."""
+    with profile_stage("bands/leitura") as stage:
+        start = f.buffer.tell()
+        lines = f.readlines(chunk_bytes)
+        # Posição do buffer binário: aproximada em alguns KiB, como em iter_xyz_frames
+        stage.add_bytes(f.buffer.tell() - start)
+    return lines
+
+def iter_bands_blocks(file_path, chunk_bytes=_BANDS_CHUNK_BYTES, fermi=None):
+    """
+    Percorre um arquivo de bandas em blocos de pontos k, com memória limitada por 'chunk_bytes'.
+    Gera (header, k_values, energies), onde k_values tem forma (m,) (coordenada no caminho k)
+    e energies tem forma (m, nspin, nbands). Além do .bands do SIESTA, lê o bands.dat do bands.x
+    e os autovalores de uma saída do pw.x do Quantum ESPRESSO (veja detect_file_format).
+    No formato simplificado, todas as energias formam um único ponto k com um único canal de spin.
+    'fermi' (eV) substitui o nível de Fermi do arquivo; é obrigatório no bands.dat, que não o traz.
+    Levanta OSError ou BandsFormatError.
+    """
+    file_format = detect_file_format(file_path)
+    if file_format == "qe_bands":
+        blocks = _iter_qe_bands_dat_blocks(file_path, chunk_bytes)
+    elif file_format == "qe_out":
+        blocks = _iter_pw_output_bands(file_path)
+    else:
+        blocks = _iter_siesta_bands_blocks(file_path, chunk_bytes)
+    for header, k_values, energies in blocks:
+        if fermi is not None:
+            header.fermi = float(fermi)
+        elif header.fermi is None:
+            raise BandsFormatError("O arquivo não traz o nível de Fermi; informe-o (ex.: o da saída scf do pw.x).",
+                                   error_code=ERROR_NATOMS)
+        yield header, k_values, energies
+
+def _iter_siesta_bands_blocks(file_path, chunk_bytes):
+    """Blocos de iter_bands_blocks para o .bands do SIESTA e o formato simplificado."""
+    with open(file_path, 'r') as f:
+        header = _read_bands_header(f)
+
+        if not header.siesta:
+            parts = []
+            while True:
+                lines = _read_bands_lines(f, chunk_bytes)
+                if not lines:
+                    break
+                with profile_stage("bands/conversao"):
+                    parts.append(_lines_to_floats(lines))
+            energies = np.concatenate(parts) if parts else np.zeros(0)
+            if energies.size == 0:
+                raise BandsFormatError("Não foi possível ler dados de energia válidos no arquivo.")
+            header.nbands, header.nk = energies.size, 1
+            yield header, np.zeros(1), energies.reshape(1, 1, -1)
+            return
+
+        # Cada ponto k ocupa 1 + nspin*nbands números: a coordenada k e as energias
+        for block in _iter_number_records(f, 1 + header.nspin * header.nbands, header.nk, chunk_bytes):
+            # Cópia da coluna k: guardar uma fatia manteria o bloco inteiro vivo na memória
+            yield header, block[:, 0].copy(), block[:, 1:].reshape(len(block), header.nspin, header.nbands)
+
+def _iter_number_records(f, record_size, n_records, chunk_bytes):
+    """
+    Lê de um arquivo aberto 'n_records' registros de 'record_size' números cada (um ponto k de um
+    arquivo de bandas), em blocos de cerca de 'chunk_bytes'. Gera arrays (m, record_size).
+    Texto depois do último registro é ignorado. Levanta BandsFormatError.
+    """
+    remaining = n_records
+    leftover = np.zeros(0)
+    while remaining > 0:
+        lines = _read_bands_lines(f, chunk_bytes)
+        if not lines:
+            raise BandsFormatError(
+                f"O arquivo terminou após {n_records - remaining} de {n_records} pontos k.")
+        with profile_stage("bands/conversao"):
+            try:
+                values = _fromstring_floats(''.join(lines))
+            except ValueError:
+                # Após o último ponto k vêm os rótulos do caminho ('Gamma', 'M', ...): só os
+                # números que ainda faltam são convertidos, separando os colados ('-1.2-3.4')
+                needed = remaining * record_size - leftover.size
+                tokens = []
+                for token in ''.join(lines).split():
+                    if len(tokens) >= needed:
+                        break
+                    parts = _split_glued(token)
+                    if parts is None:
+                        raise BandsFormatError("Valor de energia inválido no bloco de bandas.")
+                    tokens.extend(parts)
+                try:
+                    values = np.array(tokens[:needed], dtype=np.float64)
+                except ValueError:
+                    raise BandsFormatError("Valor de energia inválido no bloco de bandas.")
+        values = np.concatenate((leftover, values)) if leftover.size else values
+        n_full = min(values.size // record_size, remaining)
+        leftover = values[n_full * record_size:]
+        if n_full == 0:
+            continue
+        remaining -= n_full
+        yield values[:n_full * record_size].reshape(n_full, record_size)
+
+class BandGapResult:
+    """
+    Resultado da análise de um arquivo .bands (energias em eV):
+    - fermi, vbm, cbm, gap: nível de Fermi, topo da banda de valência, fundo da
+      banda de condução e gap fundamental (cbm - vbm);
+    - direct_gap: menor gap direto (no mesmo ponto k); is_direct indica se o gap fundamental é direto;
+    - k_vbm, k_cbm: índices (a partir de 0) dos pontos k do VBM e do CBM;
+      k_vbm_coord, k_cbm_coord: coordenadas desses pontos no caminho k;
+    - spin_gaps: array (nspin,) com o gap de cada canal de spin;
+    - is_metallic: True se alguma banda cruza o nível de Fermi;
+    - nbands, nspin, nk: dimensões lidas do arquivo.
+    """
+    __slots__ = ("fermi", "vbm", "cbm", "gap", "direct_gap", "is_direct", "k_vbm", "k_cbm",
+                 "k_vbm_coord", "k_cbm_coord", "spin_gaps", "is_metallic", "nbands", "nspin", "nk")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    def columns(self, readable=False):
+        return {"spin": np.arange(1, len(self.spin_gaps) + 1), "gap_ev": np.asarray(self.spin_gaps)}
+
+    def metadata(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != "spin_gaps"}
+
+def analyze_band_gap(file_path, chunk_bytes=_BANDS_CHUNK_BYTES, progress=None, fermi=None):
+    """
+    Calcula VBM, CBM e gap (fundamental, direto e por spin) de um arquivo de bandas (.bands do
+    SIESTA, bands.dat ou saída do pw.x), percorrendo-o em blocos de pontos k: só os extremos por
+    ponto k e por banda são guardados, nunca a matriz completa de energias. As reduções são vetorizadas.
+    'fermi' (eV) substitui o nível de Fermi do arquivo (veja iter_bands_blocks).
+    'progress' recebe a fração dos pontos k já lidos (veja CalculationCancelled).
+    O resultado fica no cache em disco (veja ResultCache).
+    Retorna um BandGapResult. Levanta OSError ou BandsFormatError.
+    """
+    params = {} if fermi is None else {"fermi": float(fermi)}
+    return _cached(file_path, "gap", params,
+                   lambda: band_gap_from_blocks(iter_bands_blocks(file_path, chunk_bytes, fermi), progress))
+
+def band_gap_from_blocks(blocks, progress=None):
+    """
+    Reduz os blocos (header, k_values, energies) de iter_bands_blocks a um BandGapResult.
+    Separada da leitura para que os blocos possam vir de outra fonte (ou já estar em memória).
+    Levanta BandsFormatError.
+    """
+    header = None
+    k_coords = []
+    vbm_k = [] # (m, nspin): maior energia <= E_F em cada ponto k
+    cbm_k = [] # (m, nspin): menor energia > E_F em cada ponto k
+    band_min = band_max = None
+
+    for header, k_values, energies in blocks:
+        if progress is not None:
+            progress(sum(len(k) for k in k_coords) / header.nk)
+        with profile_stage("gap/calculo", pontos_k=len(k_values)):
+            fermi = header.fermi
+            block_vbm, block_cbm, block_min, block_max = _backend.band_extrema(energies, fermi)
+            vbm_k.append(block_vbm)
+            cbm_k.append(block_cbm)
+            k_coords.append(k_values)
+            band_min = block_min if band_min is None else np.minimum(band_min, block_min)
+            band_max = block_max if band_max is None else np.maximum(band_max, block_max)
+
+    if header is None or band_min is None:
+        raise BandsFormatError("Não foi possível ler dados de energia válidos no arquivo.")
+
+    fermi = header.fermi
+    if not np.isfinite(band_min).all() or band_min.min() > fermi or band_max.max() <= fermi:
+        raise BandsFormatError("As energias não têm estados dos dois lados do nível de Fermi.")
+    k_coords = np.concatenate(k_coords)
+    vbm_k = np.concatenate(vbm_k) # (nk, nspin)
+    cbm_k = np.concatenate(cbm_k)
+
+    # Metálico se alguma banda tem energias dos dois lados do nível de Fermi
+    is_metallic = bool(np.any((band_min <= fermi) & (band_max > fermi)))
+
+    spin_vbm = vbm_k.max(axis=0)
+    spin_cbm = cbm_k.min(axis=0)
+    spin_gaps = spin_cbm - spin_vbm
+
+    # Posições (ponto k, spin) do VBM e do CBM globais
+    k_vbm, s_vbm = np.unravel_index(np.argmax(vbm_k), vbm_k.shape)
+    k_cbm, s_cbm = np.unravel_index(np.argmin(cbm_k), cbm_k.shape)
+    vbm = float(vbm_k[k_vbm, s_vbm])
+    cbm = float(cbm_k[k_cbm, s_cbm])
+
+    # Gap direto: menor diferença CBM - VBM no mesmo ponto k (e mesmo spin)
+    direct_gap = float((cbm_k - vbm_k).min())
+    gap = cbm - vbm
+
+    return BandGapResult(fermi=fermi, vbm=vbm, cbm=cbm, gap=gap, direct_gap=direct_gap,
+                         is_direct=bool(k_vbm == k_cbm),
+                         k_vbm=int(k_vbm), k_cbm=int(k_cbm),
+                         k_vbm_coord=float(k_coords[k_vbm]), k_cbm_coord=float(k_coords[k_cbm]),
+                         spin_gaps=spin_gaps, is_metallic=is_metallic or gap <= 0.0,
+                         nbands=header.nbands, nspin=header.nspin, nk=header.nk)
+
+def calculate_band_gap_python(file_path):
+    """
+    Calcula o gap de energia a partir de um arquivo .bands.
+    Traduzido do programa Fortran 'calcula_gap'; agora usa analyze_band_gap, que entende
+    o cabeçalho e os canais de spin do formato do SIESTA.
+    Retorna (gap_val, is_metallic) ou códigos de erro.
+    """
+    try:
+        result = analyze_band_gap(file_path)
+    except FileNotFoundError:
+        # Erro ao abrir o arquivo, similar ao -999.99 do Fortran
+        return ERROR_READ, False
+    except BandsFormatError as e:
+        return e.error_code, False
+    except Exception:
+        # Outros erros de leitura
+        return ERROR_READ, False
+
+    if result.is_metallic:
+        # No Fortran, ele imprime o Fermi para metálicos.
+        # Aqui, retornamos o Fermi como 'gap_val' e is_metallic=True.
+        return result.fermi, True
+    return result.gap, False
+
+# --- Estrutura de Bandas (dados do gráfico) ---
+
+# Fator entre os tamanhos dos intervalos de dois níveis seguidos da pirâmide de mínimos e máximos
+_ENVELOPE_FACTOR = 8
+
+def _group_extremes(values, positions, group, pick, fill):
+    """
+    Extremo de cada grupo de 'group' colunas de 'values' (R, n), escolhido por 'pick' (np.argmin
+    ou np.argmax), e a posição (índice de ponto k) de onde ele veio. 'positions' None significa
+    que a coluna é a própria posição. A última coluna incompleta é completada com 'fill'.
+    """
+    rows, n = values.shape
+    pad = -n % group
+    if pad:
+        values = np.concatenate((values, np.full((rows, pad), fill, dtype=values.dtype)), axis=1)
+        if positions is not None:
+            positions = np.concatenate((positions, np.zeros((rows, pad), dtype=positions.dtype)), axis=1)
+    values = values.reshape(rows, -1, group)
+    choice = pick(values, axis=2)
+    extremes = np.take_along_axis(values, choice[..., None], axis=2)[..., 0]
+    if positions is None:
+        return extremes, (choice + np.arange(0, n + pad, group)).astype(np.int32)
+    return extremes, np.take_along_axis(positions.reshape(rows, -1, group), choice[..., None], axis=2)[..., 0]
+
+class BandStructure:
+    """
+    Energias de todas as bandas de um arquivo, para o gráfico da estrutura de bandas (em eV):
+    - k: coordenadas dos nk pontos do caminho k;
+    - energies: array (nspin, nbands, nk) em float32 (precisão de sobra para o desenho);
+    - gap: o BandGapResult do mesmo arquivo (E_F, VBM, CBM e gap, calculados em float64);
+    - band_min, band_max: arrays (nspin, nbands) com a menor e a maior energia de cada banda.
+    Ao ser criada, monta uma pirâmide com o mínimo e o máximo de cada banda em intervalos de
+    8, 64, 512... pontos k (cerca de metade da memória das energias), de onde envelope tira as
+    curvas de qualquer zoom sem percorrer todos os pontos visíveis.
+    """
+    __slots__ = ("k", "energies", "gap", "band_min", "band_max", "_levels", "_k_sorted")
+
+    def __init__(self, k, energies, gap):
+        self.k = np.asarray(k, dtype=np.float64)
+        self.energies = np.ascontiguousarray(energies, dtype=np.float32)
+        self.gap = gap
+        rows = self.energies.reshape(-1, len(self.k))
+        self.band_min = rows.min(axis=1).reshape(self.energies.shape[:2])
+        self.band_max = rows.max(axis=1).reshape(self.energies.shape[:2])
+        self._k_sorted = bool(np.all(np.diff(self.k) >= 0.0))
+        # Níveis (tamanho do intervalo, mínimos, máximos, posição do mínimo, posição do máximo)
+        self._levels = []
+        low, high, low_at, high_at, size = rows, rows, None, None, 1
+        while low.shape[1] > _ENVELOPE_FACTOR:
+            low, low_at = _group_extremes(low, low_at, _ENVELOPE_FACTOR, np.argmin, np.inf)
+            high, high_at = _group_extremes(high, high_at, _ENVELOPE_FACTOR, np.argmax, -np.inf)
+            size *= _ENVELOPE_FACTOR
+            self._levels.append((size, low, high, low_at, high_at))
+
+    @property
+    def nk(self):
+        return len(self.k)
+
+    @property
+    def nbands(self):
+        return self.energies.shape[1]
+
+    @property
+    def nspin(self):
+        return self.energies.shape[0]
+
+    def envelope(self, k_min=None, k_max=None, width=1000, e_min=None, e_max=None):
+        """
+        Curvas para desenhar o trecho [k_min, k_max] do caminho em 'width' pixels, só das bandas que
+        passam pela janela de energia [e_min, e_max]. Quando há mais de dois pontos k por pixel, cada
+        curva é reduzida ao mínimo e ao máximo (na ordem em que aparecem) de intervalos de cerca de
+        um pixel, o que preserva picos, vales e cruzamentos; o intervalo vem do nível da pirâmide
+        mais próximo, então o custo depende de 'width' e do número de bandas, não de nk. Com poucos
+        pontos visíveis, as curvas são as originais. Cada curva vai um ponto além das bordas.
+        Retorna (spins, bands, x, y): índices (R,) do spin e da banda e arrays (R, m) das curvas.
+        """
+        nk = self.nk
+        i0, i1 = 0, nk
+        if self._k_sorted:
+            if k_min is not None:
+                i0 = max(int(np.searchsorted(self.k, k_min, side="right")) - 2, 0)
+            if k_max is not None:
+                i1 = min(int(np.searchsorted(self.k, k_max, side="left")) + 2, nk)
+        i1 = max(i1, min(i0 + 2, nk))
+        visible = np.ones(self.band_min.size, dtype=bool)
+        if e_min is not None:
+            visible &= self.band_max.ravel() >= e_min
+        if e_max is not None:
+            visible &= self.band_min.ravel() <= e_max
+        rows = np.flatnonzero(visible)
+        spins, bands = np.divmod(rows, self.nbands)
+        if not len(rows):
+            empty = np.zeros((0, 0))
+            return spins, bands, empty, empty
+
+        per_pixel = (i1 - i0) / max(int(width), 1)
+        levels = [level for level in self._levels if level[0] <= per_pixel]
+        if per_pixel <= 2.0 or not levels:
+            y = self.energies.reshape(-1, nk)[rows, i0:i1]
+            return spins, bands, np.broadcast_to(self.k[i0:i1], y.shape), y
+
+        size, low, high, low_at, high_at = levels[-1]
+        j0, j1 = i0 // size, -(-i1 // size)
+        group = max(int(per_pixel // size), 1)
+        low, low_at = _group_extremes(low[rows, j0:j1], low_at[rows, j0:j1], group, np.argmin, np.inf)
+        high, high_at = _group_extremes(high[rows, j0:j1], high_at[rows, j0:j1], group, np.argmax, -np.inf)
+        low_first = (low_at <= high_at)[..., None]
+        at = np.where(low_first, np.stack((low_at, high_at), axis=2), np.stack((high_at, low_at), axis=2))
+        y = np.where(low_first, np.stack((low, high), axis=2), np.stack((high, low), axis=2))
+        return spins, bands, self.k[at.reshape(len(rows), -1)], y.reshape(len(rows), -1)
+
+    def columns(self, readable=False):
+        columns = {"k": self.k}
+        for s in range(self.nspin):
+            for b in range(self.nbands):
+                name = f"banda_{b + 1}" if self.nspin == 1 else f"spin_{s + 1}_banda_{b + 1}"
+                columns[name] = self.energies[s, b]
+        return columns
+
+    def metadata(self):
+        return dict(self.gap.metadata(), spin_gaps=np.asarray(self.gap.spin_gaps).tolist())
+
+def calculate_band_structure(file_path, chunk_bytes=_BANDS_CHUNK_BYTES, progress=None, fermi=None):
+    """
+    Lê todas as energias de um arquivo de bandas (os mesmos de analyze_band_gap) para o gráfico
+    da estrutura de bandas, em uma única passada: o gap é calculado sobre os mesmos blocos.
+    'fermi' (eV) substitui o nível de Fermi do arquivo; 'progress' recebe a fração dos pontos k
+    já lidos (veja CalculationCancelled). O resultado, com a pirâmide do gráfico, fica no cache
+    em disco (veja ResultCache).
+    Retorna um BandStructure. Levanta OSError ou BandsFormatError.
+    """
+    params = {} if fermi is None else {"fermi": float(fermi)}
+    return _cached(file_path, "bandas", params,
+                   lambda: _read_band_structure(iter_bands_blocks(file_path, chunk_bytes, fermi), progress))
+
+def _read_band_structure(blocks, progress):
+    k_parts, energy_parts = [], []
+    def keep(blocks):
+        # Guarda cada bloco, já como (nspin, nbands, m) em float32, enquanto o gap é calculado
+        for header, k_values, energies in blocks:
+            k_parts.append(np.asarray(k_values, dtype=np.float64))
+            energy_parts.append(np.asarray(energies, dtype=np.float32).transpose(1, 2, 0))
+            yield header, k_values, energies
+    gap = band_gap_from_blocks(keep(blocks), progress)
+    with profile_stage("bandas/piramide", pontos_k=gap.nk):
+        return BandStructure(np.concatenate(k_parts), np.concatenate(energy_parts, axis=2), gap)
+
+# --- Saídas do SIESTA e do Quantum ESPRESSO ---
+
+# Símbolos químicos indexados pelo número atômico (0 = sem elemento)
+ELEMENT_SYMBOLS = tuple("""X H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn
+    Ga Ge As Se Br Kr Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd
+    Tb Dy Ho Er Tm Yb Lu Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf
+    Es Fm Md No Lr Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl Mc Lv Ts Og""".split())
+_ELEMENT_SET = frozenset(ELEMENT_SYMBOLS[1:])
+BOHR_TO_ANG = 1.0 / ANG_TO_BOHR
+
+# Formatos de detect_file_format que trazem geometrias e que trazem energias de bandas
+STRUCTURE_FORMATS = ("xyz", "siesta_struct", "siesta_out", "qe_out")
+BANDS_FORMATS = ("siesta_bands", "qe_bands", "qe_out")
+# Saídas de texto identificadas pelo conteúdo, e quanto do início delas é examinado
+_SNIFF_SUFFIXES = (".out", ".log", ".pwo", ".dat", ".txt")
+_SNIFF_BYTES = 1 << 16
+# Uma geometria a menos de 1e-4 Å da anterior é uma reimpressão (fim de relaxação), não um novo quadro
+_SAME_GEOMETRY_TOLERANCE = 1e-4
+
+def detect_file_format(file_path):
+    """
+    Identifica o formato de um arquivo de entrada: pelo nome para .xyz, .STRUCT_OUT (ou STRUCT_IN)
+    e .bands; pelo início do conteúdo para saídas de texto (.out, .log, .pwo, .dat, .txt): saída do
+    pw.x ('qe_out'), saída do SIESTA ('siesta_out') ou bands.dat do bands.x ('qe_bands').
+    Retorna um nome de STRUCTURE_FORMATS ou BANDS_FORMATS, ou None se o formato não for reconhecido.
+    """
+    name = os.path.basename(file_path).lower()
+    if name.endswith(".xyz"):
+        return "xyz"
+    if name.endswith((".struct_out", ".struct_in", ".struct_next_iter")):
+        return "siesta_struct"
+    if name.endswith(".bands"):
+        return "siesta_bands"
+    if not name.endswith(_SNIFF_SUFFIXES):
+        return None
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(_SNIFF_BYTES)
+    except OSError:
+        return None
+    if head.lstrip().lower().startswith(b"&plot"):
+        return "qe_bands"
+    if b"Program PWSCF" in head:
+        return "qe_out"
+    if b"Siesta Version" in head or b"siesta:" in head or b"SIESTA" in head:
+        return "siesta_out"
+    return None
+
+def _iter_output_lines(f, stage, progress=None, chunk_bytes=_BANDS_CHUNK_BYTES):
+    """
+    Percorre as linhas de uma saída de texto aberta lendo cerca de 'chunk_bytes' por vez (etapa
+    'stage'), então só um bloco fica em memória. 'progress' recebe a fração do arquivo já lida.
+    """
+    size = os.fstat(f.fileno()).st_size
+    while True:
+        with profile_stage(stage) as st:
+            start = f.buffer.tell()
+            lines = f.readlines(chunk_bytes)
+            st.add_bytes(f.buffer.tell() - start)
+        if not lines:
+            return
+        if progress is not None and size:
+            progress(f.buffer.tell() / size)
+        yield from lines
+
+def _symbol_from_label(label):
+    """Símbolo químico de um rótulo de espécie ('C', 'Fe1', 'O_surf', 'MO'), ou o próprio rótulo."""
+    match = re.match(r"[A-Za-z]{1,2}", label)
+    if match is not None:
+        letters = match.group()
+        for candidate in (letters, letters[:1]):
+            if candidate.capitalize() in _ELEMENT_SET:
+                return candidate.capitalize()
+    return label
+
+def _output_structure(symbols, coords, lattice, comment):
+    elements, species = _encode_species(symbols)
+    return XYZStructure(coords, species, elements, comment, lattice)
+
+def _same_geometry(a, b):
+    """Verdadeiro se duas estruturas têm os mesmos átomos e a mesma célula (a menos de 1e-4 Å)."""
+    if a is None or a.natoms != b.natoms or a.elements != b.elements or (a.lattice is None) != (b.lattice is None):
+        return False
+    if a.lattice is not None and not np.allclose(a.lattice, b.lattice, atol=_SAME_GEOMETRY_TOLERANCE):
+        return False
+    return bool(np.array_equal(a.species, b.species)
+                and np.allclose(a.coords, b.coords, atol=_SAME_GEOMETRY_TOLERANCE))
+
+def _read_vectors(lines, count, pattern=None):
+    """Lê 'count' linhas de 3 números (ou do trecho de cada linha capturado por 'pattern')."""
+    vectors = []
+    for _ in range(count):
+        line = next(lines, "")
+        if pattern is not None:
+            match = pattern.search(line)
+            line = match.group(1) if match else ""
+        values = _FLOAT_RE.findall(line)
+        if len(values) < 3:
+            raise XYZFormatError("Vetores de rede incompletos na saída.")
+        vectors.append([float(v) for v in values[:3]])
+    return np.array(vectors, dtype=np.float64)
+
+# Números em ponto fixo das saídas (aceita números colados, como '-1.2345-6.7890')
+_FLOAT_RE = re.compile(r"[-+]?\d*\.\d+(?:[EeDd][-+]?\d+)?|[-+]?\d+(?:[EeDd][-+]?\d+)?")
+
+def _split_glued(token):
+    """
+    Números de um token em que o formato fixo do Fortran colou os valores ('0.5000-105.1234'), ou
+    None se o token tiver outra coisa além de números (um rótulo do caminho k, por exemplo).
+    """
+    parts = _FLOAT_RE.findall(token)
+    if not parts or "".join(parts) != token:
+        return None
+    return [part.replace("D", "E").replace("d", "e") for part in parts]
+
+def read_siesta_struct(file_path):
+    """
+    Lê um arquivo .STRUCT_OUT (ou .STRUCT_IN) do SIESTA: três vetores de rede em Å, o número de
+    átomos e uma linha por átomo com espécie, número atômico e coordenadas fracionárias.
+    Retorna um XYZStructure periódico nas três direções. Levanta OSError ou XYZFormatError.
+    """
+    with profile_stage("siesta/leitura") as stage:
+        with open(file_path, 'r') as f:
+            text = f.read()
+        stage.add_bytes(len(text))
+    with profile_stage("siesta/conversao"):
+        tokens = text.split()
+        try:
+            lattice = np.array(tokens[:9], dtype=np.float64).reshape(3, 3)
+            natoms = int(tokens[9])
+        except (ValueError, IndexError):
+            raise XYZFormatError("Não foi possível ler os vetores de rede e o número de átomos do STRUCT_OUT.")
+        body = tokens[10:10 + 5 * natoms]
+        if natoms < 1 or len(body) != 5 * natoms:
+            raise XYZFormatError(
+                f"O número de átomos lidos ({len(body) // 5}) não corresponde ao declarado ({natoms}).",
+                natoms=natoms, n_read=len(body) // 5)
+        table = np.array(body, dtype=object).reshape(natoms, 5)
+        try:
+            numbers = np.abs(table[:, 1].astype(np.int64)) # Números negativos: átomos fantasmas (ghost)
+            fractional = table[:, 2:5].astype(np.float64)
+        except ValueError:
+            raise XYZFormatError("Número atômico ou coordenada inválida no STRUCT_OUT.", natoms=natoms)
+        if numbers.min() < 1 or numbers.max() >= len(ELEMENT_SYMBOLS):
+            raise XYZFormatError("Número atômico inválido no STRUCT_OUT.", natoms=natoms)
+        symbols = np.asarray(ELEMENT_SYMBOLS, dtype=object)[numbers]
+        return _output_structure(symbols, fractional @ lattice, lattice, "SIESTA STRUCT_OUT")
+
+_SIESTA_SPECIES_RE = re.compile(r"Species number:\s*(\d+)\s+(?:Atomic number:\s*(-?\d+)\s+Label:\s*(\S+)"
+                                r"|Label:\s*(\S+)\s+Atomic number:\s*(-?\d+))")
+_SIESTA_COORDS_RE = re.compile(r"^outcoor:.*coordinates\s*\(([^)]*)\)", re.IGNORECASE)
+_SIESTA_INITIAL_RE = re.compile(r"^siesta: Atomic coordinates \(Bohr\) and species")
+
+def _iter_siesta_output_frames(file_path, progress=None):
+    """
+    Gera as geometrias de uma saída do SIESTA (blocos 'outcoor:' de cada passo de relaxação ou de
+    MD), com a célula dos blocos 'outcell:'. Como o SIESTA imprime a célula de um passo depois das
+    coordenadas, cada quadro só é gerado quando o próximo começa (ou no fim do arquivo).
+    Sem blocos 'outcoor:', usa as coordenadas iniciais ('siesta: Atomic coordinates (Bohr)').
+    """
+    species = {} # índice da espécie -> símbolo químico
+    lattice = None
+    pending = None # (símbolos, valores, unidade) do último bloco de coordenadas
+    initial = None
+    previous = None
+    pushed = [] # Linha que encerrou um bloco de coordenadas, devolvida ao laço principal
+
+    def build(symbols, values, unit, comment):
+        unit = unit.lower()
+        if unit.startswith("ang"):
+            coords = values
+        elif unit.startswith("bohr"):
+            coords = values * BOHR_TO_ANG
+        elif unit.startswith("frac") and lattice is not None:
+            coords = values @ lattice
+        else:
+            raise XYZFormatError(f"Coordenadas em unidade não suportada na saída do SIESTA: '{unit}'.")
+        return _output_structure(symbols, coords, lattice, comment)
+
+    def read_block(lines, parse):
+        symbols, values = [], []
+        for line in lines:
+            atom = parse(line.split())
+            if atom is None:
+                pushed.append(line) # Sem linha em branco, a próxima seção ('outcell:') começa logo depois
+                break
+            symbols.append(atom[0])
+            values.append(atom[1])
+        return symbols, np.array(values, dtype=np.float64).reshape(-1, 3)
+
+    def parse_outcoor(parts):
+        # x y z espécie índice rótulo
+        try:
+            xyz = (float(parts[0]), float(parts[1]), float(parts[2]))
+            index = int(parts[3])
+        except (ValueError, IndexError):
+            return None
+        label = parts[5] if len(parts) > 5 else str(index)
+        return species.get(index) or _symbol_from_label(label), xyz
+
+    def parse_initial(parts):
+        # siesta: x y z espécie índice
+        if len(parts) < 6 or parts[0] != "siesta:":
+            return None
+        return parse_outcoor(parts[1:6])
+
+    def with_pushback(lines):
+        for line in lines:
+            yield line
+            while pushed:
+                yield pushed.pop()
+
+    with open(file_path, 'r', errors='replace') as f:
+        lines = with_pushback(_iter_output_lines(f, "siesta/leitura", progress))
+        for line in lines:
+            if line.startswith("outcoor:"):
+                match = _SIESTA_COORDS_RE.match(line)
+                if match is None:
+                    continue
+                if pending is not None:
+                    structure = build(*pending, "SIESTA")
+                    if not _same_geometry(previous, structure):
+                        yield structure
+                        previous = structure
+                with profile_stage("siesta/conversao"):
+                    pending = read_block(lines, parse_outcoor) + (match.group(1),)
+            elif line.startswith("outcell: Unit cell vectors"):
+                lattice = _read_vectors(lines, 3)
+            elif "Species number:" in line:
+                match = _SIESTA_SPECIES_RE.search(line)
+                if match is not None:
+                    number = match.group(2) or match.group(5)
+                    label = match.group(3) or match.group(4)
+                    z = abs(int(number))
+                    species[int(match.group(1))] = ELEMENT_SYMBOLS[z] if 0 < z < len(ELEMENT_SYMBOLS) \
+                        else _symbol_from_label(label)
+            elif initial is None and _SIESTA_INITIAL_RE.match(line):
+                initial = read_block(lines, parse_initial) + ("Bohr",)
+
+    if pending is None:
+        pending = initial
+    if pending is None or len(pending[0]) == 0:
+        if previous is None:
+            raise XYZFormatError("Nenhuma geometria encontrada na saída do SIESTA.")
+        return
+    structure = build(*pending, "SIESTA")
+    if not _same_geometry(previous, structure):
+        yield structure
+
+_QE_ALAT_RE = re.compile(r"lattice parameter \(alat\)\s*=\s*([-+.\dEe]+)")
+_QE_NAT_RE = re.compile(r"number of atoms/cell\s*=\s*(\d+)")
+_QE_CARD_RE = re.compile(r"^\s*(CELL_PARAMETERS|ATOMIC_POSITIONS)\s*[({]?\s*([^)}]*)")
+_QE_AXIS_RE = re.compile(r"a\(\d\)\s*=\s*\(([^)]*)\)")
+_QE_TAU_RE = re.compile(r"^\s*\d+\s+(\S+)\s+tau\(\s*\d+\)\s*=\s*\(([^)]*)\)")
+
+def _iter_pw_output_frames(file_path, progress=None):
+    """
+    Gera as geometrias de uma saída do pw.x: a inicial ('positions (alat units)', com os eixos
+    'crystal axes') e a de cada passo de relaxação ou de MD (cartões ATOMIC_POSITIONS e, em
+    vc-relax, CELL_PARAMETERS), em qualquer unidade (angstrom, bohr, alat ou crystal).
+    Uma geometria reimpressa (bloco 'Begin final coordinates') não conta como novo quadro.
+    """
+    alat = None # Bohr
+    nat = None
+    lattice = None
+    previous = None
+
+    def to_angstrom(values, unit):
+        unit = unit.strip().lower()
+        if unit.startswith("angstrom"):
+            return values
+        if unit.startswith("bohr"):
+            return values * BOHR_TO_ANG
+        if unit.startswith("alat"):
+            scale = alat
+            if "=" in unit:
+                scale = float(unit.split("=", 1)[1])
+            if scale is None:
+                raise XYZFormatError("A saída do pw.x não informa o parâmetro de rede (alat).")
+            return values * (scale * BOHR_TO_ANG)
+        if unit.startswith("crystal") and not unit.startswith("crystal_sg") and lattice is not None:
+            return values @ lattice
+        raise XYZFormatError(f"Unidade não suportada na saída do pw.x: '{unit}'.")
+
+    def emit(symbols, values, unit):
+        structure = _output_structure(symbols, to_angstrom(values, unit), lattice, "Quantum ESPRESSO pw.x")
+        return None if _same_geometry(previous, structure) else structure
+
+    with open(file_path, 'r', errors='replace') as f:
+        lines = _iter_output_lines(f, "qe/leitura", progress)
+        for line in lines:
+            structure = None
+            if "lattice parameter (alat)" in line:
+                match = _QE_ALAT_RE.search(line)
+                if match is not None:
+                    alat = float(match.group(1))
+            elif "number of atoms/cell" in line:
+                match = _QE_NAT_RE.search(line)
+                if match is not None:
+                    nat = int(match.group(1))
+            elif "crystal axes:" in line:
+                lattice = to_angstrom(_read_vectors(lines, 3, _QE_AXIS_RE), "alat")
+            elif "positions (alat units)" in line:
+                symbols, values = [], []
+                for atom_line in itertools.islice(lines, nat):
+                    match = _QE_TAU_RE.match(atom_line)
+                    if match is None:
+                        break
+                    symbols.append(_symbol_from_label(match.group(1)))
+                    values.append([float(v) for v in _FLOAT_RE.findall(match.group(2))[:3]])
+                if symbols:
+                    structure = emit(symbols, np.array(values, dtype=np.float64).reshape(-1, 3), "alat")
+            else:
+                match = _QE_CARD_RE.match(line)
+                if match is None:
+                    continue
+                card, unit = match.groups()
+                if card == "CELL_PARAMETERS":
+                    lattice = to_angstrom(_read_vectors(lines, 3), unit or "alat")
+                    continue
+                symbols, values = [], []
+                with profile_stage("qe/conversao"):
+                    for atom_line in itertools.islice(lines, nat):
+                        parts = atom_line.split()
+                        try:
+                            xyz = [float(v) for v in parts[1:4]]
+                        except ValueError:
+                            break
+                        if len(xyz) < 3:
+                            break
+                        symbols.append(_symbol_from_label(parts[0]))
+                        values.append(xyz)
+                    structure = emit(symbols, np.array(values, dtype=np.float64).reshape(-1, 3), unit or "alat")
+            if structure is not None:
+                yield structure
+                previous = structure
+
+    if previous is None:
+        raise XYZFormatError("Nenhuma geometria encontrada na saída do pw.x.")
+
+def iter_structure_frames(file_path, progress=None):
+    """
+    Gerador sobre as geometrias de qualquer arquivo de estrutura, uma por vez e numa única
+    passagem: quadros de um .xyz (iter_xyz_frames), a estrutura de um STRUCT_OUT ou os passos
+    de uma saída do SIESTA ou do pw.x. 'progress' recebe a fração do arquivo já lida.
+    Levanta OSError ou XYZFormatError.
+    """
+    file_format = detect_file_format(file_path)
+    if file_format in (None, "xyz"):
+        return iter_xyz_frames(file_path, progress)
+    if file_format == "siesta_struct":
+        return iter((read_siesta_struct(file_path),))
+    if file_format == "siesta_out":
+        return _iter_siesta_output_frames(file_path, progress)
+    if file_format == "qe_out":
+        return _iter_pw_output_frames(file_path, progress)
+    raise XYZFormatError(f"O arquivo '{os.path.basename(file_path)}' não contém geometrias ({file_format}).")
+
+class OutputFrameIndex:
+    """
+    Acesso às geometrias de um STRUCT_OUT ou de uma saída do SIESTA ou do pw.x com a mesma interface
+    de XYZFrameIndex. Como cada geometria depende do que veio antes no arquivo (célula, unidades,
+    espécies), não há deslocamentos para um seek: cada acesso percorre o arquivo de novo, com memória
+    limitada a poucos quadros, e o número de quadros é contado na primeira vez que é pedido.
+    """
+    __slots__ = ("file_path", "_n_frames")
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._n_frames = None
+
+    @property
+    def n_frames(self):
+        if self._n_frames is None:
+            self._n_frames = sum(1 for _ in iter_structure_frames(self.file_path))
+        return self._n_frames
+
+    def frame_numbers(self, frames):
+        """Converte um índice inteiro (aceita negativos) ou um slice em uma lista de quadros."""
+        return _frame_numbers(frames, self.n_frames)
+
+    def read_frame(self, frame):
+        """
+        Lê um único quadro (índice a partir de 0; negativos contam do final) numa única passagem:
+        para um índice negativo, só os últimos quadros ficam guardados.
+        """
+        frame = int(frame)
+        last = collections.deque(maxlen=max(-frame, 1))
+        n_frames = 0
+        for structure in iter_structure_frames(self.file_path):
+            if n_frames == frame:
+                return structure
+            last.append(structure)
+            n_frames += 1
+        if frame >= 0 or len(last) < -frame:
+            raise IndexError(f"O arquivo tem {n_frames} quadro(s); o quadro {frame + 1} não existe.")
+        return last[0]
+
+    def iter_frames(self, frames=slice(None)):
+        """Gerador sobre um quadro, um intervalo ou um passo de quadros (slice), em ordem crescente."""
+        if frames == slice(None):
+            yield from iter_structure_frames(self.file_path)
+            return
+        selected = sorted(self.frame_numbers(frames))
+        if not selected:
+            return
+        wanted = set(selected)
+        for k, structure in enumerate(iter_structure_frames(self.file_path)):
+            if k in wanted:
+                yield structure
+            if k >= selected[-1]:
+                return
+
+def load_frame_index(file_path, write_sidecar=True):
+    """
+    Índice de quadros de qualquer arquivo de estrutura: XYZFrameIndex para um .xyz (veja
+    load_xyz_frame_index) ou OutputFrameIndex para o STRUCT_OUT e as saídas do SIESTA e do pw.x.
+    """
+    if detect_file_format(file_path) in (None, "xyz"):
+        return load_xyz_frame_index(file_path, write_sidecar)
+    return OutputFrameIndex(file_path)
+
+_SIESTA_FERMI_RE = re.compile(r"\bFermi\s*(?:energy|level)?\s*=\s*([-+]?\d+\.\d+)", re.IGNORECASE)
+_QE_FERMI_RE = re.compile(r"the Fermi energy is\s+([-+]?\d+\.\d+)")
+_QE_FERMI_SPIN_RE = re.compile(r"the spin up/dw Fermi energies are\s+([-+]?\d+\.\d+)\s+([-+]?\d+\.\d+)")
+_QE_HOMO_RE = re.compile(r"highest occupied(?:, lowest unoccupied)? level \(ev\):\s+([-+]?\d+\.\d+)")
+
+def _pw_fermi(line):
+    """
+    Nível de Fermi (eV) de uma linha da saída do pw.x, ou None. Com ocupações fixas, usa o topo
+    da banda de valência; com dois níveis de Fermi (magnetização fixa), o maior.
+    """
+    if "Fermi" in line:
+        match = _QE_FERMI_RE.search(line)
+        if match is not None:
+            return float(match.group(1))
+        match = _QE_FERMI_SPIN_RE.search(line)
+        if match is not None:
+            return max(float(match.group(1)), float(match.group(2)))
+    elif "highest occupied" in line:
+        match = _QE_HOMO_RE.search(line)
+        if match is not None:
+            return float(match.group(1))
+    return None
+
+def read_fermi_level(file_path):
+    """
+    Lê o nível de Fermi (eV) de um .bands do SIESTA, de uma saída do SIESTA ou de uma saída do
+    pw.x (o último impresso), numa única passagem. Útil para o bands.dat do bands.x, que não o
+    traz. Levanta OSError ou BandsFormatError.
+    """
+    file_format = detect_file_format(file_path)
+    fermi = None
+    if file_format == "siesta_bands":
+        with open(file_path, 'r') as f:
+            fermi = _read_bands_header(f).fermi
+    elif file_format in ("siesta_out", "qe_out"):
+        stage = "siesta/leitura" if file_format == "siesta_out" else "qe/leitura"
+        with open(file_path, 'r', errors='replace') as f:
+            for line in _iter_output_lines(f, stage):
+                if file_format == "qe_out":
+                    value = _pw_fermi(line)
+                elif "Fermi" in line:
+                    match = _SIESTA_FERMI_RE.search(line)
+                    value = None if match is None else float(match.group(1))
+                else:
+                    continue
+                if value is not None:
+                    fermi = value
+    if fermi is None:
+        raise BandsFormatError(f"Nível de Fermi não encontrado em '{os.path.basename(file_path)}'.",
+                               error_code=ERROR_NATOMS)
+    return fermi
+
+_QE_KPOINT_RE = re.compile(r"^\s*k\s*=\s*(.*?)\s*\(\s*\d+\s*PWs\)\s*bands\s*\(ev\)")
+_QE_NUMBERS_RE = re.compile(r"\s*(?:[-+]?\d+\.\d+\s*)*")
+
+def _iter_pw_output_bands(file_path):
+    """
+    Blocos de iter_bands_blocks para uma saída do pw.x: a última listagem de autovalores ('k = ...
+    bands (ev):', nos canais SPIN UP e SPIN DOWN quando houver) e o nível de Fermi impresso depois
+    dela. Só a listagem atual fica em memória; cada passo de uma relaxação substitui a anterior.
+    A coordenada no caminho k é a distância acumulada entre os pontos k (em 2π/alat).
+    """
+    listing = None # [pontos k por canal de spin, energias por canal de spin]
+    fermi = None
+    spin = 0
+    collecting = None
+
+    with open(file_path, 'r', errors='replace') as f:
+        for line in _iter_output_lines(f, "qe/leitura"):
+            if collecting is not None:
+                if _QE_NUMBERS_RE.fullmatch(line):
+                    collecting.extend(_FLOAT_RE.findall(line))
+                    continue
+                listing[1][spin][-1] = np.array(collecting, dtype=np.float64)
+                collecting = None
+            if "End of self-consistent calculation" in line or "End of band structure calculation" in line:
+                listing, fermi, spin = ([[], []], [[], []]), None, 0
+            elif listing is None:
+                continue
+            elif "SPIN UP" in line:
+                spin = 0
+            elif "SPIN DOWN" in line:
+                spin = 1
+            elif "bands (ev)" in line:
+                match = _QE_KPOINT_RE.match(line)
+                if match is not None:
+                    listing[0][spin].append([float(v) for v in _FLOAT_RE.findall(match.group(1))[:3]])
+                    listing[1][spin].append(None)
+                    collecting = []
+            else:
+                value = _pw_fermi(line)
+                if value is not None:
+                    fermi = value
+        if collecting is not None:
+            listing[1][spin][-1] = np.array(collecting, dtype=np.float64)
+
+    if listing is None or not listing[1][0]:
+        raise BandsFormatError("Nenhuma listagem de autovalores ('bands (ev)') na saída do pw.x.")
+    with profile_stage("qe/conversao"):
+        channels = [energies for energies in listing[1] if energies]
+        try:
+            energies = np.stack([np.stack(channel) for channel in channels], axis=1) # (nk, nspin, nbands)
+        except ValueError:
+            raise BandsFormatError("Número de bandas ou de pontos k diferente entre os pontos k ou os spins.")
+        k_points = np.array(listing[0][0], dtype=np.float64).reshape(-1, 3)
+        k_path = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(k_points, axis=0), axis=1))))
+    nk, nspin, nbands = energies.shape
+    yield BandsHeader(fermi, nbands, nspin, nk), k_path, energies
+
+_QE_PLOT_RE = re.compile(r"nbnd\s*=\s*(\d+)\s*,\s*nks\s*=\s*(\d+)", re.IGNORECASE)
+
+def _iter_qe_bands_dat_blocks(file_path, chunk_bytes):
+    """
+    Blocos de iter_bands_blocks para o bands.dat do bands.x: cabeçalho '&plot nbnd=..., nks=... /'
+    seguido, para cada ponto k, das 3 coordenadas cartesianas (2π/alat) e das nbnd energias.
+    O arquivo não traz o nível de Fermi (header.fermi é None). A coordenada no caminho k é a
+    distância acumulada entre os pontos k.
+    """
+    with open(file_path, 'r') as f:
+        match = _QE_PLOT_RE.search(f.readline())
+        if match is None:
+            raise BandsFormatError("Cabeçalho '&plot nbnd=..., nks=...' inválido no bands.dat.")
+        nbands, nk = int(match.group(1)), int(match.group(2))
+        header = BandsHeader(None, nbands, 1, nk)
+        last_k, last_path = None, 0.0
+        for block in _iter_number_records(f, 3 + nbands, nk, chunk_bytes):
+            k_points = block[:, :3]
+            start = k_points[:1] if last_k is None else last_k
+            steps = np.linalg.norm(np.diff(np.concatenate((start, k_points)), axis=0), axis=1)
+            k_path = last_path + np.cumsum(steps)
+            last_k, last_path = k_points[-1:].copy(), float(k_path[-1])
+            yield header, k_path, block[:, 3:].reshape(len(block), 1, nbands)
+
+# --- Exportação de Resultados ---
+
+EXPORT_FORMATS = (".npz", ".npy", ".csv", ".json")
+_EXPORT_CHUNK_ROWS = 100000 # Linhas convertidas em texto de cada vez (CSV)
+
+def _json_value(value):
+    """Converte escalares e arrays NumPy em tipos aceitos pelo json."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def export_result(result, path, progress=None):
+    """
+    Grava um resultado (PairDistances, LayerDistanceSeries, LayerDistanceResult ou BandGapResult)
+    em colunas, no formato indicado pela extensão de 'path':
+    - .npz: as colunas e os metadados como arrays (inclusive os arrays por átomo);
+    - .npy: um único array estruturado com as colunas (sem metadados);
+    - .csv: os metadados escalares como comentários ('# chave: valor') e as colunas, em blocos;
+    - .json: {"tipo", "metadados", "colunas"}.
+    As colunas vêm de result.columns() e os metadados de result.metadata().
+    'progress' recebe a fração das linhas do CSV já gravadas (veja CalculationCancelled).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportação desconhecido: '{ext}' (use {', '.join(EXPORT_FORMATS)}).")
+    with profile_stage("exportacao/gravacao", formato=ext):
+        _export_result(result, path, ext, progress)
+
+def _export_result(result, path, ext, progress):
+    kind = type(result).__name__
+
+    if ext == ".npz":
+        meta = {k: np.asarray(v) for k, v in result.metadata().items() if v is not None}
+        np.savez(path, tipo=np.asarray(kind), **meta, **result.columns())
+    elif ext == ".npy":
+        cols = result.columns()
+        table = np.empty(len(next(iter(cols.values()))), dtype=[(k, v.dtype) for k, v in cols.items()])
+        for name, values in cols.items():
+            table[name] = values
+        np.save(path, table)
+    elif ext == ".csv":
+        cols = result.columns(readable=True)
+        n_rows = len(next(iter(cols.values())))
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            f.write(f"# tipo: {kind}\n")
+            for key, value in result.metadata().items():
+                if not isinstance(value, (np.ndarray, list)):
+                    f.write(f"# {key}: {_json_value(value)}\n")
+            writer = csv.writer(f)
+            writer.writerow(cols.keys())
+            for start in range(0, n_rows, _EXPORT_CHUNK_ROWS):
+                if progress is not None:
+                    progress(start / n_rows)
+                # astype(str) usa a menor representação exata de cada número (também para float32)
+                chunk = [values[start:start + _EXPORT_CHUNK_ROWS].astype(str) for values in cols.values()]
+                writer.writerows(zip(*chunk))
+    else:
+        document = {"tipo": kind,
+                    "metadados": {k: _json_value(v) for k, v in result.metadata().items()},
+                    "colunas": {k: _json_value(v) for k, v in result.columns(readable=True).items()}}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(document, f, ensure_ascii=False)
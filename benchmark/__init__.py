@@ -0,0 +1,7 @@
+"""
+Benchmark dos cálculos do layer.py (python -m benchmark). Gera arquivos sintéticos de
+tamanhos conhecidos, mede leitura, cálculo, formatação e renderização do relatório, e
+compara os tempos com uma referência gravada antes.
+"""
+from benchmark.medicao import run_suite, compare, save_results, load_results
+from benchmark.sinteticos import write_bilayer_xyz, write_bands
@@ -0,0 +1,5 @@
+import sys
+
+from benchmark.medicao import main
+
+sys.exit(main())
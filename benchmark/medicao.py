@@ -0,0 +1,374 @@
+"""
+Medição de desempenho dos três cálculos (camadas, pares de átomos e gap) sobre arquivos
+sintéticos, separada em etapas:
+- leitura: interpretação do arquivo (read_xyz, iter_bands_blocks);
+- calculo: o cálculo sobre os dados já lidos;
+- formatacao: geração do texto exibido (relatorio.format_result);
+- renderizacao: geração do relatório PDF só com esse resultado.
+Mede também o tempo de partida: a importação de cada módulo em um processo novo, a escolha dos
+núcleos de cálculo (analisador.set_backend), o carregamento dos núcleos compilados e, se houver
+tela, a abertura da janela da interface.
+Os núcleos usados nas medições ficam registrados no ambiente dos resultados.
+Os resultados são gravados em JSON e podem ser comparados com uma referência gravada antes.
+Tudo roda sem rede e sem tela; os caches em disco e de sessão não são usados nas medições.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import analisador
+from analisador import (
+    read_xyz, iter_xyz_frames, iter_bands_blocks, band_gap_from_blocks,
+    calculate_layers, calculate_pair_distances, calculate_layer_distance_trajectory_python,
+)
+from relatorio import format_result, build_report
+from benchmark.sinteticos import write_bilayer_xyz, write_bands
+
+RESULTS_VERSION = 1
+STAGES = ("leitura", "calculo", "formatacao", "renderizacao")
+# Etapas das medições de partida (veja bench_startup)
+STARTUP_STAGES = ("importacao", "carga", "abertura")
+# Acima deste número de átomos, o cálculo de todos os pares (memória N²) não é medido
+ALL_PAIRS_MAX_ATOMS = 3000
+# Diferenças absolutas menores do que isto (s) nunca contam como regressão (ruído de medição)
+MIN_REGRESSION_SECONDS = 0.002
+# Módulos cuja importação (em um processo novo) é medida, e os que o núcleo não deve importar
+STARTUP_MODULES = ("analisador", "lote", "relatorio", "layer")
+GUI_MODULES = ("tkinter", "PIL", "fpdf", "matplotlib")
+_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def time_call(function, repeats):
+    """Executa function() 'repeats' vezes e retorna (menor tempo em s, último resultado)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def _prime_session_cache(file_path):
+    """Lê a estrutura para o cache de sessão, para que 'calculo' não inclua a leitura."""
+    analisador._xyz_session_cache.clear()
+    analisador.load_xyz(file_path)
+
+def _measure_rendering(result, key, workdir, repeats):
+    path = os.path.join(workdir, "relatorio.pdf")
+    seconds, _ = time_call(lambda: build_report(path, {key: result}), repeats)
+    return seconds
+
+def bench_structure(file_path, case, repeats, workdir):
+    """Mede camadas e pares de átomos em um .xyz de um quadro. Retorna a lista de medições."""
+    records = []
+    natoms = read_xyz(file_path).natoms
+
+    def add(calculation, stage, seconds):
+        records.append({"calculo": calculation, "caso": case, "etapa": stage, "tempo_s": seconds})
+
+    read_seconds, _ = time_call(lambda: read_xyz(file_path), repeats)
+
+    _prime_session_cache(file_path)
+    seconds, layers = time_call(lambda: calculate_layers(file_path), repeats)
+    add("camadas", "leitura", read_seconds)
+    add("camadas", "calculo", seconds)
+    add("camadas", "formatacao", time_call(lambda: format_result(layers), repeats)[0])
+    add("camadas", "renderizacao", _measure_rendering(layers, "distancia_layers", workdir, repeats))
+
+    variants = [("ligacoes", True)]
+    if natoms <= ALL_PAIRS_MAX_ATOMS:
+        variants.append(("todos_pares", False))
+    for name, bonds_only in variants:
+        seconds, pairs = time_call(lambda: calculate_pair_distances(file_path, bonds_only=bonds_only), repeats)
+        add(name, "leitura", read_seconds)
+        add(name, "calculo", seconds)
+        add(name, "formatacao", time_call(lambda: format_result(pairs), repeats)[0])
+        add(name, "renderizacao", _measure_rendering(pairs, "calcula_distancias", workdir, repeats))
+        del pairs
+    analisador._xyz_session_cache.clear()
+    return records
+
+def bench_trajectory(file_path, case, repeats):
+    """Mede a leitura quadro a quadro e a série de distâncias entre camadas de uma trajetória."""
+    read_seconds, _ = time_call(lambda: sum(1 for _ in iter_xyz_frames(file_path)), repeats)
+    total_seconds, series = time_call(lambda: calculate_layer_distance_trajectory_python(file_path), repeats)
+    format_seconds, _ = time_call(lambda: format_result(series), repeats)
+    # O cálculo da trajetória lê os quadros enquanto calcula: a etapa 'calculo' é a diferença
+    return [{"calculo": "trajetoria", "caso": case, "etapa": "leitura", "tempo_s": read_seconds},
+            {"calculo": "trajetoria", "caso": case, "etapa": "calculo",
+             "tempo_s": max(total_seconds - read_seconds, 0.0)},
+            {"calculo": "trajetoria", "caso": case, "etapa": "formatacao", "tempo_s": format_seconds}]
+
+def bench_bands(file_path, case, repeats, workdir):
+    """Mede o gap de um .bands: leitura dos blocos, redução, texto e relatório."""
+    read_seconds, blocks = time_call(lambda: list(iter_bands_blocks(file_path)), repeats)
+    seconds, result = time_call(lambda: band_gap_from_blocks(blocks), repeats)
+    del blocks
+    return [{"calculo": "gap", "caso": case, "etapa": "leitura", "tempo_s": read_seconds},
+            {"calculo": "gap", "caso": case, "etapa": "calculo", "tempo_s": seconds},
+            {"calculo": "gap", "caso": case, "etapa": "formatacao",
+             "tempo_s": time_call(lambda: format_result(result), repeats)[0]},
+            {"calculo": "gap", "caso": case, "etapa": "renderizacao",
+             "tempo_s": _measure_rendering(result, "calcula_gap", workdir, repeats)}]
+
+def _python_seconds(code, repeats):
+    """Menor tempo (s) para executar 'code' em um interpretador novo, na pasta do projeto."""
+    command = [sys.executable, "-c", code]
+    return time_call(lambda: subprocess.run(command, cwd=_PROJECT_DIR, check=True,
+                                            stdout=subprocess.PIPE), repeats)
+
+def has_display():
+    return sys.platform in ("win32", "darwin") or bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+def bench_startup(repeats, backend="numpy"):
+    """
+    Mede a partida a frio: a importação de cada módulo de STARTUP_MODULES, a escolha dos
+    núcleos 'backend' depois de importar o analisador ('nucleos'; com o veredito da verificação
+    já guardado, o Numba fica para o primeiro cálculo grande), o carregamento dos núcleos
+    compilados do cache em disco ('nucleos_jit', só para backends além do NumPy) e, se houver
+    tela, a abertura da janela ('janela'), descontado o tempo de um interpretador vazio. Nas
+    medições dos módulos do núcleo, 'modulos_interface' lista os módulos de GUI_MODULES que eles
+    importaram.
+    """
+    baseline, _ = _python_seconds("pass", repeats)
+    records = []
+    for module in STARTUP_MODULES:
+        code = (f"import sys, {module}\n"
+                f"print(','.join(m for m in {GUI_MODULES!r} if m in sys.modules))")
+        seconds, completed = _python_seconds(code, repeats)
+        record = {"calculo": "partida", "caso": module, "etapa": "importacao",
+                  "tempo_s": max(seconds - baseline, 0.0)}
+        if module in ("analisador", "lote"):
+            record["modulos_interface"] = [m for m in completed.stdout.decode().strip().split(",") if m]
+        records.append(record)
+    imported, _ = _python_seconds("import analisador", repeats)
+    seconds, _ = _python_seconds(f"import analisador\nanalisador.set_backend({backend!r})", repeats)
+    records.append({"calculo": "partida", "caso": "nucleos", "etapa": "carga",
+                    "tempo_s": max(seconds - imported, 0.0)})
+    if backend != "numpy":
+        seconds, _ = _python_seconds(f"import analisador\nanalisador.set_backend({backend!r})\n"
+                                     "backend = analisador.get_backend()\n"
+                                     "if isinstance(backend, analisador.DeferredBackend):\n    backend.load()", repeats)
+        records.append({"calculo": "partida", "caso": "nucleos_jit", "etapa": "carga",
+                        "tempo_s": max(seconds - imported, 0.0)})
+    if has_display():
+        seconds, _ = _python_seconds("import layer\napp = layer.NanophysicsApp()\napp.update()\napp.destroy()",
+                                     repeats)
+        records.append({"calculo": "partida", "caso": "janela", "etapa": "abertura",
+                        "tempo_s": max(seconds - baseline, 0.0)})
+    return records
+
+def run_suite(sizes=(10, 1000, 100000), periodic=False, frames=1, bands=((100, 20, 1),),
+              repeats=3, progress=None, startup=True, backend=None):
+    """
+    Gera os arquivos sintéticos em uma pasta temporária e mede todas as etapas.
+    - sizes: números de átomos das bicamadas; periodic: grava a célula (extended-XYZ);
+    - frames: com frames > 1, mede também uma trajetória com esse número de quadros por tamanho;
+    - bands: tuplas (nk, nbands, nspin) dos .bands sintéticos;
+    - repeats: repetições de cada medição (vale a menor);
+    - startup: mede também a partida (veja bench_startup);
+    - backend: núcleos de cálculo das medições (veja analisador.set_backend; None = os atuais).
+    'progress', se fornecido, recebe o nome de cada caso antes de medi-lo.
+    Retorna o documento de resultados (dicionário pronto para JSON).
+    """
+    if backend is not None:
+        analisador.set_backend(backend)
+    if isinstance(analisador.get_backend(), analisador.DeferredBackend):
+        analisador.get_backend().load() # Mede os núcleos compilados em todos os tamanhos
+    backend = analisador.get_backend().name
+    cache = analisador.get_result_cache()
+    analisador.configure_result_cache(enabled=False)
+    records = []
+    if startup:
+        if progress is not None:
+            progress("partida")
+        records.extend(bench_startup(repeats, backend))
+    try:
+        with tempfile.TemporaryDirectory(prefix="layers_bench_") as workdir:
+            for natoms in sizes:
+                case = f"xyz_{natoms}" + ("_pbc" if periodic else "")
+                if progress is not None:
+                    progress(case)
+                path = write_bilayer_xyz(os.path.join(workdir, f"{case}.xyz"), natoms, periodic)
+                records.extend(bench_structure(path, case, repeats, workdir))
+                os.remove(path)
+                if frames > 1:
+                    case = f"traj_{natoms}x{frames}" + ("_pbc" if periodic else "")
+                    if progress is not None:
+                        progress(case)
+                    path = write_bilayer_xyz(os.path.join(workdir, f"{case}.xyz"), natoms, periodic, frames)
+                    records.extend(bench_trajectory(path, case, repeats))
+                    os.remove(path)
+            for nk, nbands, nspin in bands:
+                case = f"bands_{nk}k_{nbands}b_{nspin}s"
+                if progress is not None:
+                    progress(case)
+                path = write_bands(os.path.join(workdir, f"{case}.bands"), nk, nbands, nspin)
+                records.extend(bench_bands(path, case, repeats, workdir))
+                os.remove(path)
+    finally:
+        analisador._result_cache = cache
+
+    return {"versao": RESULTS_VERSION,
+            "ambiente": {"python": platform.python_version(), "numpy": np.__version__,
+                         "plataforma": platform.platform(), "processador": platform.processor(),
+                         "nucleo": backend},
+            "repeticoes": repeats,
+            "medicoes": records}
+
+def compare(results, baseline, threshold=0.25, stage_thresholds=None, min_seconds=MIN_REGRESSION_SECONDS):
+    """
+    Compara as medições com as de uma referência. Uma medição regrediu se ficou mais de
+    'threshold' (fração; 0.25 = 25%) mais lenta e a diferença passa de 'min_seconds'.
+    'stage_thresholds' ({etapa: fração}) substitui o limite de etapas específicas.
+    Retorna a lista de (calculo, caso, etapa, tempo_referencia, tempo_atual, razao), só das regressões.
+    """
+    stage_thresholds = stage_thresholds or {}
+    reference = {(m["calculo"], m["caso"], m["etapa"]): m["tempo_s"] for m in baseline["medicoes"]}
+    regressions = []
+    for m in results["medicoes"]:
+        key = (m["calculo"], m["caso"], m["etapa"])
+        old = reference.get(key)
+        if old is None:
+            continue # Caso novo, sem referência
+        new = m["tempo_s"]
+        limit = stage_thresholds.get(m["etapa"], threshold)
+        if new > old * (1.0 + limit) and new - old > min_seconds:
+            regressions.append(key + (old, new, new / old if old > 0 else float("inf")))
+    return regressions
+
+def check_startup_load(results, limit):
+    """
+    Compara o tempo de escolha dos núcleos na partida ('nucleos', etapa 'carga') com 'limit' (s),
+    sem precisar de referência. Retorna o tempo medido se passar do limite, senão None.
+    """
+    for m in results["medicoes"]:
+        if (m["calculo"], m["caso"], m["etapa"]) == ("partida", "nucleos", "carga") and m["tempo_s"] > limit:
+            return m["tempo_s"]
+    return None
+
+def print_table(results, stream=sys.stdout):
+    """Mostra as medições em uma tabela de texto (uma linha por cálculo e caso)."""
+    rows = {}
+    columns = list(STAGES)
+    for m in results["medicoes"]:
+        rows.setdefault((m["calculo"], m["caso"]), {})[m["etapa"]] = m["tempo_s"]
+        if m["etapa"] not in columns:
+            columns.append(m["etapa"])
+    print(f"{'cálculo':12s} {'caso':28s}" + "".join(f"{stage:>14s}" for stage in columns), file=stream)
+    for (calculation, case), stages in rows.items():
+        cells = "".join(f"{stages[s] * 1000:12.2f}ms" if s in stages else f"{'-':>14s}" for s in columns)
+        print(f"{calculation:12s} {case:28s}{cells}", file=stream)
+
+def save_results(results, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _parse_stage_thresholds(text):
+    """Converte 'leitura=0.5,carga=1' em {etapa: fração}."""
+    thresholds = {}
+    stages = STAGES + STARTUP_STAGES
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        stage, _, value = item.partition("=")
+        if stage not in stages or not value:
+            raise ValueError(f"limite de etapa inválido: '{item}' (etapas: {', '.join(stages)})")
+        thresholds[stage] = float(value)
+    return thresholds
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="Mede o desempenho dos cálculos do layer.py sobre arquivos sintéticos.")
+    parser.add_argument("-n", "--atomos", default="10,1000,100000",
+                        help="Números de átomos das bicamadas, separados por vírgula (padrão: %(default)s).")
+    parser.add_argument("--pbc", action="store_true", help="Grava a célula periódica nos .xyz (extended-XYZ).")
+    parser.add_argument("--quadros", type=int, default=1,
+                        help="Com mais de 1, mede também trajetórias com esse número de quadros.")
+    parser.add_argument("--bandas", default="100x20x1",
+                        help="Arquivos .bands como kxbandasxspin, separados por vírgula (padrão: %(default)s).")
+    parser.add_argument("-r", "--repeticoes", type=int, default=3,
+                        help="Repetições de cada medição; vale a menor (padrão: %(default)d).")
+    parser.add_argument("--sem-partida", action="store_true",
+                        help="Não mede a importação dos módulos nem a abertura da janela.")
+    parser.add_argument("-o", "--saida", help="Grava os resultados neste arquivo JSON.")
+    parser.add_argument("--referencia", help="Resultados JSON de referência para comparar.")
+    parser.add_argument("--limite", type=float, default=0.25,
+                        help="Lentidão relativa tolerada em relação à referência (padrão: %(default).2f = 25%%).")
+    parser.add_argument("--limite-etapa", default="",
+                        help="Limites por etapa, ex.: 'leitura=0.5,renderizacao=1' (inclui as etapas "
+                             "da partida: importacao, carga, abertura).")
+    parser.add_argument("--limite-carga", type=float, default=None,
+                        help="Tempo máximo (s) para escolher os núcleos na partida, mesmo sem referência "
+                             "(ex.: 0.05); termina com código 3 se passar.")
+    parser.add_argument("--nucleo", "--backend", choices=("auto",) + analisador.BACKENDS,
+                        default=analisador.DEFAULT_BACKEND,
+                        help="Núcleos de cálculo medidos (padrão: %(default)s; veja analisador.set_backend).")
+    parser.add_argument("-q", "--silencioso", action="store_true", help="Não mostra o progresso.")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        sizes = [int(v) for v in args.atomos.split(",") if v.strip()]
+        bands = [tuple(int(v) for v in item.lower().split("x")) for item in args.bandas.split(",") if item.strip()]
+        stage_thresholds = _parse_stage_thresholds(args.limite_etapa)
+    except ValueError as e:
+        parser.error(str(e))
+    if any(n < 2 for n in sizes):
+        parser.error("as bicamadas precisam de pelo menos 2 átomos")
+    if any(len(b) != 3 or min(b) < 1 for b in bands):
+        parser.error("use kxbandasxspin com números positivos em --bandas (ex.: 100x20x1)")
+    if args.repeticoes < 1 or args.quadros < 1:
+        parser.error("repetições e quadros devem ser positivos")
+    if args.limite_carga is not None and args.sem_partida:
+        parser.error("--limite-carga precisa das medições de partida (sem --sem-partida)")
+
+    progress = None if args.silencioso else (lambda case: print(f"Medindo {case}...", file=sys.stderr))
+    try:
+        analisador.set_backend(args.nucleo)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{analisador.backend_status()}.", file=sys.stderr)
+    results = run_suite(sizes, args.pbc, args.quadros, bands, args.repeticoes, progress,
+                        startup=not args.sem_partida)
+    print_table(results)
+    status = 0
+    for m in results["medicoes"]:
+        if m.get("modulos_interface"):
+            print(f"ERRO: importar '{m['caso']}' carrega módulos de interface: "
+                  f"{', '.join(m['modulos_interface'])}", file=sys.stderr)
+            status = 4
+    if args.saida:
+        save_results(results, args.saida)
+    if args.limite_carga is not None:
+        seconds = check_startup_load(results, args.limite_carga)
+        if seconds is not None:
+            print(f"REGRESSÃO partida nucleos carga: {seconds * 1000:.2f} ms "
+                  f"(limite {args.limite_carga * 1000:.2f} ms)", file=sys.stderr)
+            status = status or 3
+
+    if args.referencia:
+        baseline = load_results(args.referencia)
+        reference_backend = baseline["ambiente"].get("nucleo", "numpy")
+        if reference_backend != results["ambiente"]["nucleo"]:
+            print(f"Aviso: a referência foi medida com os núcleos {reference_backend}, "
+                  f"e esta medição com {results['ambiente']['nucleo']}.", file=sys.stderr)
+        regressions = compare(results, baseline, args.limite, stage_thresholds)
+        for calculation, case, stage, old, new, ratio in regressions:
+            print(f"REGRESSÃO {calculation} {case} {stage}: {old * 1000:.2f} ms -> {new * 1000:.2f} ms "
+                  f"({ratio:.2f}x)", file=sys.stderr)
+        if regressions:
+            return 3
+        print("Nenhuma regressão em relação à referência.", file=sys.stderr)
+    return status
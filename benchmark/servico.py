@@ -0,0 +1,256 @@
+"""
+Benchmark do modo de serviço (python -m benchmark.servico): compara a latência e a vazão dos
+pedidos a um serviço (servico.py, pelo cliente.py) com o caminho de um processo por chamada
+(python3 lote.py arquivo -c cálculo), que importa o NumPy e consulta o cache a cada vez.
+
+Casos medidos, para cada cálculo (camadas, segmentacao, ligacoes e gap) e no total:
+- lote_processo: um processo do lote.py por pedido ('primeiro' lê o arquivo; os demais usam o
+  cache em disco);
+- cliente_processo: um processo do cliente.py por pedido, falando com o serviço;
+- servico: pedidos seguidos pela mesma conexão ('primeiro' lê o arquivo no serviço; os demais
+  vêm do cache na memória);
+- servico_concorrente: vários clientes ao mesmo tempo ('por_pedido' = tempo total / pedidos,
+  o inverso da vazão);
+- servico_lote: todos os pedidos em uma única chamada a /lote.
+O lote.py e o serviço usam caches em disco novos e separados, em uma pasta temporária.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmark.medicao import compare, save_results, load_results, _PROJECT_DIR
+from benchmark.sinteticos import write_bilayer_xyz, write_bands
+from cliente import LayersClient
+
+RESULTS_VERSION = 1
+SERVICE_STAGES = ("primeiro", "mediana", "p95", "por_pedido")
+_STARTUP_TIMEOUT = 120.0 # Segundos para o serviço abrir (inclui verificar os núcleos de cálculo)
+
+def _summary(latencies, calculation, case, first=None):
+    """Medições de uma lista de latências (s): mediana, p95 e, se houver, o primeiro pedido."""
+    records = []
+    if first is not None:
+        records.append({"calculo": calculation, "caso": case, "etapa": "primeiro", "tempo_s": first})
+    if latencies:
+        records.append({"calculo": calculation, "caso": case, "etapa": "mediana",
+                        "tempo_s": float(np.median(latencies))})
+        records.append({"calculo": calculation, "caso": case, "etapa": "p95",
+                        "tempo_s": float(np.percentile(latencies, 95))})
+    return records
+
+def _run_process(command, env):
+    start = time.perf_counter()
+    subprocess.run(command, cwd=_PROJECT_DIR, env=env, check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def _process_latencies(tasks, command, env, repeats, case):
+    """Um processo por pedido: 'repeats' pedidos de cada tarefa (o primeiro de cada uma à parte)."""
+    records, everything = [], []
+    for file_path, calculation in tasks:
+        latencies = [_run_process(command(file_path, calculation), env) for _ in range(repeats)]
+        records.extend(_summary(latencies[1:], calculation, case, first=latencies[0]))
+        everything.extend(latencies[1:])
+    records.extend(_summary(everything, "total", case))
+    return records
+
+def start_service(cache_dir, backend):
+    """Inicia o servico.py (porta livre, cache em disco em 'cache_dir'); retorna (processo, endereço, segundos)."""
+    env = dict(os.environ, LAYERS_CACHE_DIR=cache_dir)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "servico.py", "--porta", "0", "--nucleo", backend],
+                               cwd=_PROJECT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    timer = threading.Timer(_STARTUP_TIMEOUT, process.kill)
+    timer.start()
+    try:
+        address = process.stdout.readline().strip()
+    finally:
+        timer.cancel()
+    if not address:
+        process.wait()
+        raise RuntimeError("O serviço não abriu.")
+    with LayersClient(address) as client:
+        client.status() # Primeira resposta: o serviço já atende
+    return process, address, time.perf_counter() - start
+
+def _service_latencies(client, tasks, requests):
+    """Pedidos seguidos pela mesma conexão: o primeiro de cada tarefa e 'requests' pedidos em rodízio."""
+    records, firsts, latencies = [], {}, {calc: [] for _, calc in tasks}
+    for file_path, calculation in tasks:
+        start = time.perf_counter()
+        client.calculate(file_path, calculation)
+        firsts[calculation] = time.perf_counter() - start
+    for n in range(requests):
+        file_path, calculation = tasks[n % len(tasks)]
+        start = time.perf_counter()
+        client.calculate(file_path, calculation)
+        latencies[calculation].append(time.perf_counter() - start)
+    for _, calculation in tasks:
+        records.extend(_summary(latencies[calculation], calculation, "servico", first=firsts[calculation]))
+    records.extend(_summary([t for values in latencies.values() for t in values], "total", "servico"))
+    return records
+
+def _concurrent_seconds(address, tasks, requests, threads):
+    """Tempo total de 'requests' pedidos divididos entre 'threads' clientes simultâneos."""
+    errors = []
+
+    def work(offset):
+        try:
+            with LayersClient(address) as client:
+                for n in range(offset, requests, threads):
+                    client.calculate(*tasks[n % len(tasks)])
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=work, args=(offset,)) for offset in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - start
+
+def run_service_suite(natoms=2000, bands=(2000, 40, 1), requests=400, threads=4, repeats=10,
+                      backend="numpy", progress=None):
+    """
+    Gera uma bicamada periódica com 'natoms' átomos e um .bands (nk, nbandas, nspin) em uma pasta
+    temporária e mede os casos descritos no início do módulo: 'repeats' processos por tarefa no
+    caminho de um processo por chamada, 'requests' pedidos ao serviço (seguidos e com 'threads'
+    clientes simultâneos). 'backend' são os núcleos de cálculo do lote.py e do serviço.
+    'progress', se fornecido, recebe o nome de cada caso antes de medi-lo.
+    Retorna o documento de resultados (o mesmo formato de benchmark.medicao.run_suite).
+    """
+    def report(case):
+        if progress is not None:
+            progress(case)
+
+    with tempfile.TemporaryDirectory(prefix="layers_servico_") as workdir:
+        xyz = write_bilayer_xyz(os.path.join(workdir, "bicamada.xyz"), natoms, periodic=True)
+        nk, nbands, nspin = bands
+        bands_path = write_bands(os.path.join(workdir, "bandas.bands"), nk, nbands, nspin)
+        tasks = [(xyz, "camadas"), (xyz, "segmentacao"), (xyz, "ligacoes"), (bands_path, "gap")]
+        records = []
+
+        report("lote_processo")
+        env = dict(os.environ, LAYERS_CACHE_DIR=os.path.join(workdir, "cache_lote"))
+        records.extend(_process_latencies(
+            tasks, lambda f, c: [sys.executable, "lote.py", f, "-c", c, "-f", "jsonl", "-q", "--nucleo", backend],
+            env, repeats, "lote_processo"))
+
+        report("servico")
+        process, address, startup = start_service(os.path.join(workdir, "cache_servico"), backend)
+        records.append({"calculo": "partida", "caso": "servico", "etapa": "primeiro", "tempo_s": startup})
+        try:
+            with LayersClient(address) as client:
+                records.extend(_service_latencies(client, tasks, requests))
+
+                report("servico_concorrente")
+                seconds = _concurrent_seconds(address, tasks, requests, threads)
+                records.append({"calculo": "total", "caso": f"servico_concorrente_{threads}",
+                                "etapa": "por_pedido", "tempo_s": seconds / requests})
+
+                report("servico_lote")
+                rounds = max(requests // len(tasks), 1)
+                start = time.perf_counter()
+                client.calculate_many([xyz, bands_path] * rounds)
+                records.append({"calculo": "total", "caso": "servico_lote", "etapa": "por_pedido",
+                                "tempo_s": (time.perf_counter() - start) / (rounds * len(tasks))})
+
+                report("cliente_processo")
+                env = dict(os.environ, LAYERS_SERVICE=address)
+                records.extend(_process_latencies(
+                    tasks, lambda f, c: [sys.executable, "cliente.py", c, f], env, repeats, "cliente_processo"))
+                status = client.status()
+                client.shutdown()
+        finally:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    return {"versao": RESULTS_VERSION,
+            "ambiente": {"python": sys.version.split()[0], "numpy": np.__version__, "nucleo": backend,
+                         "atomos": natoms, "bandas": list(bands), "pedidos": requests, "clientes": threads},
+            "servico": status,
+            "medicoes": records}
+
+def print_table(results, stream=sys.stdout):
+    """Tabela das medições (ms) e, no total, a vazão do serviço e do caminho de um processo por chamada."""
+    rows = {}
+    for m in results["medicoes"]:
+        rows.setdefault((m["calculo"], m["caso"]), {})[m["etapa"]] = m["tempo_s"]
+    print(f"{'cálculo':12s} {'caso':26s}" + "".join(f"{stage:>13s}" for stage in SERVICE_STAGES), file=stream)
+    for (calculation, case), stages in rows.items():
+        cells = "".join(f"{stages[s] * 1000:11.3f}ms" if s in stages else f"{'-':>13s}" for s in SERVICE_STAGES)
+        print(f"{calculation:12s} {case:26s}{cells}", file=stream)
+    print(file=stream)
+    for (calculation, case), stages in rows.items():
+        seconds = stages.get("por_pedido", stages.get("mediana"))
+        if calculation == "total" and seconds:
+            print(f"Vazão {case}: {1.0 / seconds:,.0f} pedidos/s", file=stream)
+    oneshot = rows.get(("total", "lote_processo"), {}).get("mediana")
+    warm = rows.get(("total", "servico"), {}).get("mediana")
+    if oneshot and warm:
+        print(f"Pedido ao serviço (mediana) {oneshot / warm:,.0f}x mais rápido que um processo do lote.py.", file=stream)
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.servico",
+        description="Compara a latência e a vazão do modo de serviço com um processo do lote.py por chamada.")
+    parser.add_argument("-n", "--atomos", type=int, default=2000,
+                        help="Número de átomos da bicamada (padrão: %(default)d).")
+    parser.add_argument("--bandas", default="2000x40x1",
+                        help="Arquivo .bands como kxbandasxspin (padrão: %(default)s).")
+    parser.add_argument("-p", "--pedidos", type=int, default=400,
+                        help="Pedidos ao serviço em cada caso (padrão: %(default)d).")
+    parser.add_argument("-t", "--clientes", type=int, default=4,
+                        help="Clientes simultâneos no caso concorrente (padrão: %(default)d).")
+    parser.add_argument("-r", "--repeticoes", type=int, default=10,
+                        help="Processos por cálculo nos casos de um processo por chamada (padrão: %(default)d).")
+    parser.add_argument("--nucleo", "--backend", choices=("auto", "numpy", "numba"), default="numpy",
+                        help="Núcleos de cálculo do lote.py e do serviço (padrão: %(default)s).")
+    parser.add_argument("-o", "--saida", help="Grava os resultados neste arquivo JSON.")
+    parser.add_argument("--referencia", help="Resultados JSON de referência para comparar.")
+    parser.add_argument("--limite", type=float, default=0.25,
+                        help="Lentidão relativa tolerada em relação à referência (padrão: %(default).2f = 25%%).")
+    parser.add_argument("-q", "--silencioso", action="store_true", help="Não mostra o progresso.")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        bands = tuple(int(v) for v in args.bandas.lower().split("x"))
+    except ValueError:
+        bands = ()
+    if len(bands) != 3 or min(bands) < 1:
+        parser.error("use kxbandasxspin com números positivos em --bandas (ex.: 2000x40x1)")
+    if args.atomos < 4 or args.pedidos < 1 or args.clientes < 1 or args.repeticoes < 2:
+        parser.error("use pelo menos 4 átomos, 1 pedido, 1 cliente e 2 repetições")
+
+    progress = None if args.silencioso else (lambda case: print(f"Medindo {case}...", file=sys.stderr))
+    results = run_service_suite(args.atomos, bands, args.pedidos, args.clientes, args.repeticoes,
+                                args.nucleo, progress)
+    print_table(results)
+    if args.saida:
+        save_results(results, args.saida)
+    if args.referencia:
+        regressions = compare(results, load_results(args.referencia), args.limite)
+        for calculation, case, stage, old, new, ratio in regressions:
+            print(f"REGRESSÃO {calculation} {case} {stage}: {old * 1000:.3f} ms -> {new * 1000:.3f} ms "
+                  f"({ratio:.2f}x)", file=sys.stderr)
+        if regressions:
+            return 3
+        print("Nenhuma regressão em relação à referência.", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Geradores de arquivos sintéticos para o benchmark: bicamadas .xyz (com ou sem célula
+periódica, com um ou vários quadros) e arquivos .bands no formato do SIESTA.
+Os arquivos são determinísticos para uma mesma semente.
+"""
+import numpy as np
+
+GRAPHENE_A = 2.46 # Constante de rede do grafeno (Å)
+CC_BOND = GRAPHENE_A / np.sqrt(3.0) # Distância C-C (Å)
+INTERLAYER = 3.35 # Distância entre as camadas (Å)
+VACUUM = 20.0 # Altura da célula ao longo de z (Å)
+
+def bilayer_coords(natoms, seed=0):
+    """
+    Coordenadas (natoms, 3) de uma bicamada de grafeno com empilhamento AB, em ordem aleatória
+    (para exercitar a detecção de camadas), e a matriz (3, 3) da célula retangular.
+    Com natoms que não é múltiplo de 8, a última linha de células fica incompleta.
+    """
+    per_layer = -(-natoms // 2)
+    # Célula retangular com 4 átomos: a x 3d
+    n_cells = -(-per_layer // 4)
+    nx = max(1, int(np.ceil(np.sqrt(n_cells * 3 * CC_BOND / GRAPHENE_A))))
+    ny = -(-n_cells // nx)
+    basis = np.array([[0.0, 0.0], [0.0, CC_BOND], [GRAPHENE_A / 2, 1.5 * CC_BOND], [GRAPHENE_A / 2, 2.5 * CC_BOND]])
+    ix, iy = np.meshgrid(np.arange(nx), np.arange(ny), indexing="ij")
+    origins = np.column_stack((ix.ravel() * GRAPHENE_A, iy.ravel() * 3 * CC_BOND))
+    layer_xy = (origins[:, None, :] + basis[None, :, :]).reshape(-1, 2)[:per_layer]
+
+    bottom = np.column_stack((layer_xy, np.full(per_layer, VACUUM / 2 - INTERLAYER / 2)))
+    top = np.column_stack((layer_xy + (0.0, CC_BOND), np.full(per_layer, VACUUM / 2 + INTERLAYER / 2)))
+    coords = np.concatenate((bottom, top))[:natoms]
+    coords = coords[np.random.default_rng(seed).permutation(natoms)]
+    lattice = np.diag([nx * GRAPHENE_A, ny * 3 * CC_BOND, VACUUM])
+    return coords, lattice
+
+def write_bilayer_xyz(path, natoms, periodic=False, frames=1, noise=0.02, seed=0):
+    """
+    Grava uma bicamada sintética com 'natoms' átomos em 'path'. Com periodic=True, a célula
+    vai na linha de comentário (extended-XYZ). Com frames > 1, grava uma trajetória em que
+    cada quadro tem um deslocamento aleatório de desvio padrão 'noise' (Å).
+    """
+    coords, lattice = bilayer_coords(natoms, seed)
+    if periodic:
+        comment = 'Lattice="{}" pbc="T T T"'.format(" ".join(f"{v:.6f}" for v in lattice.ravel()))
+    else:
+        comment = "bicamada sintetica"
+    rng = np.random.default_rng(seed + 1)
+    with open(path, "w") as f:
+        for frame in range(frames):
+            positions = coords if frame == 0 else coords + rng.normal(0.0, noise, coords.shape)
+            f.write(f"{natoms}\n{comment}\n")
+            np.savetxt(f, positions, fmt="C %.6f %.6f %.6f")
+    return path
+
+def write_bands(path, nk, nbands, nspin=1, gap=1.0, fermi=0.0):
+    """
+    Grava um .bands sintético no formato do SIESTA (cabeçalho de 4 linhas e, para cada ponto k,
+    a coordenada seguida de nspin*nbands energias, 10 por linha). Metade das bandas fica abaixo
+    do nível de Fermi; o gap é indireto (VBM no primeiro ponto k, CBM no último) e vale 'gap' eV.
+    """
+    nval = nbands // 2
+    k = np.linspace(0.0, 1.0, nk)
+    bands = np.arange(nbands)[None, :]
+    valence = fermi - gap / 2 - 0.5 * (nval - 1 - bands) - 0.3 * (1 - np.cos(np.pi * k[:, None]))
+    conduction = fermi + gap / 2 + 0.5 * (bands - nval) + 0.3 * (1 - np.cos(np.pi * (1 - k[:, None])))
+    energies = np.where(bands < nval, valence, conduction) # (nk, nbands)
+    # Canais de spin com um pequeno desdobramento, todos com o mesmo gap mínimo
+    energies = np.concatenate([energies - 0.01 * s * (bands < nval) for s in range(nspin)], axis=1)
+
+    with open(path, "w") as f:
+        f.write(f"{fermi:12.6f}\n{k[0]:12.6f}{k[-1]:12.6f}\n")
+        f.write(f"{energies.min():12.6f}{energies.max():12.6f}\n{nbands:8d}{nspin:8d}{nk:8d}\n")
+        for kk, row in zip(k.tolist(), energies.tolist()):
+            lines = ["".join(f"{e:12.4f}" for e in row[start:start + 10]) for start in range(0, len(row), 10)]
+            f.write(f"{kk:10.6f}" + ("\n" + " " * 10).join(lines) + "\n")
+    return path
@@ -0,0 +1,210 @@
+"""
+Cliente do modo de serviço do layer.py (servico.py).
+
+Só usa a biblioteca padrão (sem NumPy): importar este módulo e fazer um pedido custa poucos
+milissegundos, enquanto o serviço mantém o NumPy, as estruturas lidas e os resultados carregados.
+Os registros devolvidos são os mesmos do lote.py em JSON Lines. A conexão é mantida aberta entre
+os pedidos (HTTP/1.1), por TCP local ou por um socket Unix.
+
+Exemplo:
+    python3 cliente.py camadas,ligacoes estrutura.xyz
+    python3 cliente.py gap calculo.bands --servico unix:/tmp/layers.sock
+
+Em Python:
+    with LayersClient() as client:
+        record = client.calculate("estrutura.xyz", "camadas")
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+
+DEFAULT_PORT = 8642
+# Endereço padrão do serviço: 'http://máquina:porta' ou 'unix:/caminho/do/socket'
+DEFAULT_ADDRESS = os.environ.get("LAYERS_SERVICE") or f"http://127.0.0.1:{DEFAULT_PORT}"
+
+# Argumentos de LayersClient -> campos das opções nos pedidos (os nomes das opções do lote.py)
+_OPTION_FIELDS = {"use_pbc": "pbc", "lattice": "rede", "cutoff": "corte", "frame": "quadro",
+                  "layer_tolerance": "tolerancia_camadas", "fermi": "fermi"}
+
+class ServiceError(Exception):
+    """O serviço recusou um pedido (status HTTP diferente de 200) ou não respondeu."""
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection sobre um socket Unix."""
+
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def _connection(address, timeout):
+    if address.startswith("unix:"):
+        return _UnixHTTPConnection(address[len("unix:"):], timeout)
+    host = address.split("://", 1)[-1].rstrip("/")
+    return http.client.HTTPConnection(host, timeout=timeout)
+
+def _request_options(options):
+    """Converte os argumentos de LayersClient nos campos de opção dos pedidos."""
+    fields = {}
+    for name, value in options.items():
+        if name not in _OPTION_FIELDS:
+            raise TypeError(f"Opção desconhecida: {name}")
+        if value is None:
+            continue
+        if name == "frame":
+            value = value + 1 if value >= 0 else value # Nos pedidos, os quadros contam a partir de 1
+        elif name == "lattice" and not isinstance(value, str):
+            value = [float(v) for row in value for v in (row if hasattr(row, "__iter__") else (row,))]
+        elif name == "fermi" and isinstance(value, str):
+            value = os.path.abspath(value)
+        fields[_OPTION_FIELDS[name]] = value
+    return fields
+
+class LayersClient:
+    """
+    Conexão com um serviço do layer.py. As opções dos cálculos são as de analisador e lote:
+    use_pbc, lattice (9 números ou texto), cutoff, frame (a partir de 0; -1 = último),
+    layer_tolerance e fermi (número ou arquivo). Os caminhos são enviados como absolutos.
+    Levanta ServiceError se o serviço recusar o pedido e OSError se não for possível conectar.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        self.address = address
+        self.timeout = timeout
+        self._connection = None
+
+    def _request(self, method, path, body=None):
+        data = None if body is None else json.dumps(body, ensure_ascii=False).encode()
+        headers = {} if data is None else {"Content-Type": "application/json"}
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = _connection(self.address, self.timeout)
+            try:
+                self._connection.request(method, path, body=data, headers=headers)
+                response = self._connection.getresponse()
+                payload = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # O serviço fechou uma conexão ociosa: reconecta uma vez
+                self.close()
+                if attempt:
+                    raise
+        try:
+            result = json.loads(payload)
+        except ValueError:
+            raise ServiceError(f"Resposta inválida do serviço (HTTP {response.status}).") from None
+        if response.status != 200:
+            raise ServiceError(result.get("erro") if isinstance(result, dict) else f"HTTP {response.status}")
+        return result
+
+    def calculate(self, file_path, calculation, **options):
+        """Um cálculo do lote.py (camadas, segmentacao, ligacoes ou gap) sobre um arquivo; retorna o registro."""
+        body = dict(_request_options(options), arquivo=os.path.abspath(file_path))
+        return self._request("POST", f"/{calculation}", body)
+
+    def calculate_many(self, files, calculations=None, **options):
+        """
+        Os cálculos que se aplicam a cada arquivo (veja lote.build_tasks), em um único pedido: o serviço
+        lê cada arquivo uma vez para todos os seus cálculos. Retorna a lista de registros.
+        """
+        body = dict(_request_options(options), arquivos=[os.path.abspath(p) for p in files])
+        if calculations is not None:
+            body["calculos"] = list(calculations)
+        return self._request("POST", "/lote", body)["registros"]
+
+    def band_plot(self, file_path, k_min=None, k_max=None, width=1000, e_min=None, e_max=None, fermi=None):
+        """
+        Curvas da estrutura de bandas reduzidas para 'width' pixels (veja analisador.BandStructure.envelope),
+        com o gap. Retorna o registro, em que 'curvas' lista {spin, banda, k, energia} de cada banda visível.
+        """
+        body = dict(_request_options({"fermi": fermi}), arquivo=os.path.abspath(file_path), largura=width)
+        for field, value in (("k_min", k_min), ("k_max", k_max), ("e_min", e_min), ("e_max", e_max)):
+            if value is not None:
+                body[field] = value
+        return self._request("POST", "/bandas", body)
+
+    def status(self):
+        """Contadores do serviço: pedidos, acertos do cache na memória, cálculos, pedidos agrupados..."""
+        return self._request("GET", "/estado")
+
+    def shutdown(self):
+        """Encerra o serviço."""
+        result = self._request("POST", "/encerrar", {})
+        self.close()
+        return result
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Pede cálculos a um serviço do layer.py (python3 servico.py) e mostra os registros em JSON Lines.")
+    parser.add_argument("comando",
+                        help="Cálculos separados por vírgula (camadas, segmentacao, ligacoes, gap), "
+                             "'estado' ou 'encerrar'.")
+    parser.add_argument("arquivos", nargs="*", help="Arquivos de estrutura ou de bandas.")
+    parser.add_argument("--servico", default=DEFAULT_ADDRESS,
+                        help="Endereço do serviço: http://máquina:porta ou unix:/caminho (padrão: %(default)s, "
+                             "ou a variável LAYERS_SERVICE).")
+    parser.add_argument("--corte", type=float, default=None, help="Raio de corte das ligações em Å.")
+    parser.add_argument("--tolerancia-camadas", type=float, default=None,
+                        help="Vazio mínimo em z (Å) entre camadas na segmentação.")
+    parser.add_argument("--sem-pbc", action="store_true", help="Ignora a célula periódica dos arquivos.")
+    parser.add_argument("--rede", default=None, help="Vetores de rede manuais (9 números em Å).")
+    parser.add_argument("--quadro", type=int, default=None, help="Quadro das trajetórias (a partir de 1; -1 = último).")
+    parser.add_argument("--fermi", default=None, help="Nível de Fermi (eV) dos bands.dat, ou um arquivo de onde lê-lo.")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.quadro == 0:
+        parser.error("os quadros são numerados a partir de 1")
+    try:
+        fermi = float(args.fermi) if args.fermi is not None else None
+    except ValueError:
+        fermi = args.fermi
+    options = {"use_pbc": not args.sem_pbc, "lattice": args.rede, "cutoff": args.corte,
+               "frame": None if args.quadro is None else (args.quadro - 1 if args.quadro > 0 else args.quadro),
+               "layer_tolerance": args.tolerancia_camadas, "fermi": fermi}
+
+    try:
+        with LayersClient(args.servico) as client:
+            if args.comando == "estado":
+                print(json.dumps(client.status(), ensure_ascii=False, indent=1))
+                return 0
+            if args.comando == "encerrar":
+                client.shutdown()
+                return 0
+            if not args.arquivos:
+                parser.error("informe os arquivos")
+            calculations = [c.strip() for c in args.comando.split(",") if c.strip()]
+            records = client.calculate_many(args.arquivos, calculations, **options)
+    except ServiceError as e:
+        print(f"Erro do serviço: {e}", file=sys.stderr)
+        return 1
+    except OSError as e:
+        print(f"Não foi possível falar com o serviço em {args.servico}: {e}", file=sys.stderr)
+        return 1
+    for record in records:
+        print(json.dumps(record, ensure_ascii=False))
+    return 0 if all(record["status"] == "ok" for record in records) else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
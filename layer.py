@@ -1,195 +1,41 @@
+import time # Para medir o tempo de abertura da janela
+_STARTED_AT = time.perf_counter() # Início da importação do programa (veja report_startup)
+
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk # Para exibir imagens no Tkinter
-from fpdf import FPDF # Para gerar o PDF
 import os # Para manipulação de arquivos e caminhos
-import numpy as np # Para cálculos numéricos eficientes, como sqrt
-
-# --- Funções de Cálculo Traduzidas do Fortran para Python ---
-
-def calculate_layer_distance_python(file_path):
-    """
-    Calcula a distância entre camadas a partir de um arquivo .xyz.
-    Traduzido do programa Fortran 'distancia_layers'.
-    Retorna (distancia_ang, distancia_bohr) ou códigos de erro.
-    """
-    ang_to_bohr = 1.8897259886 # Constante de conversão
-
-    try:
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        # Erro ao abrir o arquivo, similar ao -999.99 do Fortran
-        return -999.99, -999.99
-    except Exception as e:
-        # Outros erros de leitura
-        print(f"Erro ao ler arquivo {file_path}: {e}")
-        return -999.99, -999.99
-
-    try:
-        natoms = int(lines[0].strip())
-    except (ValueError, IndexError):
-        # Erro ao ler o número de átomos
-        return -999.99, -999.99
-
-    if natoms < 4:
-        # Número insuficiente de átomos, similar ao -888.88 do Fortran
-        return -888.88, -888.88
-
-    z_coords = []
-    # Começa a ler os dados dos átomos a partir da terceira linha (índice 2)
-    for i in range(2, len(lines)):
-        parts = lines[i].strip().split()
-        if len(parts) >= 4: # Espera pelo menos tipo, x, y, z
-            try:
-                z_coords.append(float(parts[3])) # A coordenada Z é a quarta parte
-            except ValueError:
-                # Ignora linhas mal formatadas, mas pode indicar problema no arquivo
-                continue
-    
-    if len(z_coords) != natoms:
-        # Se o número de coordenadas lidas não corresponde ao natoms declarado
-        return -999.99, -999.99
-
-    # A lógica Fortran assume que os 2 primeiros são da camada inferior e os 2 últimos da superior.
-    # Isso implica que os átomos estão ordenados por camada no arquivo .xyz.
-    # Se o arquivo não estiver ordenado, essa lógica pode não ser precisa.
-    z_bot_avg = (z_coords[0] + z_coords[1]) / 2.0
-    z_top_avg = (z_coords[natoms-1] + z_coords[natoms-2]) / 2.0 # natoms-1 é o último, natoms-2 é o penúltimo
-
-    distancia_ang = z_top_avg - z_bot_avg
-    distancia_bohr = distancia_ang * ang_to_bohr
-
-    return distancia_ang, distancia_bohr
-
-def calculate_atom_distances_python(file_path):
-    """
-    Calcula distâncias entre pares de átomos a partir de um arquivo .xyz.
-    Traduzido do programa Fortran 'calcula_distancias'.
-    Retorna uma string formatada com os resultados ou uma mensagem de erro.
-    """
-    ang_to_bohr = 1.8897259886 # Constante de conversão
-
-    try:
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        return f"Erro ao abrir o arquivo '{os.path.basename(file_path)}'."
-    except Exception as e:
-        return f"Erro ao ler arquivo {os.path.basename(file_path)}: {e}"
-
-    try:
-        num_atoms = int(lines[0].strip())
-    except (ValueError, IndexError):
-        return f"Erro: Não foi possível ler o número de átomos do arquivo '{os.path.basename(file_path)}'."
-
-    if num_atoms < 2:
-        return "Erro: Número insuficiente de átomos para calcular distâncias (mínimo de 2)."
-
-    atoms_data = []
-    # Começa a ler os dados dos átomos a partir da terceira linha (índice 2)
-    for i in range(2, len(lines)):
-        parts = lines[i].strip().split()
-        if len(parts) >= 4: # Espera pelo menos tipo, x, y, z
-            try:
-                symbol = parts[0]
-                x, y, z = float(parts[1]), float(parts[2]), float(parts[3])
-                atoms_data.append({'symbol': symbol, 'x': x, 'y': y, 'z': z})
-            except ValueError:
-                # Ignorar linhas mal formatadas
-                continue
-    
-    if len(atoms_data) != num_atoms:
-        return f"Erro: O número de átomos lidos ({len(atoms_data)}) não corresponde ao declarado ({num_atoms})."
-
-    results = ["Distâncias entre pares de átomos (Å e bohr):"]
-    for i in range(num_atoms):
-        for j in range(i + 1, num_atoms):
-            atom1 = atoms_data[i]
-            atom2 = atoms_data[j]
-
-            dx = atom2['x'] - atom1['x']
-            dy = atom2['y'] - atom1['y']
-            dz = atom2['z'] - atom1['z']
-
-            dist_ang = np.sqrt(dx*dx + dy*dy + dz*dz)
-            dist_bohr = dist_ang * ang_to_bohr
-
-            results.append(
-                f"{i+1:3d} {atom1['symbol']:2s} - {j+1:3d} {atom2['symbol']:2s}: "
-                f"{dist_ang:10.4f} Å    {dist_bohr:10.4f} bohr"
-            )
-    return "\n".join(results)
-
-def calculate_band_gap_python(file_path):
-    """
-    Calcula o gap de energia a partir de um arquivo .bands.
-    Traduzido do programa Fortran 'calcula_gap'.
-    Retorna (gap_val, is_metallic) ou códigos de erro.
-    """
-    try:
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        # Erro ao abrir o arquivo, similar ao -999.99 do Fortran
-        return -999.99, False
-    except Exception as e:
-        print(f"Erro ao ler arquivo {file_path}: {e}")
-        return -999.99, False
-
-    if not lines:
-        return -888.88, False # Arquivo vazio
-
-    try:
-        fermi = float(lines[0].strip())
-    except (ValueError, IndexError):
-        # Erro ao ler o nível de Fermi, similar ao -888.88 do Fortran
-        return -888.88, False
-
-    # Leitura das energias
-    energies = []
-    for i in range(1, len(lines)): # Começa da segunda linha
-        line_parts = lines[i].strip().split()
-        if not line_parts: # Pula linhas vazias
-            continue
-        try:
-            # Converte todos os valores da linha para float
-            energies.extend([float(val) for val in line_parts])
-        except ValueError:
-            # Ignora linhas com dados não numéricos
-            continue
-    
-    if not energies:
-        # Se nenhuma energia foi lida
-        return -777.77, False # Similar ao erro de limite excedido ou dados inválidos
-
-    max_val = -float('inf') # Equivalente a um número muito pequeno
-    min_cond = float('inf') # Equivalente a um número muito grande
-
-    # Varre os valores para encontrar os extremos
-    for energy in energies:
-        if energy <= fermi and energy > max_val:
-            max_val = energy
-        elif energy > fermi and energy < min_cond:
-            min_cond = energy
-
-    gap = min_cond - max_val
-    is_metallic = False
-
-    if gap <= 0.0: # Material metálico se o gap for zero ou negativo
-        is_metallic = True
-        # No Fortran, ele imprime o Fermi para metálicos.
-        # Aqui, retornamos o Fermi como 'gap_val' e is_metallic=True.
-        return fermi, is_metallic
-    else:
-        return gap, is_metallic
+import queue # Mensagens das threads de cálculo para a interface
+import collections # Vistas já calculadas do gráfico de bandas
+import re # Para interpretar o filtro de pares de elementos
+import threading # Cálculos em segundo plano
+import numpy as np # Para o gráfico da distribuição radial
+
+# Funções de cálculo (núcleo sem interface gráfica)
+from analisador import (
+    XYZFormatError, BandsFormatError, CalculationCancelled, ERROR_NATOMS, ANG_TO_BOHR,
+    LAYER_GAP_TOLERANCE, parse_lattice_text, parse_frame_selection,
+    calculate_layer_distance, calculate_layers, calculate_layer_distance_trajectory_python,
+    calculate_pair_distances, calculate_rdf, calculate_bond_histogram, RDF_DEFAULT_RMAX, RDF_DEFAULT_BINS,
+    query_distances,
+    analyze_band_gap, calculate_band_structure, export_result, EXPORT_FORMATS, get_result_cache, configure_incremental,
+    clear_incremental_state, configure_pair_engine, set_backend, backend_status, DEFAULT_BACKEND,
+    enable_profiling, disable_profiling, get_profiler, profile_stage,
+)
+# Formatação dos resultados e relatório PDF (também sem interface gráfica)
+from relatorio import (REPORT_MAX_PAIRS, format_result, format_pair_summary, format_distance_summary,
+                       build_report)
+
+# Tipos de arquivo dos diálogos de seleção (estruturas e bandas)
+STRUCTURE_FILETYPES = [("Estruturas (.xyz, STRUCT_OUT, saídas do SIESTA e do pw.x)",
+                        "*.xyz *.STRUCT_OUT *.STRUCT_IN *.out *.pwo *.log")]
+BANDS_FILETYPES = [("Bandas (.bands, bands.dat, saídas do pw.x)", "*.bands *.dat *.out *.pwo *.log")]
 
 # --- Classe para o Diálogo de Informações do Usuário ---
 class UserInfoDialog(tk.Toplevel):
     def __init__(self, parent, initial_name="", initial_role="", initial_advisor=""):
         super().__init__(parent)
         self.title("Informações do Usuário para o Relatório")
-        self.geometry("400x250")
+        self.geometry("400x320")
         self.transient(parent) # Faz com que o diálogo fique acima da janela principal
         self.grab_set() # Bloqueia interação com a janela principal
         self.focus_set() # Define o foco para o diálogo
@@ -199,6 +45,8 @@ class UserInfoDialog(tk.Toplevel):
         self.user_role = initial_role
         self.user_advisor = initial_advisor
         self.result = None # Para armazenar o resultado (nome, cargo, orientador)
+        self.include_pairs = True # Apêndice com a lista de pares (até REPORT_MAX_PAIRS)
+        self.write_csv = False # Lista completa de pares em um CSV ao lado do PDF
 
         self.create_widgets()
 
@@ -227,9 +75,17 @@ class UserInfoDialog(tk.Toplevel):
         self.entry_advisor.grid(row=2, column=1, padx=5, pady=5, sticky=tk.EW)
         self.entry_advisor.insert(0, self.user_advisor)
 
+        # Lista de pares: apêndice limitado e/ou CSV completo
+        self.include_pairs_var = tk.BooleanVar(value=self.include_pairs)
+        ttk.Checkbutton(frame, text=f"Incluir apêndice com a lista de pares (até {REPORT_MAX_PAIRS})",
+                        variable=self.include_pairs_var).grid(row=3, column=0, columnspan=2, padx=5, sticky=tk.W)
+        self.write_csv_var = tk.BooleanVar(value=self.write_csv)
+        ttk.Checkbutton(frame, text="Salvar a lista completa de pares em CSV junto ao PDF",
+                        variable=self.write_csv_var).grid(row=4, column=0, columnspan=2, padx=5, sticky=tk.W)
+
         # Botão de Confirmação
         ttk.Button(frame, text="Confirmar", command=self._on_confirm,
-                   style='TButton').grid(row=3, column=0, columnspan=2, pady=15)
+                   style='TButton').grid(row=5, column=0, columnspan=2, pady=15)
         
         # Estilo para os botões (copiado da classe principal para consistência)
         style = ttk.Style()
@@ -246,6 +102,8 @@ class UserInfoDialog(tk.Toplevel):
         self.user_name = self.entry_name.get().strip()
         self.user_role = self.entry_role.get().strip()
         self.user_advisor = self.entry_advisor.get().strip()
+        self.include_pairs = self.include_pairs_var.get()
+        self.write_csv = self.write_csv_var.get()
         self.result = (self.user_name, self.user_role, self.user_advisor)
         self.destroy()
 
@@ -257,6 +115,460 @@ class UserInfoDialog(tk.Toplevel):
         self.result = None
         self.destroy()
 
+# --- Cálculos em Segundo Plano ---
+
+class BackgroundJob:
+    """
+    Executa um cálculo em uma thread separada, para que a janela continue respondendo.
+    A thread nunca acessa os widgets: ela se comunica com a interface apenas pela fila
+    'messages', com tuplas (tipo, chave, dados), que a janela principal lê periodicamente.
+    Tipos: "progress" (fração de 0 a 1), "done" (resultado), "error" (exceção) e "cancelled".
+    Com a instrumentação ligada, o cálculo inteiro é medido como a etapa 'aba/<key>', e
+    profile_mark guarda quantas medições já existiam quando ele começou.
+    """
+    __slots__ = ("key", "messages", "cancel_event", "thread", "profile_mark", "_last_fraction")
+
+    def __init__(self, key, work, messages):
+        self.key = key
+        self.messages = messages
+        self.cancel_event = threading.Event()
+        self._last_fraction = -1.0
+        self.profile_mark = 0
+        self.thread = threading.Thread(target=self._run, args=(work,), daemon=True)
+
+    def start(self):
+        profiler = get_profiler()
+        self.profile_mark = 0 if profiler is None else len(profiler.records)
+        self.thread.start()
+
+    def cancel(self):
+        """Pede o cancelamento; o cálculo para na próxima vez que informar o progresso."""
+        self.cancel_event.set()
+
+    def report_progress(self, fraction):
+        """
+        Função de progresso passada aos cálculos do núcleo. Levanta CalculationCancelled
+        se o cancelamento foi pedido e só envia mensagens a cada 1% para não inundar a fila.
+        """
+        if self.cancel_event.is_set():
+            raise CalculationCancelled()
+        if fraction - self._last_fraction >= 0.01:
+            self._last_fraction = fraction
+            self.messages.put(("progress", self.key, fraction))
+
+    def _run(self, work):
+        try:
+            with profile_stage(f"aba/{self.key}"):
+                result = work(self.report_progress)
+        except CalculationCancelled:
+            self.messages.put(("cancelled", self.key, None))
+        except Exception as e:
+            self.messages.put(("error", self.key, e))
+        else:
+            if self.cancel_event.is_set():
+                self.messages.put(("cancelled", self.key, None))
+            else:
+                self.messages.put(("done", self.key, result))
+
+# --- Tabela Virtual de Distâncias ---
+
+class PairTableView(ttk.Frame):
+    """
+    Tabela de distâncias entre pares que só cria as linhas visíveis no Treeview.
+    As linhas são geradas a partir dos arrays de um PairDistances à medida que a tabela
+    rola, de modo que milhões de pares nunca viram texto nem itens do Tk.
+    Permite ordenar por distância (clicando no cabeçalho), filtrar por par de elementos
+    e saltar para o primeiro par de um átomo.
+    """
+    COLUMNS = (("i", "Átomo i", 70), ("el_i", "Elem.", 50), ("j", "Átomo j", 70), ("el_j", "Elem.", 50),
+               ("ang", "Distância (Å)", 120), ("bohr", "Distância (bohr)", 120))
+
+    def __init__(self, parent, visible_rows=12):
+        super().__init__(parent)
+        self.pairs = None
+        self.rows = None # Índices (em self.pairs) das linhas filtradas e ordenadas
+        self.offset = 0 # Primeira linha visível
+        self.visible_rows = visible_rows
+        self.sort_by = "index"
+        self.descending = False
+        self.element_pair = None
+
+        controls = ttk.Frame(self)
+        controls.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(controls, text="Par de elementos (ex.: C-H):").pack(side=tk.LEFT, padx=(0, 2))
+        self.filter_entry = ttk.Entry(controls, width=10)
+        self.filter_entry.pack(side=tk.LEFT)
+        self.filter_entry.bind("<Return>", lambda event: self.apply_filter())
+        ttk.Button(controls, text="Filtrar", command=self.apply_filter).pack(side=tk.LEFT, padx=5)
+        ttk.Label(controls, text="Ir para o átomo:").pack(side=tk.LEFT, padx=(10, 2))
+        self.jump_entry = ttk.Entry(controls, width=8)
+        self.jump_entry.pack(side=tk.LEFT)
+        self.jump_entry.bind("<Return>", lambda event: self.jump_to_atom())
+        ttk.Button(controls, text="Ir", command=self.jump_to_atom).pack(side=tk.LEFT, padx=5)
+        self.count_label = ttk.Label(controls, text="")
+        self.count_label.pack(side=tk.RIGHT)
+
+        table = ttk.Frame(self)
+        table.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(table, columns=[c[0] for c in self.COLUMNS], show="headings",
+                                 height=visible_rows, selectmode="browse")
+        for column, title, width in self.COLUMNS:
+            self.tree.heading(column, text=title, command=lambda c=column: self.sort_by_column(c))
+            self.tree.column(column, width=width, anchor=tk.E if column in ("ang", "bohr") else tk.CENTER)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        # A barra de rolagem controla self.offset, e não o Treeview (que só tem as linhas visíveis)
+        self.scrollbar = ttk.Scrollbar(table, orient=tk.VERTICAL, command=self._on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        for widget in (self.tree, self.scrollbar):
+            widget.bind("<MouseWheel>", self._on_mouse_wheel)
+            widget.bind("<Button-4>", lambda event: self.scroll_to(self.offset - 3))
+            widget.bind("<Button-5>", lambda event: self.scroll_to(self.offset + 3))
+        self.tree.bind("<Prior>", lambda event: self.scroll_to(self.offset - self.visible_rows))
+        self.tree.bind("<Next>", lambda event: self.scroll_to(self.offset + self.visible_rows))
+        self.render()
+
+    @property
+    def n_rows(self):
+        return 0 if self.rows is None else len(self.rows)
+
+    def set_pairs(self, pairs):
+        """Exibe um novo PairDistances, mantendo o filtro de elementos digitado."""
+        self.pairs = pairs
+        self.sort_by, self.descending = "index", False
+        with profile_stage("interface/exibicao", linhas=pairs.n_pairs):
+            self.refresh()
+
+    def clear(self):
+        self.pairs = None
+        self.rows = None
+        self.offset = 0
+        self.render()
+
+    def refresh(self):
+        """Recalcula as linhas filtradas e ordenadas e volta ao início da tabela."""
+        if self.pairs is not None:
+            self.rows = self.pairs.select(self.element_pair, self.sort_by, self.descending)
+        self.offset = 0
+        self.render()
+
+    def render(self):
+        """Preenche o Treeview apenas com as linhas da janela visível."""
+        self.tree.delete(*self.tree.get_children())
+        total = self.n_rows
+        if total:
+            window = self.rows[self.offset:self.offset + self.visible_rows]
+            pairs = self.pairs
+            pair_i, pair_j, dists = pairs.pair_i[window], pairs.pair_j[window], pairs.distances[window]
+            for i, j, d in zip(pair_i.tolist(), pair_j.tolist(), dists.tolist()):
+                self.tree.insert("", tk.END, values=(i + 1, pairs.elements[pairs.species[i]],
+                                                     j + 1, pairs.elements[pairs.species[j]],
+                                                     f"{d:.4f}", f"{d * ANG_TO_BOHR:.4f}"))
+            last = min(self.offset + self.visible_rows, total)
+            self.count_label.config(text=f"Pares {self.offset + 1}–{last} de {total}")
+            self.scrollbar.set(self.offset / total, last / total)
+        else:
+            self.count_label.config(text="Nenhum par" if self.pairs is not None else "")
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll_to(self, offset):
+        offset = max(0, min(int(offset), self.n_rows - self.visible_rows))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+    def _on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(float(amount) * self.n_rows)
+        elif action == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll_to(self.offset + int(amount) * step)
+
+    def _on_mouse_wheel(self, event):
+        self.scroll_to(self.offset - 3 * (1 if event.delta > 0 else -1))
+
+    def sort_by_column(self, column):
+        """Ordena por distância (colunas de distância) ou pelos índices (demais); clicar de novo inverte."""
+        sort_by = "distance" if column in ("ang", "bohr") else "index"
+        self.descending = not self.descending if sort_by == self.sort_by else False
+        self.sort_by = sort_by
+        self.refresh()
+
+    def apply_filter(self):
+        text = self.filter_entry.get().strip()
+        if not text:
+            self.element_pair = None
+        else:
+            symbols = [s for s in re.split(r"[\s,;/–-]+", text) if s]
+            if len(symbols) != 2:
+                messagebox.showwarning("Entrada Inválida", "Informe dois elementos, por exemplo: C-H.")
+                return
+            self.element_pair = tuple(symbols)
+        self.refresh()
+
+    def jump_to_atom(self):
+        if self.pairs is None:
+            return
+        try:
+            atom = int(self.jump_entry.get()) - 1
+        except ValueError:
+            atom = -1
+        if not 0 <= atom < self.pairs.natoms:
+            messagebox.showwarning("Entrada Inválida",
+                                   f"Informe um átomo entre 1 e {self.pairs.natoms}.")
+            return
+        position = self.pairs.find_atom(atom, self.rows)
+        if position is None:
+            messagebox.showinfo("Átomo não Encontrado", f"O átomo {atom + 1} não aparece nos pares exibidos.")
+            return
+        self.offset = max(0, min(position, self.n_rows - self.visible_rows))
+        self.render()
+        # Destaca a linha encontrada
+        children = self.tree.get_children()
+        if children:
+            self.tree.selection_set(children[position - self.offset])
+
+# --- Gráfico de Linhas no Canvas ---
+
+class PlotCanvas(tk.Canvas):
+    """
+    Gráfico de linhas simples desenhado direto no Canvas do Tk (sem matplotlib): eixos com
+    marcas e rótulos e uma ou mais curvas, redesenhados quando o widget muda de tamanho.
+    Cada curva é (x, y, cor); os arrays são guardados e convertidos em coordenadas da tela
+    só no desenho.
+    """
+    MARGINS = (60, 15, 20, 40) # esquerda, direita, topo, base (pixels)
+    N_TICKS = 5
+
+    def __init__(self, parent, height=220, **kwargs):
+        super().__init__(parent, height=height, bg='white', highlightthickness=0, **kwargs)
+        self.series = []
+        self.xlabel = ""
+        self.ylabel = ""
+        self.bind("<Configure>", lambda event: self.redraw())
+
+    def set_data(self, series, xlabel="", ylabel=""):
+        """Troca as curvas exibidas: 'series' é uma lista de (x, y, cor)."""
+        self.series = [(np.asarray(x, dtype=float), np.asarray(y, dtype=float), color)
+                       for x, y, color in series]
+        self.xlabel, self.ylabel = xlabel, ylabel
+        self.redraw()
+
+    def clear(self):
+        self.set_data([])
+
+    def _limits(self):
+        x_all = np.concatenate([x for x, _, _ in self.series])
+        y_all = np.concatenate([y for _, y, _ in self.series])
+        finite = np.isfinite(y_all)
+        x_min, x_max = float(x_all.min()), float(x_all.max())
+        y_min = min(float(y_all[finite].min()), 0.0) if finite.any() else 0.0
+        y_max = float(y_all[finite].max()) if finite.any() else 1.0
+        if x_max <= x_min:
+            x_max = x_min + 1.0
+        if y_max <= y_min:
+            y_max = y_min + 1.0
+        return x_min, x_max, y_min, y_max
+
+    def has_data(self):
+        return bool(self.series)
+
+    def redraw(self):
+        with profile_stage("interface/grafico", curvas=len(self.series)):
+            self.delete("all")
+            width, height = self.winfo_width(), self.winfo_height()
+            left, right, top, bottom = self.MARGINS
+            plot_w, plot_h = width - left - right, height - top - bottom
+            if plot_w <= 10 or plot_h <= 10:
+                return
+            if not self.has_data():
+                self.create_rectangle(left, top, left + plot_w, top + plot_h, outline='#333333')
+                self.create_text(left + plot_w / 2, top + plot_h / 2, text="Sem dados", fill='#777777')
+                return
+
+            x_min, x_max, y_min, y_max = self._limits()
+            to_px = lambda x, y: (left + (x - x_min) / (x_max - x_min) * plot_w,
+                                  top + plot_h - (y - y_min) / (y_max - y_min) * plot_h)
+            self.draw_data(to_px, (x_min, x_max, y_min, y_max), (left, top, plot_w, plot_h))
+            # Cobre o que passou da área do gráfico (curvas com zoom) antes de desenhar os eixos
+            for box in ((0, 0, left, height), (left + plot_w, 0, width, height),
+                        (0, 0, width, top), (0, top + plot_h, width, height)):
+                self.create_rectangle(*box, fill='white', outline='')
+            self.create_rectangle(left, top, left + plot_w, top + plot_h, outline='#333333')
+            for k in range(self.N_TICKS + 1):
+                x = x_min + (x_max - x_min) * k / self.N_TICKS
+                y = y_min + (y_max - y_min) * k / self.N_TICKS
+                px, _ = to_px(x, y_min)
+                _, py = to_px(x_min, y)
+                self.create_line(px, top + plot_h, px, top + plot_h + 4)
+                self.create_text(px, top + plot_h + 6, text=f"{x:.3g}", anchor=tk.N, font=('Inter', 8))
+                self.create_line(left - 4, py, left, py)
+                self.create_text(left - 6, py, text=f"{y:.3g}", anchor=tk.E, font=('Inter', 8))
+            self.create_text(left + plot_w / 2, height - 4, text=self.xlabel, anchor=tk.S, font=('Inter', 9))
+            self.create_text(4, top, text=self.ylabel, anchor=tk.NW, font=('Inter', 9))
+
+    def draw_data(self, to_px, limits, box):
+        """Desenha as curvas; 'to_px' converte dados em pixels e 'box' é (esquerda, topo, largura, altura)."""
+        for x, y, color in self.series:
+            keep = np.isfinite(y)
+            px, py = to_px(x[keep], y[keep])
+            if len(px) > 1:
+                # Um único item de linha com todos os pontos (coordenadas intercaladas)
+                self.create_line(*np.column_stack((px, py)).ravel().tolist(), fill=color, width=1.5)
+
+class BandPlotCanvas(PlotCanvas):
+    """
+    Estrutura de bandas (energia em função de k) com zoom e deslocamento: a roda do mouse aproxima
+    ou afasta em torno do cursor (com Shift, só no eixo da energia), arrastar desloca e o duplo
+    clique volta à vista inicial (do VBM - ENERGY_WINDOW ao CBM + ENERGY_WINDOW). Marca o nível de
+    Fermi, o VBM, o CBM e a faixa do gap.
+    As curvas vêm de BandStructure.envelope, com cerca de dois pontos por pixel em qualquer zoom,
+    e as das últimas vistas ficam guardadas: voltar a uma vista anterior não recalcula nada.
+    """
+    ENERGY_WINDOW = 4.0 # eV
+    SPIN_COLORS = ('#1f77b4', '#d62728')
+    CACHED_VIEWS = 16
+
+    def __init__(self, parent, height=320, **kwargs):
+        super().__init__(parent, height=height, **kwargs)
+        self.bands = None
+        self.view = None # (k mín., k máx., E mín., E máx.)
+        self.box = None # Área do gráfico no último desenho (esquerda, topo, largura, altura)
+        self._envelopes = collections.OrderedDict() # (vista, largura) -> curvas de envelope
+        self._drag = None
+        self._redraw_pending = False
+        self.bind("<MouseWheel>", self._on_wheel)
+        self.bind("<Button-4>", self._on_wheel) # Roda do mouse no X11
+        self.bind("<Button-5>", self._on_wheel)
+        self.bind("<ButtonPress-1>", self._on_press)
+        self.bind("<B1-Motion>", self._on_drag)
+        self.bind("<Double-Button-1>", lambda event: self.reset_view())
+
+    def set_bands(self, bands):
+        """Exibe um BandStructure (None limpa o gráfico) na vista inicial."""
+        self.bands = bands
+        self._envelopes.clear()
+        self.xlabel, self.ylabel = "k", "E (eV)"
+        self.reset_view()
+
+    def reset_view(self):
+        if self.bands is not None:
+            gap, k = self.bands.gap, self.bands.k
+            low, high = (gap.fermi, gap.fermi) if gap.is_metallic else (gap.vbm, gap.cbm)
+            e_min = max(low - self.ENERGY_WINDOW, float(self.bands.band_min.min()))
+            e_max = min(high + self.ENERGY_WINDOW, float(self.bands.band_max.max()))
+            self.view = (float(k.min()), float(k.max()) if k.max() > k.min() else float(k.min()) + 1.0,
+                         e_min, e_max if e_max > e_min else e_min + 1.0)
+        self.schedule_redraw()
+
+    def schedule_redraw(self):
+        """Redesenha quando a interface ficar livre: vários eventos da roda viram um só desenho."""
+        if not self._redraw_pending:
+            self._redraw_pending = True
+            self.after_idle(self._redraw_now)
+
+    def _redraw_now(self):
+        self._redraw_pending = False
+        self.redraw()
+
+    def has_data(self):
+        return self.bands is not None
+
+    def _limits(self):
+        return self.view
+
+    def _envelope(self, limits, width):
+        key = (limits, width)
+        curves = self._envelopes.get(key)
+        if curves is None:
+            k_min, k_max, e_min, e_max = limits
+            curves = self.bands.envelope(k_min, k_max, width, e_min, e_max)
+            self._envelopes[key] = curves
+            if len(self._envelopes) > self.CACHED_VIEWS:
+                self._envelopes.popitem(last=False)
+        else:
+            self._envelopes.move_to_end(key)
+        return curves
+
+    def draw_data(self, to_px, limits, box):
+        self.box = box
+        left, top, plot_w, plot_h = box
+        gap = self.bands.gap
+        if not gap.is_metallic:
+            # Faixa do gap, atrás das curvas
+            _, y_cbm = to_px(0.0, gap.cbm)
+            _, y_vbm = to_px(0.0, gap.vbm)
+            self.create_rectangle(left, y_cbm, left + plot_w, y_vbm, fill='#fff3c4', outline='')
+
+        spins, _, x, y = self._envelope(limits, plot_w)
+        for spin, xs, ys in zip(spins.tolist(), x, y):
+            px, py = to_px(xs, ys)
+            if len(px) > 1:
+                self.create_line(*np.column_stack((px, py)).ravel().tolist(),
+                                 fill=self.SPIN_COLORS[spin % len(self.SPIN_COLORS)], width=1)
+
+        _, y_fermi = to_px(0.0, gap.fermi)
+        self.create_line(left, y_fermi, left + plot_w, y_fermi, fill='#555555', dash=(4, 3))
+        self.create_text(left + plot_w - 4, y_fermi - 2, text="E_F", anchor=tk.SE, fill='#555555',
+                         font=('Inter', 8))
+        if gap.is_metallic:
+            self.create_text(left + 6, top + 4, text="Metálico", anchor=tk.NW, font=('Inter', 9, 'bold'))
+            return
+        for k_coord, energy, label in ((gap.k_vbm_coord, gap.vbm, "VBM"), (gap.k_cbm_coord, gap.cbm, "CBM")):
+            px, py = to_px(k_coord, energy)
+            self.create_oval(px - 4, py - 4, px + 4, py + 4, fill='#2ca02c', outline='#1b5e20')
+            self.create_text(px + 6, py, text=label, anchor=tk.W, font=('Inter', 8))
+        kind = "direto" if gap.is_direct else "indireto"
+        self.create_text(left + 6, top + 4, text=f"Eg = {gap.gap:.3f} eV ({kind})", anchor=tk.NW,
+                         font=('Inter', 9, 'bold'))
+
+    def _to_data(self, px, py):
+        left, top, plot_w, plot_h = self.box
+        k_min, k_max, e_min, e_max = self.view
+        return (k_min + (px - left) / plot_w * (k_max - k_min),
+                e_min + (top + plot_h - py) / plot_h * (e_max - e_min))
+
+    @staticmethod
+    def _clamp(low, high, first, last):
+        """Mantém o intervalo [low, high] dentro de [first, last] (sem afastar além dele)."""
+        span = min(high - low, last - first) if last > first else high - low
+        low = min(max(low, first), max(last - span, first))
+        return low, low + span
+
+    def _clamp_view(self, k_min, k_max, e_min, e_max):
+        """A vista limitada ao caminho k e às energias das bandas (com uma pequena margem)."""
+        low, high = float(self.bands.band_min.min()), float(self.bands.band_max.max())
+        margin = 0.05 * (high - low) + 0.1
+        return (self._clamp(k_min, k_max, float(self.bands.k.min()), float(self.bands.k.max()))
+                + self._clamp(e_min, e_max, low - margin, high + margin))
+
+    def _on_wheel(self, event):
+        if self.view is None or self.box is None:
+            return
+        zoom_in = event.num == 4 or getattr(event, "delta", 0) > 0
+        factor = 0.8 if zoom_in else 1.25
+        k, e = self._to_data(event.x, event.y)
+        k_min, k_max, e_min, e_max = self.view
+        if not event.state & 0x0001: # Sem Shift: também no eixo k
+            k_min, k_max = k + (k_min - k) * factor, k + (k_max - k) * factor
+        e_min, e_max = e + (e_min - e) * factor, e + (e_max - e) * factor
+        if k_max > k_min and e_max - e_min > 1e-6:
+            self.view = self._clamp_view(k_min, k_max, e_min, e_max)
+            self.schedule_redraw()
+
+    def _on_press(self, event):
+        self._drag = (event.x, event.y, self.view)
+
+    def _on_drag(self, event):
+        if self._drag is None or self._drag[2] is None or self.box is None:
+            return
+        x0, y0, (k_min, k_max, e_min, e_max) = self._drag
+        _, _, plot_w, plot_h = self.box
+        dk = (event.x - x0) / plot_w * (k_max - k_min)
+        de = (event.y - y0) / plot_h * (e_max - e_min)
+        self.view = self._clamp_view(k_min - dk, k_max - dk, e_min + de, e_max + de)
+        self.schedule_redraw()
+
 # --- Classe Principal do Aplicativo Tkinter ---
 
 class NanophysicsApp(tk.Tk): # Renomeado de FortranApp para NanophysicsApp
@@ -270,24 +582,101 @@ class NanophysicsApp(tk.Tk): # Renomeado de FortranApp para NanophysicsApp
         self.ufpi_logo_path = "ufpi.png"
         self.nanophysics_logo_path = "gnc(1).png"
         self.qrcode_path = "qr(1)(1).png"
+        self.image_cache = {} # (caminho, tamanho, is_logo) -> PhotoImage (ou None), veja load_image_for_tkinter
+        self.startup_seconds = None # Tempo até a janela ficar pronta (veja report_startup)
+        self.backend_text = None # Núcleos de cálculo em uso (veja select_backend)
 
         # Variáveis para armazenar as informações do usuário
         self.user_name = ""
         self.user_role = ""
         self.user_advisor = ""
+        self.report_include_pairs = True # Apêndice com a lista de pares no relatório
+        self.report_write_csv = False # Lista completa de pares em CSV junto ao relatório
+
+        # Cálculos em segundo plano: um por aba, identificados pela chave de self.results
+        self.jobs = {}
+        self.job_messages = queue.Queue()
+        self.job_controls = {} # chave -> (botão de cálculo, botão de cancelar, barra de progresso)
+        self.job_outputs = {} # chave -> (widget de resultado, descrição usada nas mensagens de erro)
+        self.job_displays = {} # chave -> função que exibe o resultado em widgets próprios (padrão: texto)
+        self.job_commands = {} # chave -> função do botão de cálculo (usada na atualização automática)
+        self.pending_pdf = False # Relatório pedido enquanto havia cálculos em andamento
+        # Arquivos dos últimos cálculos: chave -> [caminho, (tamanho, mtime), mudança vista na última verificação]
+        self.watched_files = {}
+        # Durante uma relaxação o mesmo arquivo é recalculado várias vezes: guarda a última versão
+        # de cada um para refazer só os átomos que mudaram (veja configure_incremental)
+        configure_incremental(True)
+        # Tabelas grandes de todos os pares usam um processo por núcleo (veja condensed_distances)
+        configure_pair_engine(workers=None)
 
         self.create_widgets()
+        # Resultados como objetos do núcleo (ou mensagens de erro); o texto só é gerado
+        # na exibição e no relatório (veja format_result)
         self.results = {
-            "distancia_layers": "",
-            "calcula_distancias": "",
-            "calcula_gap": ""
+            "distancia_layers": None,
+            "calcula_distancias": None,
+            "consulta_distancias": None,
+            "calcula_gap": None,
+            "estrutura_bandas": None,
+            "distribuicao_radial": None
         }
+        self.poll_jobs()
+        self.poll_file_changes()
+        # Os logotipos (e o PIL) só são carregados depois que a janela aparece
+        self.after_idle(self.load_header_logos)
+
+    def load_header_logos(self):
+        """Troca os textos provisórios do cabeçalho pelos logotipos e registra o tempo de partida."""
+        for label, path, size in ((self.ufpi_label, self.ufpi_logo_path, (120, 120)),
+                                  (self.nanophysics_label, self.nanophysics_logo_path, (70, 70))):
+            photo = self.load_image_for_tkinter(path, size, is_logo=True)
+            if photo:
+                label.config(image=photo, text="")
+        self.report_startup()
+        self.select_backend()
+
+    def report_startup(self):
+        """
+        Mostra na barra de status o tempo desde a importação do programa até a janela ficar pronta
+        e, quando já escolhidos, os núcleos de cálculo em uso.
+        """
+        if self.startup_seconds is None:
+            self.startup_seconds = time.perf_counter() - _STARTED_AT
+        status = f"Pronto (janela aberta em {self.startup_seconds:.2f} s)."
+        if self.backend_text is not None:
+            status += f" {self.backend_text}."
+        self.status_var.set(status)
+
+    def select_backend(self):
+        """
+        Escolhe os núcleos de cálculo (veja set_backend) em segundo plano, depois que a janela
+        aparece: importar o Numba e verificar os núcleos não atrasa a abertura. Até lá, os
+        cálculos usam os núcleos NumPy.
+        """
+        def work():
+            try:
+                set_backend(DEFAULT_BACKEND)
+            except ValueError:
+                set_backend("auto")
+            self.job_messages.put(("backend", None, backend_status()))
+        threading.Thread(target=work, daemon=True).start()
 
     def load_image_for_tkinter(self, image_path, size, is_logo=False):
         """
         Carrega uma imagem de um caminho de arquivo para uso no Tkinter.
-        Se o arquivo não for encontrado, usa um placeholder.
+        Se o arquivo não for encontrado, usa um placeholder. Cada imagem é carregada uma única
+        vez por sessão; o PIL só é importado no primeiro uso (sem ele, retorna None).
         """
+        key = (image_path, tuple(size), is_logo)
+        if key not in self.image_cache:
+            self.image_cache[key] = self._load_image(image_path, size, is_logo)
+        return self.image_cache[key]
+
+    def _load_image(self, image_path, size, is_logo):
+        try:
+            from PIL import Image, ImageTk # Para exibir imagens no Tkinter
+        except ImportError:
+            return None # Sem o Pillow, os logotipos ficam como texto
         try:
             img = Image.open(image_path)
             # Manter a proporção da imagem
@@ -326,14 +715,10 @@ class NanophysicsApp(tk.Tk): # Renomeado de FortranApp para NanophysicsApp
         header_frame.pack(fill=tk.X, pady=10)
         header_frame.configure(relief="raised", borderwidth=2)
 
-        # Carregar e exibir logotipos
+        # Logotipos: textos provisórios, trocados pelas imagens em load_header_logos
         # UFPI Logo (maior)
-        self.ufpi_photo = self.load_image_for_tkinter(self.ufpi_logo_path, (120, 120), is_logo=True)
-        if self.ufpi_photo:
-            ufpi_label = tk.Label(header_frame, image=self.ufpi_photo)
-            ufpi_label.pack(side=tk.LEFT, padx=10)
-        else:
-            tk.Label(header_frame, text="[UFPI Logo]", font=("Inter", 10)).pack(side=tk.LEFT, padx=10)
+        self.ufpi_label = tk.Label(header_frame, text="[UFPI Logo]", font=("Inter", 10))
+        self.ufpi_label.pack(side=tk.LEFT, padx=10)
 
         # Título
         title_label = ttk.Label(header_frame, text="Ferramenta de Análise de Estruturas e Bandas",
@@ -341,12 +726,8 @@ class NanophysicsApp(tk.Tk): # Renomeado de FortranApp para NanophysicsApp
         title_label.pack(side=tk.LEFT, expand=True)
 
         # Nanophysics Logo (menor)
-        self.nanophysics_photo = self.load_image_for_tkinter(self.nanophysics_logo_path, (70, 70), is_logo=True)
-        if self.nanophysics_photo:
-            nanophysics_label = tk.Label(header_frame, image=self.nanophysics_photo)
-            nanophysics_label.pack(side=tk.RIGHT, padx=10)
-        else:
-            tk.Label(header_frame, text="[GNC Logo]", font=("Inter", 10)).pack(side=tk.RIGHT, padx=10)
+        self.nanophysics_label = tk.Label(header_frame, text="[GNC Logo]", font=("Inter", 10))
+        self.nanophysics_label.pack(side=tk.RIGHT, padx=10)
 
         # Notebook para as abas (cálculos)
         self.notebook = ttk.Notebook(self)
@@ -367,16 +748,52 @@ class NanophysicsApp(tk.Tk): # Renomeado de FortranApp para NanophysicsApp
         self.notebook.add(self.tab_calc_gap, text="Cálculo de Gap")
         self.create_calc_gap_tab()
 
+        # Aba: Estrutura de Bandas
+        self.tab_band_plot = ttk.Frame(self.notebook, padding="10")
+        self.notebook.add(self.tab_band_plot, text="Estrutura de Bandas")
+        self.create_band_plot_tab()
+
+        # Aba: Distribuição Radial
+        self.tab_rdf = ttk.Frame(self.notebook, padding="10")
+        self.notebook.add(self.tab_rdf, text="Distribuição Radial")
+        self.create_rdf_tab()
+
         # Frame para os botões de PDF e Sobre
         bottom_buttons_frame = ttk.Frame(self, padding="10 10 10 10")
         bottom_buttons_frame.pack(fill=tk.X, pady=10)
         
-        ttk.Button(bottom_buttons_frame, text="Gerar Relatório PDF", command=self.generate_pdf,
+        pdf_button = ttk.Button(bottom_buttons_frame, text="Gerar Relatório PDF", command=self.generate_pdf,
+                                style='TButton')
+        pdf_button.pack(side=tk.LEFT, padx=5, expand=True)
+        # O relatório é gerado em segundo plano, com progresso e cancelamento como os cálculos
+        report_cancel_button = ttk.Button(bottom_buttons_frame, text="Cancelar",
+                                          command=lambda: self.cancel_job("relatorio"),
+                                          style='TButton', state='disabled')
+        report_cancel_button.pack(side=tk.LEFT, padx=5)
+        report_progress_bar = ttk.Progressbar(bottom_buttons_frame, mode='determinate', maximum=100, length=120)
+        report_progress_bar.pack(side=tk.LEFT, padx=5)
+        self.job_controls["relatorio"] = (pdf_button, report_cancel_button, report_progress_bar)
+
+        ttk.Button(bottom_buttons_frame, text="Limpar Cache", command=self.clear_cache,
                    style='TButton').pack(side=tk.LEFT, padx=5, expand=True)
-        
+
         ttk.Button(bottom_buttons_frame, text="Sobre", command=self.show_about_info,
                    style='TButton').pack(side=tk.RIGHT, padx=5, expand=True)
 
+        # Instrumentação: tempo, memória e bytes lidos de cada etapa, na barra de status
+        self.profile_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(bottom_buttons_frame, text="Medir Desempenho", variable=self.profile_var,
+                        command=self.toggle_profiling).pack(side=tk.LEFT, padx=5)
+        ttk.Button(bottom_buttons_frame, text="Exportar Perfil", command=self.export_profile_trace,
+                   style='TButton').pack(side=tk.LEFT, padx=5)
+        # Recalcula as abas quando o arquivo usado muda no disco (ex.: novo passo de relaxação)
+        self.auto_refresh_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(bottom_buttons_frame, text="Atualizar ao Mudar",
+                        variable=self.auto_refresh_var).pack(side=tk.LEFT, padx=5)
+        self.status_var = tk.StringVar(value="Pronto.")
+        ttk.Label(self, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W,
+                  padding="5 2").pack(side=tk.BOTTOM, fill=tk.X)
+
         # Estilo para os botões
         style = ttk.Style()
         style.configure('TButton', font=('Inter', 10, 'bold'),
@@ -396,16 +813,41 @@ class NanophysicsApp(tk.Tk): # Renomeado de FortranApp para NanophysicsApp
         ttk.Label(frame, text="Arquivo .xyz:").pack(pady=5, anchor=tk.W)
         self.file_dist_layers_entry = ttk.Entry(frame, width=50)
         self.file_dist_layers_entry.pack(pady=5, fill=tk.X)
-        ttk.Button(frame, text="Selecionar Arquivo", command=lambda: self.select_file(self.file_dist_layers_entry, ".xyz"),
+        ttk.Button(frame, text="Selecionar Arquivo", command=lambda: self.select_file(self.file_dist_layers_entry, STRUCTURE_FILETYPES),
                    style='TButton').pack(pady=5)
 
-        ttk.Button(frame, text="Calcular Distância", command=self.run_dist_layers,
-                   style='TButton').pack(pady=10)
+        self.dist_layers_pbc_var, self.dist_layers_lattice_entry = self.create_pbc_controls(frame)
+
+        # Detecção automática das camadas pelos vazios em z (em vez dos 2 primeiros / 2 últimos átomos)
+        detect_frame = ttk.Frame(frame)
+        detect_frame.pack(pady=5, fill=tk.X)
+        self.dist_layers_detect_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(detect_frame, text="Detectar camadas automaticamente (qualquer ordem de átomos)",
+                        variable=self.dist_layers_detect_var).pack(side=tk.LEFT, padx=5)
+        ttk.Label(detect_frame, text="Tolerância (Å):").pack(side=tk.LEFT, padx=(10, 2))
+        self.dist_layers_tolerance_entry = ttk.Entry(detect_frame, width=8)
+        self.dist_layers_tolerance_entry.insert(0, f"{LAYER_GAP_TOLERANCE:.1f}")
+        self.dist_layers_tolerance_entry.pack(side=tk.LEFT)
+
+        # Trajetórias: distância entre camadas quadro a quadro
+        traj_frame = ttk.Frame(frame)
+        traj_frame.pack(pady=5, fill=tk.X)
+        self.dist_layers_traj_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(traj_frame, text="Trajetória (vários quadros)",
+                        variable=self.dist_layers_traj_var).pack(side=tk.LEFT, padx=5)
+        self.dist_layers_bonds_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(traj_frame, text="Estatísticas de ligação por quadro (raios covalentes)",
+                        variable=self.dist_layers_bonds_var).pack(side=tk.LEFT, padx=5)
+        self.dist_layers_frames_entry = self.create_frame_selection_entry(
+            frame, "Quadros (ex.: 5, -1 ou 1:1000:10; vazio = todos):")
+
+        self.create_job_controls(frame, "distancia_layers", "Calcular Distância", self.run_dist_layers)
 
         ttk.Label(frame, text="Resultados:").pack(pady=5, anchor=tk.W)
         self.result_dist_layers_text = tk.Text(frame, height=5, width=60, state='disabled', wrap=tk.WORD)
         self.result_dist_layers_text.pack(pady=5, fill=tk.BOTH, expand=True)
         self.result_dist_layers_text.configure(font=('Inter', 10), bg='#e0e0e0', fg='#333333', relief='flat')
+        self.job_outputs["distancia_layers"] = (self.result_dist_layers_text, "distância entre camadas")
 
 
     def create_calc_dist_tab(self):
@@ -415,50 +857,444 @@ class NanophysicsApp(tk.Tk): # Renomeado de FortranApp para NanophysicsApp
         ttk.Label(frame, text="Arquivo .xyz:").pack(pady=5, anchor=tk.W)
         self.file_calc_dist_entry = ttk.Entry(frame, width=50)
         self.file_calc_dist_entry.pack(pady=5, fill=tk.X)
-        ttk.Button(frame, text="Selecionar Arquivo", command=lambda: self.select_file(self.file_calc_dist_entry, ".xyz"),
+        ttk.Button(frame, text="Selecionar Arquivo", command=lambda: self.select_file(self.file_calc_dist_entry, STRUCTURE_FILETYPES),
                    style='TButton').pack(pady=5)
 
-        ttk.Button(frame, text="Calcular Distâncias", command=self.run_calc_dist,
-                   style='TButton').pack(pady=10)
+        # Modo de cálculo: todos os pares (sistemas pequenos) ou apenas ligações (lista de células)
+        mode_frame = ttk.Frame(frame)
+        mode_frame.pack(pady=5, fill=tk.X)
+        self.calc_dist_mode = tk.StringVar(value="todos")
+        ttk.Radiobutton(mode_frame, text="Todos os pares", value="todos",
+                        variable=self.calc_dist_mode).pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(mode_frame, text="Ligações (raios covalentes)", value="covalente",
+                        variable=self.calc_dist_mode).pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(mode_frame, text="Ligações (raio de corte)", value="corte",
+                        variable=self.calc_dist_mode).pack(side=tk.LEFT, padx=5)
+        ttk.Label(mode_frame, text="Corte (Å):").pack(side=tk.LEFT, padx=(10, 2))
+        self.calc_dist_cutoff_entry = ttk.Entry(mode_frame, width=8)
+        self.calc_dist_cutoff_entry.insert(0, "3.0")
+        self.calc_dist_cutoff_entry.pack(side=tk.LEFT)
+        self.calc_dist_float32_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(mode_frame, text="Precisão simples (metade da memória)",
+                        variable=self.calc_dist_float32_var).pack(side=tk.LEFT, padx=10)
+
+        self.calc_dist_pbc_var, self.calc_dist_lattice_entry = self.create_pbc_controls(frame)
+        self.calc_dist_frame_entry = self.create_frame_selection_entry(
+            frame, "Quadro da trajetória (ex.: 5 ou -1; vazio = arquivo de um quadro):")
+
+        self.create_job_controls(frame, "calcula_distancias", "Calcular Distâncias", self.run_calc_dist)
+
+        # Consultas direcionadas (vizinhos, raio, seleções e pares), sem calcular todos os pares
+        ttk.Label(frame, text="Consulta (ex.: vizinhos 3 de Mo; raio 3.2 de Mo entre S; "
+                              "pares S camada 1 com S camada 2; par 17 902):").pack(pady=5, anchor=tk.W)
+        self.calc_dist_query_entry = ttk.Entry(frame, width=50)
+        self.calc_dist_query_entry.pack(pady=5, fill=tk.X)
+        self.calc_dist_query_entry.bind("<Return>", lambda event: self.run_distance_query())
+        self.create_job_controls(frame, "consulta_distancias", "Consultar", self.run_distance_query)
 
         ttk.Label(frame, text="Resultados:").pack(pady=5, anchor=tk.W)
-        self.result_calc_dist_text = tk.Text(frame, height=10, width=60, state='disabled', wrap=tk.WORD)
-        self.result_calc_dist_text.pack(pady=5, fill=tk.BOTH, expand=True)
+        self.result_calc_dist_text = tk.Text(frame, height=3, width=60, state='disabled', wrap=tk.WORD)
+        self.result_calc_dist_text.pack(pady=5, fill=tk.X)
         self.result_calc_dist_text.configure(font=('Inter', 10), bg='#e0e0e0', fg='#333333', relief='flat')
+        # Os pares ficam em uma tabela virtual, e não no texto (veja PairTableView)
+        self.calc_dist_table = PairTableView(frame)
+        self.calc_dist_table.pack(pady=5, fill=tk.BOTH, expand=True)
+        self.job_outputs["calcula_distancias"] = (self.result_calc_dist_text, "distâncias entre átomos")
+        self.job_displays["calcula_distancias"] = self.show_pair_distances
+        self.job_outputs["consulta_distancias"] = (self.result_calc_dist_text, "consulta de distâncias")
+        self.job_displays["consulta_distancias"] = self.show_pair_distances
 
 
     def create_calc_gap_tab(self):
         frame = ttk.LabelFrame(self.tab_calc_gap, text="Calcular Gap de Energia", padding="10")
         frame.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
 
-        ttk.Label(frame, text="Arquivo .bands:").pack(pady=5, anchor=tk.W)
+        ttk.Label(frame, text="Arquivo .bands, bands.dat ou saída do pw.x:").pack(pady=5, anchor=tk.W)
         self.file_calc_gap_entry = ttk.Entry(frame, width=50)
         self.file_calc_gap_entry.pack(pady=5, fill=tk.X)
-        ttk.Button(frame, text="Selecionar Arquivo", command=lambda: self.select_file(self.file_calc_gap_entry, ".bands"),
+        ttk.Button(frame, text="Selecionar Arquivo", command=lambda: self.select_file(self.file_calc_gap_entry, BANDS_FILETYPES),
                    style='TButton').pack(pady=5)
 
-        ttk.Button(frame, text="Calcular Gap", command=self.run_calc_gap,
-                   style='TButton').pack(pady=10)
+        ttk.Label(frame, text="Nível de Fermi (eV), para o bands.dat do Quantum ESPRESSO (opcional):").pack(
+            pady=5, anchor=tk.W)
+        self.calc_gap_fermi_entry = ttk.Entry(frame, width=20)
+        self.calc_gap_fermi_entry.pack(pady=5, anchor=tk.W)
+
+        self.create_job_controls(frame, "calcula_gap", "Calcular Gap", self.run_calc_gap)
 
         ttk.Label(frame, text="Resultados:").pack(pady=5, anchor=tk.W)
         self.result_calc_gap_text = tk.Text(frame, height=5, width=60, state='disabled', wrap=tk.WORD)
         self.result_calc_gap_text.pack(pady=5, fill=tk.BOTH, expand=True)
         self.result_calc_gap_text.configure(font=('Inter', 10), bg='#e0e0e0', fg='#333333', relief='flat')
+        self.job_outputs["calcula_gap"] = (self.result_calc_gap_text, "gap")
+
+
+    def create_band_plot_tab(self):
+        frame = ttk.LabelFrame(self.tab_band_plot, text="Estrutura de Bandas", padding="10")
+        frame.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
+
+        ttk.Label(frame, text="Arquivo .bands, bands.dat ou saída do pw.x:").pack(pady=5, anchor=tk.W)
+        self.file_band_plot_entry = ttk.Entry(frame, width=50)
+        self.file_band_plot_entry.pack(pady=5, fill=tk.X)
+        ttk.Button(frame, text="Selecionar Arquivo",
+                   command=lambda: self.select_file(self.file_band_plot_entry, BANDS_FILETYPES),
+                   style='TButton').pack(pady=5)
+
+        fermi_frame = ttk.Frame(frame)
+        fermi_frame.pack(pady=5, fill=tk.X)
+        ttk.Label(fermi_frame, text="Nível de Fermi (eV), para o bands.dat (opcional):").pack(side=tk.LEFT)
+        self.band_plot_fermi_entry = ttk.Entry(fermi_frame, width=12)
+        self.band_plot_fermi_entry.pack(side=tk.LEFT, padx=5)
+
+        self.create_job_controls(frame, "estrutura_bandas", "Desenhar Bandas", self.run_band_structure)
+
+        self.result_band_plot_text = tk.Text(frame, height=3, width=60, state='disabled', wrap=tk.WORD)
+        self.result_band_plot_text.pack(pady=5, fill=tk.X)
+        self.result_band_plot_text.configure(font=('Inter', 10), bg='#e0e0e0', fg='#333333', relief='flat')
+        self.band_plot = BandPlotCanvas(frame)
+        self.band_plot.pack(pady=5, fill=tk.BOTH, expand=True)
+        ttk.Label(frame, text="Roda do mouse: zoom (com Shift, só na energia) · arrastar: mover · "
+                              "duplo clique: vista inicial", foreground='#666666').pack(anchor=tk.W)
+        self.job_outputs["estrutura_bandas"] = (self.result_band_plot_text, "estrutura de bandas")
+        self.job_displays["estrutura_bandas"] = self.show_band_structure
+
+
+    def create_rdf_tab(self):
+        frame = ttk.LabelFrame(self.tab_rdf, text="Distribuição Radial e Comprimentos de Ligação", padding="10")
+        frame.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
+
+        ttk.Label(frame, text="Arquivo .xyz:").pack(pady=5, anchor=tk.W)
+        self.file_rdf_entry = ttk.Entry(frame, width=50)
+        self.file_rdf_entry.pack(pady=5, fill=tk.X)
+        ttk.Button(frame, text="Selecionar Arquivo", command=lambda: self.select_file(self.file_rdf_entry, STRUCTURE_FILETYPES),
+                   style='TButton').pack(pady=5)
+
+        # g(r) de todos os pares até r_max, ou histograma só dos pares ligados
+        mode_frame = ttk.Frame(frame)
+        mode_frame.pack(pady=5, fill=tk.X)
+        self.rdf_mode = tk.StringVar(value="rdf")
+        ttk.Radiobutton(mode_frame, text="g(r)", value="rdf", variable=self.rdf_mode).pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(mode_frame, text="Comprimentos de ligação", value="ligacoes",
+                        variable=self.rdf_mode).pack(side=tk.LEFT, padx=5)
+        ttk.Label(mode_frame, text="r máx. (Å):").pack(side=tk.LEFT, padx=(10, 2))
+        self.rdf_rmax_entry = ttk.Entry(mode_frame, width=6)
+        self.rdf_rmax_entry.insert(0, f"{RDF_DEFAULT_RMAX:.1f}")
+        self.rdf_rmax_entry.pack(side=tk.LEFT)
+        ttk.Label(mode_frame, text="Intervalos:").pack(side=tk.LEFT, padx=(10, 2))
+        self.rdf_bins_entry = ttk.Entry(mode_frame, width=6)
+        self.rdf_bins_entry.insert(0, str(RDF_DEFAULT_BINS))
+        self.rdf_bins_entry.pack(side=tk.LEFT)
+        ttk.Label(mode_frame, text="Par (ex.: Mo-S; vazio = todos):").pack(side=tk.LEFT, padx=(10, 2))
+        self.rdf_pair_entry = ttk.Entry(mode_frame, width=8)
+        self.rdf_pair_entry.pack(side=tk.LEFT)
+
+        self.rdf_pbc_var, self.rdf_lattice_entry = self.create_pbc_controls(frame)
+        self.rdf_frames_entry = self.create_frame_selection_entry(
+            frame, "Quadros (ex.: 5, -1 ou 1:1000:10; vazio = média de todos):")
+
+        self.create_job_controls(frame, "distribuicao_radial", "Calcular Distribuição", self.run_rdf)
+
+        ttk.Label(frame, text="Resultados:").pack(pady=5, anchor=tk.W)
+        self.result_rdf_text = tk.Text(frame, height=4, width=60, state='disabled', wrap=tk.WORD)
+        self.result_rdf_text.pack(pady=5, fill=tk.X)
+        self.result_rdf_text.configure(font=('Inter', 10), bg='#e0e0e0', fg='#333333', relief='flat')
+        self.rdf_plot = PlotCanvas(frame)
+        self.rdf_plot.pack(pady=5, fill=tk.BOTH, expand=True)
+        self.job_outputs["distribuicao_radial"] = (self.result_rdf_text, "distribuição radial")
+        self.job_displays["distribuicao_radial"] = self.show_distance_histogram
+
+
+    def create_job_controls(self, parent, key, text, command):
+        """
+        Cria os controles de execução de uma aba: o botão de cálculo, um botão para
+        cancelar e uma barra de progresso, registrados em self.job_controls[key],
+        além do botão que exporta o último resultado da aba.
+        """
+        controls_frame = ttk.Frame(parent)
+        controls_frame.pack(pady=10, fill=tk.X)
+        run_button = ttk.Button(controls_frame, text=text, command=command, style='TButton')
+        run_button.pack(side=tk.LEFT, padx=5)
+        cancel_button = ttk.Button(controls_frame, text="Cancelar", command=lambda: self.cancel_job(key),
+                                   style='TButton', state='disabled')
+        cancel_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(controls_frame, text="Exportar Dados", command=lambda: self.export_results(key),
+                   style='TButton').pack(side=tk.RIGHT, padx=5)
+        progress_bar = ttk.Progressbar(controls_frame, mode='determinate', maximum=100)
+        progress_bar.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+        self.job_controls[key] = (run_button, cancel_button, progress_bar)
+        self.job_commands[key] = command
+
+    def start_job(self, key, work, watch_path=None):
+        """
+        Inicia work(progress) em segundo plano para a aba 'key'. 'work' roda fora da thread
+        da interface: deve receber todos os dados já lidos dos widgets e retornar o objeto
+        de resultado (ou uma mensagem de erro), que poll_jobs exibe quando o cálculo termina.
+        'watch_path' é o arquivo usado, acompanhado por poll_file_changes.
+        """
+        if watch_path is not None:
+            self.watched_files[key] = [watch_path, self.file_stamp(watch_path), None]
+        run_button, cancel_button, progress_bar = self.job_controls[key]
+        run_button.config(state='disabled')
+        cancel_button.config(state='normal')
+        # Indeterminada até a primeira mensagem de progresso
+        progress_bar.config(mode='indeterminate', value=0)
+        progress_bar.start(10)
+        self.update_text_widget(self.job_outputs[key][0], "Calculando...")
+
+        job = BackgroundJob(key, work, self.job_messages)
+        self.jobs[key] = job
+        job.start()
+
+    def cancel_job(self, key):
+        job = self.jobs.get(key)
+        if job is not None:
+            job.cancel()
+            self.job_controls[key][1].config(state='disabled')
+
+    def finish_job(self, key):
+        """Restaura os controles da aba e, se não restar cálculo em andamento, gera o PDF pendente."""
+        self.jobs.pop(key, None)
+        run_button, cancel_button, progress_bar = self.job_controls[key]
+        progress_bar.stop()
+        progress_bar.config(mode='determinate', value=0)
+        run_button.config(state='normal')
+        cancel_button.config(state='disabled')
+        if self.pending_pdf and not self.jobs:
+            self.pending_pdf = False
+            self._perform_pdf_generation()
+
+    def poll_jobs(self):
+        """
+        Lê as mensagens das threads de cálculo e atualiza a interface. Roda na thread
+        do Tkinter e se reagenda a cada 100 ms.
+        """
+        while True:
+            try:
+                kind, key, payload = self.job_messages.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "exported":
+                messagebox.showinfo("Dados Exportados", f"Resultado salvo com sucesso em:\n{payload}")
+                continue
+            if kind == "export_error":
+                messagebox.showerror("Erro ao Exportar", f"Ocorreu um erro ao exportar o resultado: {payload}")
+                continue
+            if kind == "backend":
+                self.backend_text = payload
+                self.report_startup()
+                continue
+            if kind == "progress":
+                progress_bar = self.job_controls[key][2]
+                if str(progress_bar.cget('mode')) == 'indeterminate':
+                    progress_bar.stop()
+                    progress_bar.config(mode='determinate')
+                progress_bar.config(value=payload * 100)
+                continue
+
+            job = self.jobs.get(key)
+            self.finish_job(key)
+            if key == "relatorio":
+                self.show_report_message(kind, payload)
+                self.show_profile_status(key, job)
+                continue
+            text_widget, description = self.job_outputs[key]
+            if kind == "done":
+                self.results[key] = payload
+                if key in self.job_displays:
+                    self.job_displays[key](payload)
+                else:
+                    self.update_text_widget(text_widget, format_result(payload))
+            elif kind == "cancelled":
+                self.update_text_widget(text_widget, "Cálculo cancelado pelo usuário.")
+                self.results[key] = None
+            else:
+                messagebox.showerror("Erro de Execução", f"Ocorreu um erro ao executar o cálculo: {payload}")
+                self.update_text_widget(text_widget, f"Erro: {payload}")
+                self.results[key] = f"Erro no cálculo de {description}: {payload}"
+            self.show_profile_status(key, job)
+
+        self.after(100, self.poll_jobs)
+
+    def file_stamp(self, path):
+        """(tamanho, mtime) de um arquivo, ou None se ele não puder ser lido."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def poll_file_changes(self):
+        """
+        Com "Atualizar ao Mudar" marcado, refaz o cálculo de cada aba cujo arquivo mudou no disco.
+        Uma mudança só dispara o cálculo quando aparece igual em duas verificações seguidas,
+        para não ler um arquivo ainda sendo gravado. Roda na thread do Tkinter a cada segundo.
+        """
+        if self.auto_refresh_var.get():
+            for key, watched in list(self.watched_files.items()):
+                path, stamp, pending = watched
+                current = self.file_stamp(path)
+                if key in self.jobs or current is None or current == stamp:
+                    watched[2] = None
+                elif current != pending:
+                    watched[2] = current
+                else:
+                    watched[1], watched[2] = current, None
+                    self.status_var.set(f"{os.path.basename(path)} mudou: recalculando...")
+                    self.job_commands[key]()
+        self.after(1000, self.poll_file_changes)
+
+    def toggle_profiling(self):
+        """Liga ou desliga a instrumentação das etapas (veja enable_profiling)."""
+        if self.profile_var.get():
+            enable_profiling(trace_memory=True)
+            self.status_var.set("Medição de desempenho ligada: o próximo cálculo mostrará o tempo de cada etapa.")
+        else:
+            disable_profiling()
+            self.status_var.set("Medição de desempenho desligada.")
+
+    def show_profile_status(self, key, job):
+        """
+        Mostra na barra de status o tempo de cada etapa do cálculo que acabou de terminar,
+        o pico de memória e os bytes lidos. Usa as medições feitas desde o início do cálculo
+        pela sua thread e pela thread da interface (exibição do resultado).
+        """
+        profiler = get_profiler()
+        if profiler is None or job is None:
+            return
+        main = threading.get_ident()
+        records = [r for r in profiler.records[job.profile_mark:] if r.thread in (job.thread.ident, main)]
+        # Total: o cálculo inteiro (aba/<key>) mais a formatação e a exibição, na thread da interface
+        total = sum(r.duration for r in records if r.name.startswith("aba/") or (r.thread == main and r.depth == 0))
+        parts, peak, read = [], None, 0
+        for name, entry in profiler.summary(records).items():
+            read += entry["bytes_lidos"]
+            if entry["pico_bytes"] is not None:
+                peak = max(peak or 0, entry["pico_bytes"])
+            if not name.startswith("aba/"):
+                parts.append(f"{name} {entry['tempo_s'] * 1000:.1f} ms")
+        status = f"{key}: {total * 1000:.1f} ms"
+        if parts:
+            status += " | " + " · ".join(parts)
+        if peak is not None:
+            status += f" | pico {peak / 2**20:.1f} MiB"
+        if read:
+            status += f" | lidos {read / 2**20:.1f} MiB"
+        self.status_var.set(status)
+
+    def export_profile_trace(self):
+        """Grava as medições da sessão no formato Trace Event (veja StageProfiler.write_trace)."""
+        profiler = get_profiler()
+        if profiler is None or not profiler.records:
+            messagebox.showwarning("Nada para Exportar",
+                                   "Marque \"Medir Desempenho\" e execute um cálculo antes de exportar o perfil.")
+            return
+        file_name = filedialog.asksaveasfilename(defaultextension=".json", initialfile="perfil_layers.json",
+                                                 filetypes=[("Trace Event (Perfetto, chrome://tracing)", "*.json")])
+        if not file_name:
+            return
+        try:
+            profiler.write_trace(file_name)
+        except OSError as e:
+            messagebox.showerror("Erro ao Exportar", f"Ocorreu um erro ao gravar o perfil: {e}")
+            return
+        messagebox.showinfo("Perfil Exportado",
+                            f"Perfil salvo em:\n{file_name}\n\nAbra-o em ui.perfetto.dev ou chrome://tracing.")
+
+    def export_results(self, key):
+        """
+        Exporta o último resultado de uma aba em colunas (.npz, .npy, .csv ou .json; veja export_result).
+        A gravação roda em segundo plano e avisa pela fila de mensagens quando termina.
+        """
+        result = self.results[key]
+        if result is None or isinstance(result, str):
+            messagebox.showwarning("Nada para Exportar", "Execute o cálculo desta aba antes de exportar os dados.")
+            return
+        file_name = filedialog.asksaveasfilename(
+            defaultextension=".npz", initialfile=f"{key}.npz",
+            filetypes=[("NumPy (colunas)", "*.npz"), ("NumPy (tabela)", "*.npy"),
+                       ("CSV", "*.csv"), ("JSON", "*.json")])
+        if not file_name:
+            return
+        if os.path.splitext(file_name)[1].lower() not in EXPORT_FORMATS:
+            messagebox.showwarning("Formato Inválido", f"Use uma das extensões: {', '.join(EXPORT_FORMATS)}.")
+            return
+
+        def write():
+            try:
+                export_result(result, file_name)
+            except Exception as e:
+                self.job_messages.put(("export_error", key, e))
+            else:
+                self.job_messages.put(("exported", key, file_name))
 
+        threading.Thread(target=write, daemon=True).start()
 
-    def select_file(self, entry_widget, file_extension):
-        file_path = filedialog.askopenfilename(
-            filetypes=[(f"Arquivos {file_extension}", f"*{file_extension}"), ("Todos os arquivos", "*.*")]
-        )
+    def create_pbc_controls(self, parent):
+        """
+        Cria os controles de condições periódicas de uma aba: uma caixa para ativar a PBC
+        e um campo opcional para os vetores de rede (substituem os do arquivo extended-XYZ).
+        Retorna (variável da caixa, campo dos vetores).
+        """
+        pbc_frame = ttk.Frame(parent)
+        pbc_frame.pack(pady=5, fill=tk.X)
+        pbc_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(pbc_frame, text="Usar PBC (imagem mínima)", variable=pbc_var).pack(side=tk.LEFT, padx=5)
+        ttk.Label(pbc_frame, text="Vetores de rede (Å, opcional):").pack(side=tk.LEFT, padx=(10, 2))
+        lattice_entry = ttk.Entry(pbc_frame, width=40)
+        lattice_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        return pbc_var, lattice_entry
+
+    def read_pbc_controls(self, pbc_var, lattice_entry):
+        """
+        Lê os controles de PBC de uma aba. Retorna (use_pbc, lattice), com lattice=None
+        para usar a célula do arquivo, ou None se os vetores digitados forem inválidos.
+        """
+        use_pbc = pbc_var.get()
+        lattice_text = lattice_entry.get().strip()
+        if not use_pbc or not lattice_text:
+            return use_pbc, None
+        try:
+            return use_pbc, parse_lattice_text(lattice_text)
+        except ValueError as e:
+            messagebox.showwarning("Entrada Inválida", f"Vetores de rede inválidos: {e}")
+            return None
+
+    def create_frame_selection_entry(self, parent, label):
+        """Cria um campo para escolher quadros de uma trajetória .xyz (veja parse_frame_selection)."""
+        frames_frame = ttk.Frame(parent)
+        frames_frame.pack(pady=5, fill=tk.X)
+        ttk.Label(frames_frame, text=label).pack(side=tk.LEFT, padx=5)
+        entry = ttk.Entry(frames_frame, width=20)
+        entry.pack(side=tk.LEFT)
+        return entry
+
+    def read_frame_selection(self, entry, allow_range):
+        """
+        Lê a seleção de quadros de um campo. Retorna (ok, seleção), onde seleção é None,
+        um índice inteiro ou (se allow_range) um slice.
+        """
+        try:
+            selection = parse_frame_selection(entry.get())
+        except ValueError as e:
+            messagebox.showwarning("Entrada Inválida", f"Seleção de quadros inválida: {e}")
+            return False, None
+        if isinstance(selection, slice) and not allow_range:
+            messagebox.showwarning("Entrada Inválida", "Informe um único quadro (ex.: 5 ou -1).")
+            return False, None
+        return True, selection
+
+    def select_file(self, entry_widget, filetypes):
+        file_path = filedialog.askopenfilename(filetypes=filetypes + [("Todos os arquivos", "*.*")])
         if file_path:
             entry_widget.delete(0, tk.END)
             entry_widget.insert(0, file_path)
 
     def update_text_widget(self, text_widget, content):
-        text_widget.config(state='normal')
-        text_widget.delete(1.0, tk.END)
-        text_widget.insert(tk.END, content)
-        text_widget.config(state='disabled')
+        with profile_stage("interface/exibicao", caracteres=len(content)):
+            text_widget.config(state='normal')
+            text_widget.delete(1.0, tk.END)
+            text_widget.insert(tk.END, content)
+            text_widget.config(state='disabled')
 
     def run_dist_layers(self):
         file_path = self.file_dist_layers_entry.get()
@@ -466,26 +1302,75 @@ class NanophysicsApp(tk.Tk): # Renomeado de FortranApp para NanophysicsApp
             messagebox.showwarning("Entrada Inválida", "Por favor, selecione um arquivo .xyz.")
             return
 
-        try:
-            # Chama a função Python traduzida
-            dist_ang, dist_bohr = calculate_layer_distance_python(file_path)
+        pbc_options = self.read_pbc_controls(self.dist_layers_pbc_var, self.dist_layers_lattice_entry)
+        if pbc_options is None:
+            return
+        use_pbc, lattice = pbc_options
 
-            if dist_ang == -999.99:
-                result_str = f"Erro: Não foi possível abrir ou processar o arquivo '{os.path.basename(file_path)}'."
-            elif dist_ang == -888.88:
-                result_str = "Erro: Número insuficiente de átomos no arquivo para calcular a distância entre camadas (mínimo de 4)."
-            else:
-                result_str = (f"Distância entre camadas:\n"
-                              f" - Em angstroms: {dist_ang:.4f} Å\n"
-                              f" - Em bohr: {dist_bohr:.4f} bohr")
+        trajectory = self.dist_layers_traj_var.get()
+        ok, frames = self.read_frame_selection(self.dist_layers_frames_entry, allow_range=trajectory)
+        if not ok:
+            return
 
-            self.update_text_widget(self.result_dist_layers_text, result_str)
-            self.results["distancia_layers"] = result_str
-        except Exception as e:
-            messagebox.showerror("Erro de Execução", f"Ocorreu um erro ao executar o cálculo: {e}")
-            self.update_text_widget(self.result_dist_layers_text, f"Erro: {e}")
-            self.results["distancia_layers"] = f"Erro no cálculo de distância entre camadas: {e}"
+        if trajectory:
+            if isinstance(frames, int):
+                frames = slice(frames, frames + 1 or None) # Um único quadro como intervalo
+            bond_stats = self.dist_layers_bonds_var.get()
+            self.start_job("distancia_layers", lambda progress: self.run_dist_layers_trajectory(
+                file_path, use_pbc, lattice, frames, bond_stats, progress), watch_path=file_path)
+            return
+
+        if self.dist_layers_detect_var.get():
+            try:
+                tolerance = float(self.dist_layers_tolerance_entry.get().replace(',', '.'))
+            except ValueError:
+                tolerance = -1.0
+            if tolerance <= 0.0:
+                messagebox.showwarning("Entrada Inválida", "Por favor, informe uma tolerância positiva (em Å).")
+                return
+            self.start_job("distancia_layers", lambda progress: self.run_detect_layers(
+                file_path, tolerance, use_pbc, lattice, frames), watch_path=file_path)
+            return
+
+        def work(progress):
+            try:
+                return calculate_layer_distance(file_path, use_pbc=use_pbc, lattice=lattice, frame=frames)
+            except XYZFormatError as e:
+                if e.natoms is not None and e.natoms < 4:
+                    return "Erro: Número insuficiente de átomos no arquivo para calcular a distância entre camadas (mínimo de 4)."
+                return f"Erro: Não foi possível abrir ou processar o arquivo '{os.path.basename(file_path)}'."
+            except (OSError, IndexError, ValueError):
+                return f"Erro: Não foi possível abrir ou processar o arquivo '{os.path.basename(file_path)}'."
 
+        self.start_job("distancia_layers", work, watch_path=file_path)
+
+
+    def run_detect_layers(self, file_path, tolerance, use_pbc, lattice, frame=None):
+        """
+        Versão de run_dist_layers com detecção automática das camadas. Roda em segundo plano
+        (veja start_job) e retorna o LayerSegmentation, exibido por format_layer_segmentation.
+        """
+        try:
+            return calculate_layers(file_path, tolerance, use_pbc=use_pbc, lattice=lattice, frame=frame)
+        except FileNotFoundError:
+            return f"Erro: Não foi possível abrir o arquivo '{os.path.basename(file_path)}'."
+        except (XYZFormatError, IndexError, ValueError) as e:
+            return f"Erro: {e}"
+
+    def run_dist_layers_trajectory(self, file_path, use_pbc, lattice, frames=None, bond_stats=False,
+                                   progress=None):
+        """
+        Versão de run_dist_layers para trajetórias. Roda em segundo plano (veja start_job)
+        e retorna o LayerDistanceSeries, exibido por format_layer_series.
+        """
+        try:
+            return calculate_layer_distance_trajectory_python(
+                file_path, use_pbc=use_pbc, lattice=lattice, bond_stats=bond_stats,
+                frames=frames, progress=progress)
+        except FileNotFoundError:
+            return f"Erro: Não foi possível abrir o arquivo '{os.path.basename(file_path)}'."
+        except (XYZFormatError, ValueError) as e:
+            return f"Erro: {e}"
 
     def run_calc_dist(self):
         file_path = self.file_calc_dist_entry.get()
@@ -493,55 +1378,229 @@ class NanophysicsApp(tk.Tk): # Renomeado de FortranApp para NanophysicsApp
             messagebox.showwarning("Entrada Inválida", "Por favor, selecione um arquivo .xyz.")
             return
 
+        mode = self.calc_dist_mode.get()
+        cutoff = None
+        if mode == "corte":
+            try:
+                cutoff = float(self.calc_dist_cutoff_entry.get().replace(',', '.'))
+            except ValueError:
+                cutoff = -1.0
+            if cutoff <= 0.0:
+                messagebox.showwarning("Entrada Inválida", "Por favor, informe um raio de corte positivo (em Å).")
+                return
+
+        pbc_options = self.read_pbc_controls(self.calc_dist_pbc_var, self.calc_dist_lattice_entry)
+        if pbc_options is None:
+            return
+        use_pbc, lattice = pbc_options
+
+        ok, frame = self.read_frame_selection(self.calc_dist_frame_entry, allow_range=False)
+        if not ok:
+            return
+        dtype = "float32" if self.calc_dist_float32_var.get() else "float64"
+
+        def work(progress):
+            # Todos os pares (sistemas pequenos) ou apenas os pares ligados, via lista de células;
+            # o resultado são arrays, formatados só na tabela e no relatório
+            try:
+                return calculate_pair_distances(file_path, bonds_only=(mode != "todos"), cutoff=cutoff,
+                                                use_pbc=use_pbc, lattice=lattice, frame=frame,
+                                                progress=progress, dtype=dtype)
+            except FileNotFoundError:
+                return f"Erro ao abrir o arquivo '{os.path.basename(file_path)}'."
+            except XYZFormatError as e:
+                if e.natoms is None:
+                    return f"Erro: Não foi possível ler o número de átomos do arquivo '{os.path.basename(file_path)}'."
+                return f"Erro: {e}"
+            except (IndexError, ValueError) as e:
+                return f"Erro: {e}"
+
+        self.calc_dist_table.clear()
+        self.start_job("calcula_distancias", work, watch_path=file_path)
+
+    def run_distance_query(self):
+        file_path = self.file_calc_dist_entry.get()
+        if not file_path:
+            messagebox.showwarning("Entrada Inválida", "Por favor, selecione um arquivo .xyz.")
+            return
+        text = self.calc_dist_query_entry.get().strip()
+        if not text:
+            messagebox.showwarning("Entrada Inválida",
+                                   "Digite uma consulta, por exemplo: vizinhos 3 de Mo ou par 17 902.")
+            return
+
+        pbc_options = self.read_pbc_controls(self.calc_dist_pbc_var, self.calc_dist_lattice_entry)
+        if pbc_options is None:
+            return
+        use_pbc, lattice = pbc_options
+
+        ok, frame = self.read_frame_selection(self.calc_dist_frame_entry, allow_range=False)
+        if not ok:
+            return
+
+        def work(progress):
+            # O índice espacial da estrutura é montado na primeira consulta e reaproveitado nas seguintes
+            try:
+                return query_distances(file_path, text, use_pbc=use_pbc, lattice=lattice, frame=frame)
+            except FileNotFoundError:
+                return f"Erro ao abrir o arquivo '{os.path.basename(file_path)}'."
+            except XYZFormatError as e:
+                if e.natoms is None:
+                    return f"Erro: Não foi possível ler o número de átomos do arquivo '{os.path.basename(file_path)}'."
+                return f"Erro: {e}"
+            except (IndexError, ValueError) as e:
+                return f"Erro: {e}"
+
+        self.calc_dist_table.clear()
+        self.start_job("consulta_distancias", work, watch_path=file_path)
+
+    def show_pair_distances(self, result):
+        """
+        Exibe o resultado da aba de distâncias (ou de uma consulta): um resumo no texto e os pares
+        na tabela virtual. 'result' é um PairDistances, um DistanceQueryResult ou uma mensagem de erro.
+        """
+        if isinstance(result, str):
+            self.calc_dist_table.clear()
+            self.update_text_widget(self.result_calc_dist_text, result)
+            return
+        self.calc_dist_table.set_pairs(result)
+        self.update_text_widget(self.result_calc_dist_text, format_pair_summary(result))
+
+
+    def run_rdf(self):
+        file_path = self.file_rdf_entry.get()
+        if not file_path:
+            messagebox.showwarning("Entrada Inválida", "Por favor, selecione um arquivo .xyz.")
+            return
+
         try:
-            # Chama a função Python traduzida
-            result_str = calculate_atom_distances_python(file_path)
+            r_max = float(self.rdf_rmax_entry.get().replace(',', '.'))
+            n_bins = int(self.rdf_bins_entry.get())
+        except ValueError:
+            r_max = n_bins = -1
+        if r_max <= 0.0 or n_bins < 1:
+            messagebox.showwarning("Entrada Inválida",
+                                   "Informe um alcance positivo (em Å) e um número inteiro de intervalos.")
+            return
 
-            self.update_text_widget(self.result_calc_dist_text, result_str)
-            self.results["calcula_distancias"] = result_str
-        except Exception as e:
-            messagebox.showerror("Erro de Execução", f"Ocorreu um erro ao executar o cálculo: {e}")
-            self.update_text_widget(self.result_calc_dist_text, f"Erro: {e}")
-            self.results["calcula_distancias"] = f"Erro no cálculo de distâncias entre átomos: {e}"
+        element_pair = None
+        pair_text = self.rdf_pair_entry.get().strip()
+        if pair_text:
+            match = re.fullmatch(r"([A-Za-z]{1,2})\s*-\s*([A-Za-z]{1,2})", pair_text)
+            if match is None:
+                messagebox.showwarning("Entrada Inválida", "Informe o par de elementos como A-B (ex.: Mo-S).")
+                return
+            element_pair = tuple(el.capitalize() for el in match.groups())
+
+        pbc_options = self.read_pbc_controls(self.rdf_pbc_var, self.rdf_lattice_entry)
+        if pbc_options is None:
+            return
+        use_pbc, lattice = pbc_options
+        ok, frames = self.read_frame_selection(self.rdf_frames_entry, allow_range=True)
+        if not ok:
+            return
+        bonds = self.rdf_mode.get() == "ligacoes"
+
+        def work(progress):
+            # Histograma acumulado em blocos; só as contagens voltam para a interface
+            try:
+                if bonds:
+                    return calculate_bond_histogram(file_path, n_bins=n_bins, element_pair=element_pair,
+                                                    use_pbc=use_pbc, lattice=lattice, frames=frames,
+                                                    progress=progress)
+                return calculate_rdf(file_path, r_max=r_max, n_bins=n_bins, element_pair=element_pair,
+                                     use_pbc=use_pbc, lattice=lattice, frames=frames, progress=progress)
+            except FileNotFoundError:
+                return f"Erro: Não foi possível abrir o arquivo '{os.path.basename(file_path)}'."
+            except (XYZFormatError, IndexError, ValueError) as e:
+                return f"Erro: {e}"
+
+        self.rdf_plot.clear()
+        self.start_job("distribuicao_radial", work, watch_path=file_path)
+
+    def show_distance_histogram(self, result):
+        """
+        Exibe o resultado da aba de distribuição radial: um resumo no texto e a curva no gráfico
+        (g(r) com célula periódica; senão, pares por quadro). A curva completa vai para
+        "Exportar Dados". 'result' é um DistanceHistogram ou uma mensagem de erro.
+        """
+        if isinstance(result, str):
+            self.rdf_plot.clear()
+            self.update_text_widget(self.result_rdf_text, result)
+            return
+        self.update_text_widget(self.result_rdf_text, format_distance_summary(result))
+        if result.g_r is not None:
+            self.rdf_plot.set_data([(result.centers, result.g_r, '#4CAF50')], "r (Å)", "g(r)")
+        else:
+            self.rdf_plot.set_data([(result.centers, result.counts / result.n_frames, '#4CAF50')],
+                                   "r (Å)", "pares por quadro")
 
 
+    def show_band_structure(self, result):
+        """
+        Exibe o resultado da aba de estrutura de bandas: o gap no texto e as bandas no gráfico.
+        As energias completas vão para "Exportar Dados". 'result' é um BandStructure ou uma
+        mensagem de erro.
+        """
+        if isinstance(result, str):
+            self.band_plot.set_bands(None)
+            self.update_text_widget(self.result_band_plot_text, result)
+            return
+        self.update_text_widget(self.result_band_plot_text, format_result(result))
+        self.band_plot.set_bands(result)
+
     def run_calc_gap(self):
-        file_path = self.file_calc_gap_entry.get()
+        self.run_bands_job("calcula_gap", self.file_calc_gap_entry, self.calc_gap_fermi_entry, analyze_band_gap)
+
+    def run_band_structure(self):
+        self.run_bands_job("estrutura_bandas", self.file_band_plot_entry, self.band_plot_fermi_entry,
+                           calculate_band_structure)
+
+    def run_bands_job(self, key, file_entry, fermi_entry, compute):
+        """
+        Inicia um cálculo sobre um arquivo de bandas (gap ou estrutura de bandas): lê dos campos o
+        arquivo e o nível de Fermi opcional e roda compute(arquivo, progress=..., fermi=...).
+        """
+        file_path = file_entry.get()
         if not file_path:
             messagebox.showwarning("Entrada Inválida", "Por favor, selecione um arquivo .bands.")
             return
-
+        fermi_text = fermi_entry.get().strip()
         try:
-            # Chama a função Python traduzida
-            gap_val, is_metallic = calculate_band_gap_python(file_path)
-
-            if gap_val == -999.99:
-                result_str = f"Erro: Não foi possível abrir o arquivo '{os.path.basename(file_path)}'."
-            elif gap_val == -888.88:
-                result_str = "Erro: Não foi possível ler o nível de Fermi da primeira linha ou o arquivo está vazio."
-            elif gap_val == -777.77:
-                result_str = "Erro: Não foi possível ler dados de energia válidos no arquivo."
-            elif is_metallic:
-                # O Fortran imprime o nível de Fermi para metálicos, então mantemos a consistência
-                result_str = f"Nível de Fermi lido: {gap_val:.4f} eV\nMaterial metálico (sem gap detectado)."
-            else:
-                result_str = (f"Gap de energia (eV): {gap_val:.4f}")
+            fermi = float(fermi_text) if fermi_text else None
+        except ValueError:
+            messagebox.showwarning("Entrada Inválida", "O nível de Fermi deve ser um número (em eV).")
+            return
 
-            self.update_text_widget(self.result_calc_gap_text, result_str)
-            self.results["calcula_gap"] = result_str
-        except Exception as e:
-            messagebox.showerror("Erro de Execução", f"Ocorreu um erro ao executar o cálculo: {e}")
-            self.update_text_widget(self.result_calc_gap_text, f"Erro: {e}")
-            self.results["calcula_gap"] = f"Erro no cálculo de gap: {e}"
+        def work(progress):
+            try:
+                return compute(file_path, progress=progress, fermi=fermi)
+            except FileNotFoundError:
+                return f"Erro: Não foi possível abrir o arquivo '{os.path.basename(file_path)}'."
+            except BandsFormatError as e:
+                if e.error_code == ERROR_NATOMS:
+                    return f"Erro: Não foi possível ler o nível de Fermi ou o arquivo está vazio. {e}"
+                return f"Erro: Não foi possível ler dados de energia válidos no arquivo. {e}"
+
+        self.start_job(key, work, watch_path=file_path)
 
     def generate_pdf(self):
         # Cria uma instância do diálogo de informações do usuário
         dialog = UserInfoDialog(self, self.user_name, self.user_role, self.user_advisor)
+        dialog.include_pairs_var.set(self.report_include_pairs)
+        dialog.write_csv_var.set(self.report_write_csv)
         self.wait_window(dialog) # Espera o diálogo ser fechado
 
         # Verifica se o usuário confirmou (não fechou com o 'X')
         if dialog.result is not None:
             self.user_name, self.user_role, self.user_advisor = dialog.result
+            self.report_include_pairs, self.report_write_csv = dialog.include_pairs, dialog.write_csv
+            if self.jobs:
+                # O relatório deve conter os resultados dos cálculos que ainda estão rodando
+                self.pending_pdf = True
+                messagebox.showinfo("Cálculos em Andamento",
+                                    "O relatório PDF será gerado assim que os cálculos em andamento terminarem.")
+                return
             # Permite a geração do PDF mesmo se os campos estiverem vazios
             self._perform_pdf_generation()
         else:
@@ -550,80 +1609,63 @@ class NanophysicsApp(tk.Tk): # Renomeado de FortranApp para NanophysicsApp
 
     def _perform_pdf_generation(self):
         """
-        Contém a lógica real de geração do PDF, agora com as informações do usuário.
+        Pergunta onde salvar e gera o PDF em segundo plano (veja build_report), com as
+        informações do usuário e um instantâneo dos resultados atuais. A barra de progresso
+        e o botão de cancelar ficam ao lado do botão do relatório.
         """
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-
-        # Adicionar logotipos ao PDF
-        try:
-            # Tenta adicionar o logo da UFPI
-            if os.path.exists(self.ufpi_logo_path):
-                pdf.image(self.ufpi_logo_path, x=10, y=10, w=30)
-            else:
-                pdf.text(10, 20, "[UFPI Logo Ausente]")
-            
-            # Tenta adicionar o logo do GNC
-            if os.path.exists(self.nanophysics_logo_path):
-                pdf.image(self.nanophysics_logo_path, x=170, y=10, w=20)
-            else:
-                pdf.text(170, 20, "[GNC Logo Ausente]")
-
-        except Exception as e:
-            messagebox.showwarning("Erro ao adicionar imagem ao PDF",
-                                   f"Não foi possível adicionar os logotipos ao PDF. "
-                                   f"Certifique-se de que os caminhos das imagens estão corretos. Erro: {e}")
-
-        pdf.ln(20) # Pula algumas linhas para o conteúdo principal
-
-        pdf.set_font("Arial", 'B', 16)
-        pdf.cell(0, 10, "Relatório de Análise de Estruturas e Bandas", 0, 1, 'C')
-        pdf.ln(5) # Espaço após o título
-
-        # Adicionar informações do usuário (mesmo que vazias)
-        pdf.set_font("Arial", size=10)
-        pdf.cell(0, 7, f"Nome: {self.user_name if self.user_name else '[Não Informado]'}", 0, 1, 'C')
-        pdf.cell(0, 7, f"Cargo: {self.user_role if self.user_role else '[Não Informado]'}", 0, 1, 'C')
-        pdf.cell(0, 7, f"Orientador: {self.user_advisor if self.user_advisor else '[Não Informado]'}", 0, 1, 'C')
-        pdf.ln(10) # Espaço após as informações do usuário
-
-        pdf.set_font("Arial", 'B', 14)
-        pdf.cell(0, 10, "1. Distância entre Camadas", 0, 1)
-        pdf.set_font("Arial", size=12)
-        if self.results["distancia_layers"]:
-            pdf.multi_cell(0, 10, self.results["distancia_layers"])
-        else:
-            pdf.multi_cell(0, 10, "Nenhum cálculo de distância entre camadas foi realizado.")
-        pdf.ln(5)
-
-        pdf.set_font("Arial", 'B', 14)
-        pdf.cell(0, 10, "2. Distâncias entre Pares de Átomos", 0, 1)
-        pdf.set_font("Arial", size=12)
-        if self.results["calcula_distancias"]:
-            pdf.multi_cell(0, 10, self.results["calcula_distancias"])
-        else:
-            pdf.multi_cell(0, 10, "Nenhum cálculo de distâncias entre átomos foi realizado.")
-        pdf.ln(5)
-
-        pdf.set_font("Arial", 'B', 14)
-        pdf.cell(0, 10, "3. Cálculo de Gap de Energia", 0, 1)
-        pdf.set_font("Arial", size=12)
-        if self.results["calcula_gap"]:
-            pdf.multi_cell(0, 10, self.results["calcula_gap"])
+        file_name = filedialog.asksaveasfilename(defaultextension=".pdf",
+                                                 filetypes=[("Arquivos PDF", "*.pdf")],
+                                                 initialfile="relatorio_nanofisica.pdf")
+        if not file_name:
+            return
+        pairs_csv = os.path.splitext(file_name)[0] + "_pares.csv" if self.report_write_csv else None
+        results = dict(self.results)
+        user_info = (self.user_name, self.user_role, self.user_advisor)
+        logos = ((self.ufpi_logo_path, 10, 30, "[UFPI Logo Ausente]"),
+                 (self.nanophysics_logo_path, 170, 20, "[GNC Logo Ausente]"))
+        include_pairs = self.report_include_pairs
+
+        def work(progress):
+            warnings = build_report(file_name, results, user_info, logos, include_pairs=include_pairs,
+                                    pairs_csv=pairs_csv, progress=progress)
+            return file_name, pairs_csv, warnings
+
+        run_button, cancel_button, progress_bar = self.job_controls["relatorio"]
+        run_button.config(state='disabled')
+        cancel_button.config(state='normal')
+        progress_bar.config(mode='determinate', value=0)
+        job = BackgroundJob("relatorio", work, self.job_messages)
+        self.jobs["relatorio"] = job
+        job.start()
+
+    def show_report_message(self, kind, payload):
+        """Exibe o fim da geração do relatório (chamado por poll_jobs)."""
+        if kind == "done":
+            file_name, pairs_csv, warnings = payload
+            if warnings:
+                messagebox.showwarning("Erro ao adicionar imagem ao PDF", "\n".join(warnings))
+            saved = f"Relatório PDF salvo com sucesso em:\n{file_name}"
+            if pairs_csv:
+                saved += f"\n\nLista completa de pares:\n{pairs_csv}"
+            messagebox.showinfo("PDF Gerado", saved)
+        elif kind == "cancelled":
+            messagebox.showinfo("Geração de PDF Cancelada", "A geração do relatório PDF foi cancelada pelo usuário.")
         else:
-            pdf.multi_cell(0, 10, "Nenhum cálculo de gap de energia foi realizado.")
-        pdf.ln(5)
+            messagebox.showerror("Erro ao Salvar PDF", f"Ocorreu um erro ao salvar o PDF: {payload}")
 
-        try:
-            file_name = filedialog.asksaveasfilename(defaultextension=".pdf",
-                                                     filetypes=[("Arquivos PDF", "*.pdf")],
-                                                     initialfile="relatorio_nanofisica.pdf")
-            if file_name:
-                pdf.output(file_name)
-                messagebox.showinfo("PDF Gerado", f"Relatório PDF salvo com sucesso em:\n{file_name}")
-        except Exception as e:
-            messagebox.showerror("Erro ao Salvar PDF", f"Ocorreu um erro ao salvar o PDF: {e}")
+    def clear_cache(self):
+        """Apaga o cache em disco de estruturas e resultados (compartilhado com o lote.py)."""
+        cache = get_result_cache()
+        if cache is None:
+            messagebox.showinfo("Cache Desativado", "O cache de resultados em disco está desativado.")
+            return
+        size_mb = cache.size_bytes() / 2**20
+        if not messagebox.askyesno("Limpar Cache",
+                                   f"Apagar {size_mb:.1f} MiB de resultados guardados em:\n{cache.directory}?"):
+            return
+        cache.clear()
+        clear_incremental_state()
+        messagebox.showinfo("Cache Limpo", "Os próximos cálculos relerão os arquivos do disco.")
 
     def show_about_info(self):
         about_window = tk.Toplevel(self)
@@ -0,0 +1,661 @@
+"""
+Modo em lote (sem interface gráfica) do layer.py.
+
+Percorre pastas, arquivos ou padrões glob em busca de arquivos .xyz e .bands (e também de
+STRUCT_OUT, saídas do SIESTA e do pw.x e bands.dat do Quantum ESPRESSO), executa os
+cálculos em um pool de processos (um por núcleo, por padrão) e grava os resultados à medida
+que ficam prontos, em CSV ou JSON Lines. Um arquivo com problema gera um registro de erro
+e o processamento continua.
+
+Com --observar, continua varrendo as pastas depois do primeiro lote e processa cada arquivo
+novo ou alterado assim que ele para de crescer, acrescentando os resultados à saída.
+
+Exemplo:
+    python3 lote.py estruturas/ bandas/*.bands -o resultados.csv
+    python3 lote.py runs/ --observar -o resultados.jsonl
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from analisador import (
+    XYZFormatError, BandsFormatError, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES,
+    parse_lattice_text, configure_result_cache, detect_file_format, read_fermi_level,
+    STRUCTURE_FORMATS, BANDS_FORMATS,
+    calculate_layer_distance, calculate_layers, calculate_pair_distances, analyze_band_gap,
+    LAYER_GAP_TOLERANCE, StageProfiler, enable_profiling, get_profiler, profile_stage,
+    BACKENDS, DEFAULT_BACKEND, set_backend, backend_status,
+)
+
+# Cálculos disponíveis para cada extensão de arquivo
+XYZ_CALCULATIONS = ("camadas", "segmentacao", "ligacoes")
+BANDS_CALCULATIONS = ("gap",)
+
+# Colunas do CSV (no JSON Lines, só os campos preenchidos são gravados)
+RESULT_FIELDS = (
+    "arquivo", "calculo", "status", "erro",
+    "distancia_ang", "distancia_bohr",
+    "n_camadas", "distancia_media_camadas_ang", "distancias_camadas_ang", "ondulacao_max_ang",
+    "n_ligacoes", "ligacao_min_ang", "ligacao_media_ang", "ligacao_max_ang",
+    "gap_ev", "metalico", "gap_direto", "gap_direto_ev", "vbm_ev", "cbm_ev", "fermi_ev",
+    "tempo_s",
+)
+# No modo de observação, cada registro indica também a versão do arquivo (hash do conteúdo)
+WATCH_FIELDS = RESULT_FIELDS + ("versao", "modificado")
+
+def collect_files(paths, recursive=True):
+    """
+    Expande pastas, arquivos e padrões glob em uma lista ordenada de arquivos de estrutura e de
+    bandas em formato reconhecido (veja detect_file_format), sem repetições.
+    """
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            pattern = "**/*" if recursive else "*"
+            candidates = glob.glob(os.path.join(path, pattern), recursive=recursive)
+        elif glob.has_magic(path):
+            candidates = glob.glob(path, recursive=True)
+        else:
+            candidates = [path]
+        for candidate in candidates:
+            if os.path.isfile(candidate) and detect_file_format(candidate) is not None:
+                found.add(os.path.abspath(candidate))
+    return sorted(found)
+
+def build_tasks(files, calculations):
+    """Combina cada arquivo com os cálculos pedidos que se aplicam ao seu formato."""
+    tasks = []
+    for file_path in files:
+        file_format = detect_file_format(file_path)
+        available = ()
+        if file_format in STRUCTURE_FORMATS:
+            available += XYZ_CALCULATIONS
+        if file_format in BANDS_FORMATS:
+            available += BANDS_CALCULATIONS
+        tasks.extend((file_path, calc) for calc in available if calc in calculations)
+    return tasks
+
+def run_task(file_path, calculation, options, band_gap=analyze_band_gap):
+    """
+    Executa um cálculo sobre um arquivo e retorna um dicionário de resultado.
+    Roda dentro dos processos do pool; nunca levanta exceções, para que um arquivo
+    com problema não interrompa o lote.
+    'band_gap' calcula o gap como band_gap(arquivo, fermi=...) e retorna um BandGapResult (o modo
+    de serviço o tira das energias das bandas que mantém na memória).
+    """
+    record = {"arquivo": file_path, "calculo": calculation, "status": "ok"}
+    start = time.perf_counter()
+    try:
+        if calculation == "camadas":
+            result = calculate_layer_distance(
+                file_path, use_pbc=options["use_pbc"], lattice=options["lattice"], frame=options["frame"])
+            record.update(distancia_ang=result.distance_ang, distancia_bohr=result.distance_bohr)
+
+        elif calculation == "segmentacao":
+            layers = calculate_layers(file_path, options["layer_tolerance"], use_pbc=options["use_pbc"],
+                                      lattice=options["lattice"], frame=options["frame"])
+            spacings = layers.spacings
+            record.update(n_camadas=layers.n_layers, distancias_camadas_ang=spacings.tolist(),
+                          ondulacao_max_ang=float(layers.corrugation.max()))
+            if len(spacings):
+                record["distancia_media_camadas_ang"] = float(spacings.mean())
+
+        elif calculation == "ligacoes":
+            pairs = calculate_pair_distances(file_path, bonds_only=True, cutoff=options["cutoff"],
+                                             use_pbc=options["use_pbc"], lattice=options["lattice"],
+                                             frame=options["frame"])
+            bonds = pairs.distances
+            record["n_ligacoes"] = int(len(bonds))
+            if len(bonds):
+                record.update(ligacao_min_ang=float(bonds.min()), ligacao_media_ang=float(bonds.mean()),
+                              ligacao_max_ang=float(bonds.max()))
+
+        elif calculation == "gap":
+            # O nível de Fermi informado só vale para o bands.dat, que não o traz
+            fermi = options["fermi"] if detect_file_format(file_path) == "qe_bands" else None
+            result = band_gap(file_path, fermi=fermi)
+            record.update(fermi_ev=result.fermi, metalico=result.is_metallic)
+            if not result.is_metallic:
+                record.update(gap_ev=result.gap, gap_direto=result.is_direct,
+                              gap_direto_ev=result.direct_gap, vbm_ev=result.vbm, cbm_ev=result.cbm)
+
+        else:
+            raise ValueError(f"Cálculo desconhecido: {calculation}")
+
+    except (OSError, XYZFormatError, BandsFormatError, ValueError, IndexError) as e:
+        record.update(status="erro", erro=str(e))
+    except Exception as e:
+        record.update(status="erro", erro=f"{type(e).__name__}: {e}")
+
+    record["tempo_s"] = round(time.perf_counter() - start, 6)
+    return record
+
+def _init_worker(cache, profile, backend=None):
+    """
+    Inicializador dos processos do pool: configura o cache, escolhe os núcleos de cálculo (já
+    verificados no processo principal) e, se pedido, liga a instrumentação.
+    """
+    if cache is not None:
+        configure_result_cache(*cache)
+    if backend is not None:
+        set_backend(backend, check=False)
+    if profile:
+        enable_profiling()
+
+def _run_task_profiled(file_path, calculation, options):
+    """run_task com a instrumentação ligada: retorna (registro, medições das etapas da tarefa)."""
+    profiler = get_profiler()
+    profiler.clear()
+    with profile_stage(f"lote/{calculation}", arquivo=os.path.basename(file_path)):
+        record = run_task(file_path, calculation, options)
+    return record, profiler.records
+
+class ResultWriter:
+    """
+    Grava os registros de resultado à medida que chegam, em CSV ou JSON Lines,
+    na saída padrão ou em um arquivo.
+    """
+    def __init__(self, stream, fmt, fields=RESULT_FIELDS, header=True):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == "csv":
+            self._csv = csv.DictWriter(stream, fieldnames=fields, extrasaction="ignore")
+            if header:
+                self._csv.writeheader()
+
+    def write(self, record):
+        if self.fmt == "csv":
+            self._csv.writerow(record)
+        else:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.stream.flush()
+
+def _failed_record(file_path, calculation, error):
+    """Registro de erro de uma tarefa cujo processo do pool não devolveu resultado."""
+    if isinstance(error, BrokenProcessPool):
+        message = "O processo do cálculo terminou de forma inesperada (falta de memória ou falha no código nativo)."
+    else:
+        message = f"{type(error).__name__}: {error}"
+    return {"arquivo": file_path, "calculo": calculation, "status": "erro", "erro": message}
+
+def _pool_results(task, tasks, options, workers, initargs):
+    """
+    Executa task(arquivo, cálculo, opções) para cada tarefa em um pool de processos e gera
+    ((arquivo, cálculo), resultado) na ordem em que terminam; o resultado é a exceção quando a
+    tarefa falha fora de run_task. No máximo 2 * workers tarefas ficam em andamento, de modo que,
+    se um processo do pool morrer, só elas são suspeitas: são refeitas uma a uma, cada uma em um
+    processo próprio (a que derrubar o processo de novo gera o BrokenProcessPool), e as demais
+    seguem em um pool novo.
+    """
+    queue = deque(tasks)
+    while queue:
+        suspects = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+            running = {}
+            while running or (queue and not suspects):
+                while queue and not suspects and len(running) < 2 * workers:
+                    item = queue.popleft()
+                    running[pool.submit(task, *item, options)] = item
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        suspects.append(item)
+                        continue
+                    except Exception as e:
+                        result = e
+                    yield item, result
+        for item in suspects:
+            with ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=initargs) as pool:
+                try:
+                    result = pool.submit(task, *item, options).result()
+                except Exception as e:
+                    result = e
+            yield item, result
+
+def run_batch(tasks, options, writer, workers=None, progress=None, cache=None, profiler=None, backend=None):
+    """
+    Distribui as tarefas em um pool de processos e grava cada resultado assim que termina.
+    'progress', se fornecido, é chamado como progress(feitos, total, registro).
+    'cache' são os argumentos de configure_result_cache (pasta, tamanho máximo, ativado),
+    aplicados em cada processo do pool; None usa o cache padrão.
+    'backend' é o nome dos núcleos de cálculo dos processos do pool (veja set_backend; None = NumPy).
+    Com 'profiler' (um StageProfiler), a instrumentação é ligada nos processos do pool e as
+    medições das etapas de cada tarefa são acrescentadas a ele.
+    Um processo do pool que morre (ex.: falta de memória) gera um registro de erro para a tarefa
+    que o derrubou e o lote continua em um pool novo (veja _pool_results).
+    Retorna (n_ok, n_erros).
+    """
+    n_ok = n_errors = 0
+    if not tasks:
+        return n_ok, n_errors
+    task = run_task if profiler is None else _run_task_profiled
+    workers = workers or os.cpu_count() or 1
+    results = _pool_results(task, tasks, options, workers, (cache, profiler is not None, backend))
+    for done, ((file_path, calc), record) in enumerate(results, start=1):
+        if isinstance(record, Exception):
+            record = _failed_record(file_path, calc, record)
+        elif profiler is not None:
+            record, stages = record
+            profiler.add_records(stages)
+        writer.write(record)
+        if record["status"] == "ok":
+            n_ok += 1
+        else:
+            n_errors += 1
+        if progress is not None:
+            progress(done, len(tasks), record)
+    return n_ok, n_errors
+
+def _print_progress(done, total, record):
+    status = "ok  " if record["status"] == "ok" else "ERRO"
+    print(f"[{done}/{total}] {status} {record['calculo']:8s} {os.path.basename(record['arquivo'])}",
+          file=sys.stderr)
+
+# --- Modo de Observação (pastas gravadas durante os cálculos) ---
+
+WATCH_INTERVAL = 2.0 # Segundos entre duas varreduras das pastas
+WATCH_SETTLE = 10.0 # Segundos sem mudança de tamanho e mtime para um arquivo ser considerado completo
+_VERSION_CHUNK_BYTES = 1 << 22
+
+def file_version(file_path):
+    """Hash do conteúdo de um arquivo: identifica a versão, mesmo que só o mtime mude."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_VERSION_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ProcessedLog:
+    """
+    Versões de arquivo já processadas no modo de observação, identificadas pelo hash do conteúdo.
+    Uma versão é reservada (claim) quando entra na fila, para não ser enfileirada de novo na mesma
+    sessão, e gravada (save) quando todos os seus cálculos terminam. Com 'path', as versões gravadas
+    são acrescentadas a um arquivo JSON Lines e relidas ao reiniciar a observação; uma versão
+    interrompida no meio dos cálculos é refeita na próxima vez.
+    """
+    __slots__ = ("path", "versions", "stamps")
+
+    def __init__(self, path=None):
+        self.path = path
+        self.versions = set() # (arquivo, hash)
+        self.stamps = {} # arquivo -> (tamanho, mtime_ns) da última versão reservada
+        if path is None or not os.path.exists(path):
+            return
+        with open(path, 'r', encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self.claim(entry["arquivo"], entry["hash"], (entry["tamanho"], entry["mtime_ns"]))
+                except (ValueError, KeyError, TypeError):
+                    continue # Linha truncada (observação interrompida durante a gravação)
+
+    def seen_stamp(self, file_path, stamp):
+        """Verdadeiro se o arquivo não mudou (tamanho e mtime) desde a última versão reservada."""
+        return self.stamps.get(file_path) == stamp
+
+    def seen(self, file_path, content_hash):
+        return (file_path, content_hash) in self.versions
+
+    def claim(self, file_path, content_hash, stamp):
+        self.versions.add((file_path, content_hash))
+        self.stamps[file_path] = stamp
+
+    def save(self, file_path, content_hash, stamp):
+        if self.path is None:
+            return
+        entry = {"arquivo": file_path, "hash": content_hash, "tamanho": stamp[0], "mtime_ns": stamp[1]}
+        with open(self.path, 'a', encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+class FolderWatcher:
+    """
+    Varre as pastas, arquivos ou padrões glob (como collect_files) e retorna as versões de arquivos
+    de estrutura e de bandas prontas para processar. Um arquivo está pronto quando está parado há
+    pelo menos 'settle' segundos: pelo mtime ou, se o relógio do sistema de arquivos não for confiável, desde a
+    varredura em que o tamanho e o mtime atuais foram vistos pela primeira vez. Arquivos vazios
+    esperam. Uma versão cujo conteúdo já consta em 'log' (um ProcessedLog) não é devolvida de novo,
+    mesmo que o mtime mude.
+    """
+    __slots__ = ("paths", "recursive", "settle", "log", "_pending")
+
+    def __init__(self, paths, log, recursive=True, settle=WATCH_SETTLE):
+        self.paths = paths
+        self.log = log
+        self.recursive = recursive
+        self.settle = settle
+        self._pending = {} # arquivo -> ((tamanho, mtime_ns), instante em que esse carimbo foi visto)
+
+    def scan(self, now=None):
+        """Retorna [(arquivo, hash, (tamanho, mtime_ns))] das versões novas prontas, já reservadas no log."""
+        now = time.time() if now is None else now
+        files = collect_files(self.paths, recursive=self.recursive)
+        present = set(files)
+        for file_path in [p for p in self._pending if p not in present]:
+            del self._pending[file_path] # Apagado ou renomeado antes de ficar pronto
+
+        ready = []
+        for file_path in files:
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            stamp = (st.st_size, st.st_mtime_ns)
+            if self.log.seen_stamp(file_path, stamp):
+                self._pending.pop(file_path, None)
+                continue
+            pending = self._pending.get(file_path)
+            if pending is None or pending[0] != stamp:
+                pending = self._pending[file_path] = (stamp, now) # Novo ou mudou desde a última varredura
+            if st.st_size == 0 or max(now - pending[1], now - st.st_mtime) < self.settle:
+                continue # Ainda pode estar sendo gravado
+            try:
+                content_hash = file_version(file_path)
+            except OSError:
+                continue
+            del self._pending[file_path]
+            if self.log.seen(file_path, content_hash):
+                self.log.stamps[file_path] = stamp # Mesmo conteúdo (ex.: só o mtime mudou)
+                continue
+            self.log.claim(file_path, content_hash, stamp)
+            ready.append((file_path, content_hash, stamp))
+        return ready
+
+async def _watch_loop(watcher, calculations, options, writer, make_pool, workers, interval, duration,
+                      counts, progress, profiler):
+    """
+    Laço do modo de observação: a cada 'interval' segundos, enfileira os cálculos das versões prontas
+    e os executa em um pool de processos (criado por make_pool(n_processos)) com no máximo 'workers'
+    tarefas em andamento, gravando cada registro assim que termina. Acumula em 'counts' (ok, erro,
+    tarefas, versões). Com 'duration', para de varrer depois desse tempo e espera as tarefas pendentes.
+    Se um processo do pool morrer, o pool é recriado e as tarefas que estavam em andamento são
+    refeitas cada uma em um processo próprio; a que o derrubar de novo gera um registro de erro.
+    """
+    import asyncio # Só o modo de observação usa asyncio (cerca de 80 ms de importação)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    remaining = {} # (arquivo, hash) -> cálculos ainda não concluídos
+    task = run_task if profiler is None else _run_task_profiled
+    pools = [make_pool(workers)]
+
+    def finish(file_path, content_hash, stamp):
+        del remaining[(file_path, content_hash)]
+        watcher.log.save(file_path, content_hash, stamp)
+
+    async def run(file_path, calc):
+        pool = pools[0]
+        try:
+            return await loop.run_in_executor(pool, task, file_path, calc, options)
+        except BrokenProcessPool:
+            if pools[0] is pool: # O primeiro a notar recria o pool
+                pools[0] = make_pool(workers)
+                pool.shutdown(wait=False)
+        single = make_pool(1)
+        try:
+            return await loop.run_in_executor(single, task, file_path, calc, options)
+        finally:
+            single.shutdown(wait=False)
+
+    async def consume():
+        while True:
+            file_path, calc, content_hash, stamp = await queue.get()
+            try:
+                try:
+                    record = await run(file_path, calc)
+                except Exception as e:
+                    record = _failed_record(file_path, calc, e)
+                else:
+                    if profiler is not None:
+                        record, stages = record
+                        profiler.add_records(stages)
+                record.update(versao=content_hash[:12],
+                              modificado=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(stamp[1] / 1e9)))
+                writer.write(record)
+                counts["ok" if record["status"] == "ok" else "erro"] += 1
+                if progress is not None:
+                    progress(counts["ok"] + counts["erro"], counts["tarefas"], record)
+                remaining[(file_path, content_hash)] -= 1
+                if remaining[(file_path, content_hash)] == 0:
+                    finish(file_path, content_hash, stamp)
+            finally:
+                queue.task_done()
+
+    def check_consumers():
+        # Um consumidor só termina com um erro fora das tarefas (ex.: na gravação da saída): repassa
+        for consumer in consumers:
+            if consumer.done():
+                consumer.result()
+
+    consumers = [asyncio.ensure_future(consume()) for _ in range(workers)]
+    deadline = None if duration is None else time.monotonic() + duration
+    try:
+        while True:
+            check_consumers()
+            # A varredura (glob, detecção do formato e hash do conteúdo) roda fora do laço de eventos
+            for file_path, content_hash, stamp in await loop.run_in_executor(None, watcher.scan):
+                tasks = build_tasks([file_path], calculations)
+                counts["versoes"] += 1
+                counts["tarefas"] += len(tasks)
+                remaining[(file_path, content_hash)] = len(tasks)
+                if not tasks:
+                    finish(file_path, content_hash, stamp)
+                for _, calc in tasks:
+                    queue.put_nowait((file_path, calc, content_hash, stamp))
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            delay = interval if deadline is None else min(interval, max(deadline - time.monotonic(), 0.0))
+            await asyncio.sleep(delay)
+        join = asyncio.ensure_future(queue.join())
+        try:
+            await asyncio.wait([join, *consumers], return_when=asyncio.FIRST_COMPLETED)
+            check_consumers()
+        finally:
+            join.cancel()
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        pools[0].shutdown()
+
+def run_watch(paths, calculations, options, writer, log, workers=None, recursive=True,
+              interval=WATCH_INTERVAL, settle=WATCH_SETTLE, duration=None, progress=None,
+              cache=None, profiler=None, backend=None):
+    """
+    Observa as pastas e processa cada versão nova ou alterada de um arquivo de estrutura ou de
+    bandas depois que ela para de crescer (veja FolderWatcher), uma única vez (veja ProcessedLog). Roda até
+    Ctrl+C ou, com 'duration', por esse número de segundos. Os demais argumentos são os de run_batch;
+    'progress' recebe como total o número de cálculos enfileirados até o momento.
+    Retorna um dicionário com os totais: ok, erro, tarefas e versoes.
+    """
+    import asyncio
+    workers = workers or os.cpu_count() or 1
+    counts = {"ok": 0, "erro": 0, "tarefas": 0, "versoes": 0}
+    watcher = FolderWatcher(paths, log, recursive=recursive, settle=settle)
+
+    def make_pool(n_processes):
+        return ProcessPoolExecutor(max_workers=n_processes, initializer=_init_worker,
+                                   initargs=(cache, profiler is not None, backend))
+
+    try:
+        asyncio.run(_watch_loop(watcher, calculations, options, writer, make_pool, workers, interval,
+                                duration, counts, progress, profiler))
+    except KeyboardInterrupt:
+        pass # Ctrl+C encerra a observação; os totais até aqui são retornados
+    return counts
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Executa os cálculos do layer.py em lote sobre arquivos .xyz e .bands e saídas do "
+                    "SIESTA e do Quantum ESPRESSO.")
+    parser.add_argument("caminhos", nargs="+", help="Pastas, arquivos ou padrões glob (ex.: 'runs/**/*.xyz').")
+    parser.add_argument("-o", "--saida", help="Arquivo de saída (padrão: saída padrão).")
+    parser.add_argument("-f", "--formato", choices=("csv", "jsonl"),
+                        help="Formato da saída (padrão: pela extensão do arquivo de saída, ou csv).")
+    parser.add_argument("-c", "--calculos", default=",".join(XYZ_CALCULATIONS + BANDS_CALCULATIONS),
+                        help="Cálculos separados por vírgula: camadas, segmentacao, ligacoes, gap (padrão: todos).")
+    parser.add_argument("--corte", type=float, default=None,
+                        help="Raio de corte das ligações em Å (padrão: raios covalentes).")
+    parser.add_argument("--tolerancia-camadas", type=float, default=LAYER_GAP_TOLERANCE,
+                        help="Vazio mínimo em z (Å) entre camadas na segmentação (padrão: %(default).1f).")
+    parser.add_argument("--sem-pbc", action="store_true", help="Ignora a célula periódica dos arquivos.")
+    parser.add_argument("--rede", default=None,
+                        help="Vetores de rede manuais (9 números em Å), usados em todos os .xyz.")
+    parser.add_argument("--quadro", type=int, default=None,
+                        help="Quadro das trajetórias .xyz e das saídas do SIESTA e do pw.x (a partir de 1; "
+                             "-1 = último; padrão: o arquivo .xyz inteiro ou a geometria final das saídas).")
+    parser.add_argument("--fermi", default=None,
+                        help="Nível de Fermi (eV) dos bands.dat do Quantum ESPRESSO, que não o trazem: "
+                             "um número ou um arquivo de onde lê-lo (ex.: a saída scf do pw.x).")
+    parser.add_argument("-j", "--processos", type=int, default=None,
+                        help="Número de processos (padrão: número de núcleos).")
+    parser.add_argument("--sem-recursao", action="store_true", help="Não entra em subpastas.")
+    parser.add_argument("--cache", default=None,
+                        help=f"Pasta do cache de resultados (padrão: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument("--cache-max", type=float, default=DEFAULT_CACHE_MAX_BYTES / 2**20,
+                        help="Tamanho máximo do cache em MiB (padrão: %(default).0f).")
+    parser.add_argument("--sem-cache", action="store_true",
+                        help="Não lê nem grava o cache de resultados em disco.")
+    parser.add_argument("--perfil", "--profile", action="store_true",
+                        help="Mede tempo, pico de memória e bytes lidos de cada etapa e mostra um resumo no final.")
+    parser.add_argument("--rastro", "--trace", default=None,
+                        help="Grava as medições das etapas neste arquivo (Trace Event JSON, para o Perfetto "
+                             "ou chrome://tracing); implica --perfil.")
+    parser.add_argument("--observar", "--watch", action="store_true",
+                        help="Continua observando as pastas e processa cada arquivo novo ou alterado depois que "
+                             "ele para de crescer, acrescentando os resultados à saída (até Ctrl+C).")
+    parser.add_argument("--intervalo", type=float, default=WATCH_INTERVAL,
+                        help="Segundos entre duas varreduras das pastas no modo --observar (padrão: %(default).0f).")
+    parser.add_argument("--espera", type=float, default=WATCH_SETTLE,
+                        help="Segundos sem mudança para um arquivo ser considerado completo (padrão: %(default).0f).")
+    parser.add_argument("--registro", default=None,
+                        help="Arquivo com as versões já processadas no modo --observar, para não repeti-las ao "
+                             "reiniciar (padrão: <saída>.vistos.jsonl; sem --saida, só na memória).")
+    parser.add_argument("--duracao", type=float, default=None,
+                        help="Encerra o modo --observar depois deste número de segundos.")
+    parser.add_argument("--nucleo", "--backend", choices=("auto",) + BACKENDS, default=None,
+                        help="Núcleos de cálculo: numpy, numba (compilados com o Numba, se instalado) ou auto "
+                             f"(o Numba quando disponível; padrão: {DEFAULT_BACKEND}, ou a variável LAYERS_BACKEND).")
+    parser.add_argument("-q", "--silencioso", action="store_true", help="Não mostra o progresso.")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    calculations = {c.strip() for c in args.calculos.split(",") if c.strip()}
+    unknown = calculations - set(XYZ_CALCULATIONS + BANDS_CALCULATIONS)
+    if unknown:
+        parser.error(f"cálculo(s) desconhecido(s): {', '.join(sorted(unknown))}")
+
+    try:
+        lattice = parse_lattice_text(args.rede) if args.rede else None
+    except ValueError as e:
+        parser.error(str(e))
+    if args.quadro == 0:
+        parser.error("os quadros são numerados a partir de 1")
+    frame = None if args.quadro is None else (args.quadro - 1 if args.quadro > 0 else args.quadro)
+    if args.tolerancia_camadas <= 0.0:
+        parser.error("a tolerância das camadas deve ser positiva")
+    fermi = None
+    if args.fermi is not None:
+        try:
+            fermi = float(args.fermi)
+        except ValueError:
+            try:
+                fermi = read_fermi_level(args.fermi)
+            except (OSError, BandsFormatError) as e:
+                parser.error(f"não foi possível ler o nível de Fermi: {e}")
+    options = {"use_pbc": not args.sem_pbc, "lattice": lattice, "cutoff": args.corte, "frame": frame,
+               "layer_tolerance": args.tolerancia_camadas, "fermi": fermi}
+    cache = (args.cache, int(args.cache_max * 2**20), not args.sem_cache)
+
+    if args.observar and (args.intervalo <= 0.0 or args.espera < 0.0):
+        parser.error("o intervalo deve ser positivo e a espera não pode ser negativa")
+
+    fmt = args.formato
+    if fmt is None:
+        fmt = "jsonl" if args.saida and args.saida.lower().endswith((".jsonl", ".json")) else "csv"
+    profiler = StageProfiler() if args.perfil or args.rastro else None
+    try:
+        backend = set_backend(args.nucleo or DEFAULT_BACKEND)
+    except ValueError as e:
+        parser.error(str(e))
+    if not args.silencioso:
+        print(f"{backend_status()}.", file=sys.stderr)
+
+    if args.observar:
+        status = _watch_main(args, calculations, options, cache, fmt, profiler, backend)
+    else:
+        status = _batch_main(args, calculations, options, cache, fmt, profiler, backend)
+    if status == 1:
+        return status
+    if profiler is not None:
+        print("\nEtapas (somadas sobre todos os processos):", file=sys.stderr)
+        print(profiler.format_summary(), file=sys.stderr)
+        if args.rastro:
+            profiler.write_trace(args.rastro)
+            print(f"Rastro gravado em {args.rastro}.", file=sys.stderr)
+    return status
+
+def _batch_main(args, calculations, options, cache, fmt, profiler, backend):
+    files = collect_files(args.caminhos, recursive=not args.sem_recursao)
+    tasks = build_tasks(files, calculations)
+    if not tasks:
+        print("Nenhum arquivo de estrutura ou de bandas encontrado.", file=sys.stderr)
+        return 1
+
+    stream = open(args.saida, "w", newline="", encoding="utf-8") if args.saida else sys.stdout
+    start = time.perf_counter()
+    try:
+        writer = ResultWriter(stream, fmt)
+        n_ok, n_errors = run_batch(tasks, options, writer, workers=args.processos,
+                                   progress=None if args.silencioso else _print_progress, cache=cache,
+                                   profiler=profiler, backend=backend)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Concluído: {len(files)} arquivo(s), {len(tasks)} cálculo(s), {n_ok} ok, "
+          f"{n_errors} com erro, em {elapsed:.2f} s.", file=sys.stderr)
+    return 0 if n_errors == 0 else 2
+
+def _watch_main(args, calculations, options, cache, fmt, profiler, backend):
+    # A saída é aberta para acréscimo: os resultados de observações anteriores são mantidos
+    log_path = args.registro or (args.saida + ".vistos.jsonl" if args.saida else None)
+    log = ProcessedLog(log_path)
+    if args.saida:
+        header = not os.path.exists(args.saida) or os.path.getsize(args.saida) == 0
+        stream = open(args.saida, "a", newline="", encoding="utf-8")
+    else:
+        header, stream = True, sys.stdout
+    if not args.silencioso:
+        print(f"Observando {', '.join(args.caminhos)} (Ctrl+C para encerrar).", file=sys.stderr)
+    start = time.perf_counter()
+    try:
+        writer = ResultWriter(stream, fmt, fields=WATCH_FIELDS, header=header)
+        counts = run_watch(args.caminhos, calculations, options, writer, log, workers=args.processos,
+                           recursive=not args.sem_recursao, interval=args.intervalo, settle=args.espera,
+                           duration=args.duracao, progress=None if args.silencioso else _print_progress,
+                           cache=cache, profiler=profiler, backend=backend)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Observação encerrada: {counts['versoes']} versão(ões) de arquivo, {counts['tarefas']} cálculo(s), "
+          f"{counts['ok']} ok, {counts['erro']} com erro, em {elapsed:.2f} s.", file=sys.stderr)
+    return 0 if counts["erro"] == 0 else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Núcleos de cálculo compilados pelo Numba (JIT), usados por analisador.set_backend("numba").
+Este módulo só é importado quando esse backend é pedido: sem o Numba instalado, o analisador
+continua com os núcleos NumPy. Cada núcleo é compilado na primeira chamada e guardado em disco
+(cache=True, na pasta NUMBA_CACHE_DIR), então as partidas seguintes não recompilam.
+Os laços repetem, elemento a elemento, as operações dos núcleos NumPy (analisador.NumpyBackend),
+para que os resultados coincidam (veja analisador.check_backend).
+"""
+import numpy as np
+from numba import njit
+
+from analisador import NumpyBackend, _is_orthogonal
+
+# --- Imagem Mínima ---
+
+@njit(cache=True, inline="always")
+def _reduced(d0, d1, d2, lattice, inverse, periodic):
+    """Vetor diferença reduzido à célula (coordenadas fracionárias arredondadas nas direções periódicas)."""
+    f0 = d0 * inverse[0, 0] + d1 * inverse[1, 0] + d2 * inverse[2, 0]
+    f1 = d0 * inverse[0, 1] + d1 * inverse[1, 1] + d2 * inverse[2, 1]
+    f2 = d0 * inverse[0, 2] + d1 * inverse[1, 2] + d2 * inverse[2, 2]
+    if periodic[0]:
+        f0 -= np.rint(f0)
+    if periodic[1]:
+        f1 -= np.rint(f1)
+    if periodic[2]:
+        f2 -= np.rint(f2)
+    return (f0 * lattice[0, 0] + f1 * lattice[1, 0] + f2 * lattice[2, 0],
+            f0 * lattice[0, 1] + f1 * lattice[1, 1] + f2 * lattice[2, 1],
+            f0 * lattice[0, 2] + f1 * lattice[1, 2] + f2 * lattice[2, 2])
+
+@njit(cache=True, inline="always")
+def _image_sq(d0, d1, d2, shifts):
+    """Menor quadrado entre o vetor reduzido e suas imagens deslocadas (sem branches no laço)."""
+    best = d0 * d0 + d1 * d1 + d2 * d2
+    for s in range(shifts.shape[0]):
+        c0 = d0 + shifts[s, 0]
+        c1 = d1 + shifts[s, 1]
+        c2 = d2 + shifts[s, 2]
+        best = min(best, c0 * c0 + c1 * c1 + c2 * c2)
+    return best
+
+# Argumentos da célula quando não há condições periódicas (tipos fixos: uma única compilação)
+_NO_CELL = (np.eye(3), np.eye(3), np.zeros(3, dtype=np.bool_), np.zeros((0, 3)), False)
+
+def _cell_args(lattice, pbc):
+    """
+    (rede, inversa, pbc, deslocamentos, usa_célula) no formato dos núcleos compilados. Em células
+    triclínicas, 'deslocamentos' traz as 26 imagens vizinhas na ordem de minimum_image (vazio nas
+    ortogonais, em que a célula reduzida já dá a imagem mínima).
+    """
+    if lattice is None:
+        return _NO_CELL
+    lattice = np.ascontiguousarray(lattice, dtype=np.float64).reshape(3, 3)
+    periodic = np.ascontiguousarray(np.asarray(pbc, dtype=np.bool_).reshape(3))
+    shifts = np.zeros((0, 3))
+    if not _is_orthogonal(lattice):
+        ranges = [(-1, 0, 1) if p else (0,) for p in periodic]
+        shifts = np.array([n1 * lattice[0] + n2 * lattice[1] + n3 * lattice[2]
+                           for n1 in ranges[0] for n2 in ranges[1] for n3 in ranges[2]
+                           if not n1 == n2 == n3 == 0], dtype=np.float64).reshape(-1, 3)
+    return lattice, np.linalg.inv(lattice), periodic, shifts, True
+
+# --- Distâncias de Pares ---
+
+@njit(cache=True)
+def _pair_tile(coords, lattice, inverse, periodic, shifts, use_cell, offsets, p0, p1, out):
+    """Grava em out[p0:p1] as distâncias das posições [p0, p1) da ordem condensada."""
+    # Linha do primeiro par: a última com offsets[i] <= p0
+    lo, hi = 0, len(offsets) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if offsets[mid] <= p0:
+            lo = mid
+        else:
+            hi = mid - 1
+    i = lo
+    p = p0
+    while p < p1:
+        stop = min(offsets[i + 1], p1)
+        j = p - offsets[i] + i + 1
+        for q in range(p, stop):
+            d0 = coords[j, 0] - coords[i, 0]
+            d1 = coords[j, 1] - coords[i, 1]
+            d2 = coords[j, 2] - coords[i, 2]
+            if use_cell:
+                d0, d1, d2 = _reduced(d0, d1, d2, lattice, inverse, periodic)
+            out[q] = np.sqrt(_image_sq(d0, d1, d2, shifts))
+            j += 1
+        p = stop
+        i += 1
+
+@njit(cache=True)
+def _pair_distances(coords, first, second, lattice, inverse, periodic, shifts, use_cell, out):
+    """Grava em out[k] a distância entre coords[first[k]] e coords[second[k]]."""
+    for k in range(len(first)):
+        i, j = first[k], second[k]
+        d0 = coords[j, 0] - coords[i, 0]
+        d1 = coords[j, 1] - coords[i, 1]
+        d2 = coords[j, 2] - coords[i, 2]
+        if use_cell:
+            d0, d1, d2 = _reduced(d0, d1, d2, lattice, inverse, periodic)
+        out[k] = np.sqrt(_image_sq(d0, d1, d2, shifts))
+
+# --- Extremos das Bandas ---
+
+@njit(cache=True)
+def _band_extrema(energies, fermi, vbm_k, cbm_k, band_min, band_max):
+    """
+    Uma única passada pelo bloco (m, nspin, nbandas). Como em NumPy, um NaN se propaga para o
+    VBM ou CBM do seu ponto k (conforme a comparação com E_F) e para os extremos da sua banda.
+    """
+    nk, nspin, nbands = energies.shape
+    for s in range(nspin):
+        for b in range(nbands):
+            value = energies[0, s, b]
+            band_min[s, b] = value
+            band_max[s, b] = value
+    for k in range(nk):
+        for s in range(nspin):
+            vbm, cbm = -np.inf, np.inf
+            for b in range(nbands):
+                value = energies[k, s, b]
+                if value <= fermi:
+                    if value > vbm:
+                        vbm = value
+                elif np.isnan(value) or np.isnan(cbm):
+                    cbm = np.nan
+                elif value < cbm:
+                    cbm = value
+                if k > 0 and not np.isnan(band_min[s, b]):
+                    if np.isnan(value):
+                        band_min[s, b] = np.nan
+                        band_max[s, b] = np.nan
+                    else:
+                        if value < band_min[s, b]:
+                            band_min[s, b] = value
+                        if value > band_max[s, b]:
+                            band_max[s, b] = value
+            vbm_k[k, s] = vbm
+            cbm_k[k, s] = cbm
+
+# --- Camadas ---
+
+@njit(cache=True)
+def _layer_segments(z_sorted, gap_tolerance):
+    """Início, número de átomos e alturas média, mínima e máxima de cada camada."""
+    natoms = len(z_sorted)
+    nlayers = 1
+    for k in range(1, natoms):
+        if z_sorted[k] - z_sorted[k - 1] > gap_tolerance:
+            nlayers += 1
+    starts = np.zeros(nlayers, dtype=np.int64)
+    layer = 0
+    for k in range(1, natoms):
+        if z_sorted[k] - z_sorted[k - 1] > gap_tolerance:
+            layer += 1
+            starts[layer] = k
+    counts = np.empty(nlayers, dtype=np.int64)
+    mean_z = np.empty(nlayers)
+    min_z = np.empty(nlayers)
+    max_z = np.empty(nlayers)
+    for layer in range(nlayers):
+        stop = starts[layer + 1] if layer + 1 < nlayers else natoms
+        total = 0.0
+        for k in range(starts[layer], stop):
+            total += z_sorted[k]
+        counts[layer] = stop - starts[layer]
+        mean_z[layer] = total / counts[layer]
+        min_z[layer] = z_sorted[starts[layer]]
+        max_z[layer] = z_sorted[stop - 1]
+    return starts, counts, mean_z, min_z, max_z
+
+# --- Backend ---
+
+class NumbaBackend(NumpyBackend):
+    """Os núcleos de NumpyBackend, compilados pelo Numba (mesmos argumentos e resultados)."""
+    name = "numba"
+    description = "Numba (JIT)"
+
+    def pair_tile(self, coords, lattice, pbc, offsets, p0, p1, out):
+        _pair_tile(np.ascontiguousarray(coords, dtype=np.float64), *_cell_args(lattice, pbc),
+                   np.ascontiguousarray(offsets, dtype=np.int64), p0, p1, out)
+
+    def pair_distances(self, coords, i, j, lattice=None, pbc=(True, True, True)):
+        i = np.ascontiguousarray(i, dtype=np.int64)
+        out = np.empty(len(i), dtype=np.float64)
+        _pair_distances(np.ascontiguousarray(coords, dtype=np.float64), i,
+                        np.ascontiguousarray(j, dtype=np.int64), *_cell_args(lattice, pbc), out)
+        return out
+
+    def band_extrema(self, energies, fermi):
+        energies = np.ascontiguousarray(energies, dtype=np.float64)
+        nk, nspin, nbands = energies.shape
+        if nk == 0 or nbands == 0:
+            # Blocos vazios: mesmos resultados (e erros) que em NumPy
+            return super().band_extrema(energies, fermi)
+        vbm_k, cbm_k = np.empty((nk, nspin)), np.empty((nk, nspin))
+        band_min, band_max = np.empty((nspin, nbands)), np.empty((nspin, nbands))
+        _band_extrema(energies, float(fermi), vbm_k, cbm_k, band_min, band_max)
+        return vbm_k, cbm_k, band_min, band_max
+
+    def layer_segments(self, z_sorted, gap_tolerance):
+        if len(z_sorted) == 0:
+            return super().layer_segments(z_sorted, gap_tolerance)
+        return _layer_segments(np.ascontiguousarray(z_sorted, dtype=np.float64), float(gap_tolerance))
@@ -0,0 +1,372 @@
+"""
+Formatação dos resultados e geração do relatório PDF do layer.py, sem dependências de
+interface gráfica. O texto dos resultados só é gerado aqui, na exibição e no relatório;
+o núcleo (analisador.py) trabalha apenas com arrays e objetos de resultado.
+O fpdf só é importado na primeira geração de relatório, para não atrasar a abertura da janela.
+"""
+import os # Para manipulação de arquivos e caminhos
+import numpy as np # Para o histograma das distâncias
+
+from analisador import (
+    ANG_TO_BOHR, LayerDistanceResult, LayerDistanceSeries, LayerSegmentation, PairDistances,
+    BandGapResult, BandStructure, DistanceHistogram, export_result, profile_stage,
+)
+
+# Número máximo de pares escritos no apêndice do relatório; a lista completa fica na tabela
+# da aba ou no CSV gravado junto com o PDF
+REPORT_MAX_PAIRS = 2000
+REPORT_HISTOGRAM_BINS = 40
+
+# --- Formatação dos Resultados (apenas para exibição e relatório) ---
+
+def format_layer_distance(result):
+    return (f"Distância entre camadas:\n"
+            f" - Em angstroms: {result.distance_ang:.4f} Å\n"
+            f" - Em bohr: {result.distance_bohr:.4f} bohr")
+
+def format_layer_segmentation(layers, max_rows=100):
+    """
+    Camadas detectadas: número de camadas, cada distância entre camadas adjacentes e,
+    por camada, o número de átomos, o z médio e a ondulação (no máximo 'max_rows' camadas).
+    """
+    lines = [f"{layers.n_layers} camada(s) detectada(s) (tolerância de {layers.gap_tolerance:.2f} Å)."]
+    spacings = layers.spacings
+    if len(spacings):
+        lines.append(f"Distância média entre camadas: {spacings.mean():.4f} Å "
+                     f"({spacings.mean() * ANG_TO_BOHR:.4f} bohr)")
+    if layers.wrap_spacing is not None:
+        lines.append(f"Distância até a imagem periódica da primeira camada: {layers.wrap_spacing:.4f} Å")
+    lines.append("")
+    lines.append("Camada: átomos, z médio (Å), ondulação (Å), distância até a próxima (Å)")
+    for k in range(min(layers.n_layers, max_rows)):
+        following = f"{spacings[k]:10.4f}" if k < len(spacings) else "         -"
+        lines.append(f"{k+1:6d}: {layers.counts[k]:7d} {layers.mean_z[k]:10.4f} "
+                     f"{layers.corrugation[k]:10.4f} {following}")
+    if layers.n_layers > max_rows:
+        lines.append(f"... e mais {layers.n_layers - max_rows} camadas.")
+    return "\n".join(lines)
+
+def format_layer_series(series, max_rows=100):
+    """
+    Resumo de uma trajetória: valor do último quadro, média e desvio padrão,
+    e uma amostra da série temporal com no máximo 'max_rows' linhas.
+    """
+    lines = [f"Trajetória com {series.n_frames} quadro(s).",
+             "Distância entre camadas (último quadro):",
+             f" - Em angstroms: {series.final_ang:.4f} Å",
+             f" - Em bohr: {series.final_ang * ANG_TO_BOHR:.4f} bohr",
+             f"Média ao longo da trajetória: {series.mean_ang:.4f} ± {series.std_ang:.4f} Å"]
+    if series.bond_count is not None:
+        lines.append(f"Ligações no último quadro: {series.bond_count[-1]} "
+                     f"(média {series.bond_mean[-1]:.4f} ± {series.bond_std[-1]:.4f} Å)")
+
+    stride = max(1, -(-series.n_frames // max_rows)) # Divisão arredondada para cima
+    lines.append("")
+    lines.append("Série temporal (quadro: distância em Å)" +
+                 (f", a cada {stride} quadros:" if stride > 1 else ":"))
+    for k in range(0, series.n_frames, stride):
+        lines.append(f"{series.frame_numbers[k]+1:6d}: {series.distances_ang[k]:10.4f}")
+    return "\n".join(lines)
+
+def format_pair_summary(pairs):
+    """Título e estatísticas de um PairDistances, sem listar os pares."""
+    if pairs.n_pairs == 0:
+        summary = "Nenhuma ligação encontrada."
+    else:
+        d = pairs.distances
+        summary = (f"{pairs.n_pairs} par(es) de {pairs.natoms} átomos. "
+                   f"Menor distância: {d.min():.4f} Å; maior: {d.max():.4f} Å; média: {d.mean():.4f} Å.")
+    return f"{pairs.header()}\n{summary}"
+
+def format_pair_report(pairs, max_pairs=REPORT_MAX_PAIRS):
+    """Lista de pares em texto, limitada a 'max_pairs' linhas."""
+    lines = [pairs.header()]
+    if pairs.n_pairs == 0:
+        lines.append("Nenhuma ligação encontrada.")
+    lines.extend(pairs.format_lines(slice(0, max_pairs)))
+    if pairs.n_pairs > max_pairs:
+        lines.append(f"... e mais {pairs.n_pairs - max_pairs} pares (lista completa na tabela da aba).")
+    return "\n".join(lines)
+
+def format_band_gap(result):
+    if result.is_metallic:
+        # O Fortran imprime o nível de Fermi para metálicos, então mantemos a consistência
+        return f"Nível de Fermi lido: {result.fermi:.4f} eV\nMaterial metálico (sem gap detectado)."
+    lines = [f"Gap de energia (eV): {result.gap:.4f}",
+             f"Tipo de gap: {'direto' if result.is_direct else 'indireto'}"
+             f" (menor gap direto: {result.direct_gap:.4f} eV)",
+             f"VBM: {result.vbm:.4f} eV no ponto k {result.k_vbm + 1} (k = {result.k_vbm_coord:.4f})",
+             f"CBM: {result.cbm:.4f} eV no ponto k {result.k_cbm + 1} (k = {result.k_cbm_coord:.4f})",
+             f"Nível de Fermi: {result.fermi:.4f} eV"]
+    if result.nspin > 1:
+        lines.extend(f"Gap do spin {s + 1}: {g:.4f} eV" for s, g in enumerate(result.spin_gaps))
+    return "\n".join(lines)
+
+def format_band_structure(result):
+    """Gap da estrutura de bandas (veja format_band_gap) e o tamanho dos dados do gráfico."""
+    spins = f" × {result.nspin} spins" if result.nspin > 1 else ""
+    return (f"{format_band_gap(result.gap)}\n"
+            f"Gráfico: {result.nk} pontos k × {result.nbands} bandas{spins}.")
+
+def format_distance_summary(hist):
+    """
+    Resumo de um DistanceHistogram: par e quadros usados, posição do pico mais alto e, na RDF,
+    o número de coordenação até o primeiro mínimo depois do pico.
+    """
+    title = "Distribuição radial g(r)" if hist.kind == "rdf" else "Histograma dos comprimentos de ligação"
+    lines = [f"{title} ({hist.pair_label}), {hist.n_frames} quadro(s), até {hist.r_max:.2f} Å."]
+    centers = hist.centers
+    if not hist.counts.any():
+        lines.append("Nenhum par encontrado no intervalo.")
+        return "\n".join(lines)
+
+    curve = hist.g_r if hist.g_r is not None else hist.counts
+    if hist.kind == "rdf" and hist.g_r is None:
+        # Sem densidade definida, compara as cascas pela contagem por volume (forma de g(r))
+        curve = hist.counts / (hist.edges[1:] ** 3 - hist.edges[:-1] ** 3)
+    peak = int(np.argmax(curve))
+    lines.append(f"Pico mais alto em r = {centers[peak]:.3f} Å.")
+    if hist.kind == "rdf":
+        if hist.g_r is None:
+            lines.append("Sem célula periódica: g(r) não normalizada (apenas contagens).")
+        # Primeiro mínimo local depois do pico (ou o fim do intervalo)
+        after = curve[peak + 1:]
+        rising = np.nonzero(np.diff(after) > 0)[0]
+        first_min = peak + 1 + (int(rising[0]) if len(rising) else len(after) - 1)
+        first_min = min(first_min, len(centers) - 1)
+        lines.append(f"Primeiro mínimo em r = {centers[first_min]:.3f} Å; "
+                     f"número de coordenação até ele: {hist.coordination[first_min]:.3f}")
+    else:
+        lines.append(f"{hist.n_reference} ligação(ões) por quadro; "
+                     f"média {hist.mean:.4f} ± {hist.std:.4f} Å.")
+    return "\n".join(lines)
+
+def format_distance_histogram(hist, max_rows=40):
+    """Resumo de um DistanceHistogram seguido de uma amostra da curva com no máximo 'max_rows' linhas."""
+    lines = [format_distance_summary(hist)]
+    if not hist.counts.any():
+        return lines[0]
+    centers = hist.centers
+    stride = max(1, -(-len(centers) // max_rows)) # Divisão arredondada para cima
+    header = "r (Å), pares por quadro" + (", g(r)" if hist.g_r is not None else "") + (
+        ", n(r)" if hist.coordination is not None else "")
+    lines.append("")
+    lines.append(header + (f", a cada {stride} intervalos:" if stride > 1 else ":"))
+    for k in range(0, len(centers), stride):
+        row = f"{centers[k]:8.3f} {hist.counts[k] / hist.n_frames:12.2f}"
+        if hist.g_r is not None:
+            row += f" {hist.g_r[k]:10.4f}"
+        if hist.coordination is not None:
+            row += f" {hist.coordination[k]:10.4f}"
+        lines.append(row)
+    return "\n".join(lines)
+
+def format_result(result):
+    """
+    Texto de um resultado guardado em NanophysicsApp.results: um objeto de resultado do núcleo,
+    uma mensagem de erro (str) ou None (nenhum cálculo).
+    """
+    if result is None or isinstance(result, str):
+        return result or ""
+    with profile_stage("texto/formatacao", resultado=type(result).__name__):
+        if isinstance(result, LayerDistanceResult):
+            return format_layer_distance(result)
+        if isinstance(result, LayerSegmentation):
+            return format_layer_segmentation(result)
+        if isinstance(result, LayerDistanceSeries):
+            return format_layer_series(result)
+        if isinstance(result, PairDistances):
+            return format_pair_report(result)
+        if isinstance(result, BandGapResult):
+            return format_band_gap(result)
+        if isinstance(result, BandStructure):
+            return format_band_structure(result)
+        if isinstance(result, DistanceHistogram):
+            return format_distance_histogram(result)
+    raise TypeError(f"Resultado desconhecido: {type(result).__name__}")
+
+# --- Relatório PDF ---
+
+def _section_title(pdf, title):
+    pdf.set_font("Arial", 'B', 14)
+    pdf.cell(0, 10, title, 0, 1)
+    pdf.set_font("Arial", size=12)
+
+def _write_pair_stats_table(pdf, pairs):
+    """Tabela com o número de pares e as distâncias mínima, média e máxima de cada par de elementos."""
+    widths = (40, 35, 35, 35, 35)
+    pdf.set_font("Arial", 'B', 10)
+    for width, title in zip(widths, ("Par", "Pares", "Mínima (Å)", "Média (Å)", "Máxima (Å)")):
+        pdf.cell(width, 7, title, 1, 0, 'C')
+    pdf.ln()
+    pdf.set_font("Arial", size=10)
+    for el_a, el_b, count, low, mean, high in pairs.element_pair_stats():
+        row = (f"{el_a}-{el_b}", str(count), f"{low:.4f}", f"{mean:.4f}", f"{high:.4f}")
+        for width, text in zip(widths, row):
+            pdf.cell(width, 6, text, 1, 0, 'C')
+        pdf.ln()
+    pdf.set_font("Arial", size=12)
+
+def _draw_histogram(pdf, distances, bins=REPORT_HISTOGRAM_BINS, width=170.0, height=45.0):
+    """
+    Desenha o histograma das distâncias como barras vetoriais do próprio PDF
+    (sem imagens intermediárias), com os limites dos eixos.
+    """
+    counts, edges = np.histogram(distances, bins=bins)
+    _draw_bars(pdf, counts, edges, "Distância entre pares (Å)", width, height)
+
+def _draw_bars(pdf, counts, edges, xlabel, width=170.0, height=45.0):
+    """Barras vetoriais de um histograma já acumulado ('counts' nos intervalos 'edges')."""
+    if pdf.get_y() + height + 15 > pdf.h - pdf.b_margin:
+        pdf.add_page()
+    x0, y0 = pdf.l_margin + 10, pdf.get_y() + 2
+    peak = max(float(counts.max()), 1e-12)
+    bar_width = width / len(counts)
+    pdf.set_fill_color(76, 175, 80)
+    for k, count in enumerate(counts.tolist()):
+        bar_height = height * count / peak
+        if bar_height > 0:
+            pdf.rect(x0 + k * bar_width, y0 + height - bar_height, bar_width, bar_height, 'F')
+    pdf.rect(x0, y0, width, height)
+
+    pdf.set_font("Arial", size=8)
+    pdf.text(pdf.l_margin, y0 + 3, f"{peak:.4g}")
+    pdf.text(pdf.l_margin, y0 + height, "0")
+    pdf.text(x0, y0 + height + 4, f"{edges[0]:.3f} Å")
+    pdf.text(x0 + width - 15, y0 + height + 4, f"{edges[-1]:.3f} Å")
+    pdf.text(x0 + width / 2 - 25, y0 + height + 4, xlabel)
+    pdf.set_y(y0 + height + 8)
+    pdf.set_font("Arial", size=12)
+
+def _write_pairs_appendix(pdf, pairs, max_pairs, progress):
+    """Lista de pares (no máximo 'max_pairs' linhas), uma célula por linha, em fonte monoespaçada."""
+    pdf.add_page()
+    _section_title(pdf, "Apêndice: Lista de Pares de Átomos")
+    pdf.set_font("Courier", size=8)
+    pdf.cell(0, 5, pairs.header(), 0, 1)
+    n_rows = min(pairs.n_pairs, max_pairs)
+    for k, line in enumerate(pairs.format_lines(slice(0, max_pairs))):
+        if progress is not None and k % 200 == 0:
+            progress(0.5 + 0.2 * k / max(n_rows, 1))
+        pdf.cell(0, 4, line, 0, 1)
+    if pairs.n_pairs > max_pairs:
+        pdf.set_font("Arial", 'I', 10)
+        pdf.cell(0, 6, f"... e mais {pairs.n_pairs - max_pairs} pares (lista completa no CSV ou na tabela da aba).",
+                 0, 1)
+
+def build_report(file_name, results, user_info=("", "", ""), logos=(), include_pairs=True,
+                 max_pairs=REPORT_MAX_PAIRS, pairs_csv=None, progress=None):
+    """
+    Gera o relatório PDF em 'file_name' a partir dos resultados das abas
+    ('distancia_layers', 'calcula_distancias', 'calcula_gap' e, se houver, 'distribuicao_radial';
+    veja format_result).
+    O corpo traz apenas resumos: as camadas e suas distâncias, as estatísticas das ligações por par
+    de elementos e um histograma das distâncias. A lista de pares vai para um apêndice limitado a
+    'max_pairs' linhas (include_pairs) e, se 'pairs_csv' for dado, completa para esse CSV.
+    'logos' é uma sequência de (caminho, x, largura, texto se ausente).
+    'progress' recebe a fração concluída (veja CalculationCancelled). Pode rodar fora da thread da
+    interface. Retorna a lista de avisos (ex.: logotipos que não puderam ser incluídos).
+    """
+    with profile_stage("relatorio/renderizacao", arquivo=file_name):
+        return _build_report(file_name, results, user_info, logos, include_pairs, max_pairs, pairs_csv, progress)
+
+def _build_report(file_name, results, user_info, logos, include_pairs, max_pairs, pairs_csv, progress):
+    from fpdf import FPDF # Importado só aqui (veja o início do módulo)
+
+    warnings = []
+    report = lambda fraction: progress(fraction) if progress is not None else None
+
+    pdf = FPDF()
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+
+    # Adicionar logotipos ao PDF
+    for path, x, width, placeholder in logos:
+        try:
+            if os.path.exists(path):
+                pdf.image(path, x=x, y=10, w=width)
+            else:
+                pdf.text(x, 20, placeholder)
+        except Exception as e:
+            warnings.append(f"Não foi possível adicionar o logotipo '{path}' ao PDF: {e}")
+
+    pdf.ln(20) # Pula algumas linhas para o conteúdo principal
+
+    pdf.set_font("Arial", 'B', 16)
+    pdf.cell(0, 10, "Relatório de Análise de Estruturas e Bandas", 0, 1, 'C')
+    pdf.ln(5) # Espaço após o título
+
+    # Adicionar informações do usuário (mesmo que vazias)
+    user_name, user_role, user_advisor = user_info
+    pdf.set_font("Arial", size=10)
+    pdf.cell(0, 7, f"Nome: {user_name if user_name else '[Não Informado]'}", 0, 1, 'C')
+    pdf.cell(0, 7, f"Cargo: {user_role if user_role else '[Não Informado]'}", 0, 1, 'C')
+    pdf.cell(0, 7, f"Orientador: {user_advisor if user_advisor else '[Não Informado]'}", 0, 1, 'C')
+    pdf.ln(10) # Espaço após as informações do usuário
+    report(0.1)
+
+    _section_title(pdf, "1. Distância entre Camadas")
+    layers = results.get("distancia_layers")
+    if layers is not None:
+        pdf.multi_cell(0, 8, format_result(layers))
+    else:
+        pdf.multi_cell(0, 10, "Nenhum cálculo de distância entre camadas foi realizado.")
+    pdf.ln(5)
+    report(0.2)
+
+    _section_title(pdf, "2. Distâncias entre Pares de Átomos")
+    pairs = results.get("calcula_distancias")
+    if isinstance(pairs, PairDistances):
+        pdf.multi_cell(0, 8, format_pair_summary(pairs))
+        if pairs.n_pairs:
+            pdf.ln(2)
+            _write_pair_stats_table(pdf, pairs)
+            report(0.3)
+            pdf.ln(4)
+            _draw_histogram(pdf, pairs.distances)
+        if include_pairs and pairs.n_pairs:
+            pdf.multi_cell(0, 8, f"A lista de pares (até {max_pairs}) está no apêndice.")
+        if pairs_csv:
+            pdf.multi_cell(0, 8, f"Lista completa de pares: {os.path.basename(pairs_csv)}")
+    elif pairs is not None:
+        pdf.multi_cell(0, 10, format_result(pairs))
+    else:
+        pdf.multi_cell(0, 10, "Nenhum cálculo de distâncias entre átomos foi realizado.")
+    pdf.ln(5)
+    report(0.4)
+
+    _section_title(pdf, "3. Cálculo de Gap de Energia")
+    gap = results.get("calcula_gap")
+    if gap is not None:
+        pdf.multi_cell(0, 10, format_result(gap))
+    else:
+        pdf.multi_cell(0, 10, "Nenhum cálculo de gap de energia foi realizado.")
+    pdf.ln(5)
+
+    # Seção opcional: só aparece se a aba de distribuição radial foi usada
+    rdf = results.get("distribuicao_radial")
+    if rdf is not None:
+        _section_title(pdf, "4. Distribuição Radial e Comprimentos de Ligação")
+        if isinstance(rdf, DistanceHistogram):
+            pdf.multi_cell(0, 8, format_distance_summary(rdf))
+            if rdf.counts.any():
+                pdf.ln(2)
+                curve = rdf.g_r if rdf.g_r is not None else rdf.counts / rdf.n_frames
+                _draw_bars(pdf, curve, rdf.edges, "g(r)" if rdf.g_r is not None else "Distância (Å)")
+        else:
+            pdf.multi_cell(0, 10, format_result(rdf))
+        pdf.ln(5)
+    report(0.5)
+
+    if isinstance(pairs, PairDistances) and pairs.n_pairs:
+        if include_pairs:
+            _write_pairs_appendix(pdf, pairs, max_pairs, progress)
+        if pairs_csv:
+            report(0.7)
+            export_result(pairs, pairs_csv, progress=lambda fraction: report(0.7 + 0.25 * fraction))
+
+    report(0.95)
+    pdf.output(file_name)
+    report(1.0)
+    return warnings
@@ -0,0 +1,511 @@
+"""
+Modo de serviço do layer.py: um processo local de longa duração que responde, em JSON, aos
+cálculos do modo em lote (camadas, segmentacao, ligacoes e gap) e às curvas do gráfico das bandas.
+
+Feito para scripts que chamam a análise milhares de vezes: o NumPy e os núcleos de cálculo são
+carregados uma única vez, as estruturas lidas ficam no cache de sessão do analisador e os
+registros e as energias das bandas ficam em um cache na memória (LRU limitado em bytes), que
+não é consultado para versões antigas de um arquivo (a chave inclui o tamanho e o mtime). Os
+resultados continuam indo para o cache em disco, compartilhado com a interface e o lote.py.
+
+Pedidos simultâneos sobre o mesmo arquivo são agrupados: o primeiro executa, de uma vez, todos os
+que chegarem enquanto espera ou calcula, a estrutura é lida uma única vez e pedidos idênticos são
+calculados uma vez. Os cálculos rodam um de cada vez (o estado de sessão do analisador não é
+compartilhado entre threads); os acertos do cache na memória são respondidos em paralelo.
+
+Rotas (corpo e resposta em JSON; as opções são as do lote.py: pbc, rede, corte, quadro,
+tolerancia_camadas e fermi):
+    POST /camadas, /segmentacao, /ligacoes, /gap  {"arquivo": ...}       -> registro do lote.py
+    POST /lote      {"arquivos": [...], "calculos": [...]}              -> {"registros": [...]}
+    POST /bandas    {"arquivo": ..., "largura", "k_min", "k_max", "e_min", "e_max"} -> gap e curvas
+    GET  /estado                                                        -> contadores e cache
+    POST /encerrar
+
+O serviço escuta só na máquina local (127.0.0.1 ou um socket Unix) e não tem autenticação:
+qualquer processo local pode pedir cálculos sobre os arquivos que o usuário do serviço lê.
+
+Exemplo:
+    python3 servico.py
+    python3 cliente.py camadas estrutura.xyz
+"""
+import argparse
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from analisador import (
+    BandsFormatError, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES, LAYER_GAP_TOLERANCE,
+    BACKENDS, DEFAULT_BACKEND, configure_result_cache, configure_session_cache, set_backend,
+    backend_status, get_backend, parse_lattice_text, read_fermi_level, calculate_band_structure,
+)
+from cliente import DEFAULT_PORT
+from lote import XYZ_CALCULATIONS, BANDS_CALCULATIONS, build_tasks, run_task
+
+PROTOCOL_VERSION = 1
+DEFAULT_MEMORY_BYTES = 512 << 20 # Registros e energias das bandas guardados na memória
+DEFAULT_SESSION_STRUCTURES = 64 # Estruturas lidas guardadas no cache de sessão do analisador
+_MAX_BODY_BYTES = 16 << 20
+_BAND_WIDTH_MAX = 20000 # Pixels de uma curva pedida a /bandas
+
+# --- Cache na Memória ---
+
+def _nbytes(value):
+    """Memória aproximada de um valor: arrays, registros e objetos com __slots__ (como os resultados)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return 64 + sum(64 + _nbytes(v) for v in value.values())
+    slots = [name for cls in type(value).__mro__ for name in getattr(cls, "__slots__", ())]
+    if slots:
+        return 64 + sum(_nbytes(getattr(value, name, None)) for name in slots)
+    return sys.getsizeof(value)
+
+class MemoryCache:
+    """
+    Cache LRU na memória, limitado a 'max_bytes' (estimados por _nbytes): guarda os registros
+    calculados e as estruturas de bandas do serviço. Seguro entre threads.
+    """
+    __slots__ = ("max_bytes", "hits", "misses", "evictions", "_entries", "_bytes", "_lock")
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict() # chave -> (valor, bytes), da usada há mais tempo para a mais recente
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Retorna o valor de 'key' (e marca o uso), ou None se não houver."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Guarda 'value' e descarta os usados há mais tempo até o total caber em max_bytes."""
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return # Maior que o cache inteiro: não vale a pena guardar
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._bytes -= dropped
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entradas": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "acertos": self.hits, "faltas": self.misses, "descartes": self.evictions}
+
+# --- Pedidos ---
+
+class RequestError(ValueError):
+    """Pedido malformado (campo ausente, opção inválida): respondido com HTTP 400."""
+
+def request_options(body):
+    """
+    Converte as opções de um pedido (os nomes das opções do lote.py; quadro a partir de 1, -1 = último)
+    no dicionário de opções de lote.run_task. Levanta RequestError.
+    """
+    try:
+        lattice = body.get("rede")
+        if isinstance(lattice, str):
+            lattice = parse_lattice_text(lattice)
+        elif lattice is not None:
+            lattice = np.asarray(lattice, dtype=np.float64)
+            if lattice.size != 9:
+                raise ValueError("Informe exatamente 9 números para os vetores de rede (a, b e c).")
+            lattice = lattice.reshape(3, 3)
+        frame = body.get("quadro")
+        if frame is not None:
+            frame = int(frame)
+            if frame == 0:
+                raise ValueError("Os quadros são numerados a partir de 1.")
+            frame = frame - 1 if frame > 0 else frame
+        tolerance = float(body.get("tolerancia_camadas", LAYER_GAP_TOLERANCE))
+        if tolerance <= 0.0:
+            raise ValueError("A tolerância das camadas deve ser positiva.")
+        cutoff = body.get("corte")
+        use_pbc = body.get("pbc", True)
+        if not isinstance(use_pbc, bool): # "false" ou 0 não podem virar PBC ligado
+            raise ValueError("O campo 'pbc' deve ser true ou false.")
+        fermi = body.get("fermi")
+        if isinstance(fermi, str):
+            fermi = read_fermi_level(fermi)
+        return {"use_pbc": use_pbc, "lattice": lattice,
+                "cutoff": None if cutoff is None else float(cutoff), "frame": frame,
+                "layer_tolerance": tolerance, "fermi": None if fermi is None else float(fermi)}
+    except (OSError, BandsFormatError) as e:
+        raise RequestError(f"Não foi possível ler o nível de Fermi: {e}") from None
+    except (TypeError, ValueError) as e:
+        raise RequestError(str(e)) from None
+
+def _options_key(options):
+    return json.dumps(options, sort_keys=True, default=lambda value: value.tolist())
+
+def _file_stamp(path):
+    """(tamanho, mtime_ns) do arquivo, ou None se ele não puder ser lido (o cálculo dá o erro)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+# --- Serviço ---
+
+class AnalysisService:
+    """
+    Executa os cálculos dos pedidos com o cache na memória e o agrupamento por arquivo (veja o
+    início do módulo). Independente do transporte: o servidor HTTP só converte pedidos e respostas.
+    """
+
+    def __init__(self, memory_bytes=DEFAULT_MEMORY_BYTES):
+        self.memory = MemoryCache(memory_bytes)
+        self.started = time.time()
+        self.counts = {"pedidos": 0, "calculos": 0, "agrupados": 0, "repetidos": 0}
+        self._lock = threading.Lock() # Protege _batches e counts
+        self._compute_lock = threading.Lock() # Um cálculo de cada vez (estado de sessão do analisador)
+        self._batches = {} # arquivo -> [(chave, cálculo, opções, Future)] à espera do primeiro pedido
+
+    def run(self, tasks, options):
+        """
+        Executa as tarefas [(arquivo, cálculo)] com as mesmas opções e retorna os registros, na ordem.
+        O cálculo "bandas" retorna as curvas do gráfico (veja band_plot_record). Pedidos já
+        calculados para a versão atual do arquivo vêm do cache na memória; os demais entram no grupo
+        do seu arquivo (veja _run_batch).
+        """
+        start = time.perf_counter()
+        options_key = _options_key(options)
+        records = [None] * len(tasks)
+        waiting, leading = [], []
+        for n, (file_path, calculation) in enumerate(tasks):
+            path = os.path.abspath(file_path)
+            key = (path, _file_stamp(path), calculation, options_key)
+            record = None if key[1] is None else self.memory.get(key)
+            if record is not None:
+                records[n] = dict(record, tempo_s=round(time.perf_counter() - start, 6))
+                continue
+            future = Future()
+            with self._lock:
+                batch = self._batches.get(path)
+                if batch is None:
+                    batch = self._batches[path] = []
+                    leading.append(path)
+                else:
+                    self.counts["agrupados"] += 1
+                batch.append((key, calculation, options, future))
+            waiting.append((n, future))
+        with self._lock:
+            self.counts["pedidos"] += len(tasks)
+        for path in leading:
+            self._run_batch(path)
+        for n, future in waiting:
+            records[n] = dict(future.result())
+        return records
+
+    def _run_batch(self, path):
+        """
+        Executa o grupo de pedidos do arquivo, inclusive os que chegarem enquanto este espera a vez
+        ou calcula, até o grupo esvaziar. Pedidos idênticos (mesma versão, cálculo e opções) são
+        calculados uma vez.
+        """
+        with self._compute_lock:
+            while True:
+                with self._lock:
+                    batch = self._batches[path]
+                    if not batch:
+                        del self._batches[path]
+                        return
+                    self._batches[path] = []
+                done = {}
+                for key, calculation, options, future in batch:
+                    try:
+                        if key in done:
+                            with self._lock:
+                                self.counts["repetidos"] += 1
+                        else:
+                            done[key] = self._compute(key, calculation, options)
+                        future.set_result(done[key])
+                    except Exception as e:
+                        future.set_exception(e)
+
+    def _compute(self, key, calculation, options):
+        path, stamp = key[0], key[1]
+        with self._lock:
+            self.counts["calculos"] += 1
+        if calculation == "bandas":
+            return self.band_plot_record(path, options) # Curvas de um zoom: não são guardadas
+        record = run_task(path, calculation, options, band_gap=self._band_gap)
+        if stamp is not None and record["status"] == "ok":
+            self.memory.put(key, record)
+        return record
+
+    def band_structure(self, path, fermi=None):
+        """O BandStructure do arquivo (veja analisador.calculate_band_structure), mantido na memória."""
+        key = (path, _file_stamp(path), "estrutura_bandas", fermi)
+        bands = None if key[1] is None else self.memory.get(key)
+        if bands is None:
+            bands = calculate_band_structure(path, fermi=fermi)
+            if key[1] is not None:
+                self.memory.put(key, bands)
+        return bands
+
+    def _band_gap(self, path, fermi=None):
+        return self.band_structure(os.path.abspath(path), fermi).gap
+
+    def band_plot_record(self, path, options):
+        """
+        Registro com o gap (campos do lote.py) e as curvas das bandas visíveis na janela pedida,
+        reduzidas aos mínimos e máximos de cada pixel (veja analisador.BandStructure.envelope).
+        As opções da vista (largura, k_min, k_max, e_min, e_max) vêm em options["vista"].
+        """
+        view = options.get("vista", {})
+        start = time.perf_counter()
+        loaded = []
+
+        def band_gap(file_path, fermi=None):
+            loaded.append(self.band_structure(path, fermi))
+            return loaded[0].gap
+
+        # O gap (e a escolha do nível de Fermi, e os erros) como no registro de /gap
+        record = run_task(path, "gap", options, band_gap=band_gap)
+        record["calculo"] = "bandas"
+        if record["status"] == "ok":
+            spins, band_numbers, x, y = loaded[0].envelope(view.get("k_min"), view.get("k_max"),
+                                                           view.get("largura", 1000),
+                                                           view.get("e_min"), view.get("e_max"))
+            record["curvas"] = [{"spin": int(s) + 1, "banda": int(b) + 1,
+                                 "k": np.round(x[n].astype(np.float64), 6).tolist(),
+                                 "energia": np.round(y[n].astype(np.float64), 5).tolist()}
+                                for n, (s, b) in enumerate(zip(spins, band_numbers))]
+        record["tempo_s"] = round(time.perf_counter() - start, 6)
+        return record
+
+    def status(self):
+        with self._lock:
+            counts = dict(self.counts)
+        return dict(counts, versao=PROTOCOL_VERSION, pid=os.getpid(), nucleos=get_backend().name,
+                    ativo_s=round(time.time() - self.started, 3), memoria=self.memory.stats())
+
+# --- Servidor HTTP ---
+
+CALCULATIONS = XYZ_CALCULATIONS + BANDS_CALCULATIONS
+
+def _required(body, field):
+    value = body.get(field)
+    if not isinstance(value, str) or not value:
+        raise RequestError(f"Informe o campo '{field}'.")
+    return value
+
+def _batch_tasks(body):
+    """As tarefas de um pedido a /lote: os cálculos pedidos que se aplicam a cada arquivo (como no lote.py)."""
+    files = body.get("arquivos")
+    if not isinstance(files, list) or not all(isinstance(f, str) for f in files):
+        raise RequestError("Informe o campo 'arquivos' (uma lista de caminhos).")
+    calculations = body.get("calculos", CALCULATIONS)
+    if isinstance(calculations, str):
+        calculations = [c.strip() for c in calculations.split(",") if c.strip()]
+    elif not isinstance(calculations, list) or not all(isinstance(c, str) for c in calculations):
+        raise RequestError("O campo 'calculos' deve ser uma lista de nomes ou um texto separado por vírgulas.")
+    unknown = set(calculations) - set(CALCULATIONS)
+    if unknown:
+        raise RequestError(f"Cálculo(s) desconhecido(s): {', '.join(sorted(unknown))}")
+    return build_tasks([os.path.abspath(f) for f in files], set(calculations))
+
+def _band_view(body):
+    """A janela pedida a /bandas: largura (pixels) e os limites opcionais em k e em energia."""
+    try:
+        view = {"largura": int(body.get("largura", 1000))}
+        for field in ("k_min", "k_max", "e_min", "e_max"):
+            if body.get(field) is not None:
+                view[field] = float(body[field])
+    except (TypeError, ValueError):
+        raise RequestError("A largura e os limites da janela das bandas devem ser números.") from None
+    if not 1 <= view["largura"] <= _BAND_WIDTH_MAX:
+        raise RequestError(f"A largura deve estar entre 1 e {_BAND_WIDTH_MAX} pixels.")
+    return view
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Conexão mantida aberta entre os pedidos de um cliente
+    server_version = f"layers-servico/{PROTOCOL_VERSION}"
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/estado":
+            self._reply(200, self.server.service.status())
+        else:
+            self._reply(404, {"erro": f"Rota desconhecida: {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        route = self.path.strip("/")
+        try:
+            body = self._read_body()
+            if route in CALCULATIONS:
+                payload = service.run([(_required(body, "arquivo"), route)], request_options(body))[0]
+            elif route == "lote":
+                payload = {"registros": service.run(_batch_tasks(body), request_options(body))}
+            elif route == "bandas":
+                options = dict(request_options(body), vista=_band_view(body))
+                payload = service.run([(_required(body, "arquivo"), "bandas")], options)[0]
+            elif route == "encerrar":
+                payload = {"encerrando": True}
+                # shutdown() espera o laço do servidor, que está esperando este pedido: outra thread
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                self._reply(404, {"erro": f"Rota desconhecida: {self.path}"})
+                return
+        except RequestError as e:
+            self._reply(400, {"erro": str(e)})
+            return
+        except Exception as e:
+            self._reply(500, {"erro": f"{type(e).__name__}: {e}"})
+            return
+        self._reply(200, payload)
+
+    def _read_body(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            raise RequestError("Content-Length inválido.") from None
+        if length > _MAX_BODY_BYTES:
+            raise RequestError("Pedido grande demais.")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise RequestError("O corpo do pedido deve ser um objeto JSON.") from None
+        if not isinstance(body, dict):
+            raise RequestError("O corpo do pedido deve ser um objeto JSON.")
+        return body
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class _TCPHandler(_Handler):
+    # Cabeçalhos e corpo vão em duas escritas: sem isto, o algoritmo de Nagle atrasa cada resposta
+    disable_nagle_algorithm = True
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(service, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None, verbose=False):
+    """
+    Cria o servidor HTTP (em host:porta, ou no socket Unix 'socket_path', só para o usuário) que
+    atende 'service' (um AnalysisService), uma thread por conexão. Com porta 0, o sistema escolhe uma
+    livre. O endereço para o cliente fica em server.address ('http://...' ou 'unix:...').
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path) # Socket de um serviço anterior que não foi encerrado
+        server = _UnixHTTPServer(socket_path, _Handler)
+        os.chmod(socket_path, 0o600)
+        server.address = f"unix:{socket_path}"
+    else:
+        server = ThreadingHTTPServer((host, port), _TCPHandler)
+        server.address = f"http://{host}:{server.server_address[1]}"
+    server.service = service
+    server.verbose = verbose
+    return server
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Serviço local do layer.py: responde em JSON aos cálculos do lote.py, mantendo o NumPy, "
+                    "as estruturas lidas e os resultados na memória entre os pedidos.")
+    parser.add_argument("--endereco", default="127.0.0.1",
+                        help="Endereço em que o serviço escuta (padrão: %(default)s, só a máquina local).")
+    parser.add_argument("--porta", type=int, default=DEFAULT_PORT,
+                        help="Porta TCP (padrão: %(default)d; 0 = uma porta livre).")
+    parser.add_argument("--socket", default=None,
+                        help="Escuta neste socket Unix (acessível só pelo usuário) em vez de TCP.")
+    parser.add_argument("--memoria", type=float, default=DEFAULT_MEMORY_BYTES / 2**20,
+                        help="Memória máxima (MiB) dos registros e das energias das bandas guardados e, à parte, "
+                             "das estruturas lidas (padrão: %(default).0f).")
+    parser.add_argument("--estruturas", type=int, default=DEFAULT_SESSION_STRUCTURES,
+                        help="Número máximo de estruturas lidas guardadas na memória (padrão: %(default)d).")
+    parser.add_argument("--cache", default=None,
+                        help=f"Pasta do cache de resultados em disco (padrão: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument("--cache-max", type=float, default=DEFAULT_CACHE_MAX_BYTES / 2**20,
+                        help="Tamanho máximo do cache em disco em MiB (padrão: %(default).0f).")
+    parser.add_argument("--sem-cache", action="store_true",
+                        help="Não lê nem grava o cache de resultados em disco (o cache na memória continua).")
+    parser.add_argument("--nucleo", "--backend", choices=("auto",) + BACKENDS, default=None,
+                        help=f"Núcleos de cálculo (padrão: {DEFAULT_BACKEND}; veja lote.py --nucleo).")
+    parser.add_argument("-v", "--detalhado", action="store_true", help="Mostra cada pedido recebido.")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.memoria <= 0.0 or args.estruturas < 1:
+        parser.error("a memória e o número de estruturas devem ser positivos")
+    memory_bytes = int(args.memoria * 2**20)
+    configure_result_cache(args.cache, int(args.cache_max * 2**20), not args.sem_cache)
+    configure_session_cache(args.estruturas, memory_bytes)
+    try:
+        set_backend(args.nucleo or DEFAULT_BACKEND)
+    except ValueError as e:
+        parser.error(str(e))
+
+    service = AnalysisService(memory_bytes)
+    try:
+        server = make_server(service, args.endereco, args.porta, args.socket, args.detalhado)
+    except OSError as e:
+        print(f"Não foi possível abrir o serviço: {e}", file=sys.stderr)
+        return 1
+    # O endereço vai para a saída padrão (para scripts que iniciam o serviço); o resto, para stderr
+    print(server.address, flush=True)
+    print(f"{backend_status()}.", file=sys.stderr)
+    print(f"Serviço em {server.address} (Ctrl+C para encerrar).", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None:
+            try:
+                os.remove(args.socket)
+            except OSError:
+                pass
+    counts = service.status()
+    print(f"Serviço encerrado: {counts['pedidos']} pedido(s), {counts['calculos']} cálculo(s), "
+          f"{counts['memoria']['acertos']} acerto(s) na memória.", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
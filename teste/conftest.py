@@ -0,0 +1,24 @@
+"""
+Configuração dos testes (python -m pytest teste): os módulos do projeto ficam na pasta acima.
+Cada teste roda com o cache em disco desligado e o estado de sessão do analisador restaurado.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analisador
+
+@pytest.fixture(autouse=True)
+def sessao_limpa():
+    cache = analisador.get_result_cache()
+    analisador.configure_result_cache(enabled=False)
+    analisador._xyz_session_cache.clear()
+    yield
+    analisador.configure_incremental(False)
+    analisador.configure_session_cache()
+    analisador._xyz_session_cache.clear()
+    analisador._query_session.clear()
+    analisador._result_cache = cache
@@ -0,0 +1,38 @@
+"""Histograma dos comprimentos de ligação sobre os quadros de uma trajetória."""
+import numpy as np
+import pytest
+
+import analisador
+
+def _trajectory(path, frames):
+    with open(path, "w") as f:
+        for atoms in frames:
+            f.write(f"{len(atoms)}\nquadro\n" + "".join(f"{el} 0.0 0.0 {z}\n" for el, z in atoms))
+    return str(path)
+
+def _bin_of(histogram, distance):
+    return int(np.searchsorted(histogram.edges, distance, side="right")) - 1
+
+def test_quadro_com_raio_maior_estende_o_histograma(tmp_path):
+    # O primeiro quadro só tem C (corte de 1,75 Å); a ligação Mo-Mo de 2,9 Å do segundo não pode
+    # cair no último intervalo do primeiro
+    path = _trajectory(tmp_path / "traj.xyz", [[("C", 0.0), ("C", 1.4)], [("Mo", 0.0), ("Mo", 2.9)]])
+    c_cutoff = 2.0 * analisador.BOND_TOLERANCE * analisador.COVALENT_RADII["C"]
+    mo_cutoff = 2.0 * analisador.BOND_TOLERANCE * analisador.COVALENT_RADII["Mo"]
+    histogram = analisador.calculate_bond_histogram(path, n_bins=10)
+    assert histogram.n_frames == 2
+    assert histogram.counts.sum() == 2
+    np.testing.assert_allclose(np.diff(histogram.edges), c_cutoff / 10)
+    assert histogram.edges[-1] == pytest.approx(np.ceil(mo_cutoff / (c_cutoff / 10)) * c_cutoff / 10)
+    assert histogram.counts[_bin_of(histogram, 1.4)] == 1
+    assert histogram.counts[_bin_of(histogram, 2.9)] == 1
+    assert histogram.mean == pytest.approx(2.15)
+
+def test_intervalos_de_um_quadro(tmp_path):
+    path = _trajectory(tmp_path / "c.xyz", [[("C", 0.0), ("C", 1.4), ("C", 2.8)]])
+    histogram = analisador.calculate_bond_histogram(path, n_bins=7)
+    assert len(histogram.counts) == 7
+    assert histogram.edges[-1] == pytest.approx(2.0 * analisador.BOND_TOLERANCE * analisador.COVALENT_RADII["C"])
+    histogram = analisador.calculate_bond_histogram(path, n_bins=7, cutoff=1.4)
+    assert len(histogram.counts) == 7 and histogram.edges[-1] == pytest.approx(1.4)
+    assert histogram.counts[-1] == 2 # d == corte fica no último intervalo
@@ -0,0 +1,140 @@
+"""
+Recálculo incremental (configure_incremental): depois de editar, acrescentar ou remover átomos de
+um arquivo, as ligações, a tabela de todos os pares e as camadas atualizadas devem ser as mesmas de
+um cálculo do zero com o recálculo incremental desligado.
+"""
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+import analisador
+
+LATTICE = 'Lattice="12.0 0.0 0.0 0.0 12.0 0.0 0.0 0.0 20.0" pbc="T T T"'
+
+def _atoms(rng, count, symbols=("C", "S")):
+    # Duas camadas (z ~ 5 e ~ 8.4 Å), com alguma ondulação
+    layer = rng.integers(0, 2, count)
+    coords = np.column_stack((rng.uniform(0.0, 12.0, count), rng.uniform(0.0, 12.0, count),
+                              5.0 + 3.4 * layer + rng.uniform(-0.3, 0.3, count)))
+    return [str(s) for s in rng.choice(symbols, count)], coords
+
+def _write(path, symbols, coords, version):
+    lines = "".join(f"{s} {x:.6f} {y:.6f} {z:.6f}\n" for s, (x, y, z) in zip(symbols, coords))
+    with open(path, "w") as f:
+        f.write(f"{len(symbols)}\n{LATTICE}\n{lines}")
+    # Carimbo explícito: versões gravadas no mesmo instante também contam como alteradas
+    stamp = 1_700_000_000_000_000_000 + version * 1_000_000_000
+    os.utime(path, ns=(stamp, stamp))
+
+def _calculations(path):
+    return (analisador.calculate_pair_distances(path, bonds_only=True),
+            analisador.calculate_pair_distances(path),
+            analisador.calculate_layers(path))
+
+def _sorted_pairs(pairs):
+    order = np.lexsort((pairs.pair_j, pairs.pair_i))
+    return pairs.pair_i[order], pairs.pair_j[order], pairs.distances[order]
+
+def _assert_same_pairs(updated, reference):
+    assert updated.elements == reference.elements
+    assert np.array_equal(updated.species, reference.species)
+    i, j, d = _sorted_pairs(updated)
+    ref_i, ref_j, ref_d = _sorted_pairs(reference)
+    assert np.array_equal(i, ref_i) and np.array_equal(j, ref_j)
+    np.testing.assert_allclose(d, ref_d, rtol=0.0, atol=1e-12)
+
+def _assert_same_layers(updated, reference):
+    assert np.array_equal(updated.layer_of_atom, reference.layer_of_atom)
+    assert np.array_equal(updated.counts, reference.counts)
+    for name in ("mean_z", "min_z", "max_z"):
+        np.testing.assert_allclose(getattr(updated, name), getattr(reference, name), rtol=0.0, atol=1e-12)
+    assert updated.wrap_spacing == pytest.approx(reference.wrap_spacing, abs=1e-12)
+
+def _incremental_stages():
+    return {record.name for record in analisador.get_profiler().records if record.name.endswith("/incremental")}
+
+def test_incremental_igual_ao_calculo_do_zero(tmp_path):
+    rng = np.random.default_rng(7)
+    symbols, coords = _atoms(rng, 240)
+    versions = [(list(symbols), coords.copy())]
+    # Edição: poucos átomos movidos (alguns mudam o tamanho da linha) e um que troca de elemento
+    coords[[3, 50, 51, 200]] += rng.uniform(-0.4, 0.4, (4, 3))
+    coords[120, 0] = 11.999
+    symbols[77] = "S" if symbols[77] == "C" else "C"
+    versions.append((symbols, coords))
+    # Acréscimo no fim, com um elemento novo; depois, remoção dos últimos átomos
+    added_symbols, added_coords = _atoms(rng, 20, ("Mo",))
+    versions.append((symbols + added_symbols, np.concatenate((coords, added_coords))))
+    versions.append((symbols[:225], coords[:225]))
+
+    # Referência: cada versão calculada do zero, com o recálculo incremental desligado
+    references = []
+    for version, (new_symbols, new_coords) in enumerate(versions):
+        reference_path = str(tmp_path / f"referencia_{version}.xyz")
+        _write(reference_path, new_symbols, new_coords, version)
+        references.append(_calculations(reference_path))
+
+    path = str(tmp_path / "estrutura.xyz")
+    _write(path, *versions[0], 0)
+    analisador.configure_incremental(True)
+    analisador.enable_profiling(trace_memory=False)
+    try:
+        _calculations(path)
+        for version in range(1, len(versions)):
+            _write(path, *versions[version], version)
+            analisador.get_profiler().clear()
+            updated = _calculations(path)
+            # As atualizações de fato aproveitaram a versão anterior
+            assert _incremental_stages() == {"pares/incremental", "segmentacao/incremental"}
+            bonds, pairs, layers = references[version]
+            _assert_same_pairs(updated[0], bonds)
+            _assert_same_pairs(updated[1], pairs)
+            _assert_same_layers(updated[2], layers)
+    finally:
+        analisador.disable_profiling()
+
+def test_incremental_com_calculos_simultaneos(tmp_path):
+    # "Atualizar ao Mudar": as abas refazem seus cálculos ao mesmo tempo quando o arquivo muda
+    rng = np.random.default_rng(11)
+    symbols, coords = _atoms(rng, 240)
+    versions = []
+    for version in range(6):
+        coords = coords.copy()
+        coords[rng.integers(0, len(coords), 3)] += 0.05
+        versions.append(coords)
+    references = []
+    for version, new_coords in enumerate(versions):
+        reference_path = str(tmp_path / f"referencia_{version}.xyz")
+        _write(reference_path, symbols, new_coords, version)
+        references.append(_calculations(reference_path))
+
+    path = str(tmp_path / "estrutura.xyz")
+    analisador.configure_incremental(True)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5) # Trocas de thread frequentes, para expor as corridas
+    try:
+        for version, new_coords in enumerate(versions):
+            _write(path, symbols, new_coords, version)
+            results, errors = [None] * 6, []
+
+            def work(n):
+                try:
+                    results[n] = _calculations(path)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=work, args=(n,)) for n in range(len(results))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert errors == []
+            for bonds, pairs, layers in results:
+                _assert_same_pairs(bonds, references[version][0])
+                _assert_same_pairs(pairs, references[version][1])
+                _assert_same_layers(layers, references[version][2])
+    finally:
+        sys.setswitchinterval(interval)
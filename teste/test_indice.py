@@ -0,0 +1,28 @@
+"""Arquivo auxiliar '<arquivo>.frames.npz' do índice de quadros das trajetórias .xyz."""
+import os
+
+import numpy as np
+import pytest
+
+import analisador
+
+def _trajectory(path, n_frames=5):
+    path.write_text("".join(f"3\nquadro {k}\n" + "".join(f"C 0 0 {z + 0.1 * k}\n" for z in range(3))
+                            for k in range(n_frames)))
+    return str(path)
+
+@pytest.mark.parametrize("size", [0, 10, 200, -1])
+def test_auxiliar_truncado_e_reindexado(tmp_path, size):
+    path = _trajectory(tmp_path / "traj.xyz")
+    expected = analisador.load_xyz_frame_index(path)
+    sidecar = path + analisador.FRAME_INDEX_SUFFIX
+    data = open(sidecar, "rb").read()
+    with open(sidecar, "wb") as f:
+        f.write(data[:size if size >= 0 else len(data) - 1])
+
+    index = analisador.load_xyz_frame_index(path)
+    assert index.n_frames == expected.n_frames == 5
+    np.testing.assert_allclose(index.read_frame(-1).coords[:, 2], [0.4, 1.4, 2.4])
+    with np.load(sidecar) as stored: # Regravado inteiro
+        assert int(stored["version"]) == analisador._FRAME_INDEX_VERSION
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
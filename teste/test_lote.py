@@ -0,0 +1,52 @@
+"""Modo em lote (lote.py): um processo do pool que morre não interrompe o lote."""
+import io
+import json
+import os
+import threading
+
+import lote
+
+def _task(file_path, calculation, options):
+    if os.path.basename(file_path) == "derruba.xyz":
+        os._exit(1) # Como um processo morto por falta de memória
+    if os.path.basename(file_path) == "resultado_invalido.xyz":
+        return {"arquivo": file_path, "calculo": calculation, "status": "ok", "tempo_s": lambda: 0}
+    return {"arquivo": file_path, "calculo": calculation, "status": "ok", "tempo_s": 0.0}
+
+def _records(stream):
+    return {os.path.basename(r["arquivo"]): r for r in map(json.loads, stream.getvalue().splitlines())}
+
+def test_processo_morto_gera_erro_e_o_lote_continua(monkeypatch):
+    monkeypatch.setattr(lote, "run_task", _task)
+    names = [f"e{k}.xyz" for k in range(6)]
+    names[2] = "derruba.xyz"
+    names[4] = "resultado_invalido.xyz" # Não volta do processo do pool (não serializável)
+    stream = io.StringIO()
+    progress = []
+    n_ok, n_errors = lote.run_batch([(name, "camadas") for name in names], {}, lote.ResultWriter(stream, "jsonl"),
+                                    workers=2, progress=lambda done, total, record: progress.append(done))
+    records = _records(stream)
+    assert (n_ok, n_errors) == (4, 2)
+    assert sorted(records) == sorted(names)
+    assert progress == list(range(1, 7))
+    assert records["derruba.xyz"]["status"] == "erro"
+    assert "terminou de forma inesperada" in records["derruba.xyz"]["erro"]
+    assert records["resultado_invalido.xyz"]["status"] == "erro"
+    assert all(records[name]["status"] == "ok" for name in names if name.startswith("e"))
+
+def test_observacao_termina_com_processo_morto(tmp_path, monkeypatch):
+    monkeypatch.setattr(lote, "run_task", _task)
+    for name in ("e0.xyz", "derruba.xyz", "e1.xyz", "resultado_invalido.xyz"):
+        (tmp_path / name).write_text("2\nx\nC 0 0 0\nC 0 0 3.3\n")
+    stream = io.StringIO()
+    outcome = []
+    thread = threading.Thread(target=lambda: outcome.append(lote.run_watch(
+        [str(tmp_path)], ("camadas",), {}, lote.ResultWriter(stream, "jsonl", fields=lote.WATCH_FIELDS),
+        lote.ProcessedLog(), workers=2, interval=0.1, settle=0.0, duration=1.0)), daemon=True)
+    thread.start()
+    thread.join(60)
+    assert outcome == [{"ok": 2, "erro": 2, "tarefas": 4, "versoes": 4}]
+    records = _records(stream)
+    assert "terminou de forma inesperada" in records["derruba.xyz"]["erro"]
+    assert records["resultado_invalido.xyz"]["status"] == "erro"
+    assert records["e0.xyz"]["status"] == records["e1.xyz"]["status"] == "ok"
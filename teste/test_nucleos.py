@@ -0,0 +1,83 @@
+"""Escolha dos núcleos de cálculo: veredito da verificação guardado entre partidas e Numba carregado sob demanda."""
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import analisador
+
+requires_numba = pytest.mark.skipif("numba" not in analisador.available_backends(), reason="Numba não instalado")
+
+@pytest.fixture(autouse=True)
+def nucleos(tmp_path, monkeypatch):
+    monkeypatch.setattr(analisador, "BACKEND_CHECK_FILE", str(tmp_path / "nucleos.json"))
+    yield
+    analisador._backend, analisador._backend_note = analisador.NumpyBackend(), None
+
+def _count_checks(monkeypatch, problems=None):
+    calls = []
+    def check(backend, reference=None, seed=0):
+        calls.append(backend.name)
+        return list(problems or [])
+    monkeypatch.setattr(analisador, "check_backend", check)
+    return calls
+
+@requires_numba
+def test_veredito_guardado_entre_partidas(monkeypatch):
+    calls = _count_checks(monkeypatch)
+    assert analisador.set_backend("numba") == "numba"
+    assert analisador.set_backend("numba") == "numba"
+    assert calls == ["numba"]
+    assert isinstance(analisador.get_backend(), analisador.DeferredBackend)
+    assert analisador.backend_status().startswith("Núcleos: Numba")
+
+@requires_numba
+def test_divergencia_guardada_mantem_numpy(monkeypatch):
+    calls = _count_checks(monkeypatch, ["camadas"])
+    assert analisador.set_backend("numba") == "numpy"
+    assert analisador.set_backend("numba") == "numpy"
+    assert calls == ["numba"]
+    assert "divergiu do NumPy em camadas" in analisador.backend_status()
+
+@requires_numba
+def test_veredito_refeito_quando_a_chave_muda(monkeypatch):
+    calls = _count_checks(monkeypatch)
+    analisador.set_backend("numba")
+    key = analisador._backend_check_key("numba")
+    monkeypatch.setattr(analisador, "_backend_check_key", lambda name: key.replace("|", "|outra|", 1))
+    analisador.set_backend("numba")
+    assert calls == ["numba", "numba"]
+
+@requires_numba
+def test_backend_adiado_carrega_acima_do_limite(monkeypatch):
+    monkeypatch.setattr(analisador, "JIT_MIN_WORK", 1000)
+    analisador.set_backend("numba", check=False)
+    deferred = analisador.get_backend()
+    z_sorted = np.sort(np.random.default_rng(0).random(600) * 20.0)
+    expected = analisador.NumpyBackend().layer_segments(z_sorted, 0.5)
+
+    for _ in range(2): # 600 e depois 1200 alturas somadas: só a segunda chamada carrega o Numba
+        assert analisador.get_backend() is deferred
+        got = deferred.layer_segments(z_sorted, 0.5)
+        for g, e in zip(got, expected):
+            np.testing.assert_allclose(g, e, rtol=1e-12)
+    assert analisador.get_backend().name == "numba"
+    assert not isinstance(analisador.get_backend(), analisador.DeferredBackend)
+
+@requires_numba
+def test_partida_com_veredito_nao_importa_numba(tmp_path):
+    # Processos novos com o mesmo cache: só o primeiro verifica (e importa) o Numba
+    structure = tmp_path / "bicamada.xyz"
+    structure.write_text("4\nx\n" + "".join(f"C {k} 0 {3.3 * (k % 2)}\n" for k in range(4)))
+    code = ("import sys, analisador\n"
+            "analisador.set_backend('auto')\n"
+            f"analisador.calculate_layers({str(structure)!r})\n"
+            "print(analisador.get_backend().name, 'numba' in sys.modules)")
+    env = dict(os.environ, LAYERS_CACHE_DIR=str(tmp_path / "cache"))
+    env.pop("LAYERS_BACKEND", None)
+    project = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    outputs = [subprocess.run([sys.executable, "-c", code], cwd=project, env=env, check=True,
+                              capture_output=True, text=True).stdout.split() for _ in range(2)]
+    assert outputs == [["numba", "True"], ["numba", "False"]]
@@ -0,0 +1,143 @@
+"""Leitura das saídas do SIESTA e do pw.x e dos arquivos de bandas (arquivos pequenos em teste/dados)."""
+import os
+import re
+
+import numpy as np
+import pytest
+
+import analisador
+from analisador import BOHR_TO_ANG, BandsFormatError
+
+DADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dados")
+
+def _path(name):
+    return os.path.join(DADOS, name)
+
+def _frames(name):
+    return list(analisador.iter_structure_frames(_path(name)))
+
+def _assert_structure(structure, coords, lattice):
+    assert structure.elements == ("C", "Mo")
+    np.testing.assert_array_equal(structure.species, [0, 1])
+    np.testing.assert_allclose(structure.coords, coords, atol=1e-6)
+    np.testing.assert_allclose(structure.lattice, lattice, atol=1e-6)
+
+def _gap(name, **options):
+    return analisador.analyze_band_gap(_path(name), **options)
+
+@pytest.fixture(params=["atual", "antigo"])
+def fromstring(request, monkeypatch):
+    """
+    np.fromstring das versões atuais do NumPy (ValueError com texto ou números colados no meio) ou
+    das anteriores, como a 2.2: devolvem só os números antes do problema, com um DeprecationWarning.
+    """
+    if request.param == "antigo":
+        current = np.fromstring
+        def old(text, dtype=float, sep=""):
+            try:
+                return current(text, dtype=dtype, sep=sep)
+            except ValueError:
+                values = []
+                for token in text.split():
+                    match = re.match(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?", token)
+                    if match is not None:
+                        values.append(float(match.group()))
+                    if match is None or match.end() != len(token):
+                        break
+                return np.array(values, dtype=dtype)
+        monkeypatch.setattr(np, "fromstring", old)
+    return request.param
+
+# --- SIESTA ---
+
+def test_siesta_quadros_em_angstrom_bohr_e_fracionarias():
+    # Os blocos outcoor terminam direto na linha 'outcell:' (sem linha em branco)
+    first_cell = [[3.0, 0.0, 0.0], [-1.5, 2.598076, 0.0], [0.0, 0.0, 20.0]]
+    second_cell = [[3.1, 0.0, 0.0], [-1.55, 2.684679, 0.0], [0.0, 0.0, 20.0]]
+    frames = _frames("siesta_relax.out")
+    assert analisador.detect_file_format(_path("siesta_relax.out")) == "siesta_out"
+    assert len(frames) == 3
+    _assert_structure(frames[0], [[0.0, 0.0, 5.0], [1.5, 1.0, 8.3]], first_cell)
+    _assert_structure(frames[1], np.array([[0.0, 0.0, 9.6376], [2.83459, 1.88973, 15.87369]]) * BOHR_TO_ANG,
+                      second_cell)
+    _assert_structure(frames[2], [[0.0, 0.0, 5.0], [0.775, 1.3423395, 8.4]], second_cell)
+    assert analisador.read_fermi_level(_path("siesta_relax.out")) == pytest.approx(-4.5678)
+
+@pytest.mark.parametrize("chunk_bytes", [1 << 16, 40])
+def test_siesta_bands_com_dois_spins_e_numeros_colados(chunk_bytes, fromstring):
+    gap = _gap("siesta_spin.bands", chunk_bytes=chunk_bytes)
+    assert (gap.nk, gap.nspin, gap.nbands) == (3, 2, 3)
+    assert gap.fermi == pytest.approx(-2.0)
+    assert gap.vbm == pytest.approx(-2.2) # Spin down
+    assert gap.cbm == pytest.approx(0.6) # Spin up
+    assert gap.gap == pytest.approx(2.8)
+    assert gap.is_direct and gap.k_vbm == gap.k_cbm == 1
+    assert gap.k_vbm_coord == pytest.approx(0.5)
+    np.testing.assert_allclose(gap.spin_gaps, [3.4, 3.6])
+
+    structure = analisador.calculate_band_structure(_path("siesta_spin.bands"), chunk_bytes)
+    np.testing.assert_allclose(structure.k, [0.0, 0.5, 1.5])
+    np.testing.assert_allclose(structure.energies[:, 0, 0], [-105.1234, -104.9], rtol=1e-6) # (spin, banda, k)
+
+def test_bands_simplificado_com_numeros_colados(tmp_path, fromstring):
+    path = tmp_path / "simples.bands"
+    path.write_text("-1.0\n-3.0000-2.5000 1.0000\n 2.0000\n")
+    gap = analisador.analyze_band_gap(str(path))
+    assert gap.nbands == 4
+    assert (gap.vbm, gap.cbm) == (pytest.approx(-2.5), pytest.approx(1.0))
+
+# --- Quantum ESPRESSO ---
+
+def test_pw_quadros_em_alat_angstrom_bohr_e_crystal():
+    alat = 6.0 * BOHR_TO_ANG
+    axes = np.array([[1.0, 0.0, 0.0], [-0.5, 0.866025, 0.0], [0.0, 0.0, 4.0]]) * alat
+    relaxed_cell = np.array([[1.02, 0.0, 0.0], [-0.51, 0.8833455, 0.0], [0.0, 0.0, 4.0]]) * alat
+    frames = _frames("pw_relax.out")
+    # A reimpressão em 'Begin final coordinates' não é um quadro novo
+    assert len(frames) == 4
+    _assert_structure(frames[0], np.array([[-0.1, -0.2, 1.0], [0.5, 0.288675, 1.6]]) * alat, axes)
+    _assert_structure(frames[1], [[-0.3, -0.6, 3.1750632502], [1.5875316251, 0.916561728, 5.08]], axes)
+    _assert_structure(frames[2], np.array([[-0.5669178, -1.1338356, 6.2], [3.0, 1.73205, 9.6]]) * BOHR_TO_ANG,
+                      axes)
+    _assert_structure(frames[3], np.array([[0.0, 0.0, 0.25], [1 / 3, 2 / 3, 0.4]]) @ relaxed_cell, relaxed_cell)
+
+def test_pw_bandas_com_spin_e_numeros_colados():
+    # Vale a última listagem de autovalores e o maior dos dois níveis de Fermi
+    gap = _gap("pw_relax.out")
+    assert (gap.nk, gap.nspin, gap.nbands) == (2, 2, 4)
+    assert gap.fermi == pytest.approx(-2.0)
+    assert (gap.vbm, gap.cbm, gap.gap) == (pytest.approx(-4.0), pytest.approx(0.5), pytest.approx(4.5))
+    assert not gap.is_direct and (gap.k_vbm, gap.k_cbm) == (0, 1)
+    assert gap.direct_gap == pytest.approx(5.0)
+    assert gap.k_cbm_coord == pytest.approx(np.hypot(0.5, 0.2887))
+    np.testing.assert_allclose(gap.spin_gaps, [4.5, 5.4])
+    structure = analisador.calculate_band_structure(_path("pw_relax.out"))
+    # energies é (spin, banda, ponto k)
+    np.testing.assert_allclose(structure.energies[0, :2, 0], [-100.1234, -99.8765], rtol=1e-6)
+    np.testing.assert_allclose(structure.energies[1, 0, :], [-100.1, -100.05], rtol=1e-6)
+
+def test_pw_sem_nivel_de_fermi():
+    path = _path("pw_bandas_sem_fermi.out")
+    with pytest.raises(BandsFormatError):
+        _gap("pw_bandas_sem_fermi.out")
+    with pytest.raises(BandsFormatError):
+        analisador.read_fermi_level(path)
+    gap = _gap("pw_bandas_sem_fermi.out", fermi=-0.5)
+    assert (gap.vbm, gap.cbm, gap.gap, gap.direct_gap) == (pytest.approx(-1.0), pytest.approx(1.0),
+                                                           pytest.approx(2.0), pytest.approx(2.5))
+    assert (gap.k_vbm, gap.k_cbm) == (0, 1)
+
+@pytest.mark.parametrize("chunk_bytes", [1 << 16, 30])
+def test_bands_dat_com_numeros_colados(chunk_bytes, fromstring):
+    assert analisador.detect_file_format(_path("bands.dat")) == "qe_bands"
+    with pytest.raises(BandsFormatError): # O bands.dat não traz o nível de Fermi
+        _gap("bands.dat", chunk_bytes=chunk_bytes)
+    fermi = analisador.read_fermi_level(_path("pw_relax.out"))
+    gap = _gap("bands.dat", chunk_bytes=chunk_bytes, fermi=fermi)
+    assert (gap.nk, gap.nspin, gap.nbands) == (3, 1, 4)
+    assert (gap.vbm, gap.cbm, gap.gap) == (pytest.approx(-4.0), pytest.approx(0.3), pytest.approx(4.3))
+    assert not gap.is_direct and gap.direct_gap == pytest.approx(4.5)
+    structure = analisador.calculate_band_structure(_path("bands.dat"), chunk_bytes, fermi=fermi)
+    np.testing.assert_allclose(structure.k, [0.0, 0.5, 1.0])
+    np.testing.assert_allclose(structure.energies[0, :, 0], [-100.123, -99.876, -5.0, 0.3], rtol=1e-6)
+    np.testing.assert_allclose(structure.energies[0, 1, :], [-99.876, -199.7, -99.8], rtol=1e-6)
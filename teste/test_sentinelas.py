@@ -0,0 +1,21 @@
+"""Funções traduzidas do Fortran: erros viram os códigos de erro, sem nada na saída padrão."""
+import analisador
+from analisador import ERROR_NATOMS, ERROR_READ
+
+def _fail(*args, **kwargs):
+    raise RuntimeError("falha inesperada")
+
+def test_distancia_entre_camadas_devolve_codigos(tmp_path, monkeypatch, capsys):
+    assert analisador.calculate_layer_distance_python(str(tmp_path / "falta.xyz")) == (ERROR_READ, ERROR_READ)
+    small = tmp_path / "pequeno.xyz"
+    small.write_text("2\nx\nC 0 0 0\nC 0 0 3.3\n")
+    assert analisador.calculate_layer_distance_python(str(small)) == (ERROR_NATOMS, ERROR_NATOMS)
+    monkeypatch.setattr(analisador, "calculate_layer_distance", _fail)
+    assert analisador.calculate_layer_distance_python(str(small)) == (ERROR_READ, ERROR_READ)
+    assert capsys.readouterr().out == ""
+
+def test_gap_devolve_codigos(tmp_path, monkeypatch, capsys):
+    assert analisador.calculate_band_gap_python(str(tmp_path / "falta.bands")) == (ERROR_READ, False)
+    monkeypatch.setattr(analisador, "analyze_band_gap", _fail)
+    assert analisador.calculate_band_gap_python(str(tmp_path / "falta.bands")) == (ERROR_READ, False)
+    assert capsys.readouterr().out == ""
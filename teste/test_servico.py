@@ -0,0 +1,55 @@
+"""Validação dos pedidos do serviço (servico.py): opções inválidas respondem 400, não 500."""
+import http.client
+import json
+import threading
+
+import pytest
+
+import servico
+from servico import RequestError, request_options
+
+@pytest.fixture
+def server():
+    server = servico.make_server(servico.AnalysisService(), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _structure(tmp_path):
+    path = tmp_path / "a.xyz"
+    path.write_text("4\nx\n" + "".join(f"C {k} 0 {3.3 * (k % 2)}\n" for k in range(4)))
+    return str(path)
+
+def _post(server, route, body):
+    connection = http.client.HTTPConnection(server.address.split("://", 1)[1], timeout=30)
+    try:
+        connection.request("POST", route, body=json.dumps(body), headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+@pytest.mark.parametrize("value", ["false", "true", 0, 1, None, [False]])
+def test_pbc_so_aceita_booleano(value):
+    with pytest.raises(RequestError, match="pbc"):
+        request_options({"pbc": value})
+
+def test_pbc_booleano_e_padrao():
+    assert request_options({"pbc": False})["use_pbc"] is False
+    assert request_options({"pbc": True})["use_pbc"] is True
+    assert request_options({})["use_pbc"] is True
+
+@pytest.mark.parametrize("calculations", [[1], ["camadas", None], {"camadas": 1}, 5, None])
+def test_calculos_invalidos_respondem_400(server, tmp_path, calculations):
+    status, payload = _post(server, "/lote", {"arquivos": [_structure(tmp_path)], "calculos": calculations})
+    assert status == 400
+    assert "calculos" in payload["erro"]
+
+def test_pbc_texto_responde_400(server, tmp_path):
+    path = _structure(tmp_path)
+    status, payload = _post(server, "/camadas", {"arquivo": path, "pbc": "false"})
+    assert status == 400 and "pbc" in payload["erro"]
+    status, payload = _post(server, "/lote", {"arquivos": [path], "calculos": ["camadas"], "pbc": False})
+    assert status == 200 and payload["registros"][0]["status"] == "ok"
@@ -0,0 +1,78 @@
+"""Cache de sessão das estruturas (load_xyz) usado por vários cálculos em threads, como nas abas da interface."""
+import sys
+import threading
+
+import analisador
+
+def _write_structures(folder, count):
+    paths = []
+    for n in range(count):
+        path = folder / f"s{n}.xyz"
+        path.write_text("4\nx\n" + "".join(f"C 0 0 {k + n * 0.1}\n" for k in range(4)))
+        paths.append(str(path))
+    return paths
+
+def test_load_xyz_em_threads(tmp_path):
+    # Mais arquivos do que o cache guarda: cada thread reordena e descarta entradas ao mesmo tempo
+    paths = _write_structures(tmp_path, 12)
+    analisador.configure_session_cache(3)
+
+    def work(seed):
+        for r in range(1500):
+            structure = analisador.load_xyz(paths[(r * 7 + seed) % len(paths)])
+            assert structure.natoms == 4
+
+    assert _run_threads(work) == []
+    assert len(analisador._xyz_session_cache) == 3
+
+def _run_threads(work, n_threads=8):
+    """Roda work(semente) em várias threads ao mesmo tempo e retorna as exceções levantadas."""
+    errors = []
+
+    def run(seed):
+        try:
+            work(seed)
+        except Exception as e:
+            errors.append(e)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # Trocas de thread frequentes, para expor as corridas
+    try:
+        threads = [threading.Thread(target=run, args=(seed,)) for seed in range(n_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    return errors
+
+def test_cache_de_sessao_lru_e_limite_de_bytes(tmp_path):
+    paths = _write_structures(tmp_path, 3)
+    analisador.configure_session_cache(2)
+    for path in (paths[0], paths[1], paths[0], paths[2]):
+        analisador.load_xyz(path)
+    assert [key[0] for key in analisador._xyz_session_cache] == [paths[0], paths[2]]
+    # Limite de bytes menor que uma estrutura: só a mais recente fica
+    analisador.configure_session_cache(8, max_bytes=1)
+    assert [key[0] for key in analisador._xyz_session_cache] == [paths[2]]
+
+def test_consultas_de_distancia_em_threads_e_lru(tmp_path):
+    paths = _write_structures(tmp_path, 10)
+
+    def work(seed):
+        for r in range(300):
+            query = analisador.open_distance_query(paths[(r * 3 + seed) % len(paths)], use_pbc=False)
+            assert query.structure.natoms == 4
+
+    assert _run_threads(work) == []
+    assert len(analisador._query_session) == analisador._QUERY_SESSION_MAX
+
+    # Uma consulta reaproveitada passa a ser a mais recente e não é a próxima descartada
+    analisador._query_session.clear()
+    first = analisador.open_distance_query(paths[0], use_pbc=False)
+    for path in paths[1:4]:
+        analisador.open_distance_query(path, use_pbc=False)
+    assert analisador.open_distance_query(paths[0], use_pbc=False) is first
+    analisador.open_distance_query(paths[4], use_pbc=False)
+    assert [key[0] for key in analisador._query_session] == [paths[2], paths[3], paths[0], paths[4]]